@@ -671,6 +671,80 @@ MAXTOTALLOGFILESIZE = 200
 CACHE_MAXIMUM = 1000000
 CACHE_THREADS = 1
 
+# Number of threads used to read the input data from the database when loading
+# a plan. With a value of 1 all data is read sequentially.
+LOAD_THREADS = 1
+
+# Format used to export the plan to the database: "text" or "binary".
+# The binary format of the COPY command avoids converting all values to text
+# and parsing them again in the database.
+EXPORT_COPY_FORMAT = "text"
+
+# When True, a complete export writes the plan into new tables that replace the
+# current output tables only at the end of the export. The reports keep showing
+# the previous plan while the plan is being exported.
+# A single plan run can override it with "--env=shadowtables" or
+# "--env=shadowtables=0".
+EXPORT_SHADOW_TABLES = False
+
+# Number of processes used by the importfromfolder command to load data files
+# that don't depend on each other in parallel.
+# With a value of 1 all files are loaded sequentially.
+IMPORT_PROCESSES = 4
+
+# Delay in seconds before the web service saves interactive changes to the
+# plan in the database. All changes received within this delay are saved
+# together.
+WEBSERVICE_SAVE_DELAY = 0.5
+
+# Number of seconds the users and their permissions in a scenario are cached.
+# With a value of 0 the cache is disabled.
+PERMISSION_CACHE_TTL = 60
+
+# Paginate the responses of the REST API list endpoints. When false, clients
+# can still ask for pagination with the arguments ?page_size= and ?cursor=,
+# and unpaginated lists are streamed.
+API_PAGINATION = False
+
+# Results of custom SQL reports with up to this number of rows are kept in
+# memory for the number of seconds specified. Paging through the report is then
+# served from the cache, as long as no data changes in the scenario.
+# With a value of 0 the cache is disabled.
+REPORT_CACHE_ROWS = 10000
+REPORT_CACHE_TTL = 300
+
+# Number of tasks the worker of a scenario runs at the same time, per class of
+# task. Tasks not listed in WORKER_TASK_CLASSES are "heavy": with a single heavy
+# slot only one plan or data load runs at a time in a scenario.
+# Light tasks don't wait for the heavy tasks submitted before them.
+WORKER_SLOTS = {"heavy": 1, "light": 2}
+WORKER_TASK_CLASSES = {
+    "emailreport": "light",
+    "exportworkbook": "light",
+    "uploadreport": "light",
+}
+
+# Strategy of the scenario_copy command: "auto", "template", "directory" or "stream".
+# With "auto" a scenario is created from the source database as a template when
+# nobody is connected to the source. Otherwise databases bigger than
+# SCENARIO_COPY_PARALLEL_SIZE megabytes are copied with a directory-format
+# pg_dump and pg_restore running SCENARIO_COPY_JOBS parallel jobs.
+SCENARIO_COPY_STRATEGY = "auto"
+SCENARIO_COPY_JOBS = 4
+SCENARIO_COPY_PARALLEL_SIZE = 1024
+
+# Settings of the backup command.
+# The "directory" format writes the dump as a folder with BACKUP_JOBS parallel
+# jobs. BACKUP_COMPRESSION is passed to pg_dump, eg "zstd" or "gzip:6".
+# The data of the plan output tables can be included, excluded or saved in a
+# separate dump with BACKUP_OUTPUT "include", "exclude" or "separate".
+# Backups older than BACKUP_RETENTION_DAYS days are removed.
+BACKUP_FORMAT = "custom"
+BACKUP_JOBS = 4
+BACKUP_COMPRESSION = None
+BACKUP_OUTPUT = "include"
+BACKUP_RETENTION_DAYS = 31
+
 # A list of available user interface themes.
 # If multiple themes are configured in this list, the user's can change their
 # preferences among the ones listed here.
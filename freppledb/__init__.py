@@ -89,6 +89,36 @@ def runCommand(taskname, *args, **kwargs):
             task.save(using=database)
 
 
+def initializeProcess(database):
+    """
+    Auxilary method to initialize the processes of a process pool, such
+    as the concurrent.futures.ProcessPoolExecutor.
+
+    The code is put here, such that a child process loads only
+    a minimum of other python modules.
+    """
+    # Initialize django
+    import os
+
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "freppledb.settings")
+    import django
+
+    django.setup()
+
+    # Be sure to use the correct database
+    from django.conf import settings
+    from django.db import connections
+    from freppledb.common.middleware import _thread_locals
+    from threading import local
+
+    setattr(_thread_locals, "database", database)
+    connections._connections = local()
+    if "FREPPLE_TEST" in os.environ:
+        settings.EMAIL_BACKEND = "django.core.mail.backends.dummy.EmailBackend"
+        for db in settings.DATABASES:
+            settings.DATABASES[db]["NAME"] = settings.DATABASES[db]["TEST"]["NAME"]
+
+
 def runFunction(func, *args, **kwargs):
     """
     Auxilary method to run the "func".start(*args, **kwargs) method using
@@ -21,18 +21,28 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+import json
+
+from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.db.models import QuerySet
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.csrf import csrf_protect
 
 from rest_framework import generics
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+from rest_framework.response import Response
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework_bulk import ListBulkCreateUpdateDestroyAPIView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import permissions
 
-from freppledb.common.models import User
-from freppledb.common.auth import getWebserviceAuthorization
+from freppledb.common.auth import getWebserviceAuthorization, PermissionCache
 
 
 @staff_member_required
@@ -71,36 +81,222 @@ class frepplePermissionClass(permissions.DjangoModelPermissions):
         request.user._state.db = request.database
 
         # Django is not checking if user is active or superuser on the scenario
-        try:
-            thisuser = (
-                User.objects.all().using(request.database).get(username=request.user)
-            )
-            request.user.is_active = thisuser.is_active
-            request.user.is_superuser = thisuser.is_superuser
-        except Exception:
+        cached = PermissionCache.get(request.database, request.user.username)
+        if cached:
+            request.user.is_active = cached[0]
+            request.user.is_superuser = cached[1]
+        else:
             request.user.is_active = False
             request.user.is_superuser = False
 
         return super().has_permission(request, view)
 
 
+class frepplePagination(CursorPagination):
+    """
+    Keyset pagination for the list API:
+      - pages are retrieved with a "where key > last key of the previous page"
+        filter, which remains fast for the last pages of large tables
+      - records are sorted by primary key, or by last modification date with
+        the argument ?ordering=lastmodified
+      - the key is a row value of all ordering fields, so that records with
+        the same last modification date are split correctly over the pages
+      - the cursor contains the values of all ordering fields
+      - the page size can be set with the argument ?page_size=
+      - pagination is only applied when the request asks for it with the
+        arguments ?page_size= or ?cursor=, or when the setting API_PAGINATION
+        is true
+    """
+
+    page_size = 1000
+    page_size_query_param = "page_size"
+    max_page_size = 10000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not isinstance(queryset, QuerySet) or not (
+            getattr(settings, "API_PAGINATION", False)
+            or self.cursor_query_param in request.query_params
+            or self.page_size_query_param in request.query_params
+        ):
+            return None
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor.reverse if self.cursor else False
+
+        if self.cursor and self.cursor.position is not None:
+            try:
+                position = json.loads(self.cursor.position)
+                if len(position) != len(self.ordering):
+                    raise ValueError
+            except (TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+            quote = connections[queryset.db].ops.quote_name
+            opts = queryset.model._meta
+            queryset = queryset.extra(
+                where=[
+                    "(%s) %s (%s)"
+                    % (
+                        ", ".join(
+                            "%s.%s"
+                            % (quote(opts.db_table), quote(opts.get_field(f).column))
+                            for f in self.ordering
+                        ),
+                        "<" if reverse else ">",
+                        ", ".join(["%s"] * len(position)),
+                    )
+                ],
+                params=position,
+            )
+        queryset = queryset.order_by(
+            *[("-%s" % f) if reverse else f for f in self.ordering]
+        )
+
+        # Read one extra record to find out whether there are more
+        results = list(queryset[: self.page_size + 1])
+        self.page = results[: self.page_size]
+        more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = more
+        else:
+            self.has_next = more
+            self.has_previous = bool(self.cursor and self.cursor.position is not None)
+        return self.page
+
+    def getPosition(self, obj):
+        # Dates are converted with str() to keep their microseconds
+        return json.dumps([getattr(obj, f) for f in self.ordering], default=str)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=self.getPosition(self.page[-1]))
+        )
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=self.getPosition(self.page[0]))
+        )
+
+    def get_ordering(self, request, queryset, view):
+        pk = queryset.model._meta.pk.name
+        if request.query_params.get("ordering") == "lastmodified":
+            try:
+                queryset.model._meta.get_field("lastmodified")
+                return ("lastmodified", pk)
+            except Exception:
+                pass
+        return (pk,)
+
+
 class frePPleListCreateAPIView(ListBulkCreateUpdateDestroyAPIView):
     """
     Customized API view for the REST framework.:
         - support for request-specific scenario database
         - add 'title' to the context of the html view
+        - keyset pagination, see frepplePagination
+        - unpaginated JSON lists are streamed in chunks
+        - the argument ?fields= limits the fields returned by a GET request
     """
 
     filter_backends = (DjangoFilterBackend,)
     permission_classes = (frepplePermissionClass,)
+    pagination_class = frepplePagination
+
+    # Number of records read from the database at a time when streaming
+    chunksize = 2000
 
     def get_queryset(self):
         queryset = super().get_queryset().using(self.request.database)
         return queryset
 
+    def get_fields(self):
+        """
+        Returns the list of fields requested with the ?fields= argument.
+        """
+        if self.request.method != "GET" or "fields" not in self.request.query_params:
+            return None
+        return [
+            f.strip()
+            for f in self.request.query_params["fields"].split(",")
+            if f.strip()
+        ]
+
     def get_serializer(self, *args, **kwargs):
         kwargs["partial"] = True
-        return super().get_serializer(*args, **kwargs)
+        serializer = super().get_serializer(*args, **kwargs)
+        fields = self.get_fields()
+        if fields:
+            child = getattr(serializer, "child", serializer)
+            for f in list(child.fields):
+                if f not in fields:
+                    child.fields.pop(f)
+        return serializer
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        fields = self.get_fields()
+        if fields and isinstance(queryset, QuerySet):
+            # Only read the requested fields from the database
+            concrete = {
+                f.name
+                for f in queryset.model._meta.concrete_fields
+                if not f.many_to_many
+            }
+            if all(f in concrete for f in fields):
+                queryset = queryset.only(queryset.model._meta.pk.name, *fields)
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        if not isinstance(request.accepted_renderer, JSONRenderer):
+            serializer = self.get_serializer(queryset, many=True)
+            return Response(serializer.data)
+        return StreamingHttpResponse(
+            self.streamJSON(queryset), content_type="application/json"
+        )
+
+    def streamJSON(self, queryset):
+        """
+        Generates the JSON list in chunks, reading the records with a
+        server-side cursor. The memory use doesn't depend on the number of
+        records.
+        """
+        encoder = JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+        if isinstance(queryset, QuerySet):
+            records = queryset.iterator(chunk_size=self.chunksize)
+        else:
+            records = iter(queryset)
+        first = True
+        yield "["
+        while True:
+            chunk = []
+            for obj in records:
+                chunk.append(obj)
+                if len(chunk) >= self.chunksize:
+                    break
+            if not chunk:
+                break
+            data = encoder.encode(self.get_serializer(chunk, many=True).data)
+            if first:
+                first = False
+                yield data[1:-1]
+            elif len(data) > 2:
+                yield ",%s" % data[1:-1]
+        yield "]"
 
     def allow_bulk_destroy(self, qs, filtered):
         # Safety check to prevent deleting all records in the database table
@@ -23,16 +23,19 @@
 
 import base64
 import jwt
+from threading import Lock
 import time
 
 from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.backends import ModelBackend
-from django.contrib.auth.models import Permission
+from django.contrib.auth.models import Group, Permission
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
-from django.db import DEFAULT_DB_ALIAS
+from django.db import connections, transaction, DEFAULT_DB_ALIAS
 from django.db.models import Q
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch.dispatcher import receiver
 from django.http import HttpResponse
 
 from freppledb.common.models import User, Scenario
@@ -42,6 +45,154 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class PermissionCache:
+    """
+    A process-wide cache with the active and superuser flags and the
+    permissions of users in each scenario.
+
+    The REST API and the user interface check the user and its permissions
+    in each request. The cache avoids these queries for repeated requests.
+    Entries expire after PERMISSION_CACHE_TTL seconds.
+    Saving users, groups, permissions or scenarios increments a version
+    counter in the database. Entries cached with an older version are
+    refreshed, which also picks up the changes made by other processes.
+    The counter is read at most once every versionInterval seconds per
+    scenario, so most cache hits don't need a query.
+    """
+
+    lock = Lock()
+    entries = {}
+    hits = 0
+    misses = 0
+
+    # Seconds during which the version counter of a scenario is reused
+    versionInterval = 5
+    versions = {}
+
+    @classmethod
+    def get(cls, database, username):
+        """
+        Returns a tuple (is_active, is_superuser, permissions) for a user in
+        a scenario. None is returned when the user doesn't exist.
+        """
+        ttl = getattr(settings, "PERMISSION_CACHE_TTL", 60)
+        now = time.monotonic()
+        key = (database, username)
+        version = cls.getVersion(database) if ttl > 0 else None
+        with cls.lock:
+            entry = cls.entries.get(key)
+            if entry and entry[0] > now and entry[1] == version:
+                cls.hits += 1
+                return entry[2]
+            cls.misses += 1
+        try:
+            user = User.objects.using(database).get(username=username)
+        except User.DoesNotExist:
+            value = None
+        else:
+            if not user.is_active:
+                perms = frozenset()
+            elif user.is_superuser:
+                perms = Permission.objects.using(database).all()
+            else:
+                perms = Permission.objects.using(database).filter(
+                    Q(user=user) | Q(group__user=user)
+                )
+            if not isinstance(perms, frozenset):
+                perms = frozenset(
+                    "%s.%s" % (ct, name)
+                    for ct, name in perms.values_list(
+                        "content_type__app_label", "codename"
+                    ).order_by()
+                )
+            value = (user.is_active, user.is_superuser, perms)
+        if ttl > 0:
+            with cls.lock:
+                cls.entries[key] = (now + ttl, version, value)
+        return value
+
+    @classmethod
+    def getVersion(cls, database):
+        now = time.monotonic()
+        with cls.lock:
+            checked = cls.versions.get(database)
+            if checked and checked[0] > now:
+                return checked[1]
+        with connections[database].cursor() as cursor:
+            cursor.execute("select last_value from common_permission_version")
+            version = cursor.fetchone()[0]
+        with cls.lock:
+            cls.versions[database] = (now + cls.versionInterval, version)
+        return version
+
+    @classmethod
+    def publish(cls, database):
+        """
+        Tells the caches in all processes that the users or permissions of a
+        scenario changed. The version is only incremented after the commit, so
+        other processes can't cache the old data under the new version.
+        """
+
+        def increment():
+            with connections[database].cursor() as cursor:
+                cursor.execute("select nextval('common_permission_version')")
+            with cls.lock:
+                cls.versions.pop(database, None)
+
+        transaction.on_commit(increment, using=database)
+
+    @classmethod
+    def invalidate(cls, database=None, username=None):
+        with cls.lock:
+            for db in list(cls.versions):
+                if database is None or db == database:
+                    del cls.versions[db]
+            for key in list(cls.entries):
+                if (database is None or key[0] == database) and (
+                    username is None or key[1] == username
+                ):
+                    del cls.entries[key]
+
+    @classmethod
+    def getStatistics(cls):
+        with cls.lock:
+            return {
+                "entries": len(cls.entries),
+                "hits": cls.hits,
+                "misses": cls.misses,
+            }
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidateUser(sender, instance, using, **kwargs):
+    # User changes are saved in all scenarios
+    PermissionCache.invalidate(username=instance.username)
+    PermissionCache.publish(using)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidateGroup(sender, using, **kwargs):
+    PermissionCache.invalidate(database=using)
+    PermissionCache.publish(using)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidatePermissions(sender, using, **kwargs):
+    PermissionCache.invalidate(database=using)
+    PermissionCache.publish(using)
+
+
+@receiver(post_save, sender=Scenario)
+def invalidateScenario(sender, instance, **kwargs):
+    PermissionCache.invalidate(database=instance.name)
+    if instance.name in settings.DATABASES and instance.status == "In use":
+        PermissionCache.publish(instance.name)
+
+
 class MultiDBBackend(ModelBackend):
     """
     This customized authentication is based on the Django ModelBackend
@@ -159,10 +310,16 @@ class MultiDBBackend(ModelBackend):
     def get_all_permissions(self, user_obj, obj=None):
         if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
             return set()
-        if not hasattr(user_obj, "_perm_cache_%s" % user_obj._state.db):
-            user_obj._perm_cache = self.get_user_permissions(user_obj)
-            user_obj._perm_cache.update(self.get_group_permissions(user_obj))
-        return user_obj._perm_cache
+        perm_cache_name = "_perm_cache_%s" % user_obj._state.db
+        if not hasattr(user_obj, perm_cache_name):
+            cached = PermissionCache.get(user_obj._state.db, user_obj.username)
+            if cached and cached[1] == user_obj.is_superuser:
+                perms = set(cached[2])
+            else:
+                perms = self.get_user_permissions(user_obj)
+                perms.update(self.get_group_permissions(user_obj))
+            setattr(user_obj, perm_cache_name, perms)
+        return getattr(user_obj, perm_cache_name)
 
     def get_user(self, user_id):
         try:
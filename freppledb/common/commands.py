@@ -21,15 +21,25 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-from datetime import datetime
+from datetime import datetime, date, time, timedelta, timezone
+from decimal import Decimal
+from functools import lru_cache
+import heapq
 import io
 from importlib import import_module
 from operator import attrgetter
 import os
+from queue import Queue, Empty, Full
 import sys
 import site
 import logging
-from threading import Thread
+import struct
+from threading import Thread, Event
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
 
 
 if __name__ == "__main__":
@@ -104,64 +114,329 @@ logger = logging.getLogger(__name__)
 
 def clean_value(value):
     """
-    A small auxilary function to handle newline characters or backslashes
-    in exporting data to PostgreSQL over a COPY command.
+    A small auxilary function to handle newline characters, backslashes
+    and the \\v separator in exporting data to PostgreSQL over a COPY command.
     """
     if value is None:
         return "\\N"
-    elif "\n" in value or "\\" in value or "\r" in value:
-        return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r")
+    elif "\n" in value or "\\" in value or "\r" in value or "\v" in value:
+        return (
+            value.replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace("\r", "\\r")
+            .replace("\v", "\\v")
+        )
     else:
         return value
 
 
-class CopyFromGenerator(io.TextIOBase):
+class CopyFromGenerator(io.RawIOBase):
     """
     File-like object to handle exporting data to PostgreSQL over
     a copy command.
 
-    Inspired on and copied from:
+    The lines returned by the iterator are batched and encoded in chunks of
+    about chunksize bytes. Reading hands out (views on) these chunks, so that
+    every byte is copied only once on its way to the database driver.
+
+    Inspired on:
       https://hakibenita.com/fast-load-data-python-postgresql
     """
 
+    chunksize = 65536
+
     def __init__(self, itr):
-        self._iter = itr
-        self._buff = ""
+        self._iter = iter(itr)
+        self._chunks = self.getChunks()
+        self._chunk = memoryview(b"")
+        self._pos = 0
 
     def readable(self):
         return True
 
-    def _read1(self, n=None):
-        while not self._buff:
-            try:
-                self._buff = next(self._iter)
-            except StopIteration:
+    def getChunks(self):
+        lines = []
+        size = 0
+        for line in self._iter:
+            lines.append(line)
+            size += len(line)
+            if size >= self.chunksize:
+                yield "".join(lines).encode("utf-8")
+                lines.clear()
+                size = 0
+        if lines:
+            yield "".join(lines).encode("utf-8")
+
+    def _available(self):
+        # Number of bytes left in the current chunk, moving to the next
+        # chunk when needed
+        while self._pos >= len(self._chunk):
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._chunk = memoryview(chunk)
+            self._pos = 0
+        return len(self._chunk) - self._pos
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            return self.readall()
+        available = self._available()
+        if not available:
+            return b""
+        if not self._pos and n >= available:
+            # Return the complete chunk without copying it
+            self._pos = available
+            return self._chunk.obj
+        n = min(n, available)
+        data = self._chunk[self._pos : self._pos + n].tobytes()
+        self._pos += n
+        return data
+
+    def readall(self):
+        data = []
+        while True:
+            chunk = self.read(self.chunksize)
+            if not chunk:
+                return b"".join(data)
+            data.append(chunk)
+
+    def readinto(self, b):
+        b = memoryview(b).cast("B")
+        n = len(b)
+        done = 0
+        while done < n:
+            available = self._available()
+            if not available:
                 break
-        ret = self._buff[:n]
-        self._buff = self._buff[len(ret) :]
-        return ret
+            count = min(n - done, available)
+            b[done : done + count] = self._chunk[self._pos : self._pos + count]
+            self._pos += count
+            done += count
+        return done
 
-    def read(self, n=None):
-        line = []
-        if n is None or n < 0:
-            while True:
-                m = self._read1()
-                if not m:
-                    break
-                line.append(m)
+
+def textRows(rows, sep="\v"):
+    """
+    Converts tuples of python values into lines for a COPY command in
+    text format. None values are exported as null.
+    """
+    for row in rows:
+        yield "%s\n" % sep.join(
+            clean_value(v) if v is None or isinstance(v, str) else str(v) for v in row
+        )
+
+
+_int16 = struct.Struct(">h")
+_int32 = struct.Struct(">i")
+_int64 = struct.Struct(">q")
+_float64 = struct.Struct(">d")
+_interval = struct.Struct(">qii")
+_pg_epoch = datetime(2000, 1, 1, tzinfo=timezone.utc)
+_pg_epoch_date = date(2000, 1, 1)
+_numeric_header = struct.Struct(">hhHh")
+_numeric_nan = _numeric_header.pack(0, 0, 0xC000, 0)
+
+
+def _binaryNumeric(value):
+    # Format: number of base-10000 digits, weight of the first digit,
+    # sign, display scale, followed by the digits.
+    if isinstance(value, float):
+        txt = repr(value)
+        if "e" in txt or "n" in txt:
+            value = Decimal(txt)
         else:
-            while n > 0:
-                m = self._read1(n)
-                if not m:
-                    break
-                n -= len(m)
-                line.append(m)
-        return "".join(line)
+            sign = txt[0] == "-"
+            intpart, fracpart = txt.lstrip("-").split(".")
+    elif isinstance(value, int):
+        sign = value < 0
+        intpart = str(-value if sign else value)
+        fracpart = ""
+    elif not isinstance(value, Decimal):
+        value = Decimal(value)
+    if isinstance(value, Decimal):
+        if not value.is_finite():
+            return _numeric_nan
+        sign, digits, exponent = value.as_tuple()
+        digits = "".join(map(str, digits))
+        if exponent >= 0:
+            intpart = digits + "0" * exponent
+            fracpart = ""
+        else:
+            fracpart = digits[exponent:].rjust(-exponent, "0")
+            intpart = digits[:exponent]
+    dscale = len(fracpart)
+    fracgroups = -(-dscale // 4)
+    n = int(intpart + fracpart.ljust(fracgroups * 4, "0"))
+    groups = []
+    while n:
+        n, d = divmod(n, 10000)
+        groups.append(d)
+    weight = len(groups) - 1 - fracgroups
+    while groups and not groups[0]:
+        groups.pop(0)
+    groups.reverse()
+    if not groups:
+        weight = 0
+    return _numeric_header.pack(
+        len(groups), weight, 0x4000 if sign else 0, dscale
+    ) + struct.pack(">%dH" % len(groups), *groups)
+
+
+def _binaryInterval(value):
+    # A number is interpreted as a number of seconds, as in the text format
+    if isinstance(value, timedelta):
+        return _interval.pack(
+            value.seconds * 1000000 + value.microseconds, value.days, 0
+        )
+    return _interval.pack(round(value * 1000000), 0, 0)
+
+
+def _binaryTime(value):
+    if isinstance(value, time):
+        return _int64.pack(
+            ((value.hour * 60 + value.minute) * 60 + value.second) * 1000000
+            + value.microsecond
+        )
+    return _int64.pack(round(value * 1000000))
+
+
+def _binaryDate(value):
+    if isinstance(value, datetime):
+        value = value.date()
+    return _int32.pack((value - _pg_epoch_date).days)
+
+
+def _binaryTimestamp(value):
+    # Timestamps without time zone are stored as if they were in UTC
+    delta = value.replace(tzinfo=timezone.utc) - _pg_epoch
+    return _int64.pack(
+        (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+    )
+
+
+def _binaryTimestampTz(tz):
+    # Naive datetimes are interpreted in the time zone of the database
+    # session, as PostgreSQL does when parsing the text format.
+    # The same dates come back very often in a plan.
+    @lru_cache(maxsize=4096)
+    def encode(value):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=tz)
+        delta = value - _pg_epoch
+        return _int64.pack(
+            (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        )
+
+    return encode
+
+
+binaryEncoders = {
+    "varchar": lambda v: v.encode("utf-8"),
+    "text": lambda v: v.encode("utf-8"),
+    "jsonb": lambda v: b"\x01" + v.encode("utf-8"),
+    "boolean": lambda v: b"\x01" if v else b"\x00",
+    "integer": lambda v: _int32.pack(round(v)),
+    "bigint": lambda v: _int64.pack(round(v)),
+    "double precision": lambda v: _float64.pack(v),
+    "numeric": _binaryNumeric,
+    "interval": _binaryInterval,
+    "time": _binaryTime,
+    "date": _binaryDate,
+    "timestamp": _binaryTimestamp,
+}
+
+
+class CopyBinaryGenerator(CopyFromGenerator):
+    """
+    File-like object to export data to PostgreSQL with a COPY command
+    in binary format.
+
+    The iterator returns tuples of python values, which are encoded
+    according to the list of PostgreSQL column types. This avoids
+    formatting the values as text in python and parsing them again in
+    the database.
+    See https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+    """
+
+    header = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    trailer = _int16.pack(-1)
+    null = _int32.pack(-1)
+
+    def __init__(self, itr, types, tz=None):
+        tz_encoder = _binaryTimestampTz(ZoneInfo(tz or settings.TIME_ZONE))
+        self._encoders = [
+            tz_encoder if t == "timestamptz" else binaryEncoders[t] for t in types
+        ]
+        self._fieldcount = _int16.pack(len(types))
+        super().__init__(itr)
+
+    def getChunks(self):
+        data = [self.header]
+        append = data.append
+        size = len(self.header)
+        pack = _int32.pack
+        null = self.null
+        fieldcount = self._fieldcount
+        encoders = self._encoders
+        for row in self._iter:
+            append(fieldcount)
+            size += 2
+            for encoder, value in zip(encoders, row):
+                if value is None:
+                    append(null)
+                    size += 4
+                else:
+                    value = encoder(value)
+                    append(pack(len(value)))
+                    append(value)
+                    size += 4 + len(value)
+            if size >= self.chunksize:
+                yield b"".join(data)
+                data.clear()
+                size = 0
+        append(self.trailer)
+        yield b"".join(data)
+
+
+def copyRows(cursor, rows, table, columns=None, types=None, binary=False):
+    """
+    Inserts an iterable of tuples into a table with a COPY command.
+
+    The binary format requires the list of PostgreSQL types of the columns,
+    in the same order as the columns.
+    """
+    if binary:
+        cursor.copy_expert(
+            "copy %s%s from stdin with (format binary)"
+            % (
+                table,
+                " (%s)" % ", ".join('"%s"' % c for c in columns) if columns else "",
+            ),
+            CopyBinaryGenerator(rows, types),
+            size=CopyFromGenerator.chunksize,
+        )
+    else:
+        cursor.copy_from(
+            CopyFromGenerator(textRows(rows)),
+            table,
+            columns=columns,
+            size=CopyFromGenerator.chunksize,
+            sep="\v",
+        )
 
 
 class PlanTask:
     """
     Base class for steps in the plan generation process
+
+    A task can either implement the run method, or split its work in
+    two methods:
+      - fetch(**kwargs) is a generator that reads the rows from the database.
+        It shouldn't touch the planning engine.
+      - apply(rows, **kwargs) processes the rows into the planning engine.
+    Tasks using the second style can have their data retrieved in parallel
+    with other tasks, see PlanTaskPipeline.
     """
 
     # Field to be set on each subclass
@@ -170,6 +445,18 @@ class PlanTask:
     label = None
     export = False
 
+    # Tasks that need to be applied before this one when running in a pipeline
+    dependencies = ()
+
+    # Relative size of the data read by the fetch method. A pipeline moves
+    # tasks with a big volume forward as far as their dependencies allow.
+    # Such tasks need to declare all their dependencies.
+    fetchVolume = 1
+
+    # Methods to be set on subclasses that split fetching and applying data
+    fetch = None
+    apply = None
+
     # Fields for internal use
     task = None
     thread = "main"
@@ -182,7 +469,10 @@ class PlanTask:
 
     @classmethod
     def run(cls, **kwargs):
-        logger.warning("Warning: PlanTask doesn't implement the run method")
+        if callable(cls.fetch) and callable(cls.apply):
+            cls.apply(cls.fetch(**kwargs), **kwargs)
+        else:
+            logger.warning("Warning: PlanTask doesn't implement the run method")
 
     @classmethod
     def display(cls, indentlevel=0, **kwargs):
@@ -237,12 +527,10 @@ class PlanTaskSequence(PlanTask):
             task_weight = 1
 
         # Execute all tasks in the list
+        schedule = self._schedule()
         try:
             progress = 0
-            for step in self.steps:
-                if step.weight is None or step.weight <= 0:
-                    continue
-
+            for step, pipeline in schedule:
                 # Update status and message
                 if self.task:
                     self.task.status = "%d%%" % int(progress * 100.0 / task_weight)
@@ -269,7 +557,12 @@ class PlanTaskSequence(PlanTask):
                         )
                     )
                 step.timestamp = self.timestamp
-                step.run(**PlanTaskRegistry.getArguments())
+                if pipeline:
+                    if not pipeline.started:
+                        pipeline.start(**PlanTaskRegistry.getArguments())
+                    step.apply(pipeline.rows(step), **PlanTaskRegistry.getArguments())
+                else:
+                    step.run(**PlanTaskRegistry.getArguments())
                 logger.info(
                     "Finished '%s' in %s %s"
                     % (
@@ -294,6 +587,34 @@ class PlanTaskSequence(PlanTask):
                 self.task.message = str(e)
                 self.task.save(using=database)
             raise
+        finally:
+            for pipeline in {p for s, p in schedule if p}:
+                pipeline.stop()
+
+    def _schedule(self):
+        """
+        Returns the list of steps to execute, each with the pipeline it runs in.
+        When multiple load threads are configured, consecutive steps that
+        implement the fetch and apply methods are grouped in a pipeline.
+        """
+        threads = PlanTaskPipeline.getThreads()
+        schedule = []
+        group = []
+        for step in self.steps + [None]:
+            if step is not None and (step.weight is None or step.weight <= 0):
+                continue
+            if step is not None and threads > 1 and PlanTaskPipeline.isPipelined(step):
+                group.append(step)
+                continue
+            if len(group) > 1:
+                pipeline = PlanTaskPipeline(group, threads)
+                schedule.extend((s, pipeline) for s in pipeline.steps)
+            elif group:
+                schedule.append((group[0], None))
+            group = []
+            if step is not None:
+                schedule.append((step, None))
+        return schedule
 
     def display(self, indentlevel=0, **kwargs):
         for i in self.steps:
@@ -431,6 +752,170 @@ class PlanTaskParallel(PlanTask):
             g._remove(task)
 
 
+class PlanTaskPipeline:
+    """
+    Executes a group of tasks that implement the fetch and apply methods.
+
+    The fetch methods only read from the database. They run concurrently on
+    a pool of worker threads, each with its own database connection, and
+    stream their rows into a bounded queue per task.
+    The apply methods run on the calling thread, one task at a time, in an
+    order that respects the dependencies declared on the tasks. Among the
+    tasks that are ready, the one with the biggest fetch volume goes first.
+    The workers pick up the tasks in the same order, so the big fetches
+    start as soon as their dependencies allow. Between tasks with the same
+    fetch volume the order of the sequence numbers is kept.
+    """
+
+    # Number of rows passed through the queue at once
+    chunksize = 1000
+
+    # Maximum number of chunks waiting in the queue of a task
+    queuesize = 50
+
+    class _Cancelled(Exception):
+        pass
+
+    def __init__(self, steps, threads):
+        self.steps = self.sort(steps)
+        self.threads = threads
+        self.started = False
+        self.cancelled = Event()
+        self.todo = Queue()
+        self.queues = {s: Queue(maxsize=self.queuesize) for s in self.steps}
+        self.workers = []
+
+    @staticmethod
+    def getThreads():
+        try:
+            return int(
+                os.environ.get("loadthreads", getattr(settings, "LOAD_THREADS", 1))
+            )
+        except ValueError:
+            return 1
+
+    @staticmethod
+    def isPipelined(step):
+        return (
+            callable(getattr(step, "fetch", None))
+            and callable(getattr(step, "apply", None))
+            and getattr(step.run, "__func__", None) is PlanTask.run.__func__
+        )
+
+    @staticmethod
+    def sort(steps):
+        # Dependencies are matched on the sequence number, such that they also
+        # apply to a task registered by an app to replace a standard one.
+        position = {s.sequence: idx for idx, s in enumerate(steps)}
+        waiting = {}
+        for s in steps:
+            waiting[s] = set()
+            for d in s.dependencies:
+                if d.sequence in position:
+                    waiting[s].add(steps[position[d.sequence]])
+                elif getattr(d, "step", None) and d.step > s.step:
+                    logger.warning(
+                        "Task '%s' depends on later task '%s'"
+                        % (s.description, d.description)
+                    )
+
+        def key(s):
+            return (-s.fetchVolume, position[s.sequence])
+
+        ready = [key(s) for s, d in waiting.items() if not d]
+        heapq.heapify(ready)
+        result = []
+        while ready:
+            s = steps[heapq.heappop(ready)[1]]
+            result.append(s)
+            for t, d in waiting.items():
+                if s in d:
+                    d.remove(s)
+                    if not d:
+                        heapq.heappush(ready, key(t))
+        if len(result) < len(steps):
+            raise ValueError(
+                "Circular dependency between tasks: %s"
+                % ", ".join(s.description for s in steps if s not in result)
+            )
+        return result
+
+    def start(self, **kwargs):
+        self.started = True
+        for s in self.steps:
+            self.todo.put(s)
+        for idx in range(min(self.threads, len(self.steps))):
+            worker = Thread(
+                target=self._work, name="fetch-%s" % idx, kwargs=kwargs, daemon=True
+            )
+            self.workers.append(worker)
+            worker.start()
+
+    def stop(self):
+        self.cancelled.set()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def rows(self, step):
+        q = self.queues[step]
+        while True:
+            chunk = q.get()
+            if chunk is None:
+                return
+            if isinstance(chunk, Exception):
+                logger.error("Exception caught fetching data for %s" % step.description)
+                raise chunk
+            yield from chunk
+
+    def _put(self, q, chunk):
+        while True:
+            try:
+                q.put(chunk, timeout=1)
+                return
+            except Full:
+                if self.cancelled.is_set():
+                    raise self._Cancelled
+
+    def _work(self, **kwargs):
+        # Tasks are picked up in the order they are applied. This guarantees
+        # the task being applied is always being fetched or already fetched.
+        try:
+            while not self.cancelled.is_set():
+                try:
+                    step = self.todo.get_nowait()
+                except Empty:
+                    break
+                self._fetch(step, **kwargs)
+        finally:
+            connections.close_all()
+
+    def _fetch(self, step, **kwargs):
+        q = self.queues[step]
+        rows = None
+        try:
+            rows = step.fetch(**kwargs)
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= self.chunksize:
+                    self._put(q, chunk)
+                    chunk = []
+            if chunk:
+                self._put(q, chunk)
+            self._put(q, None)
+        except self._Cancelled:
+            pass
+        except Exception as e:
+            try:
+                self._put(q, e)
+            except self._Cancelled:
+                pass
+        finally:
+            if hasattr(rows, "close"):
+                rows.close()
+
+
 class PlanTaskRegistry:
     reg = PlanTaskSequence()
     arguments = {}
@@ -21,33 +21,41 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, date
 from decimal import Decimal
+import json
 from logging import INFO, ERROR, WARNING, DEBUG
+from openpyxl import load_workbook
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 from openpyxl.worksheet.cell_range import CellRange
 from openpyxl.worksheet.worksheet import Worksheet
+import re
 import unicodedata
 
 from django import forms
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
 from django.core.validators import EMPTY_VALUES
-from django.db import DEFAULT_DB_ALIAS
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
 from django.db.models.fields import (
     IntegerField,
     AutoField,
     DurationField,
     BooleanField,
     DecimalField,
+    FloatField,
 )
 from django.db.models.fields import (
     DateField,
     DateTimeField,
     TimeField,
     CharField,
+    TextField,
     NOT_PROVIDED,
 )
 from django.db.models.fields.related import RelatedField
+from django.db.models.signals import pre_save, post_save
 from django.forms.models import modelform_factory
 from django.utils import translation
 from django.utils.translation import get_language, gettext_lazy as _
@@ -55,7 +63,8 @@ from django.utils.encoding import force_str
 from django.utils.formats import get_format
 from django.utils.text import get_text_list
 
-from .models import Comment
+from .commands import copyRows
+from .models import AuditModel, Comment, HierarchyModel, NotificationFactory
 from .localization import parseLocalizedDateTime
 
 
@@ -90,6 +99,56 @@ def sanitizeNumber(value):
     return value
 
 
+def loadWorkbook(file):
+    """
+    Opens an Excel workbook for importing data.
+
+    The workbook is opened in read-only mode: the rows of a worksheet are
+    parsed from the file while iterating over them, rather than loading
+    all cells of the workbook in memory upfront.
+    The caller needs to close the workbook when done.
+    """
+    wb = load_workbook(filename=file, read_only=True, data_only=True)
+    for ws in wb.worksheets:
+        # Not all applications write the dimensions of the worksheet correctly
+        ws.reset_dimensions()
+    return wb
+
+
+_autofilter = re.compile(rb'<(?:\w+:)?autoFilter\b[^>]*?\bref="([^"]*)"')
+
+
+def getAutoFilterBounds(ws):
+    """
+    Returns the bounds (min_col, min_row, max_col, max_row) of the auto-filter
+    range of a worksheet, or None when the worksheet has no auto-filter.
+    """
+    ref = None
+    if isinstance(ws, Worksheet):
+        ref = ws.auto_filter.ref
+    elif isinstance(ws, ReadOnlyWorksheet):
+        # The read-only worksheet doesn't parse the auto-filter, which comes
+        # after the cell data in the file. Scanning the raw xml is a lot
+        # cheaper than parsing it a second time.
+        with ws._get_source() as src:
+            tail = b""
+            while True:
+                chunk = src.read(1048576)
+                if not chunk:
+                    break
+                m = _autofilter.search(tail + chunk)
+                if m:
+                    ref = m.group(1).decode("utf-8")
+                    break
+                tail = chunk[-1024:]
+    if not ref:
+        return None
+    try:
+        return CellRange(ref).bounds
+    except Exception:
+        return None
+
+
 def parseExcelWorksheet(
     model,
     data,
@@ -420,17 +479,12 @@ def _parseData(
     has_pk_field = False
     processed_header = False
     rowWrapper = rowmapper()
+    rows = iter(data)
 
     # Detect excel autofilter data tables
-    if isinstance(data, Worksheet) and data.auto_filter.ref:
-        try:
-            bounds = CellRange(data.auto_filter.ref).bounds
-        except Exception:
-            bounds = None
-    else:
-        bounds = None
+    bounds = getAutoFilterBounds(data)
 
-    for row in data:
+    for row in rows:
         rownumber += 1
         if bounds:
             # Only process data in the excel auto-filter range
@@ -532,7 +586,10 @@ def _parseData(
                 )
             # Abort when there are errors
             if errors:
-                if isinstance(data, Worksheet) and len(data.parent.sheetnames) > 1:
+                if (
+                    isinstance(data, (Worksheet, ReadOnlyWorksheet))
+                    and len(data.parent.sheetnames) > 1
+                ):
                     # Skip this sheet an continue with the next one
                     return
                 else:
@@ -558,6 +615,22 @@ def _parseData(
                 ):
                     natural_key = model.natural_key
 
+            # Use the bulk upload when the model allows it
+            if has_pk_field and _bulkEligible(model, headers):
+                yield from _bulkParseData(
+                    model,
+                    headers,
+                    rows,
+                    rowWrapper,
+                    rownumber,
+                    warnings,
+                    content_type_id,
+                    user,
+                    database,
+                    ping,
+                )
+                return
+
         # Case 3: Process a data row
         else:
             try:
@@ -681,6 +754,461 @@ def _parseData(
     )
 
 
+# Model field types supported by the bulk upload
+bulkFieldTypes = {
+    "AutoField",
+    "BigIntegerField",
+    "BooleanField",
+    "CharField",
+    "DateField",
+    "DateTimeField",
+    "DecimalField",
+    "DurationField",
+    "FloatField",
+    "ForeignKey",
+    "IntegerField",
+    "JSONField",
+    "NullBooleanField",
+    "PositiveBigIntegerField",
+    "PositiveIntegerField",
+    "PositiveSmallIntegerField",
+    "SmallIntegerField",
+    "TextField",
+    "TimeField",
+}
+
+
+def _bulkEligible(model, headers):
+    """
+    Checks whether the bulk upload can be used for a model.
+    The bulk upload requires the primary key in the data, and a model
+    without custom logic to validate or save a record.
+    """
+    if (
+        not getattr(model, "bulkUpload", True)
+        or hasattr(model, "getModelForm")
+        or model._meta.proxy
+        or model._meta.parents
+        or isinstance(model._meta.pk, AutoField)
+        or model._meta.pk not in headers
+        or model._meta.unique_together
+        or pre_save.has_listeners(model)
+        or post_save.has_listeners(model)
+    ):
+        return False
+    for method in ("save", "clean", "clean_fields", "full_clean", "validate_unique"):
+        for cls in model.__mro__:
+            if method in cls.__dict__:
+                if cls not in (models.Model, AuditModel, HierarchyModel):
+                    return False
+                break
+    for f in model._meta.concrete_fields:
+        if f.get_internal_type() not in bulkFieldTypes:
+            return False
+        if f.unique and not f.primary_key:
+            return False
+        if f in headers:
+            if f.get_internal_type() == "ForeignKey" and (
+                f.remote_field.model._meta.proxy
+                or f.target_field.get_internal_type() not in bulkFieldTypes
+            ):
+                return False
+        elif f.has_default():
+            if callable(f.default):
+                if f.default not in (dict, list) and not (
+                    issubclass(model, AuditModel) and f.name == "lastmodified"
+                ):
+                    return False
+            elif not isinstance(
+                f.default,
+                (str, int, float, Decimal, bool, date, timedelta, dict, list),
+            ):
+                return False
+    return True
+
+
+def _bulkConverter(field, formfield):
+    """
+    Returns a function to validate and convert the values of a column.
+    Common value types are converted directly. Other values go through the
+    form field, which raises the same validation errors as the regular form.
+    """
+
+    def clean(value):
+        value = formfield.clean(value)
+        if value is not None:
+            field.run_validators(value)
+        return value
+
+    if field.choices or field._validators:
+        return clean
+    if isinstance(field, (CharField, TextField)) and type(formfield) is forms.CharField:
+        max_length = field.max_length
+
+        def convert(value):
+            if isinstance(value, str):
+                value = value.strip()
+                if value and (not max_length or len(value) <= max_length):
+                    return value
+            return clean(value)
+
+    elif isinstance(field, DecimalField):
+        limit = 10 ** (field.max_digits - field.decimal_places)
+        places = field.decimal_places
+
+        def convert(value):
+            if (
+                isinstance(value, (int, float, Decimal))
+                and not isinstance(value, bool)
+                and abs(value) < limit
+            ):
+                return round(value, places)
+            return clean(value)
+
+    elif isinstance(field, FloatField):
+
+        def convert(value):
+            if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+                return float(value)
+            return clean(value)
+
+    elif isinstance(field, IntegerField) and not field.get_internal_type().startswith(
+        "Positive"
+    ):
+
+        def convert(value):
+            if isinstance(value, int) and not isinstance(value, bool):
+                return value
+            return clean(value)
+
+    elif isinstance(field, DateTimeField):
+
+        def convert(value):
+            if isinstance(value, datetime):
+                return value
+            return clean(value)
+
+    elif isinstance(field, DateField):
+
+        def convert(value):
+            if isinstance(value, datetime):
+                return value.date()
+            elif isinstance(value, date):
+                return value
+            return clean(value)
+
+    else:
+        convert = clean
+    return convert
+
+
+def _bulkParseData(
+    model,
+    headers,
+    rows,
+    rowWrapper,
+    rownumber,
+    warnings,
+    content_type_id,
+    user,
+    database,
+    ping,
+):
+    """
+    Uploads data with a few set-based statements rather than saving records
+    one by one:
+      - the values are validated and converted column by column
+      - foreign keys are validated against the set of existing keys
+      - the valid rows are copied in a temporary table
+      - a single insert ... on conflict statement adds and updates the records
+    The messages are the same as the row by row upload in _parseData.
+    """
+    errors = 0
+    added = 0
+    changed = 0
+    fields = [f for f in headers if f]
+    pk = model._meta.pk
+
+    # Step 1: Read all data, column by column
+    rownumbers = []
+    columns = {f: [] for f in fields}
+    for row in rows:
+        rownumber += 1
+        rowWrapper.setData(row)
+        if ping and rownumber % 50 == 0:
+            yield (DEBUG, rownumber, None, None, None)
+        if rowWrapper.empty():
+            continue
+        rownumbers.append(rownumber)
+        for f in fields:
+            columns[f].append(rowWrapper[f.name])
+
+    # Step 2: Validate and convert each column
+    rowerrors = {}
+    required_msg = forms.Field.default_error_messages["required"]
+    invalid_fk_msg = _(
+        "Select a valid choice. That choice is not one of the available choices."
+    )
+    pk_values = None
+    for f in sorted(fields, key=lambda f: not f.primary_key):
+        values = columns[f]
+        if isinstance(f, RelatedField):
+            required = not f.null
+            target = f.target_field
+            convert = _bulkConverter(
+                target, target.formfield(localize=True) or forms.IntegerField()
+            )
+            if f.remote_field.model == model:
+                # Self-referencing key can refer to records in the data
+                keys = set(pk_values)
+            else:
+                keys = set()
+            lookup = set()
+        else:
+            formfield = f.formfield(localize=True)
+            required = formfield.required
+            convert = _bulkConverter(f, formfield)
+            if not required:
+                empty = formfield.clean(None)
+                if empty is None and not f.null:
+                    empty = f.get_default()
+        for idx, value in enumerate(values):
+            try:
+                if value in EMPTY_VALUES:
+                    if required:
+                        raise ValidationError(required_msg)
+                    values[idx] = None if isinstance(f, RelatedField) else empty
+                else:
+                    values[idx] = convert(value)
+                    if isinstance(f, RelatedField) and values[idx] not in keys:
+                        lookup.add(values[idx])
+            except ValidationError as e:
+                values[idx] = None
+                for msg in e.messages:
+                    rowerrors.setdefault(idx, []).append(
+                        (ERROR, rownumbers[idx], f.name, value, msg)
+                    )
+            except Exception as e:
+                values[idx] = None
+                rowerrors.setdefault(idx, []).append(
+                    (ERROR, rownumbers[idx], f.name, value, str(e))
+                )
+        if isinstance(f, RelatedField):
+            # Validate the keys against the database
+            lookup = list(lookup)
+            manager = f.remote_field.model._default_manager.using(database)
+            for i in range(0, len(lookup), 10000):
+                keys.update(
+                    manager.filter(
+                        **{"%s__in" % target.attname: lookup[i : i + 10000]}
+                    ).values_list(target.attname, flat=True)
+                )
+            for idx, value in enumerate(values):
+                if value is not None and value not in keys:
+                    values[idx] = None
+                    rowerrors.setdefault(idx, []).append(
+                        (
+                            ERROR,
+                            rownumbers[idx],
+                            f.name,
+                            columns[f][idx],
+                            invalid_fk_msg,
+                        )
+                    )
+        if f.primary_key:
+            pk_values = values
+
+    # Step 3: Collect the valid rows. The last row wins for duplicate keys.
+    for idx in sorted(rowerrors):
+        for e in rowerrors[idx]:
+            errors += 1
+            yield e
+    validrows = {}
+    for idx in range(len(rownumbers)):
+        if idx not in rowerrors:
+            validrows[pk_values[idx]] = idx
+    if not validrows:
+        yield _bulkSummary(rownumber, changed, added, errors, warnings)
+        return
+
+    # Step 4: Build the list of columns in the temporary table
+    insertfields = list(fields)
+    defaults = []
+    now = datetime.now()
+    for f in model._meta.concrete_fields:
+        if f in fields:
+            continue
+        if issubclass(model, AuditModel) and f.name == "lastmodified":
+            defaults.append(now)
+        elif f.has_default():
+            defaults.append(f.get_default())
+        else:
+            continue
+        insertfields.append(f)
+    jsonfields = [
+        i for i, f in enumerate(insertfields) if f.get_internal_type() == "JSONField"
+    ]
+    durationfields = [
+        i for i, f in enumerate(insertfields) if isinstance(f, DurationField)
+    ]
+
+    def getRows():
+        for idx in validrows.values():
+            r = [columns[f][idx] for f in fields] + defaults
+            for i in jsonfields:
+                if r[i] is not None:
+                    r[i] = json.dumps(r[i])
+            for i in durationfields:
+                if isinstance(r[i], timedelta):
+                    r[i] = r[i].total_seconds()
+            yield r
+
+    # Step 5: Merge the temporary table into the table
+    qn = connections[database].ops.quote_name
+    table = qn(model._meta.db_table)
+    cols = [qn(f.column) for f in insertfields]
+    updatecols = [qn(f.column) for f in fields if not f.primary_key]
+    extraupdates = []
+    if issubclass(model, AuditModel):
+        extraupdates.append(
+            "%s = excluded.%s" % (qn("lastmodified"), qn("lastmodified"))
+        )
+    if issubclass(model, HierarchyModel):
+        extraupdates += ["%s = null" % qn(c) for c in ("lft", "rght", "lvl")]
+    if updatecols:
+        conflict = "do update set %s where (%s) is distinct from (%s)" % (
+            ", ".join(["%s = excluded.%s" % (c, c) for c in updatecols] + extraupdates),
+            ", ".join("t.%s" % c for c in updatecols),
+            ", ".join("excluded.%s" % c for c in updatecols),
+        )
+    else:
+        conflict = "do nothing"
+    try:
+        with transaction.atomic(using=database):
+            with connections[database].cursor() as cursor:
+                cursor.execute("drop table if exists tmp_upload")
+                cursor.execute(
+                    "create temporary table tmp_upload on commit drop as select %s from %s where false"
+                    % (", ".join(cols), table)
+                )
+                copyRows(
+                    cursor,
+                    getRows(),
+                    "tmp_upload",
+                    columns=[f.column for f in insertfields],
+                )
+                # The final select sees the table as it was before the insert
+                cursor.execute(
+                    """
+                    with upsert as (
+                      insert into %s as t (%s)
+                      select %s from tmp_upload
+                      on conflict (%s) %s
+                      returning t.%s, t.xmax = 0 as inserted
+                    )
+                    select upsert.%s, upsert.inserted, array[%s]
+                    from upsert
+                    inner join tmp_upload on tmp_upload.%s = upsert.%s
+                    left outer join %s as old on old.%s = upsert.%s
+                    """
+                    % (
+                        table,
+                        ", ".join(cols),
+                        ", ".join(cols),
+                        qn(pk.column),
+                        conflict,
+                        qn(pk.column),
+                        qn(pk.column),
+                        ", ".join(
+                            "old.%s is distinct from tmp_upload.%s" % (c, c)
+                            for c in updatecols
+                        )
+                        or "false",
+                        qn(pk.column),
+                        qn(pk.column),
+                        table,
+                        qn(pk.column),
+                        qn(pk.column),
+                    )
+                )
+                comments = []
+                for key, inserted, changedcols in cursor.fetchall():
+                    if inserted:
+                        added += 1
+                    else:
+                        changed += 1
+                    if user:
+                        comments.append(
+                            Comment(
+                                user_id=user.id,
+                                content_type_id=content_type_id,
+                                object_pk=key,
+                                object_repr=force_str(key)[:200],
+                                type="add" if inserted else "change",
+                                comment=(
+                                    "Added"
+                                    if inserted
+                                    else "Changed %s."
+                                    % get_text_list(
+                                        [
+                                            f.name
+                                            for f, c in zip(
+                                                [
+                                                    f
+                                                    for f in fields
+                                                    if not f.primary_key
+                                                ],
+                                                changedcols,
+                                            )
+                                            if c
+                                        ],
+                                        "and",
+                                    )
+                                ),
+                            )
+                        )
+                if comments:
+                    Comment.objects.using(database).bulk_create(
+                        comments, batch_size=1000
+                    )
+        if comments:
+            from .middleware import _thread_locals
+
+            req = getattr(_thread_locals, "request", None)
+            NotificationFactory.launchWorker(
+                database=database,
+                url=(
+                    "%s://%s" % ("https" if req.is_secure() else "http", req.get_host())
+                    if req
+                    else None
+                ),
+            )
+    except Exception as e:
+        errors += 1
+        added = changed = 0
+        yield (ERROR, None, None, None, "Exception during upload: %s" % e)
+    yield _bulkSummary(rownumber, changed, added, errors, warnings)
+
+
+def _bulkSummary(rownumber, changed, added, errors, warnings):
+    return (
+        INFO,
+        None,
+        None,
+        None,
+        _(
+            "%(rows)d data rows, changed %(changed)d and added %(added)d records, %(errors)d errors, %(warnings)d warnings"
+        )
+        % {
+            "rows": rownumber - 1,
+            "changed": changed,
+            "added": added,
+            "errors": errors,
+            "warnings": warnings,
+        },
+    )
+
+
 class BulkForeignKeyFormField(forms.fields.Field):
     def __init__(
         self,
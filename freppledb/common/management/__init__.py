@@ -21,8 +21,9 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+from django.apps import apps
 from django.core.signals import request_finished
-from django.db import DEFAULT_DB_ALIAS
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.db.models import signals
 from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
@@ -64,6 +65,64 @@ def removePermissions(sender, using=DEFAULT_DB_ALIAS, **kwargs):
     Permission.objects.all().using(using).filter(codename="view_permission").delete()
 
 
+def createTombstoneTriggers(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Deletes from the tables of all AuditModel subclasses are recorded in the
+    common_tombstone table, so a scenario refresh can replicate them.
+    """
+    if sender.label != "common":
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute("select to_regclass('common_tombstone') is not null")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            """
+            select pg_class.relname
+            from pg_trigger
+            inner join pg_class on pg_class.oid = pg_trigger.tgrelid
+            where pg_trigger.tgname = 'tombstone'
+            """
+        )
+        existing = {i[0] for i in cursor}
+        added = False
+        for m in apps.get_models():
+            if (
+                not issubclass(m, common_models.AuditModel)
+                or m._meta.proxy
+                or not m._meta.managed
+                or m._meta.db_table in existing
+            ):
+                continue
+            cursor.execute("select to_regclass(%s) is not null", (m._meta.db_table,))
+            if not cursor.fetchone()[0]:
+                continue
+            table = connections[using].ops.quote_name(m._meta.db_table)
+            cursor.execute(
+                """
+                create trigger tombstone after delete on %s
+                referencing old table as deleted
+                for each statement execute function common_tombstone('%s')
+                """
+                % (table, m._meta.pk.column)
+            )
+            cursor.execute(
+                """
+                create trigger tombstone_truncate after truncate on %s
+                for each statement execute function common_tombstone()
+                """
+                % table
+            )
+            existing.add(m._meta.db_table)
+            added = True
+        if added:
+            # Deletes on the new tables weren't tracked until now
+            cursor.execute(
+                "update common_tombstone set deleted = now() where tablename = ''"
+            )
+
+
 signals.post_migrate.connect(removePermissions)
 signals.post_migrate.connect(createExtraPermissions)
+signals.post_migrate.connect(createTombstoneTriggers)
 request_finished.connect(resetRequest)
@@ -0,0 +1,65 @@
+#
+# Copyright (C) 2026 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common", "0035_user_scenario_themes"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            create table common_tombstone (
+              tablename varchar(300) not null,
+              key text,
+              deleted timestamp with time zone not null default now()
+            );
+            create index common_tombstone_deleted on common_tombstone (deleted);
+
+            -- The row with an empty table name marks since when deletes are tracked
+            insert into common_tombstone (tablename) values ('');
+
+            create or replace function common_tombstone() returns trigger
+            language plpgsql as $$
+            begin
+              if tg_op = 'TRUNCATE' then
+                insert into common_tombstone (tablename) values (tg_table_name);
+              else
+                execute format(
+                  'insert into common_tombstone (tablename, key) select %L, %I::text from deleted',
+                  tg_table_name, tg_argv[0]
+                  );
+              end if;
+              return null;
+            end;
+            $$;
+            """,
+            """
+            drop function if exists common_tombstone() cascade;
+            drop table if exists common_tombstone;
+            """,
+        ),
+    ]
@@ -0,0 +1,79 @@
+#
+# Copyright (C) 2026 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("common", "0037_permission_version"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            # A delete of many rows, such as the cleanup of a plan run, is
+            # recorded like a truncate: a single record for the table instead
+            # of one per deleted row. The next refresh copies the table completely.
+            """
+            create or replace function common_tombstone() returns trigger
+            language plpgsql as $$
+            declare
+              threshold constant integer := 10000;
+              cnt integer;
+            begin
+              if tg_op = 'TRUNCATE' then
+                insert into common_tombstone (tablename) values (tg_table_name);
+              else
+                select count(*) into cnt
+                from (select 1 from deleted limit threshold + 1) d;
+                if cnt > threshold then
+                  insert into common_tombstone (tablename) values (tg_table_name);
+                else
+                  execute format(
+                    'insert into common_tombstone (tablename, key) select %L, %I::text from deleted',
+                    tg_table_name, tg_argv[0]
+                    );
+                end if;
+              end if;
+              return null;
+            end;
+            $$;
+            """,
+            """
+            create or replace function common_tombstone() returns trigger
+            language plpgsql as $$
+            begin
+              if tg_op = 'TRUNCATE' then
+                insert into common_tombstone (tablename) values (tg_table_name);
+              else
+                execute format(
+                  'insert into common_tombstone (tablename, key) select %L, %I::text from deleted',
+                  tg_table_name, tg_argv[0]
+                  );
+              end if;
+              return null;
+            end;
+            $$;
+            """,
+        ),
+    ]
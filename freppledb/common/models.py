@@ -41,8 +41,8 @@ from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import PermissionDenied, ValidationError
 from django.core import mail
 from django.core.validators import FileExtensionValidator
-from django.db import models, DEFAULT_DB_ALIAS, connections, transaction
-from django.db.models import Q
+from django.db import models, router, DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import prefetch_related_objects, Q
 from django.db.models.signals import pre_delete
 from django.dispatch.dispatcher import receiver
 from django import forms
@@ -79,35 +79,243 @@ class HierarchyModel(models.Model):
         on_delete=models.SET_NULL,
     )
 
+    # Full rebuilds updating more records than this use a COPY to a temporary
+    # table instead of individual update statements
+    copythreshold = 1000
+
     def save(self, *args, **kwargs):
-        # Trigger recalculation of the hieracrhy.
-        # TODO this triggers the recalculation in too many cases, including a lot
-        # of changes which don't require it. Alternative solution is to use the
-        # pre-save signal which has more information.
-        self.lft = None
-        self.rght = None
-        self.lvl = None
+        if kwargs.get("update_fields", None) is not None and "owner" not in (
+            kwargs["update_fields"]
+        ):
+            # The hierarchy isn't changing
+            super().save(*args, **kwargs)
+            return
 
-        # Call the real save() method
-        super().save(*args, **kwargs)
+        database = kwargs.get("using", None) or router.db_for_write(
+            self.__class__, instance=self
+        )
+        with transaction.atomic(using=database):
+            # Update the hierarchy incrementally. When that isn't possible we
+            # trigger the recalculation of the complete hierarchy.
+            if not self.moveInHierarchy(database):
+                self.lft = None
+                self.rght = None
+                self.lvl = None
+
+            # Call the real save() method
+            super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
-        try:
-            # Update an arbitrary other object to trigger recalculation of the hierarchy
-            obj = self.__class__.objects.using(self._state.db).exclude(pk=self.pk)[0]
-            obj.lft = None
-            obj.rght = None
-            obj.lvl = None
-            obj.save(update_fields=["lft", "rght", "lvl"], using=self._state.db)
-        except Exception:
-            # Failure can happen when eg we delete the last record
-            pass
-        # Call the real delete() method
-        super().delete(*args, **kwargs)
+        database = kwargs.get("using", None) or self._state.db or DEFAULT_DB_ALIAS
+        with transaction.atomic(using=database):
+            if not self.removeFromHierarchy(database):
+                try:
+                    # Update an arbitrary other object to trigger recalculation of the hierarchy
+                    obj = self.__class__.objects.using(database).exclude(pk=self.pk)[0]
+                    obj.lft = None
+                    obj.rght = None
+                    obj.lvl = None
+                    obj.save(update_fields=["lft", "rght", "lvl"], using=database)
+                except Exception:
+                    # Failure can happen when eg we delete the last record
+                    pass
+            # Call the real delete() method
+            return super().delete(*args, **kwargs)
 
     class Meta:
         abstract = True
 
+    @classmethod
+    def _lockHierarchy(cls, cursor, name, database):
+        """
+        Locks the table against concurrent changes, and returns the current
+        owner, lft, rght and lvl of a record, or None if the record doesn't exist.
+        Returns False when the hierarchy has other records that still need to
+        be calculated, in which case an incremental update isn't possible.
+        """
+        table = connections[database].ops.quote_name(cls._meta.db_table)
+        cursor.execute("lock table %s in share row exclusive mode" % table)
+        cursor.execute(
+            "select exists (select 1 from %s where lft is null and name <> %%s)"
+            % table,
+            (name,),
+        )
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(
+            "select owner_id, lft, rght, lvl from %s where name = %%s" % table,
+            (name,),
+        )
+        return cursor.fetchone()
+
+    def moveInHierarchy(self, database=DEFAULT_DB_ALIAS):
+        """
+        Updates the nested set fields when this record is inserted or when
+        it gets a new owner. Only the records between the old and the new
+        position of the record and its children are updated.
+        Returns False when the hierarchy needs to be rebuilt completely.
+        """
+        table = connections[database].ops.quote_name(self._meta.db_table)
+        with connections[database].cursor() as cursor:
+            cursor.execute(
+                "select owner_id, lft, rght, lvl from %s where name = %%s" % table,
+                (self.name,),
+            )
+            old = cursor.fetchone()
+            if old and old[0] == self.owner_id:
+                # Same owner: the record keeps its position
+                self.lft, self.rght, self.lvl = old[1:]
+                return old[1] is not None
+
+            old = self._lockHierarchy(cursor, self.name, database)
+            if old is False or (old and old[1] is None):
+                return False
+
+            # Find the position of the record: as last child of the owner
+            if self.owner_id:
+                if self.owner_id == self.name:
+                    return False
+                cursor.execute(
+                    "select lft, rght, lvl from %s where name = %%s" % table,
+                    (self.owner_id,),
+                )
+                parent = cursor.fetchone()
+                if not parent or parent[0] is None:
+                    return False
+                target = parent[1]
+                level = parent[2] + 1
+            else:
+                cursor.execute("select coalesce(max(rght), 0) + 1 from %s" % table)
+                target = cursor.fetchone()[0]
+                level = 0
+
+            if not old:
+                # A new leaf node
+                cursor.execute(
+                    """
+                    update %s set
+                      lft = case when lft >= %%s then lft + 2 else lft end,
+                      rght = rght + 2
+                    where rght >= %%s
+                    """
+                    % table,
+                    (target, target),
+                )
+                self.lft = target
+                self.rght = target + 1
+                self.lvl = level
+                return True
+
+            # Move the record with all its children
+            left, right, oldlevel = old[1:]
+            if left <= target <= right:
+                # The new owner is a child of this record
+                return False
+            width = right - left + 1
+            if target > right:
+                # Move to the right, the records in between shift left
+                shift = target - right - 1
+                low, high, other = right + 1, target - 1, -width
+            else:
+                # Move to the left, the records in between shift right
+                shift = target - left
+                low, high, other = target, left - 1, width
+            cursor.execute(
+                """
+                update %s set
+                  lft = case
+                    when lft between %%s and %%s then lft + %%s
+                    when lft between %%s and %%s then lft + %%s
+                    else lft end,
+                  rght = case
+                    when rght between %%s and %%s then rght + %%s
+                    when rght between %%s and %%s then rght + %%s
+                    else rght end,
+                  lvl = case
+                    when lft between %%s and %%s then lvl + %%s
+                    else lvl end
+                where lft between %%s and %%s or rght between %%s and %%s
+                """
+                % table,
+                (
+                    left,
+                    right,
+                    shift,
+                    low,
+                    high,
+                    other,
+                    left,
+                    right,
+                    shift,
+                    low,
+                    high,
+                    other,
+                    left,
+                    right,
+                    level - oldlevel,
+                    min(left, low),
+                    max(right, high),
+                    min(left, low),
+                    max(right, high),
+                ),
+            )
+            self.lft = left + shift
+            self.rght = right + shift
+            self.lvl = level
+            return True
+
+    def removeFromHierarchy(self, database=DEFAULT_DB_ALIAS):
+        """
+        Updates the nested set fields of the other records before this record
+        is deleted. The children of the record become top level records.
+        Returns False when the hierarchy needs to be rebuilt completely.
+        """
+        table = connections[database].ops.quote_name(self._meta.db_table)
+        with connections[database].cursor() as cursor:
+            old = self._lockHierarchy(cursor, self.name, database)
+            if not old or old[1] is None:
+                return False
+            left, right, level = old[1:]
+            width = right - left + 1
+            cursor.execute("select max(rght) from %s" % table)
+            move = cursor.fetchone()[0] + 1 - left - 1 - width
+            cursor.execute(
+                """
+                update %s set
+                  lft = case
+                    when lft > %%s and lft < %%s then lft + %%s
+                    when lft > %%s then lft - %%s
+                    else lft end,
+                  rght = case
+                    when rght > %%s and rght < %%s then rght + %%s
+                    when rght > %%s then rght - %%s
+                    else rght end,
+                  lvl = case
+                    when lft > %%s and lft < %%s then lvl - %%s
+                    else lvl end
+                where rght > %%s and name <> %%s
+                """
+                % table,
+                (
+                    left,
+                    right,
+                    move,
+                    right,
+                    width,
+                    left,
+                    right,
+                    move,
+                    right,
+                    width,
+                    left,
+                    right,
+                    level + 1,
+                    left,
+                    self.name,
+                ),
+            )
+            return True
+
     @classmethod
     def rebuildHierarchy(cls, database=DEFAULT_DB_ALIAS):
         # Verify whether we need to rebuild or not.
@@ -117,26 +325,37 @@ class HierarchyModel(models.Model):
 
         nodes = {}
         children = {}
+        current = {}
         updates = []
 
-        def tagChildren(me, left, level):
-            right = left + 1
-            # Get all children of this node
-            for i in children.get(me, []):
-                # Recursive execution of this function for each child of this node
-                right = tagChildren(i, right, level + 1)
-
-            # After processing the children of this node now know its left and right values
-            updates.append((left, right, level, me))
-
-            # Remove from node list (to mark as processed)
-            del nodes[me]
-
-            # Return the right value of this node + 1
-            return right + 1
+        def tagChildren(root, cnt):
+            # Iterative depth-first traversal, to avoid hitting the recursion
+            # limit on deep hierarchies
+            del nodes[root]
+            stack = [(root, cnt, 0, iter(sorted(children.get(root, ()))))]
+            cnt += 1
+            while stack:
+                me, left, level, todo = stack[-1]
+                child = next(todo, None)
+                if child is None:
+                    # All children are processed, so we now know the right value
+                    stack.pop()
+                    if current[me] != (left, cnt, level):
+                        updates.append((left, cnt, level, me))
+                    cnt += 1
+                else:
+                    del nodes[child]
+                    stack.append(
+                        (child, cnt, level + 1, iter(sorted(children.get(child, ()))))
+                    )
+                    cnt += 1
+            return cnt
 
         # Load all nodes in memory
-        for i in cls.objects.using(database).values("name", "owner"):
+        for i in cls.objects.using(database).values(
+            "name", "owner", "lft", "rght", "lvl"
+        ):
+            current[i["name"]] = (i["lft"], i["rght"], i["lvl"])
             if i["name"] == i["owner"]:
                 logging.error("Data error: '%s' points to itself as owner" % i["name"])
                 nodes[i["name"]] = None
@@ -152,47 +371,71 @@ class HierarchyModel(models.Model):
         cnt = 1
         for i, j in keys:
             if j is None:
-                cnt = tagChildren(i, cnt, 0)
+                cnt = tagChildren(i, cnt)
 
         if nodes:
             # If the nodes dictionary isn't empty, it is an indication of an
             # invalid hierarchy.
             # There are loops in your hierarchy, ie parent-chains not ending
             # at a top-level node without parent.
-            bad = nodes.copy()
-            updated = True
-            while updated:
-                updated = False
-                for i in list(bad.keys()):
-                    ok = True
-                    for j, k in bad.items():
-                        if k == i:
-                            ok = False
-                            break
-                    if ok:
-                        # If none of the bad keys points to me as a parent, I am unguilty
-                        del bad[i]
-                        updated = True
-            logging.error("Data error: Hierarchy loops among %s" % sorted(bad.keys()))
-            for i, j in sorted(bad.items()):
-                children[j].remove(i)
+            # Every remaining node has a parent chain ending in a loop. We
+            # follow each chain only once to find the nodes on the loops.
+            bad = set()
+            visited = {}
+            for start in nodes:
+                i = start
+                while i not in visited:
+                    visited[i] = start
+                    i = nodes[i]
+                if visited[i] == start:
+                    # We found a new loop
+                    while i not in bad:
+                        bad.add(i)
+                        i = nodes[i]
+            logging.error("Data error: Hierarchy loops among %s" % sorted(bad))
+            for i in sorted(bad):
+                children[nodes[i]].remove(i)
                 nodes[i] = None
 
             # Continue loop over nodes without parent
             keys = sorted(nodes.items())
             for i, j in keys:
                 if j is None:
-                    cnt = tagChildren(i, cnt, 0)
+                    cnt = tagChildren(i, cnt)
 
         # Write all results to the database
+        table = connections[database].ops.quote_name(cls._meta.db_table)
         with transaction.atomic(using=database):
             cursor = connections[database].cursor()
-            execute_batch(
-                cursor,
-                "update %s set lft=%%s, rght=%%s, lvl=%%s where name = %%s"
-                % connections[database].ops.quote_name(cls._meta.db_table),
-                updates,
-            )
+            if len(updates) > cls.copythreshold:
+                from freppledb.common.commands import copyRows
+
+                cursor.execute("drop table if exists tmp_hierarchy")
+                cursor.execute(
+                    """
+                    create temporary table tmp_hierarchy (
+                      lft integer, rght integer, lvl integer, name varchar(300)
+                    ) on commit drop
+                    """
+                )
+                copyRows(cursor, updates, "tmp_hierarchy")
+                cursor.execute(
+                    """
+                    update %s set
+                      lft = tmp_hierarchy.lft,
+                      rght = tmp_hierarchy.rght,
+                      lvl = tmp_hierarchy.lvl
+                    from tmp_hierarchy
+                    where %s.name = tmp_hierarchy.name
+                    """
+                    % (table, table)
+                )
+            else:
+                execute_batch(
+                    cursor,
+                    "update %s set lft=%%s, rght=%%s, lvl=%%s where name = %%s" % table,
+                    updates,
+                )
 
     @classmethod
     def createRootObject(cls, database=DEFAULT_DB_ALIAS):
@@ -217,7 +460,7 @@ class HierarchyModel(models.Model):
                 obj.save(update_fields=["lft"])
             cls.objects.using(database).filter(owner__isnull=True).exclude(
                 name=rootname
-            ).update(owner=obj)
+            ).update(owner=obj, lft=None)
 
             # Rebuild the hierarchy again with the new root
             cls.rebuildHierarchy(database=database)
@@ -1103,6 +1346,9 @@ class NotificationFactory:
     _workers = {}
     _reg = {}
 
+    # Number of messages processed in a single transaction
+    batchsize = 500
+
     @classmethod
     def launchWorker(cls, database=DEFAULT_DB_ALIAS, url=None):
         worker = cls._workers.get(database, None)
@@ -1120,7 +1366,25 @@ class NotificationFactory:
             p.start()
 
     @classmethod
-    def register(cls, followerclass, messageclasses):
+    def register(cls, followerclass, messageclasses, keys=None, prefetch=None):
+        """
+        Registers a function that decides whether a follower of an object
+        of the follower class is notified of a message on an object of one of
+        the message classes.
+
+        The optional keys argument lists the fields of the message objects
+        that can refer to the followed object. The function is then only
+        evaluated for the followers of the message object itself, of the
+        objects referred to by these fields and of all objects. Without keys,
+        the function is evaluated for every follower.
+        A key in the format "relation__field" reads the field of all objects
+        of a related set.
+
+        The optional prefetch argument maps a message class to the related
+        objects that the function reads. They are prefetched for a batch of
+        messages, instead of being read again for every follower.
+        """
+
         def decorator(func):
             if not inspect.isclass(followerclass):
                 raise Exception("NotificationFactory needs a class as first argument")
@@ -1135,10 +1399,82 @@ class NotificationFactory:
                     cls._reg[m] = [func]
             func.messages = messageclasses
             func.follower = followerclass
+            func.keys = keys
+            func.prefetch = prefetch or {}
             return func
 
         return decorator
 
+    @staticmethod
+    def indexFollowers(followers):
+        """
+        Returns a dictionary of the followers by model and object primary key.
+        """
+        index = {}
+        for flw in followers:
+            index.setdefault(flw.content_type.model_class(), {}).setdefault(
+                flw.object_pk, []
+            ).append(flw)
+        return index
+
+    @staticmethod
+    def candidates(msg, meta, index):
+        """
+        Returns the followers which can be notified of a message, sorted by
+        their identifier, with the set of functions to evaluate for each.
+        """
+        result = {}
+        for c in meta:
+            if c.keys is None:
+                pks = None
+            else:
+                pks = {msg.object_pk, "all"}
+                obj = msg.content_object
+                if obj is not None:
+                    for k in c.keys:
+                        if "__" in k:
+                            rel, fld = k.split("__", 1)
+                            related = getattr(obj, rel, None)
+                            if related is not None and hasattr(related, "all"):
+                                for x in related.all():
+                                    val = getattr(x, fld, None)
+                                    if val is not None:
+                                        pks.add(str(val))
+                        else:
+                            val = getattr(obj, k, None)
+                            if val is not None:
+                                pks.add(str(val))
+            for model in c.messages:
+                objs = index.get(model, None)
+                if not objs:
+                    continue
+                for pk in objs if pks is None else pks:
+                    for flw in objs.get(pk, ()):
+                        if flw.id in result:
+                            result[flw.id][1].add(c)
+                        else:
+                            result[flw.id] = (flw, {c})
+        return [result[i] for i in sorted(result)]
+
+    @classmethod
+    def prefetch(cls, messages):
+        """
+        Reads the related objects of the messages that the registered
+        functions use, with a single query per model and relation.
+        """
+        objs = {}
+        for msg in messages:
+            if msg.content_object is not None:
+                objs.setdefault(msg.content_type.model_class(), []).append(
+                    msg.content_object
+                )
+        for model, instances in objs.items():
+            lookups = set()
+            for c in cls._reg.get(model, ()):
+                lookups.update(c.prefetch.get(model, ()))
+            if lookups:
+                prefetch_related_objects(instances, *sorted(lookups))
+
     @classmethod
     def _buildRegistry(cls):
         # Find all notification registrations
@@ -1155,6 +1491,13 @@ class NotificationFactory:
                 ):
                     raise e
 
+    @staticmethod
+    def hasPermission(cache, user, permission):
+        key = (user.id, permission)
+        if key not in cache:
+            cache[key] = user.has_perm(permission)
+        return cache[key]
+
     @classmethod
     def start(cls, url=None, database=DEFAULT_DB_ALIAS):
         """
@@ -1170,22 +1513,32 @@ class NotificationFactory:
                 Follower.objects.all()
                 .using(database)
                 .filter(user__is_active=True)
+                .select_related("user", "content_type")
                 .order_by("id")
             )
+            index = cls.indexFollowers(followers)
+            permissions = {}
             idle_loop_done = False
             while True:
                 with transaction.atomic(using=database):
                     empty = True
                     emails = []
                     if followers:
-                        for msg in (
+                        notifications = []
+                        processed = []
+                        # The objects of the messages are read with a single
+                        # query per model.
+                        messages = list(
                             Comment.objects.all()
                             .using(database)
                             .filter(processed=False)
                             .order_by("id")
                             .select_related("content_type")
-                            .select_for_update(skip_locked=True, of=("self",))[:50]
-                        ):
+                            .select_for_update(skip_locked=True, of=("self",))
+                            .prefetch_related("content_object")[: cls.batchsize]
+                        )
+                        cls.prefetch(messages)
+                        for msg in messages:
                             empty = False
                             recipients = set()
                             try:
@@ -1199,30 +1552,34 @@ class NotificationFactory:
                                 )
                                 meta = cls._reg.get(model, None)
                                 if meta:
-                                    for flw in followers:
+                                    for flw, funcs in cls.candidates(msg, meta, index):
                                         for c in meta:
+                                            if c not in funcs:
+                                                continue
                                             try:
                                                 if (
                                                     flw.user not in created
-                                                    and flw.content_type.model_class()
-                                                    in c.messages
                                                     and (
                                                         flw.object_pk == "all"
                                                         or c(flw, msg)
                                                     )
                                                     and (
                                                         not view_permission
-                                                        or flw.user.has_perm(
-                                                            view_permission
+                                                        or cls.hasPermission(
+                                                            permissions,
+                                                            flw.user,
+                                                            view_permission,
                                                         )
                                                     )
                                                 ):
-                                                    Notification(
-                                                        comment=msg,
-                                                        user=flw.user,
-                                                        type=flw.type,
-                                                        follower=flw,
-                                                    ).save(database)
+                                                    notifications.append(
+                                                        Notification(
+                                                            comment=msg,
+                                                            user=flw.user,
+                                                            type=flw.type,
+                                                            follower=flw,
+                                                        )
+                                                    )
                                                     if (
                                                         flw.type == "M"
                                                         and flw.user.email
@@ -1236,8 +1593,7 @@ class NotificationFactory:
                                                     "Exception in notification function %s: %s"
                                                     % (c, e)
                                                 )
-                                msg.processed = True
-                                msg.save(update_fields=["processed"], using=database)
+                                processed.append(msg.id)
                                 if recipients:
                                     data = msg.getMail(url, database)
                                     email = mail.EmailMultiAlternatives(
@@ -1254,6 +1610,14 @@ class NotificationFactory:
                                     "Couldn't create nofications for message %s: %s"
                                     % (msg.id, e)
                                 )
+                        if notifications:
+                            Notification.objects.using(database).bulk_create(
+                                notifications, batch_size=1000
+                            )
+                        if processed:
+                            Comment.objects.all().using(database).filter(
+                                id__in=processed
+                            ).update(processed=True)
                         if emails:
                             connection = None
                             try:
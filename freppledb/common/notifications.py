@@ -24,12 +24,12 @@
 from .models import NotificationFactory, User, Bucket, BucketDetail, Parameter
 
 
-@NotificationFactory.register(User, [User])
+@NotificationFactory.register(User, [User], keys=())
 def UserNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(Bucket, [Bucket, BucketDetail])
+@NotificationFactory.register(Bucket, [Bucket, BucketDetail], keys=("bucket_id",))
 def BucketNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return flw.object_pk == msg.object_pk
@@ -37,11 +37,11 @@ def BucketNotification(flw, msg):
         return flw.object_pk == msg.content_object.bucket.name
 
 
-@NotificationFactory.register(BucketDetail, [BucketDetail])
+@NotificationFactory.register(BucketDetail, [BucketDetail], keys=())
 def BucketDetailNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(Parameter, [Parameter])
+@NotificationFactory.register(Parameter, [Parameter], keys=())
 def ParameterNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
@@ -47,9 +47,11 @@ import json
 import random
 import re
 from time import timezone, localtime, sleep
+from threading import Lock
+from contextlib import contextmanager
 from io import StringIO, BytesIO
 import urllib
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import NamedStyle, PatternFill
@@ -101,7 +103,7 @@ from freppledb.common.models import (
     HierarchyModel,
     NotificationFactory,
 )
-from freppledb.common.dataload import parseExcelWorksheet, parseCSVdata
+from freppledb.common.dataload import loadWorkbook, parseExcelWorksheet, parseCSVdata
 from freppledb.common.localization import parseLocalizedDate, parseLocalizedDateTime
 from freppledb.common.utils import getStorageUsage
 
@@ -169,6 +171,59 @@ def create_connection(alias=DEFAULT_DB_ALIAS):
     return backend.DatabaseWrapper(db, alias)
 
 
+class RoleConnectionPool:
+    """
+    A pool of database connections for executing user-defined SQL queries
+    under the restricted SQL_ROLE of a scenario.
+
+    Connections are kept open between requests to avoid the cost of a new
+    connection handshake for every query. The role is set again each time a
+    connection is borrowed, since the SQL of the user can change it.
+    """
+
+    lock = Lock()
+    pools = {}
+    size = 4
+
+    @classmethod
+    @contextmanager
+    def connection(cls, database=DEFAULT_DB_ALIAS):
+        conn = None
+        with cls.lock:
+            pool = cls.pools.get(database)
+            if pool:
+                conn = pool.pop()
+        if conn is None:
+            conn = create_connection(database)
+            # Connections are reused by different request threads
+            conn.inc_thread_sharing()
+        ok = False
+        try:
+            with conn.cursor() as cursor:
+                sqlrole = settings.DATABASES[database].get("SQL_ROLE", "report_role")
+                if sqlrole:
+                    cursor.execute("set role %s" % (sqlrole,))
+            yield conn
+            ok = True
+        finally:
+            if ok and conn.is_usable() and not conn.needs_rollback:
+                with cls.lock:
+                    pool = cls.pools.setdefault(database, [])
+                    if len(pool) < cls.size:
+                        pool.append(conn)
+                        conn = None
+            if conn:
+                conn.close()
+
+    @classmethod
+    def clear(cls, database=None):
+        with cls.lock:
+            for db in list(cls.pools.keys()):
+                if database is None or db == database:
+                    for conn in cls.pools.pop(db):
+                        conn.close()
+
+
 def matchesModelName(name, model):
     """
     Returns true if the first argument is a valid name for the model passed as second argument.
@@ -1247,6 +1302,12 @@ class GridReport(View):
                 if hasattr(request, "query"):
                     delattr(request, "query")
 
+                if len(scenario_list) == 1 and decimal_separator != ",":
+                    copied = cls.copy_query(request, *args, fields=fields, **kwargs)
+                    if copied is not None:
+                        yield from copied
+                        continue
+
                 for row in cls.data_query(request, *args, fields=fields, **kwargs):
                     # Clear the return string buffer
                     sf.seek(0)
@@ -1602,6 +1663,16 @@ class GridReport(View):
             cache_val = cursor.fetchone()[0]
             return cache_val
 
+    @classmethod
+    def copy_query(cls, request, *args, fields=None, **kwargs):
+        """
+        Reports can override this method to export CSV data without localized
+        formatting directly from the database.
+        It returns an iterator over lines of CSV formatted text, or None when
+        the records need to be formatted from the result of data_query.
+        """
+        return None
+
     @classmethod
     def _generate_json_data(cls, request, *args, **kwargs):
         request.prefs = request.user.getPreference(
@@ -2674,7 +2745,7 @@ class GridReport(View):
                     )
 
                     # Loop through the data records
-                    wb = load_workbook(filename=file, data_only=True)
+                    wb = loadWorkbook(file)
                     numsheets = len(wb.sheetnames)
 
                     for ws_name in wb.sheetnames:
@@ -2750,6 +2821,7 @@ class GridReport(View):
                                     error[3] if error[3] else "",
                                     error[4],
                                 )
+                    wb.close()
                 yield "</tbody></table></div>"
 
             # Update the hierachy
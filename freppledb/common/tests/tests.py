@@ -21,12 +21,32 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+from datetime import datetime, timedelta
+from decimal import Decimal
+import logging
 import os
+import struct
+import time
+from unittest import skipUnless
 
+from django.contrib.auth.models import Permission
+from django.db import connections, DEFAULT_DB_ALIAS
 from django.http.response import StreamingHttpResponse
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
 
+from freppledb.common.auth import PermissionCache
+from freppledb.common.commands import (
+    CopyBinaryGenerator,
+    CopyFromGenerator,
+    PlanTask,
+    PlanTaskPipeline,
+    textRows,
+)
 from freppledb.common.models import User, Scenario
+from freppledb.input.models import Item, Location, OperationPlan
+from freppledb.output.commands import ExportOperationPlanMaterials
+
+logger = logging.getLogger(__name__)
 
 
 def checkResponse(testcase, response):
@@ -61,6 +81,41 @@ class UserPreferenceTest(TestCase):
         self.assertEqual(after, {"a": 1, "b": "c"})
 
 
+class PermissionCacheTest(TestCase):
+    def test_cache(self):
+        PermissionCache.invalidate()
+        user = User.objects.create_user("cachetest", password="cachetest")
+        view_item = Permission.objects.get(
+            content_type__app_label="input", codename="view_item"
+        )
+        self.assertEqual(
+            PermissionCache.get(DEFAULT_DB_ALIAS, "cachetest"), (True, False, set())
+        )
+        hits = PermissionCache.getStatistics()["hits"]
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(PermissionCache.get(DEFAULT_DB_ALIAS, "cachetest"))
+        self.assertEqual(PermissionCache.getStatistics()["hits"], hits + 1)
+
+        # Changes to the permissions invalidate the cache
+        user.user_permissions.add(view_item)
+        self.assertEqual(
+            PermissionCache.get(DEFAULT_DB_ALIAS, "cachetest")[2], {"input.view_item"}
+        )
+        user.is_active = False
+        user.save()
+        self.assertFalse(PermissionCache.get(DEFAULT_DB_ALIAS, "cachetest")[0])
+        self.assertIsNone(PermissionCache.get(DEFAULT_DB_ALIAS, "unknown user"))
+
+        # Changes made in other processes are picked up when the version changes
+        User.objects.filter(username="cachetest").update(is_active=True)
+        self.assertFalse(PermissionCache.get(DEFAULT_DB_ALIAS, "cachetest")[0])
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute("select nextval('common_permission_version')")
+        # The new version is read when the version interval expires
+        PermissionCache.versions.clear()
+        self.assertTrue(PermissionCache.get(DEFAULT_DB_ALIAS, "cachetest")[0])
+
+
 class AppsAndAboutTest(TestCase):
     def setUp(self):
         os.environ["FREPPLE_TEST"] = "YES"
@@ -77,3 +132,240 @@ class AppsAndAboutTest(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.client.get("/about/")
         self.assertEqual(response.status_code, 200)
+
+
+class PlanTaskPipelineTest(SimpleTestCase):
+    applied = []
+
+    def makeTask(self, seq, rows, dependencies=()):
+        test = self
+
+        class task(PlanTask):
+            description = "task %s" % seq
+            sequence = seq
+            step = seq
+
+            @classmethod
+            def fetch(cls, **kwargs):
+                for r in range(rows):
+                    if r == 5000 and seq == 99:
+                        raise ValueError("fetch failed")
+                    yield (seq, r)
+
+            @classmethod
+            def apply(cls, rows, **kwargs):
+                test.applied.append((seq, sum(1 for r in rows)))
+
+        task.dependencies = dependencies
+        return task
+
+    def test_pipeline_order(self):
+        t1 = self.makeTask(1, 10)
+        t2 = self.makeTask(2, 5000)
+        t3 = self.makeTask(3, 200000, dependencies=(t1,))
+        t4 = self.makeTask(4, 10, dependencies=(t3,))
+        t2.dependencies = (t4,)
+        pipeline = PlanTaskPipeline([t1, t2, t3, t4], threads=2)
+        self.assertEqual(pipeline.steps, [t1, t3, t4, t2])
+        self.applied.clear()
+        pipeline.start()
+        try:
+            for step in pipeline.steps:
+                step.apply(pipeline.rows(step))
+        finally:
+            pipeline.stop()
+        self.assertEqual(self.applied, [(1, 10), (3, 200000), (4, 10), (2, 5000)])
+
+    def test_pipeline_volume(self):
+        # A big fetch moves forward once its dependencies are applied
+        t1 = self.makeTask(1, 10)
+        t2 = self.makeTask(2, 10)
+        t3 = self.makeTask(3, 10)
+        t4 = self.makeTask(4, 100000, dependencies=(t1,))
+        t4.fetchVolume = 100
+        t5 = self.makeTask(5, 10, dependencies=(t4,))
+        pipeline = PlanTaskPipeline([t1, t2, t3, t4, t5], threads=2)
+        self.assertEqual(pipeline.steps, [t1, t4, t2, t3, t5])
+
+    def test_pipeline_errors(self):
+        t1 = self.makeTask(1, 10)
+        t2 = self.makeTask(2, 10, dependencies=(t1,))
+        t1.dependencies = (t2,)
+        with self.assertRaises(ValueError):
+            PlanTaskPipeline([t1, t2], threads=2)
+        t3 = self.makeTask(99, 10000)
+        t4 = self.makeTask(4, 100000)
+        pipeline = PlanTaskPipeline([t3, t4], threads=2)
+        pipeline.start()
+        try:
+            with self.assertRaises(ValueError):
+                t3.apply(pipeline.rows(t3))
+        finally:
+            pipeline.stop()
+
+
+class CopyFormatTest(SimpleTestCase):
+    types = ["varchar", "numeric", "timestamptz", "jsonb", "interval"]
+
+    def getRows(self, count):
+        start = datetime(2024, 1, 1)
+        for i in range(count):
+            yield (
+                "operationplan %s" % i,
+                round(i / 7, 8),
+                start,
+                '{"pegging": {}}',
+                3600 if i % 2 else None,
+            )
+
+    def test_binary_encoding(self):
+        data = CopyBinaryGenerator(
+            [("a\\bc", Decimal("-12.5"), datetime(2000, 1, 1), None, 1.5)],
+            self.types,
+            tz="UTC",
+        ).read()
+        self.assertTrue(data.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertTrue(data.endswith(b"\xff\xff"))
+        row = data[19:-2]
+        self.assertEqual(row[:2], struct.pack(">h", 5))
+        # String without escaping
+        self.assertEqual(row[2:10], struct.pack(">i", 4) + b"a\\bc")
+        # Numeric -12.5: digits 12 and 5000, weight 0, negative, scale 1
+        self.assertEqual(
+            row[10:26],
+            struct.pack(">i", 12) + struct.pack(">hhHhHH", 2, 0, 0x4000, 1, 12, 5000),
+        )
+        # Timestamp at the postgresql epoch
+        self.assertEqual(row[26:38], struct.pack(">iq", 8, 0))
+        # Null
+        self.assertEqual(row[38:42], struct.pack(">i", -1))
+        # Interval of 1.5 seconds
+        self.assertEqual(row[42:], struct.pack(">iqii", 16, 1500000, 0, 0))
+
+    def test_chunked_read(self):
+        lines = ["line %s \u00e9\n" % i for i in range(20000)]
+        expected = "".join(lines).encode("utf-8")
+        self.assertEqual(CopyFromGenerator(lines).read(), expected)
+        for size in (1, 1000, CopyFromGenerator.chunksize, 100000):
+            stream = CopyFromGenerator(lines)
+            data = []
+            while True:
+                chunk = stream.read(size)
+                if not chunk:
+                    break
+                self.assertLessEqual(len(chunk), size)
+                data.append(chunk)
+            self.assertEqual(b"".join(data), expected)
+            stream = CopyFromGenerator(lines)
+            buffer = bytearray(size)
+            data = bytearray()
+            while True:
+                count = stream.readinto(buffer)
+                if not count:
+                    break
+                data += buffer[:count]
+            self.assertEqual(data, expected)
+
+    def test_binary_rows(self):
+        # Walk through the fields of all rows in the binary stream
+        count = 100
+        data = CopyBinaryGenerator(self.getRows(count), self.types, tz="UTC").read()
+        self.assertTrue(data.startswith(CopyBinaryGenerator.header))
+        pos = len(CopyBinaryGenerator.header)
+        names = []
+        while True:
+            fields = struct.unpack_from(">h", data, pos)[0]
+            pos += 2
+            if fields == -1:
+                break
+            self.assertEqual(fields, len(self.types))
+            for idx in range(fields):
+                size = struct.unpack_from(">i", data, pos)[0]
+                pos += 4
+                if idx == 0:
+                    names.append(data[pos : pos + size].decode("utf-8"))
+                if size > 0:
+                    pos += size
+        self.assertEqual(pos, len(data))
+        self.assertEqual(names, ["operationplan %s" % i for i in range(count)])
+
+
+@skipUnless("FREPPLE_BENCHMARK" in os.environ, "Benchmarks run on request only")
+class CopyBenchmarkTest(TestCase):
+    # Compares the text and binary COPY formats when exporting the
+    # material plan of a synthetic model
+    operationplans = 100000
+    flows = 10
+
+    def setUp(self):
+        location = Location.objects.create(name="factory")
+        items = Item.objects.bulk_create(
+            Item(name="item %s" % i) for i in range(self.flows)
+        )
+        start = datetime(2024, 1, 1)
+        OperationPlan.objects.bulk_create(
+            (
+                OperationPlan(
+                    reference="MO %s" % i,
+                    type="MO",
+                    status="proposed",
+                    quantity=i % 100 + 1,
+                    startdate=start + timedelta(hours=i % 8760),
+                    enddate=start + timedelta(hours=i % 8760 + 24),
+                    item=items[0],
+                    location=location,
+                )
+                for i in range(self.operationplans)
+            ),
+            batch_size=10000,
+        )
+        self.items = [i.name for i in items]
+
+    def getRows(self):
+        start = datetime(2024, 1, 1)
+        timestamp = datetime.now()
+        for i in range(self.operationplans):
+            for j, item in enumerate(self.items):
+                yield (
+                    "MO %s" % i,
+                    item,
+                    "factory",
+                    round((i % 100 + 1) * (-1.5 if j else 1), 8),
+                    start + timedelta(hours=i % 8760 + (24 if j else 0)),
+                    round(i / 7, 8),
+                    0,
+                    round(i % 30 / 3, 8),
+                    "proposed",
+                    timestamp,
+                )
+
+    def test_throughput(self):
+        fields = ExportOperationPlanMaterials.fields
+        columns = ", ".join(f[0] for f in fields)
+        count = self.operationplans * self.flows
+        timings = {}
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            for fmt in ("text", "binary"):
+                cursor.execute("delete from operationplanmaterial")
+                start = time.perf_counter()
+                if fmt == "text":
+                    cursor.copy_expert(
+                        "copy operationplanmaterial (%s) from stdin "
+                        "with (format text, delimiter E'\\v')" % columns,
+                        CopyFromGenerator(textRows(self.getRows())),
+                        size=CopyFromGenerator.chunksize,
+                    )
+                else:
+                    cursor.copy_expert(
+                        "copy operationplanmaterial (%s) from stdin "
+                        "with (format binary)" % columns,
+                        CopyBinaryGenerator(self.getRows(), [f[1] for f in fields]),
+                        size=CopyFromGenerator.chunksize,
+                    )
+                timings[fmt] = time.perf_counter() - start
+                cursor.execute("select count(*) from operationplanmaterial")
+                self.assertEqual(cursor.fetchone()[0], count)
+        logger.info(
+            "COPY of %s operationplanmaterial rows: text %.2fs, binary %.2fs"
+            % (count, timings["text"], timings["binary"])
+        )
@@ -29,6 +29,8 @@ from django.shortcuts import render
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.cache import never_cache
 
+from freppledb.common.auth import PermissionCache
+
 
 @staff_member_required
 @never_cache
@@ -87,5 +89,6 @@ def logapache(request):
             "logdata": logdata
             if len(logdata) > 0
             else "No exception found in the log file",
+            "permissioncache": PermissionCache.getStatistics(),
         },
     )
@@ -26,7 +26,7 @@ import os
 import logging
 
 from django.conf import settings
-from django.db import DEFAULT_DB_ALIAS
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.utils.translation import gettext_lazy as _
 
 from freppledb.common.commands import PlanTaskRegistry, PlanTask
@@ -79,6 +79,26 @@ class UpdateLastCurrentDate(PlanTask):
             logger.warning("Failed to set last_currentdate parameter")
 
 
+@PlanTaskRegistry.register
+class PurgeTombstones(PlanTask):
+    description = "Purge old records of deleted rows"
+    sequence = 460
+
+    @classmethod
+    def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        return 0.1
+
+    @classmethod
+    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        from freppledb.execute.management.commands.scenario_copy import Command
+
+        # Scenarios that are never refreshed would otherwise keep them forever
+        with connections[database].cursor() as cursor:
+            cursor.execute("select to_regclass('common_tombstone') is not null")
+            if cursor.fetchone()[0]:
+                Command.purgeTombstones(database)
+
+
 @PlanTaskRegistry.register
 class MakePlanFeasible(PlanTask):
     description = "Initial plan problems"
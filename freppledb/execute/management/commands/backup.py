@@ -22,6 +22,7 @@
 #
 
 import os
+import shutil
 import subprocess
 from datetime import datetime
 import pkg_resources
@@ -36,6 +37,7 @@ from django.template.loader import render_to_string
 from freppledb.execute.models import Task
 from freppledb.common.middleware import _thread_locals
 from freppledb.common.models import User
+from freppledb.common.report import create_connection
 from freppledb import __version__
 
 
@@ -43,9 +45,14 @@ class Command(BaseCommand):
     help = """
       This command creates a database dump of the frePPLe database.
 
-      It also removes dumps older than a month to limit the disk space usage.
-      If you want to keep dumps for a longer period of time, you'll need to
-      copy the dumps to a different location.
+      It also removes dumps older than BACKUP_RETENTION_DAYS days to limit the
+      disk space usage. If you want to keep dumps for a longer period of time,
+      you'll need to copy the dumps to a different location.
+
+      With the directory format the dump is a folder, and pg_dump saves
+      multiple tables in parallel.
+      The plan output tables can be left out of the backup, or saved in a
+      separate dump. A replan rebuilds their contents.
 
       The pg_dump command needs to be in the path, otherwise this command
       will fail.
@@ -68,6 +75,29 @@ class Command(BaseCommand):
             type=int,
             help="Task identifier (generated automatically if not provided)",
         )
+        parser.add_argument(
+            "--format",
+            default=getattr(settings, "BACKUP_FORMAT", "custom"),
+            choices=["custom", "directory"],
+            help="Dump format: a single file (default) or a folder written in parallel",
+        )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=getattr(settings, "BACKUP_JOBS", 4),
+            help="Number of parallel jobs with the directory format",
+        )
+        parser.add_argument(
+            "--compress",
+            default=getattr(settings, "BACKUP_COMPRESSION", None),
+            help="Compression method and level for pg_dump, eg zstd or gzip:6",
+        )
+        parser.add_argument(
+            "--output",
+            default=getattr(settings, "BACKUP_OUTPUT", "include"),
+            choices=["include", "exclude", "separate"],
+            help="Include, exclude or separately dump the data of the plan output tables",
+        )
 
     def handle(self, **options):
         # Pick up the options
@@ -154,28 +184,61 @@ class Command(BaseCommand):
             # Commenting the next line is a little more secure, but requires you to
             # create a .pgpass file.
             os.environ["PGPASSWORD"] = settings.DATABASES[database]["PASSWORD"]
-            args = [
-                "pg_dump",
-                "-Fc",
-                "-w",
-                "--username=%s" % settings.DATABASES[database]["USER"],
-                "--file=%s"
-                % os.path.abspath(os.path.join(settings.FREPPLE_LOGDIR, backupfile)),
-            ]
-            if settings.DATABASES[database]["HOST"]:
-                args.append("--host=%s" % settings.DATABASES[database]["HOST"])
-            if settings.DATABASES[database]["PORT"]:
-                args.append("--port=%s" % settings.DATABASES[database]["PORT"])
-            args.append(settings.DATABASES[database]["NAME"])
-            with subprocess.Popen(args) as p:
-                try:
-                    task.processid = p.pid
+            snapshot_conn = None
+            try:
+                args = self.dumpArguments(database, options)
+                if options["output"] == "separate":
+                    # Both dumps need to see the same state of the database.
+                    # The snapshot stays valid while its transaction is open.
+                    snapshot_conn = create_connection(database)
+                    snapshot_conn.set_autocommit(False)
+                    with snapshot_conn.cursor() as cursor:
+                        cursor.execute(
+                            "set transaction isolation level repeatable read, read only"
+                        )
+                        cursor.execute("select pg_export_snapshot()")
+                        snapshot = cursor.fetchone()[0]
+                    args.append("--snapshot=%s" % snapshot)
+                if options["output"] != "include":
+                    for t in self.outputTables:
+                        args.append("--exclude-table-data=%s" % t)
+                self.runDump(
+                    task,
+                    database,
+                    args
+                    + [
+                        "--file=%s"
+                        % os.path.abspath(
+                            os.path.join(settings.FREPPLE_LOGDIR, backupfile)
+                        )
+                    ],
+                )
+                if options["output"] == "separate":
+                    task.status = "60%"
                     task.save(using=database)
-                    p.wait()
-                except Exception:
-                    p.kill()
-                    p.wait()
-                    raise Exception("Run of run pg_dump failed")
+                    args = self.dumpArguments(database, options) + [
+                        "--data-only",
+                        "--snapshot=%s" % snapshot,
+                    ]
+                    for t in self.outputTables:
+                        args.append("--table=%s" % t)
+                    self.runDump(
+                        task,
+                        database,
+                        args
+                        + [
+                            "--file=%s"
+                            % os.path.abspath(
+                                os.path.join(
+                                    settings.FREPPLE_LOGDIR, "%s.output" % backupfile
+                                )
+                            )
+                        ],
+                    )
+            finally:
+                if snapshot_conn:
+                    snapshot_conn.rollback()
+                    snapshot_conn.close()
 
             # drop installed apps table
             with connections[database].cursor() as cursor:
@@ -191,18 +254,23 @@ class Command(BaseCommand):
             task.status = "99%"
             task.save(using=database)
 
-            # Delete backups older than a month
-            for f in os.listdir(settings.FREPPLE_LOGDIR):
-                if os.path.isfile(os.path.join(settings.FREPPLE_LOGDIR, f)):
+            # Delete old backups
+            retention = getattr(settings, "BACKUP_RETENTION_DAYS", 31)
+            with os.scandir(settings.FREPPLE_LOGDIR) as entries:
+                for f in entries:
+                    if not f.name.lower().endswith((".dump", ".dump.output")):
+                        continue
                     # Note this is NOT 100% correct on UNIX. st_ctime is not always the creation date...
-                    created = datetime.fromtimestamp(
-                        os.stat(os.path.join(settings.FREPPLE_LOGDIR, f)).st_ctime
-                    )
-                    if f.lower().endswith(".dump") and (now - created).days > 31:
-                        try:
-                            os.remove(os.path.join(settings.FREPPLE_LOGDIR, f))
-                        except Exception:
-                            pass
+                    created = datetime.fromtimestamp(f.stat().st_ctime)
+                    if (now - created).days <= retention:
+                        continue
+                    try:
+                        if f.is_dir():
+                            shutil.rmtree(f.path)
+                        else:
+                            os.remove(f.path)
+                    except Exception:
+                        pass
 
             # Task update
             task.status = "Done"
@@ -222,6 +290,46 @@ class Command(BaseCommand):
                 task.save(using=database)
             setattr(_thread_locals, "database", old_thread_locals)
 
+    # Plan output tables that a replan regenerates
+    outputTables = (
+        "operationplanmaterial",
+        "operationplanresource",
+        "operationplan_pegging",
+        "out_problem",
+        "out_resourceplan",
+    )
+
+    @staticmethod
+    def dumpArguments(database, options):
+        args = ["pg_dump", "-w"]
+        if options["format"] == "directory":
+            args += ["-Fd", "--jobs=%s" % options["jobs"]]
+        else:
+            args.append("-Fc")
+        if options["compress"]:
+            args.append("--compress=%s" % options["compress"])
+        args.append("--username=%s" % settings.DATABASES[database]["USER"])
+        if settings.DATABASES[database]["HOST"]:
+            args.append("--host=%s" % settings.DATABASES[database]["HOST"])
+        if settings.DATABASES[database]["PORT"]:
+            args.append("--port=%s" % settings.DATABASES[database]["PORT"])
+        return args
+
+    @staticmethod
+    def runDump(task, database, args):
+        args.append(settings.DATABASES[database]["NAME"])
+        with subprocess.Popen(args) as p:
+            try:
+                task.processid = p.pid
+                task.save(using=database)
+                p.wait()
+            except Exception:
+                p.kill()
+                p.wait()
+                raise Exception("Run of run pg_dump failed")
+            if p.returncode:
+                raise Exception("Run of run pg_dump failed")
+
     # accordion template
     title = _("Contact frePPLe support")
     index = 3100
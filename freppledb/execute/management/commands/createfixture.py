@@ -51,6 +51,8 @@ class Command(BaseCommand):
 
     @staticmethod
     def extractTable(database, file, table, model):
+        from freppledb.forecast.models import ForecastPlan
+
         cursor = connections[database].cursor()
 
         # First retrieve the column names from that table
@@ -58,8 +60,9 @@ class Command(BaseCommand):
     select column_name, data_type
     from information_schema.columns
     where table_name = %s and column_name <> 'lastmodified' and column_name <> 'id'
+    and not (table_name = 'forecastplan' and column_name = any(%s))
     """
-        cursor.execute(sql, (table,))
+        cursor.execute(sql, (table, list(ForecastPlan.measure_columns)))
         nb_of_rows = cursor.rowcount
 
         # Then build a sql request like this
@@ -78,6 +81,9 @@ class Command(BaseCommand):
                     + 'case when extract(epoch from "%s")<0 then 0 else extract(epoch from "%s") end as %s'
                     % (columns[0], columns[0], columns[0])
                 )
+            elif table == "forecastplan" and columns[0] == "value":
+                # Merge the standard measure columns into the value field
+                sql = sql + "%s as value" % ForecastPlan.valueSQL()
             else:
                 sql = sql + columns[0]
             if row < nb_of_rows:
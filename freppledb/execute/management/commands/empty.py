@@ -252,15 +252,23 @@ class Command(BaseCommand):
                 tables.add("operationplanmaterial")
                 tables.add("operationplanresource")
                 tables.add("out_problem")
+                tables.add("out_operationsummary")
+                tables.add("out_buffersummary")
+                tables.add("out_demandsummary")
             if "resource" in tables and "out_resourceplan" not in tables:
                 tables.add("out_resourceplan")
+            if "out_resourceplan" in tables:
+                tables.add("out_resourcesummary")
             if "freppledb.forecast" in settings.INSTALLED_APPS:
                 if "forecast" in tables:
                     tables.add("forecastplan")
+                    tables.add("forecast_backtest")
                 if "forecastplan" in tables:
                     cursor.execute("refresh materialized view forecastreport_view")
             if "demand" in tables and "out_constraint" not in tables:
                 tables.add("out_constraint")
+            if "demand" in tables:
+                tables.add("out_demandsummary")
             if (
                 "reportmanager_report" in tables
                 and "reportmanager_column" not in tables
@@ -22,14 +22,16 @@
 #
 
 import codecs
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from time import localtime, strftime
 import csv
 import gzip
-from openpyxl import load_workbook
+import multiprocessing
 import os
 import logging
 
+from django.apps import apps
 from django.conf import settings
 from django.contrib.auth import get_permission_codename
 from django.contrib.contenttypes.models import ContentType
@@ -43,8 +45,8 @@ from django.utils.translation import gettext_lazy as _
 from freppledb.execute.models import Task
 from freppledb.common.middleware import _thread_locals
 from freppledb.common.report import GridReport, matchesModelName, sizeof_fmt
-from freppledb import __version__
-from freppledb.common.dataload import parseCSVdata, parseExcelWorksheet
+from freppledb import __version__, initializeProcess
+from freppledb.common.dataload import loadWorkbook, parseCSVdata, parseExcelWorksheet
 from freppledb.common.models import User, NotificationFactory, Parameter
 from freppledb.common.report import EXCLUDE_FROM_BULK_OPERATIONS, create_connection
 from freppledb.common.utils import getStorageUsage
@@ -56,6 +58,69 @@ def timesince(st):
     return str(datetime.now() - st).split(".")[0]
 
 
+def scheduleModels(models):
+    """
+    Returns for each file in the sorted list of models the set of files
+    (as indexes in the list) that need to be loaded before it.
+
+    Files conflict with each other when:
+      - one of the models refers to the other one
+      - the models are stored in the same table
+      - one of them is a parameter file or a SQL file, which can touch any data
+    A file waits for all files before it in the list with which it conflicts.
+    """
+    predecessors = []
+    for k, (ifile_k, model_k, ct_k, deps_k) in enumerate(models):
+        pred = set()
+        for p in range(k):
+            ifile_p, model_p, ct_p, deps_p = models[p]
+            if (
+                ifile_p.lower().endswith((".sql", ".sql.gz"))
+                or ifile_k.lower().endswith((".sql", ".sql.gz"))
+                or model_p == Parameter
+                or model_p._meta.concrete_model == model_k._meta.concrete_model
+                or issubclass(model_p, model_k)
+                or issubclass(model_k, model_p)
+                or model_k in deps_p
+                or model_p in deps_k
+            ):
+                pred.add(p)
+        predecessors.append(pred)
+    return predecessors
+
+
+def importFileWorker(
+    folder, ifile, modelname, database, username, delimiter, SQLrole, logfile
+):
+    """
+    Loads a single data file in a child process of the importfromfolder command.
+    """
+    try:
+        handler = logging.FileHandler(
+            os.path.join(settings.FREPPLE_LOGDIR, logfile), encoding="utf-8"
+        )
+        logger.addHandler(handler)
+        logger.propagate = False
+    except Exception:
+        handler = None
+    try:
+        cmd = Command()
+        cmd.database = database
+        cmd.user = (
+            User.objects.all().using(database).get(username=username)
+            if username
+            else None
+        )
+        cmd.delimiter = delimiter
+        cmd.SQLrole = SQLrole
+        translation.activate(settings.LANGUAGE_CODE)
+        return cmd.importFile(folder, ifile, apps.get_model(modelname))
+    finally:
+        if handler:
+            logger.removeHandler(handler)
+            handler.close()
+
+
 class Command(BaseCommand):
     help = """
     Loads CSV files from the configured FILEUPLOADFOLDER folder into the frePPLe database.
@@ -77,6 +142,11 @@ class Command(BaseCommand):
             type=int,
             help="Task identifier (generated automatically if not provided)",
         )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            help="Number of files to load in parallel (default: IMPORT_PROCESSES setting)",
+        )
 
     def get_version(self):
         return __version__
@@ -229,54 +299,30 @@ class Command(BaseCommand):
                 # Sort the list of models, based on dependencies between models
                 models = GridReport.sort_models(models)
 
-                i = 0
                 cnt = len(models)
-                for ifile, model, contenttype_id, dependencies in models:
-                    task.status = str(int(i / cnt * 100)) + "%"
-                    task.message = "Processing data file %s" % ifile
-                    task.save(using=self.database)
-                    i += 1
-                    filetoparse = os.path.join(
-                        os.path.abspath(
-                            settings.DATABASES[self.database]["FILEUPLOADFOLDER"]
-                        ),
-                        ifile,
+                folder = os.path.abspath(
+                    settings.DATABASES[self.database]["FILEUPLOADFOLDER"]
+                )
+                processes = options["processes"] or getattr(
+                    settings, "IMPORT_PROCESSES", 1
+                )
+                if processes > 1 and cnt > 1:
+                    self.importParallel(
+                        folder, models, processes, task, errors, logfile
                     )
-                    starting = datetime.now()
-                    if ifile.lower().endswith((".sql", ".sql.gz")):
-                        logger.info(
-                            "Started executing SQL statements from file: %s" % ifile
-                        )
-                        errors[0] += self.executeSQLfile(filetoparse)
-                        logger.info(
-                            "Finished executing SQL statements from file %s in %s"
-                            % (ifile, timesince(starting))
-                        )
-                    elif ifile.lower().endswith((".cpy", ".cpy.gz")):
-                        logger.info("Started uploading copy file: %s" % ifile)
-                        errors[0] += self.executeCOPYfile(model, filetoparse)
-                        logger.info(
-                            "Finished uploading copy file %s in %s"
-                            % (ifile, timesince(starting))
-                        )
-                    elif ifile.lower().endswith((".xlsx", ".xlsm")):
-                        logger.info("Started processing data in Excel file: %s" % ifile)
-                        returnederrors = self.loadExcelfile(model, filetoparse)
-                        errors[0] += returnederrors[0]
-                        errors[1] += returnederrors[1]
-                        logger.info(
-                            "Finished processing data in file %s in %s"
-                            % (ifile, timesince(starting))
-                        )
-                    else:
-                        logger.info("Started processing data in CSV file: %s" % ifile)
-                        returnederrors = self.loadCSVfile(model, filetoparse)
+                else:
+                    i = 0
+                    for ifile, model, contenttype_id, dependencies in models:
+                        task.status = str(int(i / cnt * 100)) + "%"
+                        task.message = "Processing data file %s" % ifile
+                        task.save(using=self.database)
+                        i += 1
+                        returnederrors = self.importFile(folder, ifile, model)
                         errors[0] += returnederrors[0]
                         errors[1] += returnederrors[1]
-                        logger.info(
-                            "Finished processing data in CSV file %s in %s"
-                            % (ifile, timesince(starting))
-                        )
+
+                # Records are committed. Launch notification generator now.
+                NotificationFactory.launchWorker(database=self.database, url=None)
             else:
                 errors[0] += 1
                 cnt = 0
@@ -325,6 +371,102 @@ class Command(BaseCommand):
                 task.save(using=self.database)
             logger.info("End of importfromfolder in %s\n" % timesince(startofall))
 
+    def importFile(self, folder, ifile, model):
+        """
+        Loads a single data file, and returns the number of errors and warnings.
+        """
+        filetoparse = os.path.join(folder, ifile)
+        starting = datetime.now()
+        if ifile.lower().endswith((".sql", ".sql.gz")):
+            logger.info("Started executing SQL statements from file: %s" % ifile)
+            returnederrors = [self.executeSQLfile(filetoparse), 0]
+            logger.info(
+                "Finished executing SQL statements from file %s in %s"
+                % (ifile, timesince(starting))
+            )
+        elif ifile.lower().endswith((".cpy", ".cpy.gz")):
+            logger.info("Started uploading copy file: %s" % ifile)
+            returnederrors = [self.executeCOPYfile(model, filetoparse), 0]
+            logger.info(
+                "Finished uploading copy file %s in %s" % (ifile, timesince(starting))
+            )
+        elif ifile.lower().endswith((".xlsx", ".xlsm")):
+            logger.info("Started processing data in Excel file: %s" % ifile)
+            returnederrors = self.loadExcelfile(model, filetoparse)
+            logger.info(
+                "Finished processing data in file %s in %s"
+                % (ifile, timesince(starting))
+            )
+        else:
+            logger.info("Started processing data in CSV file: %s" % ifile)
+            returnederrors = self.loadCSVfile(model, filetoparse)
+            logger.info(
+                "Finished processing data in CSV file %s in %s"
+                % (ifile, timesince(starting))
+            )
+        return returnederrors
+
+    def importParallel(self, folder, models, processes, task, errors, logfile):
+        """
+        Loads the data files with a pool of processes.
+        A file is submitted as soon as all files it depends on are loaded.
+        """
+        predecessors = scheduleModels(models)
+        todo = set(range(len(models)))
+        running = {}
+        done = 0
+        # Child processes open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=initializeProcess,
+            initargs=(self.database,),
+        ) as pool:
+            while todo or running:
+                # Submit all files that are ready to be loaded
+                pending = todo.union(running.values())
+                for idx in sorted(todo):
+                    if predecessors[idx].isdisjoint(pending):
+                        todo.remove(idx)
+                        running[
+                            pool.submit(
+                                importFileWorker,
+                                folder,
+                                models[idx][0],
+                                "%s.%s"
+                                % (
+                                    models[idx][1]._meta.app_label,
+                                    models[idx][1].__name__,
+                                ),
+                                self.database,
+                                self.user.username if self.user else None,
+                                self.delimiter,
+                                self.SQLrole,
+                                logfile,
+                            )
+                        ] = idx
+
+                # Report progress
+                task.status = str(int(done / len(models) * 100)) + "%"
+                task.message = "Processing data files %s" % ", ".join(
+                    sorted(models[idx][0] for idx in running.values())
+                )
+                task.save(using=self.database)
+
+                # Wait for a file to finish
+                finished, notfinished = wait(running, return_when=FIRST_COMPLETED)
+                for f in finished:
+                    idx = running.pop(f)
+                    done += 1
+                    try:
+                        returnederrors = f.result()
+                        errors[0] += returnederrors[0]
+                        errors[1] += returnederrors[1]
+                    except Exception as e:
+                        errors[0] += 1
+                        logger.error("Error loading file %s: %s" % (models[idx][0], e))
+
     def executeCOPYfile(self, model, ifile):
         """
         Use the copy command to upload data into the database
@@ -467,9 +609,6 @@ class Command(BaseCommand):
                             )
                         )
 
-            # Records are committed. Launch notification generator now.
-            NotificationFactory.launchWorker(database=self.database, url=None)
-
         except Exception:
             errorcount += 1
             logger.error("Error: Invalid data format - skipping the file \n")
@@ -487,7 +626,7 @@ class Command(BaseCommand):
 
         try:
             with transaction.atomic(using=self.database):
-                wb = load_workbook(filename=file, data_only=True)
+                wb = loadWorkbook(file)
                 for ws_name in wb.sheetnames:
                     ws = wb[ws_name]
                     for error in parseExcelWorksheet(
@@ -529,8 +668,7 @@ class Command(BaseCommand):
                                     error[4],
                                 )
                             )
-            # Records are committed. Launch notification generator now.
-            NotificationFactory.launchWorker(database=self.database, url=None)
+                wb.close()
         except Exception:
             errorcount += 1
             logger.error("Error: Invalid data format - skipping the file \n")
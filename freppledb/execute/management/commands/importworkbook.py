@@ -23,7 +23,6 @@
 
 from datetime import datetime
 import logging
-from openpyxl import load_workbook
 
 from django.core.management.base import BaseCommand, CommandError
 from django.contrib.auth import get_permission_codename
@@ -41,7 +40,7 @@ from freppledb import __version__
 from freppledb.common.middleware import _thread_locals
 from freppledb.common.models import User, Comment, Parameter
 from freppledb.common.report import GridReport, matchesModelName
-from freppledb.common.dataload import parseExcelWorksheet
+from freppledb.common.dataload import loadWorkbook, parseExcelWorksheet
 from freppledb.execute.models import Task
 
 
@@ -147,7 +146,7 @@ class Command(BaseCommand):
                     if "filename" not in locals():
                         filename = options["file"]
                     for file in filename:
-                        wb = load_workbook(filename=file, data_only=True)
+                        wb = loadWorkbook(file)
                         models = []
                         for ws_name in wb.sheetnames:
                             # Find the model
@@ -303,6 +302,7 @@ class Command(BaseCommand):
                                     ).lower()
                                     == "true"
                                 )
+                        wb.close()
 
                         print("%s" % _("Done"))
                         # yield '<div><strong>%s</strong></div>' % _("Done")
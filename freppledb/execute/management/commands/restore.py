@@ -38,6 +38,10 @@ class Command(BaseCommand):
     help = """
     This command restores a database dump of the frePPLe database.
 
+    Both single file and directory-format dumps are supported. A separate
+    dump of the plan output tables is restored as well, unless the
+    --skip-output option is used.
+
     The pg_restore command needs to be in the path, otherwise this command
     will fail.
     """
@@ -59,6 +63,18 @@ class Command(BaseCommand):
             type=int,
             help="Task identifier (generated automatically if not provided)",
         )
+        parser.add_argument(
+            "--jobs",
+            type=int,
+            default=getattr(settings, "BACKUP_JOBS", 4),
+            help="Number of parallel jobs to restore a directory-format dump",
+        )
+        parser.add_argument(
+            "--skip-output",
+            action="store_true",
+            default=False,
+            help="Don't restore the separate dump of the plan output tables",
+        )
         parser.add_argument("dump", help="Database dump file to restore.")
 
     def handle(self, **options):
@@ -104,33 +120,28 @@ class Command(BaseCommand):
             dumpfile = os.path.abspath(
                 os.path.join(settings.FREPPLE_LOGDIR, options["dump"])
             )
-            if not os.path.isfile(dumpfile):
+            if not os.path.exists(dumpfile):
                 raise CommandError("Dump file not found")
 
             # Run the restore command
             # Commenting the next line is a little more secure, but requires you to create a .pgpass file.
             if settings.DATABASES[database]["PASSWORD"]:
                 os.environ["PGPASSWORD"] = settings.DATABASES[database]["PASSWORD"]
-            cmd = ["pg_restore", "-n", "public", "-Fc", "-c", "--if-exists"]
-            if settings.DATABASES[database]["USER"]:
-                cmd.append("--username=%s" % settings.DATABASES[database]["USER"])
-            if settings.DATABASES[database]["HOST"]:
-                cmd.append("--host=%s" % settings.DATABASES[database]["HOST"])
-            if settings.DATABASES[database]["PORT"]:
-                cmd.append("--port=%s " % settings.DATABASES[database]["PORT"])
-            cmd.append("-d")
-            cmd.append(settings.DATABASES[database]["NAME"])
-            cmd.append("<%s" % dumpfile)
-            # Shell needs to be True in order to interpret the < character
-            with subprocess.Popen(cmd, shell=True) as p:
-                try:
-                    task.processid = p.pid
-                    task.save(using=database)
-                    p.wait()
-                except Exception:
-                    p.kill()
-                    p.wait()
-                    raise Exception("Database restoration failed")
+            self.runRestore(
+                task,
+                database,
+                ["-c", "--if-exists"],
+                dumpfile,
+                options["jobs"],
+            )
+
+            # Restore the plan output saved in a separate dump
+            outputfile = "%s.output" % dumpfile
+            # The task record was replaced by the restore, and isn't updated here.
+            if os.path.exists(outputfile) and not options["skip_output"]:
+                self.runRestore(
+                    None, database, ["--data-only"], outputfile, options["jobs"]
+                )
 
             # Task update
             # We need to recreate a new task record, since the previous one is lost during the restoration.
@@ -156,3 +167,29 @@ class Command(BaseCommand):
             if task:
                 task.processid = None
                 task.save(using=database)
+
+    @staticmethod
+    def runRestore(task, database, args, dumpfile, jobs):
+        cmd = ["pg_restore", "-n", "public"]
+        if os.path.isdir(dumpfile):
+            cmd += ["-Fd", "--jobs=%s" % jobs]
+        else:
+            cmd.append("-Fc")
+        cmd += args
+        if settings.DATABASES[database]["USER"]:
+            cmd.append("--username=%s" % settings.DATABASES[database]["USER"])
+        if settings.DATABASES[database]["HOST"]:
+            cmd.append("--host=%s" % settings.DATABASES[database]["HOST"])
+        if settings.DATABASES[database]["PORT"]:
+            cmd.append("--port=%s" % settings.DATABASES[database]["PORT"])
+        cmd += ["-d", settings.DATABASES[database]["NAME"], dumpfile]
+        with subprocess.Popen(cmd) as p:
+            try:
+                if task:
+                    task.processid = p.pid
+                    task.save(using=database)
+                p.wait()
+            except Exception:
+                p.kill()
+                p.wait()
+                raise Exception("Database restoration failed")
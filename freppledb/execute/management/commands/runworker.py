@@ -24,8 +24,10 @@
 from datetime import datetime, timedelta
 import logging
 from multiprocessing import Process
+from multiprocessing.connection import wait
 import operator
 import os
+import psutil
 import shlex
 from subprocess import Popen
 import sys
@@ -119,77 +121,299 @@ def launchWorker(database=DEFAULT_DB_ALIAS):
             Popen(["frepplectl", "runworker", "--database=%s" % database])
 
 
-def runTask(task, database):
-    task.started = datetime.now()
-    # Verify the command exists
-    exists = False
-    for commandname in get_commands():
-        if commandname == task.name:
-            exists = True
-            break
+def getTaskClass(name):
+    """
+    Returns the class of a task, which determines the slots it can run in.
+    """
+    return getattr(settings, "WORKER_TASK_CLASSES", {}).get(name, "heavy")
 
-    if not exists:
+
+def startTask(task, database):
+    """
+    Starts a task in a child process and returns the process.
+    Returns None when the task isn't a known command.
+    """
+    # Verify the command exists
+    if task.name not in get_commands():
         # No such task exists
         logger.error("Task %s not recognized" % task.name)
+        return None
+
+    # Close all database connections to assure the parent and child
+    # process don't share them.
+    connections.close_all()
+    # Spawn a new command process
+    args = []
+    kwargs = {"database": database, "task": task.id, "verbosity": 0}
+    if task.arguments:
+        for i in shlex.split(task.arguments or ""):
+            if "=" in i:
+                key, val = i.split("=")
+                kwargs[key.strip("--").replace("-", "_")] = val
+            else:
+                args.append(i)
+    child = Process(
+        target=runCommand,
+        args=(task.name, *args),
+        kwargs=kwargs,
+        name="frepplectl %s" % task.name,
+    )
+    child.start()
+    return child
+
+
+def finishTask(taskid, database):
+    """
+    Updates a task after its child process has finished.
+    """
+    # Read the task again from the database and update it
+    task = Task.objects.all().using(database).get(pk=taskid)
+    background = "background" in task.arguments if task.arguments else False
+    task.processid = None
+    if (
+        task.status not in ("Done", "Failed") or not task.finished or not task.started
+    ) and task.status != "Canceled":
+        now = datetime.now()
+        if not task.started:
+            task.started = now
+        if not background:
+            if not task.finished:
+                task.finished = now
+            if task.status not in ("Done", "Failed"):
+                task.status = "Done"
+        task.save(using=database)
+    if "FREPPLE_TEST" not in os.environ:
+        logger.debug(
+            "Worker %s for database '%s' finished task %d at %s: success"
+            % (
+                os.getpid(),
+                settings.DATABASES[database]["NAME"],
+                task.id,
+                datetime.now(),
+            )
+        )
+
+
+def runTask(task, database):
+    task.started = datetime.now()
+    child = startTask(task, database)
+    if not child:
         task.status = "Failed"
         task.processid = None
         task.save(using=database)
-    else:
-        # Close all database connections to assure the parent and child
-        # process don't share them.
-        connections.close_all()
-        # Spawn a new command process
-        args = []
-        kwargs = {"database": database, "task": task.id, "verbosity": 0}
-        background = "background" in task.arguments if task.arguments else False
-        if task.arguments:
-            for i in shlex.split(task.arguments or ""):
-                if "=" in i:
-                    key, val = i.split("=")
-                    kwargs[key.strip("--").replace("-", "_")] = val
-                else:
-                    args.append(i)
-        child = Process(
-            target=runCommand,
-            args=(task.name, *args),
-            kwargs=kwargs,
-            name="frepplectl %s" % task.name,
-        )
-        child.start()
+        return
 
-        # Normally, the child will update the processid.
-        # Just to make sure, we do it also here.
-        task.processid = child.pid
-        task.save(update_fields=["processid"], using=database)
+    # Normally, the child will update the processid.
+    # Just to make sure, we do it also here.
+    task.processid = child.pid
+    task.save(update_fields=["processid"], using=database)
 
-        # Wait for the child to finish
-        child.join()
+    # Wait for the child to finish
+    child.join()
+    finishTask(task.id, database)
 
-        # Read the task again from the database and update it
-        task = Task.objects.all().using(database).get(pk=task.id)
-        task.processid = None
-        if (
-            task.status not in ("Done", "Failed")
-            or not task.finished
-            or not task.started
-        ) and task.status != "Canceled":
-            now = datetime.now()
-            if not task.started:
-                task.started = now
-            if not background:
-                if not task.finished:
-                    task.finished = now
-                if task.status not in ("Done", "Failed"):
-                    task.status = "Done"
-            task.save(using=database)
-        if "FREPPLE_TEST" not in os.environ:
-            logger.debug(
-                "Worker %s for database '%s' finished task %d at %s: success"
+
+class TaskQueue:
+    """
+    Runs the waiting tasks of a database in child processes.
+
+    The number of tasks running at the same time is limited per class of task
+    by the setting WORKER_SLOTS. The queue listens for notifications from the
+    database, so new tasks start without polling the task table.
+    """
+
+    # Maximum number of seconds to wait for a notification
+    timeout = 60
+
+    # Seconds after which a task claimed by a process that didn't start it
+    # is released again
+    claimTimeout = 600
+
+    def __init__(self, database=DEFAULT_DB_ALIAS):
+        self.database = database
+        self.slots = getattr(settings, "WORKER_SLOTS", {"heavy": 1})
+        # Running tasks: id -> (process, class of the task)
+        self.running = {}
+        # Queue latency of the started tasks, per class of task:
+        # number of tasks, total seconds, maximum seconds
+        self.latency = {}
+
+        # A dedicated connection to listen for notifications and to claim
+        # tasks. The child processes don't use it.
+        db = connections[database]
+        self.conn = db.get_new_connection(db.get_connection_params())
+        self.conn.autocommit = True
+        with self.conn.cursor() as cursor:
+            cursor.execute("listen execute_log")
+
+    def close(self):
+        self.conn.close()
+
+    def hasSlot(self, taskclass):
+        return sum(
+            1 for p, c in self.running.values() if c == taskclass
+        ) < self.slots.get(taskclass, 1)
+
+    def claim(self):
+        """
+        Starts the oldest waiting task for which a slot is free.
+        Returns True when a task was started.
+        """
+        self.conn.autocommit = False
+        try:
+            with self.conn.cursor() as cursor:
+                # Other workers skip the tasks we are looking at, and the
+                # child process can only update the task after we commit.
+                cursor.execute(
+                    """
+                    select id, name, submitted
+                    from execute_log
+                    where status = 'Waiting' and processid is null
+                    order by id
+                    for update skip locked
+                    """
+                )
+                for taskid, name, submitted in cursor.fetchall():
+                    taskclass = getTaskClass(name)
+                    if taskid in self.running or not self.hasSlot(taskclass):
+                        continue
+                    task = Task.objects.all().using(self.database).get(pk=taskid)
+                    now = datetime.now()
+                    try:
+                        child = startTask(task, self.database)
+                        message = None if child else "Task not recognized"
+                    except Exception as e:
+                        child = None
+                        message = str(e)
+                    if child:
+                        cursor.execute(
+                            "update execute_log set processid = %s where id = %s",
+                            (child.pid, taskid),
+                        )
+                        self.running[taskid] = (child, taskclass)
+                        waited = (now - submitted).total_seconds()
+                        cnt, total, longest = self.latency.get(taskclass, (0, 0, 0))
+                        self.latency[taskclass] = (
+                            cnt + 1,
+                            total + waited,
+                            max(longest, waited),
+                        )
+                        if "FREPPLE_TEST" not in os.environ:
+                            logger.info(
+                                "Worker %s for database '%s' starting %s task %d at %s after %.1f seconds in the queue"
+                                % (
+                                    os.getpid(),
+                                    settings.DATABASES[self.database]["NAME"],
+                                    taskclass,
+                                    taskid,
+                                    now,
+                                    waited,
+                                )
+                            )
+                    else:
+                        cursor.execute(
+                            """
+                            update execute_log
+                            set status = 'Failed', started = coalesce(started, %s),
+                              finished = %s, message = %s, processid = null
+                            where id = %s
+                            """,
+                            (now, now, message, taskid),
+                        )
+                    self.conn.commit()
+                    return True
+            self.conn.commit()
+            return False
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.conn.autocommit = True
+
+    def reclaim(self):
+        """
+        Releases the waiting tasks claimed by a process that no longer
+        exists or that didn't start the task within the claim timeout.
+        Returns the number of released tasks.
+        """
+        orphans = []
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                select id, processid
+                from execute_log
+                where status = 'Waiting' and processid is not null
+                """
+            )
+            for taskid, pid in cursor.fetchall():
+                if taskid in self.running:
+                    continue
+                try:
+                    p = psutil.Process(pid)
+                    if (
+                        p.status() == psutil.STATUS_ZOMBIE
+                        or time.time() - p.create_time() > self.claimTimeout
+                    ):
+                        orphans.append(taskid)
+                except psutil.NoSuchProcess:
+                    orphans.append(taskid)
+                except psutil.AccessDenied:
+                    pass
+            if orphans:
+                cursor.execute(
+                    """
+                    update execute_log set processid = null
+                    where id = any(%s) and status = 'Waiting'
+                    """,
+                    (orphans,),
+                )
+                logger.warning(
+                    "Worker %s for database '%s' released orphaned tasks %s"
+                    % (
+                        os.getpid(),
+                        settings.DATABASES[self.database]["NAME"],
+                        ", ".join(str(i) for i in orphans),
+                    )
+                )
+        return len(orphans)
+
+    def reap(self):
+        """
+        Updates the tasks whose child process has finished.
+        """
+        for taskid, (child, taskclass) in list(self.running.items()):
+            if child.is_alive():
+                continue
+            child.join()
+            del self.running[taskid]
+            try:
+                finishTask(taskid, self.database)
+            except Exception as e:
+                logger.error("Error finishing task %s: %s" % (taskid, e))
+
+    def wait(self, timeout=None):
+        """
+        Waits for a notification from the database or for a running task
+        to finish.
+        """
+        wait(
+            [self.conn] + [child.sentinel for child, c in self.running.values()],
+            timeout or self.timeout,
+        )
+        self.conn.poll()
+        self.conn.notifies.clear()
+
+    def logLatency(self):
+        for taskclass, (cnt, total, longest) in sorted(self.latency.items()):
+            logger.info(
+                "Worker %s for database '%s' started %d %s tasks: queue latency average %.1f seconds, maximum %.1f seconds"
                 % (
                     os.getpid(),
-                    settings.DATABASES[database]["NAME"],
-                    task.id,
-                    datetime.now(),
+                    settings.DATABASES[self.database]["NAME"],
+                    cnt,
+                    taskclass,
+                    total / cnt,
+                    longest,
                 )
             )
 
@@ -251,62 +475,28 @@ class Command(BaseCommand):
         idle_loop_done = False
         old_thread_locals = getattr(_thread_locals, "database", None)
         setattr(_thread_locals, "database", database)
-        while True:
-            try:
-                task = (
-                    Task.objects.all()
-                    .using(database)
-                    .filter(status="Waiting")
-                    .order_by("id")[0]
-                )
-                idle_loop_done = False
-            except Exception:
-                # No more tasks found
-                if continuous:
-                    time.sleep(5)
-                    continue
-                else:
+        queue = TaskQueue(database)
+        try:
+            while True:
+                queue.reap()
+                queue.reclaim()
+                while queue.claim():
+                    pass
+                if queue.running:
+                    idle_loop_done = False
+                elif not continuous:
                     # Special case: we need to permit a single idle loop before shutting down
                     # the worker. If we shut down immediately, a newly launched task could think
                     # that a worker is already running - while it just shut down.
                     if idle_loop_done:
                         break
-                    else:
-                        idle_loop_done = True
-                        time.sleep(5)
-                        continue
-            try:
-                if "FREPPLE_TEST" not in os.environ:
-                    logger.debug(
-                        "Worker %s for database '%s' starting task %d at %s"
-                        % (
-                            os.getpid(),
-                            settings.DATABASES[database]["NAME"],
-                            task.id,
-                            datetime.now(),
-                        )
-                    )
-                runTask(task, database)
-            except Exception as e:
-                # Read the task again from the database and update.
-                task = Task.objects.all().using(database).get(pk=task.id)
-                task.status = "Failed"
-                now = datetime.now()
-                if not task.started:
-                    task.started = now
-                task.finished = now
-                task.message = str(e)
-                task.save(using=database)
-                if "FREPPLE_TEST" not in os.environ:
-                    logger.debug(
-                        "Worker %s for database '%s' finished task %d at %s: failed"
-                        % (
-                            os.getpid(),
-                            settings.DATABASES[database]["NAME"],
-                            task.id,
-                            datetime.now(),
-                        )
-                    )
+                    idle_loop_done = True
+                    queue.wait(5)
+                    continue
+                queue.wait()
+        finally:
+            queue.logLatency()
+            queue.close()
         # Remove the parameter again
         try:
             Parameter.objects.all().using(database).get(pk="Worker alive").delete()
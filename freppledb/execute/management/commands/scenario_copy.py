@@ -22,20 +22,29 @@
 #
 
 import os
+import shutil
 import subprocess
-from datetime import datetime
+import tempfile
+from datetime import datetime, timedelta
 
+from django.apps import apps
 from django.core.management import call_command
 from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
-from django.db import DEFAULT_DB_ALIAS, connections
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
 from django.utils.translation import gettext_lazy as _
 from django.template.loader import render_to_string
 
 from freppledb.execute.models import Task, ScheduledTask
 from freppledb.execute.views import FileManager
 from freppledb.common.middleware import _thread_locals
-from freppledb.common.models import User, Scenario, Parameter
+from freppledb.common.models import (
+    AuditModel,
+    HierarchyModel,
+    User,
+    Scenario,
+    Parameter,
+)
 from freppledb.common.report import create_connection
 from freppledb.common.utils import getStorageUsage
 from freppledb.input.models import Item
@@ -49,6 +58,10 @@ class Command(BaseCommand):
 
         The pg_dump and psql commands need to be in the path, otherwise
         this command will fail.
+
+        Depending on the size of the source database and on whether it is
+        in use, the copy uses a template database, a parallel directory-format
+        dump and restore, or a single-threaded dump piped into a restore.
         """
 
     requires_system_checks = []
@@ -86,6 +99,18 @@ class Command(BaseCommand):
         parser.add_argument(
             "--dumpfile", default=None, help="specifies source dump file"
         )
+        parser.add_argument(
+            "--refresh",
+            action="store_true",
+            default=False,
+            help="only replicate the changes since the previous copy from the same source",
+        )
+        parser.add_argument(
+            "--strategy",
+            default=getattr(settings, "SCENARIO_COPY_STRATEGY", "auto"),
+            choices=["auto", "template", "directory", "stream"],
+            help="method to copy the database: auto (default), template, directory or stream",
+        )
         parser.add_argument("source", help="source database to copy")
         parser.add_argument("destination", help="destination database to copy")
 
@@ -156,6 +181,10 @@ class Command(BaseCommand):
                 )
             if force:
                 task.arguments += " --force"
+            if options["refresh"]:
+                task.arguments += " --refresh"
+            if options["strategy"] != "auto":
+                task.arguments += " --strategy=%s" % options["strategy"]
             task.save(using=source)
             try:
                 destinationscenario = Scenario.objects.using(DEFAULT_DB_ALIAS).get(
@@ -188,7 +217,7 @@ class Command(BaseCommand):
                 )
 
             # check that dump file exists
-            if options["dumpfile"] and not os.path.isfile(
+            if options["dumpfile"] and not os.path.exists(
                 os.path.join(settings.FREPPLE_LOGDIR, options["dumpfile"])
             ):
                 raise CommandError("Cannot find dump file %s" % options["dumpfile"])
@@ -241,241 +270,288 @@ class Command(BaseCommand):
                 for t in cursor:
                     noOwnershipTables.append(t[0])
 
-            # Cleaning of the destination scenario
-            with connections[destination].cursor() as cursor:
-                quick_drop_failed = False
-                if destination != DEFAULT_DB_ALIAS:
-                    try:
-                        cursor.execute(
-                            "drop owned by %s" % settings.DATABASES[destination]["USER"]
-                        )
-                    except Exception:
-                        quick_drop_failed = True
-                    sql_role = settings.DATABASES[destination].get("SQL_ROLE", None)
-                    if sql_role:
-                        with create_connection(destination).cursor() as cursor2:
-                            try:
-                                cursor2.execute("set role %s", (sql_role,))
-                                cursor2.execute("drop owned by %s" % sql_role)
-                            except Exception:
-                                quick_drop_failed = True
-                if destination == DEFAULT_DB_ALIAS or quick_drop_failed:
-                    # drop tables
-                    cursor.execute(
-                        """
-                        select tablename
-                        FROM pg_catalog.pg_tables
-                        WHERE schemaname='public'
-                        """
-                    )
-                    tables = [
-                        connections[destination].ops.quote_name(i[0])
-                        for i in cursor
-                        if quick_drop_failed or i[0] not in excludedTables
-                    ]
-                    if tables:
-                        cursor.execute("drop table %s cascade" % (",".join(tables)))
-
-                    # drop any remaining type
-                    cursor.execute(
-                        """
-                        SELECT typname
-                        from pg_type
-                        inner join pg_namespace on pg_namespace.oid = typnamespace
-                        where nspname = 'public';
-                        """
+            # Replicate only the changes when possible
+            task.status = "10%"
+            task.save(using=source)
+            strategy = None
+            if options["refresh"] and not options["dumpfile"] and not promote:
+                try:
+                    if self.refresh(task, source, destination):
+                        strategy = "refresh"
+                except Exception:
+                    # Nothing has changed in the destination, we do a full copy instead
+                    pass
+
+            # Pick the copy strategy
+            if not strategy:
+                strategies = self.getStrategies(
+                    options["strategy"], source, destination, options["dumpfile"], test
+                )
+                strategy = strategies.pop(0)
+            if strategy == "template":
+                if self.copyTemplate(source, destination, test):
+                    self.checkCopy(task, source, destination)
+                elif strategies:
+                    strategy = strategies.pop(0)
+                else:
+                    raise Exception(
+                        "Scenario %s is in use and can't be copied as a template"
+                        % source
                     )
-                    types = [i[0] for i in cursor]
-                    for i in types:
+
+            # Cleaning of the destination scenario
+            # A template copy creates a new database and doesn't need this.
+            if strategy not in ("template", "refresh"):
+                with connections[destination].cursor() as cursor:
+                    quick_drop_failed = False
+                    if destination != DEFAULT_DB_ALIAS:
                         try:
                             cursor.execute(
-                                "drop type %s"
-                                % connections[destination].ops.quote_name(i)
+                                "drop owned by %s"
+                                % settings.DATABASES[destination]["USER"]
                             )
                         except Exception:
-                            # silently fail
-                            pass
+                            quick_drop_failed = True
+                        sql_role = settings.DATABASES[destination].get("SQL_ROLE", None)
+                        if sql_role:
+                            with create_connection(destination).cursor() as cursor2:
+                                try:
+                                    cursor2.execute("set role %s", (sql_role,))
+                                    cursor2.execute("drop owned by %s" % sql_role)
+                                except Exception:
+                                    quick_drop_failed = True
+                    if destination == DEFAULT_DB_ALIAS or quick_drop_failed:
+                        # drop tables
+                        cursor.execute(
+                            """
+                            select tablename
+                            FROM pg_catalog.pg_tables
+                            WHERE schemaname='public'
+                            """
+                        )
+                        tables = [
+                            connections[destination].ops.quote_name(i[0])
+                            for i in cursor
+                            if quick_drop_failed or i[0] not in excludedTables
+                        ]
+                        if tables:
+                            cursor.execute("drop table %s cascade" % (",".join(tables)))
 
-                    # drop materialzed views
-                    cursor.execute(
-                        """
-                        select
-                        matviewname
-                        from pg_matviews
-                        where schemaname = 'public'
-                        """
-                    )
-                    matviews = [i[0] for i in cursor]
-                    for i in matviews:
+                        # drop any remaining type
                         cursor.execute(
-                            "drop materialized view %s"
-                            % connections[destination].ops.quote_name(i)
+                            """
+                            SELECT typname
+                            from pg_type
+                            inner join pg_namespace on pg_namespace.oid = typnamespace
+                            where nspname = 'public';
+                            """
                         )
+                        types = [i[0] for i in cursor]
+                        for i in types:
+                            try:
+                                cursor.execute(
+                                    "drop type %s"
+                                    % connections[destination].ops.quote_name(i)
+                                )
+                            except Exception:
+                                # silently fail
+                                pass
 
-                    # drop routines
-                    cursor.execute(
-                        """
-                        SELECT routines.routine_name
-                        FROM information_schema.routines
-                        WHERE routines.specific_schema='public'
-                        """
-                    )
-                    routines = [i[0] for i in cursor]
-                    for i in routines:
+                        # drop materialzed views
                         cursor.execute(
-                            "drop routine %s"
-                            % connections[destination].ops.quote_name(i)
+                            """
+                            select
+                            matviewname
+                            from pg_matviews
+                            where schemaname = 'public'
+                            """
                         )
+                        matviews = [i[0] for i in cursor]
+                        for i in matviews:
+                            cursor.execute(
+                                "drop materialized view %s"
+                                % connections[destination].ops.quote_name(i)
+                            )
 
-                    # drop triggers
-                    cursor.execute(
-                        """
-                        SELECT trigger_name
-                        FROM information_schema.triggers
-                        """
-                    )
-                    triggers = [i[0] for i in cursor]
-                    for i in triggers:
+                        # drop routines
                         cursor.execute(
-                            "drop trigger %s"
-                            % connections[destination].ops.quote_name(i)
+                            """
+                            SELECT routines.routine_name
+                            FROM information_schema.routines
+                            WHERE routines.specific_schema='public'
+                            """
                         )
+                        routines = [i[0] for i in cursor]
+                        for i in routines:
+                            cursor.execute(
+                                "drop routine %s"
+                                % connections[destination].ops.quote_name(i)
+                            )
 
-                    # drop views
-                    cursor.execute(
-                        """
-                        select table_name from INFORMATION_SCHEMA.views WHERE table_schema = 'public'
-                        """
-                    )
-                    views = [i[0] for i in cursor]
-                    for i in views:
+                        # drop triggers
                         cursor.execute(
-                            "drop view %s" % connections[destination].ops.quote_name(i)
+                            """
+                            SELECT trigger_name
+                            FROM information_schema.triggers
+                            """
                         )
+                        triggers = [i[0] for i in cursor]
+                        for i in triggers:
+                            cursor.execute(
+                                "drop trigger %s"
+                                % connections[destination].ops.quote_name(i)
+                            )
+
+                        # drop views
+                        cursor.execute(
+                            """
+                            select table_name from INFORMATION_SCHEMA.views WHERE table_schema = 'public'
+                            """
+                        )
+                        views = [i[0] for i in cursor]
+                        for i in views:
+                            cursor.execute(
+                                "drop view %s"
+                                % connections[destination].ops.quote_name(i)
+                            )
 
             # Copying the data
-            # Commenting the next line is a little more secure, but requires you to create a .pgpass file.
-            if not options["dumpfile"]:
-                if settings.DATABASES[source]["PASSWORD"]:
-                    os.environ["PGPASSWORD"] = settings.DATABASES[source]["PASSWORD"]
-                if os.name == "nt":
-                    # On windows restoring with pg_restore over a pipe is broken :-(
-                    cmd = "pg_dump -Fp %s%s%s%s%s%s | psql %s%s%s%s"
+            if strategy == "directory":
+                self.copyDirectory(
+                    task, source, destination, test, excludedTables, noOwnershipTables
+                )
+                self.checkCopy(task, source, destination)
+            elif strategy not in ("template", "refresh"):
+                # Commenting the next line is a little more secure, but requires you to create a .pgpass file.
+                if not options["dumpfile"]:
+                    if settings.DATABASES[source]["PASSWORD"]:
+                        os.environ["PGPASSWORD"] = settings.DATABASES[source][
+                            "PASSWORD"
+                        ]
+                    if os.name == "nt":
+                        # On windows restoring with pg_restore over a pipe is broken :-(
+                        cmd = "pg_dump -Fp %s%s%s%s%s%s | psql %s%s%s%s"
+                    else:
+                        cmd = "pg_dump -Fc %s%s%s%s%s%s | pg_restore -n public -Fc %s%s%s -d %s"
+                    commandline = cmd % (
+                        settings.DATABASES[source]["USER"]
+                        and ("-U %s " % settings.DATABASES[source]["USER"])
+                        or "",
+                        settings.DATABASES[source]["HOST"]
+                        and ("-h %s " % settings.DATABASES[source]["HOST"])
+                        or "",
+                        settings.DATABASES[source]["PORT"]
+                        and ("-p %s " % settings.DATABASES[source]["PORT"])
+                        or "",
+                        (
+                            (
+                                "%s %s "
+                                % (
+                                    " -T ".join(["", *excludedTables]),
+                                    " --exclude-table-data=".join(
+                                        ["", *excludedTables]
+                                    ),
+                                )
+                            )
+                            if destination == DEFAULT_DB_ALIAS
+                            else ""
+                        ),
+                        (
+                            ("%s " % (" -T ".join(["", *noOwnershipTables])))
+                            if len(noOwnershipTables) > 0
+                            else ""
+                        ),
+                        test
+                        and settings.DATABASES[source]["TEST"]["NAME"]
+                        or settings.DATABASES[source]["NAME"],
+                        settings.DATABASES[destination]["USER"]
+                        and ("-U %s " % settings.DATABASES[destination]["USER"])
+                        or "",
+                        settings.DATABASES[destination]["HOST"]
+                        and ("-h %s " % settings.DATABASES[destination]["HOST"])
+                        or "",
+                        settings.DATABASES[destination]["PORT"]
+                        and ("-p %s " % settings.DATABASES[destination]["PORT"])
+                        or "",
+                        test
+                        and settings.DATABASES[destination]["TEST"]["NAME"]
+                        or settings.DATABASES[destination]["NAME"],
+                    )
                 else:
-                    cmd = "pg_dump -Fc %s%s%s%s%s%s | pg_restore -n public -Fc %s%s%s -d %s"
-                commandline = cmd % (
-                    settings.DATABASES[source]["USER"]
-                    and ("-U %s " % settings.DATABASES[source]["USER"])
-                    or "",
-                    settings.DATABASES[source]["HOST"]
-                    and ("-h %s " % settings.DATABASES[source]["HOST"])
-                    or "",
-                    settings.DATABASES[source]["PORT"]
-                    and ("-p %s " % settings.DATABASES[source]["PORT"])
-                    or "",
-                    (
+                    cmd = "pg_restore -n public %s --no-password %s%s%s -d %s %s"
+                    commandline = cmd % (
                         (
-                            "%s %s "
-                            % (
-                                " -T ".join(["", *excludedTables]),
-                                " --exclude-table-data=".join(["", *excludedTables]),
+                            "-Fd -j %s" % getattr(settings, "SCENARIO_COPY_JOBS", 4)
+                            if os.path.isdir(
+                                os.path.join(
+                                    settings.FREPPLE_LOGDIR, options["dumpfile"]
+                                )
                             )
-                        )
-                        if destination == DEFAULT_DB_ALIAS
-                        else ""
-                    ),
-                    (
-                        ("%s " % (" -T ".join(["", *noOwnershipTables])))
-                        if len(noOwnershipTables) > 0
-                        else ""
-                    ),
-                    test
-                    and settings.DATABASES[source]["TEST"]["NAME"]
-                    or settings.DATABASES[source]["NAME"],
-                    settings.DATABASES[destination]["USER"]
-                    and ("-U %s " % settings.DATABASES[destination]["USER"])
-                    or "",
-                    settings.DATABASES[destination]["HOST"]
-                    and ("-h %s " % settings.DATABASES[destination]["HOST"])
-                    or "",
-                    settings.DATABASES[destination]["PORT"]
-                    and ("-p %s " % settings.DATABASES[destination]["PORT"])
-                    or "",
-                    test
-                    and settings.DATABASES[destination]["TEST"]["NAME"]
-                    or settings.DATABASES[destination]["NAME"],
-                )
-            else:
-                cmd = "pg_restore -n public -Fc --no-password %s%s%s -d %s %s"
-                commandline = cmd % (
-                    settings.DATABASES[destination]["USER"]
-                    and ("-U %s " % settings.DATABASES[destination]["USER"])
-                    or "",
-                    settings.DATABASES[destination]["HOST"]
-                    and ("-h %s " % settings.DATABASES[destination]["HOST"])
-                    or "",
-                    settings.DATABASES[destination]["PORT"]
-                    and ("-p %s " % settings.DATABASES[destination]["PORT"])
-                    or "",
-                    test
-                    and settings.DATABASES[destination]["TEST"]["NAME"]
-                    or settings.DATABASES[destination]["NAME"],
-                    os.path.join(settings.FREPPLE_LOGDIR, options["dumpfile"]),
-                )
+                            else "-Fc"
+                        ),
+                        settings.DATABASES[destination]["USER"]
+                        and ("-U %s " % settings.DATABASES[destination]["USER"])
+                        or "",
+                        settings.DATABASES[destination]["HOST"]
+                        and ("-h %s " % settings.DATABASES[destination]["HOST"])
+                        or "",
+                        settings.DATABASES[destination]["PORT"]
+                        and ("-p %s " % settings.DATABASES[destination]["PORT"])
+                        or "",
+                        test
+                        and settings.DATABASES[destination]["TEST"]["NAME"]
+                        or settings.DATABASES[destination]["NAME"],
+                        os.path.join(settings.FREPPLE_LOGDIR, options["dumpfile"]),
+                    )
 
-            with subprocess.Popen(
-                commandline,
-                shell=True,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.PIPE,
-            ) as p:
-                error_message = None
-                try:
-                    res = p.communicate()
-                    task.processid = p.pid
-                    task.save(using=source)
-                    p.wait()
-                    error_message = res[1].decode().partition("\n")[0]
-                    if p.returncode != 0 or "error" in error_message.lower():
-                        raise Exception(error_message)
-
-                    if not options["dumpfile"]:
-                        # Successful copy can still leave warnings and errors
-                        # To confirm copy is ok, let's check that the scenario copy task exists
-                        # in the destination database
-                        t = Task.objects.using(destination).filter(id=task.id).first()
-                        if (
-                            not t
-                            or t.name != task.name
-                            or t.submitted != task.submitted
-                        ):
+                with subprocess.Popen(
+                    commandline,
+                    shell=True,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.PIPE,
+                ) as p:
+                    error_message = None
+                    try:
+                        res = p.communicate()
+                        task.processid = p.pid
+                        task.save(using=source)
+                        p.wait()
+                        error_message = res[1].decode().partition("\n")[0]
+                        if p.returncode != 0 or "error" in error_message.lower():
+                            raise Exception(error_message)
+
+                        if not options["dumpfile"]:
+                            self.checkCopy(task, source, destination)
+
+                    except Exception as e:
+                        p.kill()
+                        p.wait()
+                        # Consider the destination database free again
+                        if destination != DEFAULT_DB_ALIAS:
                             destinationscenario.status = "Free"
                             destinationscenario.lastrefresh = datetime.today()
                             destinationscenario.save(
                                 update_fields=["status", "lastrefresh"],
                                 using=DEFAULT_DB_ALIAS,
                             )
-                            raise Exception("Database copy failed")
-                        t.status = "Done"
-                        t.finished = datetime.now()
-                        t.message = "Scenario copied from %s" % source
-                        t.save(
-                            using=destination,
-                            update_fields=["status", "finished", "message"],
-                        )
+                        raise Exception(e or "Database copy failed")
 
-                except Exception as e:
-                    p.kill()
-                    p.wait()
-                    # Consider the destination database free again
-                    if destination != DEFAULT_DB_ALIAS:
-                        destinationscenario.status = "Free"
-                        destinationscenario.lastrefresh = datetime.today()
-                        destinationscenario.save(
-                            update_fields=["status", "lastrefresh"],
-                            using=DEFAULT_DB_ALIAS,
-                        )
-                    raise Exception(e or "Database copy failed")
+                # Restore the plan output saved in a separate dump of a backup
+                if options["dumpfile"]:
+                    outputfile = os.path.join(
+                        settings.FREPPLE_LOGDIR, "%s.output" % options["dumpfile"]
+                    )
+                    if os.path.exists(outputfile):
+                        cmd = ["pg_restore", "-n", "public", "--data-only"]
+                        if os.path.isdir(outputfile):
+                            cmd += [
+                                "-Fd",
+                                "-j",
+                                str(getattr(settings, "SCENARIO_COPY_JOBS", 4)),
+                            ]
+                        cmd += self.connectionArgs(destination)
+                        cmd += ["-d", self.dbName(destination, test), outputfile]
+                        self.runTool(cmd, destination)
 
             # Assure the identity sequences are bigger than the id values
             with connections[destination].cursor() as cursor:
@@ -579,8 +655,8 @@ class Command(BaseCommand):
             # Give access to the destination scenario to:
             #  a) the user doing the copy
             #  b) all active superusers from the source schema
-            # unless it's a promotion
-            if destination != DEFAULT_DB_ALIAS:
+            # unless it's a promotion or a refresh
+            if destination != DEFAULT_DB_ALIAS and strategy != "refresh":
                 User.objects.using(destination).filter(
                     is_superuser=True, is_active=True
                 ).update(is_active=True)
@@ -593,11 +669,14 @@ class Command(BaseCommand):
                     ).update(is_active=True)
 
             # Delete data files present in the scenario folders
-            if destination != DEFAULT_DB_ALIAS and settings.DATABASES[destination][
-                "FILEUPLOADFOLDER"
-            ] not in (
-                settings.DATABASES[DEFAULT_DB_ALIAS]["FILEUPLOADFOLDER"],
-                settings.DATABASES[source]["FILEUPLOADFOLDER"],
+            if (
+                destination != DEFAULT_DB_ALIAS
+                and strategy != "refresh"
+                and settings.DATABASES[destination]["FILEUPLOADFOLDER"]
+                not in (
+                    settings.DATABASES[DEFAULT_DB_ALIAS]["FILEUPLOADFOLDER"],
+                    settings.DATABASES[source]["FILEUPLOADFOLDER"],
+                )
             ):
                 FileManager.cleanFolder(0, destination)
                 FileManager.cleanFolder(1, destination)
@@ -622,6 +701,8 @@ class Command(BaseCommand):
                 dest_task.message = "Scenario restored from %s" % options["dumpfile"]
             elif promote:
                 dest_task.message = "Scenario promoted from %s" % source
+            elif strategy == "refresh":
+                dest_task.message = "Scenario refreshed from %s" % source
             else:
                 dest_task.message = "Scenario copied from %s" % source
             dest_task.save(using=destination)
@@ -630,13 +711,16 @@ class Command(BaseCommand):
                     destination,
                     options["dumpfile"],
                 )
+            elif strategy == "refresh":
+                task.message = "Scenario %s refreshed" % destination
             else:
                 task.message = "Scenario copied to %s" % destination
 
             # Delete any waiting tasks in the new copy.
             # This is needed for situations where the same source is copied to
             # multiple destinations at the same moment.
-            if not options["dumpfile"]:
+            # A refresh leaves the log of the destination untouched.
+            if not options["dumpfile"] and strategy != "refresh":
                 Task.objects.all().using(destination).filter(id__gt=task.id).delete()
 
             # Don't automate any task in the new copy
@@ -681,6 +765,512 @@ class Command(BaseCommand):
                 task.save(using=source)
             settings.DEBUG = tmp_debug
 
+    @staticmethod
+    def dbName(alias, test):
+        return (
+            test
+            and settings.DATABASES[alias]["TEST"]["NAME"]
+            or settings.DATABASES[alias]["NAME"]
+        )
+
+    @staticmethod
+    def connectionArgs(alias):
+        args = []
+        if settings.DATABASES[alias]["USER"]:
+            args += ["-U", settings.DATABASES[alias]["USER"]]
+        if settings.DATABASES[alias]["HOST"]:
+            args += ["-h", settings.DATABASES[alias]["HOST"]]
+        if settings.DATABASES[alias]["PORT"]:
+            args += ["-p", str(settings.DATABASES[alias]["PORT"])]
+        return args
+
+    def getStrategies(self, requested, source, destination, dumpfile, test):
+        """
+        Returns the copy strategies to try, in order of preference.
+
+        - template: create the destination database with the source as a
+          template. This is a file level copy and by far the fastest, but
+          it requires that nobody else is connected to the source database.
+        - directory: a directory-format pg_dump and pg_restore, both
+          running with SCENARIO_COPY_JOBS parallel jobs.
+        - stream: a single-threaded pg_dump piped into pg_restore.
+        """
+        if dumpfile:
+            return ["restore"]
+        if requested in ("directory", "stream"):
+            return [requested]
+        with connections[source].cursor() as cursor:
+            cursor.execute(
+                """
+                select
+                  pg_database_size(current_database()),
+                  (
+                  select count(*) from pg_stat_activity
+                  where datname = current_database() and pid != pg_backend_pid()
+                  )
+                """
+            )
+            size, sessions = cursor.fetchone()
+        strategies = []
+        if (
+            requested == "template"
+            or (not sessions and self.canUseTemplate(source, destination, test))
+        ) and destination != DEFAULT_DB_ALIAS:
+            strategies.append("template")
+        if requested == "auto":
+            strategies.append(
+                "directory"
+                if size
+                >= getattr(settings, "SCENARIO_COPY_PARALLEL_SIZE", 1024) * 1024 * 1024
+                else "stream"
+            )
+        if not strategies:
+            raise CommandError("Can't copy into production with a template")
+        return strategies
+
+    def canUseTemplate(self, source, destination, test):
+        """
+        A template copy requires both databases on the same server, and a user
+        allowed to create databases that owns the source and destination
+        databases.
+        """
+        if (
+            settings.DATABASES[source]["HOST"]
+            != settings.DATABASES[destination]["HOST"]
+            or settings.DATABASES[source]["PORT"]
+            != settings.DATABASES[destination]["PORT"]
+        ):
+            return False
+        with connections[destination].cursor() as cursor:
+            cursor.execute(
+                """
+                select
+                  (select rolsuper or rolcreatedb from pg_roles where rolname = current_user),
+                  count(*) filter (where pg_has_role(datdba, 'MEMBER'))
+                from pg_database
+                where datname in (%s, %s)
+                """,
+                (self.dbName(source, test), self.dbName(destination, test)),
+            )
+            createdb, owned = cursor.fetchone()
+        return createdb and owned == 2
+
+    def copyTemplate(self, source, destination, test):
+        """
+        Creates a copy of the source database under a temporary name, and swaps
+        it with the destination database.
+        Returns False when the source database is in use.
+        """
+        quote = connections[destination].ops.quote_name
+        sourcename = self.dbName(source, test)
+        destinationname = self.dbName(destination, test)
+        tmpname = "%s_copy" % destinationname
+
+        # Our own connections block the copy and the drop
+        connections[source].close()
+        connections[destination].close()
+        db = connections[destination]
+        params = db.get_connection_params()
+        params.pop("database", None)
+        params["dbname"] = "postgres"
+        conn = db.get_new_connection(params)
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("drop database if exists %s" % quote(tmpname))
+                try:
+                    cursor.execute(
+                        "create database %s template %s"
+                        % (quote(tmpname), quote(sourcename))
+                    )
+                except Exception:
+                    # Somebody is connected to the source database
+                    return False
+                try:
+                    cursor.execute(
+                        "drop database %s with (force)" % quote(destinationname)
+                    )
+                except Exception:
+                    cursor.execute("drop database %s" % quote(tmpname))
+                    return False
+                cursor.execute(
+                    "alter database %s rename to %s"
+                    % (quote(tmpname), quote(destinationname))
+                )
+                return True
+        finally:
+            conn.close()
+
+    def copyDirectory(
+        self,
+        task,
+        source,
+        destination,
+        test,
+        excludedTables,
+        noOwnershipTables,
+    ):
+        """
+        Runs pg_dump and pg_restore with the directory format, which allows
+        both to process multiple tables in parallel.
+        """
+        jobs = str(getattr(settings, "SCENARIO_COPY_JOBS", 4))
+        folder = tempfile.mkdtemp(prefix="scenario_copy_", dir=settings.FREPPLE_LOGDIR)
+        dumpfolder = os.path.join(folder, "dump")
+        try:
+            cmd = ["pg_dump", "-Fd", "-j", jobs, "-f", dumpfolder]
+            cmd += self.connectionArgs(source)
+            if destination == DEFAULT_DB_ALIAS:
+                for t in excludedTables:
+                    cmd += ["-T", t, "--exclude-table-data=%s" % t]
+            for t in noOwnershipTables:
+                cmd += ["-T", t]
+            cmd.append(self.dbName(source, test))
+            self.runTool(cmd, source)
+            task.status = "50%"
+            task.save(using=source)
+
+            cmd = ["pg_restore", "-n", "public", "-Fd", "-j", jobs]
+            cmd += self.connectionArgs(destination)
+            cmd += ["-d", self.dbName(destination, test), dumpfolder]
+            self.runTool(cmd, destination)
+            task.status = "90%"
+            task.save(using=source)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    @staticmethod
+    def runTool(cmd, database):
+        env = os.environ.copy()
+        if settings.DATABASES[database]["PASSWORD"]:
+            env["PGPASSWORD"] = settings.DATABASES[database]["PASSWORD"]
+        res = subprocess.run(
+            cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+        )
+        error_message = res.stderr.decode().partition("\n")[0]
+        if res.returncode != 0 or "error" in error_message.lower():
+            raise Exception(error_message or "Database copy failed")
+
+    @staticmethod
+    def checkCopy(task, source, destination):
+        # Successful copy can still leave warnings and errors
+        # To confirm copy is ok, let's check that the scenario copy task exists
+        # in the destination database
+        t = Task.objects.using(destination).filter(id=task.id).first()
+        if not t or t.name != task.name or t.submitted != task.submitted:
+            raise Exception("Database copy failed")
+        t.status = "Done"
+        t.finished = datetime.now()
+        t.message = "Scenario copied from %s" % source
+        t.save(
+            using=destination,
+            update_fields=["status", "finished", "message"],
+        )
+
+    # Tables of which a refresh keeps the destination contents
+    refreshExcludedTables = (
+        "common_user",
+        "common_scenario",
+        "auth_group",
+        "auth_group_permissions",
+        "auth_permission",
+        "django_content_type",
+        "django_session",
+        "django_admin_log",
+        "common_comment",
+        "common_notification",
+        "common_follower",
+        "common_preference",
+        "common_user_groups",
+        "common_user_user_permissions",
+        "execute_log",
+        "execute_schedule",
+    )
+
+    # Overlap between consecutive refreshes, to cover clock differences and
+    # transactions that were still running during the previous copy
+    refreshMargin = timedelta(minutes=5)
+
+    # Maximum number of days the records of deleted rows are kept
+    tombstoneDays = 30
+
+    # Log message of the tasks that overwrite a scenario
+    copiedMessage = r"^Scenario (copied|refreshed|restored|promoted) from "
+
+    @classmethod
+    def lastCopy(cls, database):
+        """
+        Returns the source of the previous copy or refresh into a database,
+        and the moment since which a refresh needs to replicate changes.
+        Returns None when the database can't be refreshed incrementally.
+        """
+        last = (
+            Task.objects.using(database)
+            .filter(
+                name="scenario_copy",
+                status="Done",
+                message__regex=cls.copiedMessage,
+            )
+            .order_by("-finished")
+            .first()
+        )
+        if not last or not last.started:
+            return None
+        for prefix in ("Scenario copied from ", "Scenario refreshed from "):
+            if last.message.startswith(prefix):
+                return (last.message[len(prefix) :], last.started - cls.refreshMargin)
+        return None
+
+    @classmethod
+    def purgeTombstones(cls, database):
+        """
+        Removes the records of deleted rows that no refresh needs any longer.
+
+        A refresh reads the records since the previous copy into the
+        destination, in both the source and the destination database.
+        Records older than the previous copy of every scenario copied from
+        this database and of the database itself are removed, and in any case
+        those older than tombstoneDays. Deletes are then only tracked since
+        that moment.
+        """
+        since = []
+        scenarios = {
+            sc.name
+            for sc in Scenario.objects.using(DEFAULT_DB_ALIAS).filter(status="In use")
+            if sc.name in settings.DATABASES
+        }
+        scenarios.add(database)
+        for sc in scenarios:
+            try:
+                last = cls.lastCopy(sc)
+            except Exception:
+                # Keep the records when a scenario can't be checked
+                since.append(None)
+                continue
+            if last and (sc == database or last[0] == database):
+                since.append(last[1])
+        if None in since:
+            cutoff = None
+        elif since:
+            cutoff = min(since)
+        else:
+            cutoff = datetime.now()
+        with connections[database].cursor() as cursor:
+            cursor.execute(
+                """
+                delete from common_tombstone
+                where tablename != ''
+                and deleted < greatest(now() - %s * interval '1 day', %s)
+                """,
+                (cls.tombstoneDays, cutoff),
+            )
+            cursor.execute(
+                """
+                update common_tombstone
+                set deleted = greatest(now() - %s * interval '1 day', %s)
+                where tablename = ''
+                and deleted < greatest(now() - %s * interval '1 day', %s)
+                """,
+                (cls.tombstoneDays, cutoff, cls.tombstoneDays, cutoff),
+            )
+
+    def refresh(self, task, source, destination):
+        """
+        Replicates only the records that changed in the source or the
+        destination since the previous copy or refresh from the same source.
+
+        Changed records are found with the lastmodified field of the AuditModel
+        tables, and deleted records in the common_tombstone table. Other tables
+        are copied completely.
+        Returns False when an incremental refresh isn't possible, and the
+        destination is left untouched.
+        """
+        if destination == DEFAULT_DB_ALIAS:
+            return False
+
+        # Find the previous copy into the destination
+        last = self.lastCopy(destination)
+        if not last or last[0] != source:
+            return False
+        since = last[1]
+
+        # The source must not have been overwritten since then
+        if (
+            Task.objects.using(source)
+            .filter(
+                name="scenario_copy",
+                status="Done",
+                message__regex=self.copiedMessage,
+                finished__gt=since,
+            )
+            .exists()
+        ):
+            return False
+
+        # Both databases must have the same schema, and track deletes since then
+        migrations = []
+        for db in (source, destination):
+            self.purgeTombstones(db)
+            with connections[db].cursor() as cursor:
+                cursor.execute("select app, name from django_migrations")
+                migrations.append(set(cursor.fetchall()))
+                cursor.execute(
+                    "select bool_and(deleted <= %s) from common_tombstone where tablename = ''",
+                    (since,),
+                )
+                if not cursor.fetchone()[0]:
+                    return False
+        if migrations[0] != migrations[1]:
+            return False
+
+        models = {}
+        for m in apps.get_models(include_auto_created=True):
+            if (
+                not m._meta.proxy
+                and m._meta.managed
+                and m._meta.db_table not in self.refreshExcludedTables
+            ):
+                models[m._meta.db_table] = m
+
+        # A separate connection reads a consistent snapshot of the source,
+        # while the default connection reports the progress.
+        quote = connections[destination].ops.quote_name
+        srcconn = create_connection(source)
+        try:
+            with srcconn.cursor() as src, transaction.atomic(
+                using=destination
+            ), connections[destination].cursor() as dst:
+                src.execute("begin isolation level repeatable read")
+                dst.execute("set constraints all deferred")
+                hierarchies = []
+                for cnt, (tablename, m) in enumerate(sorted(models.items())):
+                    table = quote(tablename)
+                    columns = ", ".join(
+                        quote(c) for c in self.getColumns(src, dst, tablename)
+                    )
+                    full = not issubclass(m, AuditModel)
+                    if not full:
+                        # Truncated tables are copied completely
+                        for c in (src, dst):
+                            c.execute(
+                                """
+                                select exists (
+                                  select 1 from common_tombstone
+                                  where tablename = %s and key is null and deleted >= %s
+                                  )
+                                """,
+                                (tablename, since),
+                            )
+                            full = full or c.fetchone()[0]
+                    if full:
+                        dst.execute("delete from %s" % table)
+                        self.transfer(
+                            src,
+                            "select %s from %s" % (columns, table),
+                            dst,
+                            "%s (%s)" % (table, columns),
+                        )
+                    else:
+                        # Collect the keys changed or deleted in either database
+                        pk = quote(m._meta.pk.column)
+                        changed = """
+                            insert into tmp_refresh
+                            select %s from %s where lastmodified >= %%s
+                            union
+                            select key::%s from common_tombstone
+                            where tablename = %%s and key is not null and deleted >= %%s
+                            """ % (
+                            pk,
+                            table,
+                            m._meta.pk.rel_db_type(srcconn),
+                        )
+                        for c in (src, dst):
+                            c.execute("drop table if exists tmp_refresh")
+                            c.execute(
+                                "create temporary table tmp_refresh (key %s) on commit drop"
+                                % m._meta.pk.rel_db_type(srcconn)
+                            )
+                            c.execute(changed, (since, tablename, since))
+                        self.transfer(
+                            dst, "select key from tmp_refresh", src, "tmp_refresh"
+                        )
+                        dst.execute("truncate tmp_refresh")
+                        self.transfer(
+                            src,
+                            "select distinct key from tmp_refresh",
+                            dst,
+                            "tmp_refresh",
+                        )
+
+                        # Replace these records with the ones from the source
+                        dst.execute(
+                            "delete from %s using tmp_refresh where %s.%s = tmp_refresh.key"
+                            % (table, table, pk)
+                        )
+                        self.transfer(
+                            src,
+                            "select %s from %s where %s in (select key from tmp_refresh)"
+                            % (columns, table, pk),
+                            dst,
+                            "%s (%s)" % (table, columns),
+                        )
+                        dst.execute("select count(*) from tmp_refresh")
+                        if dst.fetchone()[0] and issubclass(m, HierarchyModel):
+                            hierarchies.append(m)
+
+                    # Assure the sequence is bigger than the id values
+                    dst.execute(
+                        "select pg_get_serial_sequence(%s, %s)",
+                        (table, m._meta.pk.column),
+                    )
+                    seq = dst.fetchone()[0]
+                    if seq:
+                        dst.execute(
+                            "select setval(%%s, coalesce((select max(%s) from %s), 1))"
+                            % (quote(m._meta.pk.column), table),
+                            (seq,),
+                        )
+
+                    task.status = "%d%%" % (10 + 80 * (cnt + 1) / len(models))
+                    task.save(using=source)
+
+                # The hierarchy fields aren't tracked with lastmodified
+                for m in hierarchies:
+                    m.objects.using(destination).filter(
+                        pk__in=m.objects.using(destination).values("pk")[:1]
+                    ).update(lft=None)
+                    m.rebuildHierarchy(database=destination)
+
+                # Our own deletes don't need replication in the next refresh
+                dst.execute("delete from common_tombstone where deleted = now()")
+                src.execute("commit")
+        finally:
+            srcconn.close()
+        return True
+
+    @staticmethod
+    def getColumns(src, dst, table):
+        """
+        Returns the columns of a table in both databases, except generated
+        columns.
+        """
+        sql = """
+            select column_name from information_schema.columns
+            where table_schema = 'public' and table_name = %s and is_generated = 'NEVER'
+            order by ordinal_position
+            """
+        src.execute(sql, (table,))
+        columns = {i[0] for i in src.fetchall()}
+        dst.execute(sql, (table,))
+        return [i[0] for i in dst.fetchall() if i[0] in columns]
+
+    @staticmethod
+    def transfer(fromcursor, query, tocursor, table):
+        with tempfile.SpooledTemporaryFile(max_size=100 * 1024 * 1024) as data:
+            fromcursor.copy_expert("copy (%s) to stdout" % query, data)
+            data.seek(0)
+            tocursor.copy_expert("copy %s from stdin" % table, data)
+
     # accordion template
     title = _("scenario management")
     index = 1500
@@ -707,9 +1297,8 @@ class Command(BaseCommand):
 
         # look for dump files in the log folder of production
         for f in sorted(os.listdir(settings.FREPPLE_LOGDIR)):
-            if os.path.isfile(
-                os.path.join(settings.FREPPLE_LOGDIR, f)
-            ) and f.lower().endswith(".dump"):
+            # Directory-format dumps are folders
+            if f.lower().endswith(".dump"):
                 dumps.append(f)
 
         for scenario in scenarios:
@@ -0,0 +1,53 @@
+#
+# Copyright (C) 2026 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("execute", "0011_alter_model_options"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            """
+            create or replace function execute_log_notify() returns trigger
+            language plpgsql as $$
+            begin
+              perform pg_notify('execute_log', new.id::text);
+              return null;
+            end;
+            $$;
+
+            create trigger execute_log_notify
+            after insert or update of status on execute_log
+            for each row when (new.status = 'Waiting')
+            execute function execute_log_notify();
+            """,
+            """
+            drop trigger if exists execute_log_notify on execute_log;
+            drop function if exists execute_log_notify();
+            """,
+        ),
+    ]
@@ -28,11 +28,19 @@ import tempfile
 from django.conf import settings
 from django.core import management
 from django.db import DEFAULT_DB_ALIAS
-from django.test import TransactionTestCase
-
-from freppledb.input.models import ManufacturingOrder, PurchaseOrder, DistributionOrder
-from freppledb.common.models import Notification, User
-
+from django.test import SimpleTestCase, TransactionTestCase
+
+from freppledb.execute.management.commands.importfromfolder import scheduleModels
+from freppledb.input.models import (
+    Customer,
+    Demand,
+    DistributionOrder,
+    ManufacturingOrder,
+    PurchaseOrder,
+    Supplier,
+)
+from freppledb.common.models import Notification, Parameter, User
+from freppledb.common.report import GridReport
 
 class execute_with_commands(TransactionTestCase):
     fixtures = ["demo", "initial"]
@@ -96,3 +104,34 @@ class execute_with_commands(TransactionTestCase):
         self.assertEqual(DistributionOrder.objects.count(), countDO)
         self.assertEqual(PurchaseOrder.objects.count(), countPO)
         self.assertEqual(ManufacturingOrder.objects.count(), countMO)
+
+
+class importfromfolder_schedule(SimpleTestCase):
+    def test_schedule(self):
+        models = []
+        for ifile, model in (
+            ("demand.csv", Demand),
+            ("customer.csv", Customer),
+            ("supplier.csv", Supplier),
+            ("purchaseorder.csv", PurchaseOrder),
+            ("manufacturingorder.csv", ManufacturingOrder),
+            ("parameter.csv", Parameter),
+        ):
+            deps = set([model])
+            GridReport.dependent_models(model, deps)
+            models.append((ifile, model, None, deps))
+        models = GridReport.sort_models(models)
+        predecessors = scheduleModels(models)
+        files = [m[0] for m in models]
+        waitsfor = {
+            files[i]: {files[p] for p in predecessors[i]} for i in range(len(files))
+        }
+        self.assertEqual(waitsfor["parameter.csv"], set())
+        self.assertEqual(waitsfor["customer.csv"], {"parameter.csv"})
+        self.assertEqual(waitsfor["supplier.csv"], {"parameter.csv"})
+        self.assertIn("customer.csv", waitsfor["demand.csv"])
+        # Purchase orders and manufacturing orders share the same table
+        self.assertTrue(
+            "purchaseorder.csv" in waitsfor["manufacturingorder.csv"]
+            or "manufacturingorder.csv" in waitsfor["purchaseorder.csv"]
+        )
@@ -22,17 +22,19 @@
 #
 
 import base64
+from datetime import datetime
 import json
 import os
-from time import sleep
+from time import sleep, time
 import unittest
 
 from django.conf import settings
 from django.core import management
-from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
 from django.db.models import Sum, Count, Q
 from django.test import TransactionTestCase
 
+from freppledb.execute.management.commands.runworker import getTaskClass, TaskQueue
 from freppledb.execute.models import Task
 import freppledb.output as output
 import freppledb.input as input
@@ -196,6 +198,61 @@ class execute_multidb(TransactionTestCase):
         self.assertNotEqual(count2, 0)
         self.assertNotEqual(count2, count1new)
 
+        # Copy db1 into db2 again with a parallel dump and restore
+        transaction.commit(using=db1)
+        transaction.commit(using=db2)
+        management.call_command(
+            "scenario_copy", db1, db2, force=True, strategy="directory"
+        )
+        self.assertEqual(
+            input.models.OperationPlanMaterial.objects.all().using(db2).count(),
+            count1new,
+        )
+        task = Task.objects.using(db1).filter(name="scenario_copy").order_by("-id")[0]
+        self.assertEqual(task.status, "Done")
+        self.assertIn("--strategy=directory", task.arguments)
+
+        # Refresh db2 with the changes in both databases since the copy
+        po = input.models.PurchaseOrder.objects.all().using(db1).first()
+        po.delete(using=db1)
+        dmd = input.models.Demand.objects.all().using(db1).first()
+        dmd.quantity += 1
+        dmd.save(using=db1)
+        input.models.Demand.objects.all().using(db2).exclude(
+            name=dmd.name
+        ).first().delete(using=db2)
+        transaction.commit(using=db1)
+        transaction.commit(using=db2)
+        management.call_command("scenario_copy", db1, db2, force=True, refresh=True)
+        task = Task.objects.using(db1).filter(name="scenario_copy").order_by("-id")[0]
+        self.assertEqual(task.status, "Done")
+        self.assertEqual(task.message, "Scenario %s refreshed" % db2)
+        self.assertFalse(
+            input.models.PurchaseOrder.objects.using(db2)
+            .filter(reference=po.reference)
+            .exists()
+        )
+        self.assertEqual(
+            input.models.Demand.objects.using(db2).get(name=dmd.name).quantity,
+            dmd.quantity,
+        )
+        for m in (input.models.Demand, input.models.OperationPlanMaterial):
+            self.assertEqual(
+                m.objects.all().using(db1).count(), m.objects.all().using(db2).count()
+            )
+
+        # The deleted purchase order is recorded by its key, and kept for the
+        # next refresh of db2
+        with connections[db1].cursor() as cursor:
+            cursor.execute(
+                """
+                select count(*) from common_tombstone
+                where tablename = 'operationplan' and key = %s
+                """,
+                (po.reference,),
+            )
+            self.assertEqual(cursor.fetchone()[0], 1)
+
         # Populate db2 with a backup of db1
         management.call_command("backup", database=db1)
         dumpfile = Task.objects.filter(name="backup").first().logfile
@@ -207,6 +264,24 @@ class execute_multidb(TransactionTestCase):
             input.models.PurchaseOrder.objects.all().using(db2).count(),
         )
 
+        # Same with a parallel backup that saves the plan output separately
+        management.call_command(
+            "backup", database=db1, format="directory", jobs=2, output="separate"
+        )
+        dumpfile = Task.objects.filter(name="backup").order_by("-id").first().logfile
+        self.assertTrue(os.path.isdir(os.path.join(settings.FREPPLE_LOGDIR, dumpfile)))
+        self.assertTrue(
+            os.path.exists(
+                os.path.join(settings.FREPPLE_LOGDIR, "%s.output" % dumpfile)
+            )
+        )
+        management.call_command("scenario_release", database=db2)
+        management.call_command("scenario_copy", "--dumpfile=%s" % dumpfile, db1, db2)
+        for m in (input.models.PurchaseOrder, input.models.OperationPlanMaterial):
+            self.assertEqual(
+                m.objects.all().using(db1).count(), m.objects.all().using(db2).count()
+            )
+
 
 class FixtureTest(TransactionTestCase):
     def test_fixture_demo(self):
@@ -405,3 +480,49 @@ class remote_commands(TransactionTestCase):
             cnt += 1
         self.assertLess(cnt, 20, "Running task taking too long")
         sleep(4)  # Wait for the worker to die
+
+
+class worker_queue(TransactionTestCase):
+    def setUp(self):
+        os.environ["FREPPLE_TEST"] = "YES"
+        super().setUp()
+
+    def tearDown(self):
+        del os.environ["FREPPLE_TEST"]
+        super().tearDown()
+
+    def test_task_queue(self):
+        self.assertEqual(getTaskClass("runplan"), "heavy")
+        self.assertEqual(getTaskClass("emailreport"), "light")
+
+        queue = TaskQueue(DEFAULT_DB_ALIAS)
+        try:
+            self.assertFalse(queue.claim())
+
+            # A new task wakes up the queue
+            start = time()
+            Task.objects.create(
+                name="unknown_command", submitted=datetime.now(), status="Waiting"
+            )
+            queue.wait(30)
+            self.assertLess(time() - start, 10)
+
+            # Claiming an unknown command marks it as failed
+            self.assertTrue(queue.claim())
+            self.assertFalse(queue.claim())
+            self.assertFalse(queue.running)
+            self.assertEqual(Task.objects.get(name="unknown_command").status, "Failed")
+
+            # A task claimed by a process that died is released again
+            orphan = Task.objects.create(
+                name="unknown_command",
+                submitted=datetime.now(),
+                status="Waiting",
+                processid=99999999,
+            )
+            self.assertEqual(queue.reclaim(), 1)
+            orphan.refresh_from_db()
+            self.assertIsNone(orphan.processid)
+            self.assertEqual(orphan.status, "Waiting")
+        finally:
+            queue.close()
@@ -26,7 +26,7 @@ import gzip
 from importlib import import_module
 from io import BytesIO
 import json
-from openpyxl import load_workbook, Workbook
+from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
 from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import NamedStyle, PatternFill
@@ -36,6 +36,7 @@ import os
 import psutil
 import re
 import shlex
+import shutil
 from time import sleep
 from zipfile import ZipFile, ZIP_DEFLATED
 
@@ -71,7 +72,7 @@ from django.core.management import get_commands, call_command
 from freppledb import __version__
 from freppledb.admin import data_site
 from freppledb.common.auth import basicauthentication
-from freppledb.common.dataload import parseExcelWorksheet
+from freppledb.common.dataload import loadWorkbook, parseExcelWorksheet
 from freppledb.common.models import Scenario, HierarchyModel, Parameter
 from freppledb.common.report import (
     GridFieldDuration,
@@ -209,7 +210,12 @@ class TaskReport(GridReport):
                 x
                 for x in os.listdir(settings.FREPPLE_LOGDIR)
                 if x.endswith(".log")
-                or (x.lower().endswith(".dump") and request.user.is_superuser)
+                or (
+                    x.lower().endswith(".dump")
+                    and request.user.is_superuser
+                    # Directory-format dumps can't be downloaded
+                    and os.path.isfile(os.path.join(settings.FREPPLE_LOGDIR, x))
+                )
             ]
         )
 
@@ -776,6 +782,13 @@ def DeleteLogFile(request, taskid):
         return HttpResponseNotFound(force_str(_("Error")))
     try:
         os.remove(os.path.join(settings.FREPPLE_LOGDIR, filename))
+        # A backup can have a separate dump of the plan output
+        output = os.path.join(settings.FREPPLE_LOGDIR, "%s.output" % filename)
+        if filename.lower().endswith(".dump") and os.path.exists(output):
+            if os.path.isdir(output):
+                shutil.rmtree(output)
+            else:
+                os.remove(output)
         Task.objects.using(request.database).filter(id=taskid).update(logfile=None)
         return HttpResponse(content="OK")
     except Exception as e:
@@ -1397,7 +1410,7 @@ def importWorkbook(request):
             ):
                 yield _("Unsupported file format.")
                 continue
-            wb = load_workbook(filename=file, data_only=True)
+            wb = loadWorkbook(file)
             models = []
             for ws_name in wb.sheetnames:
                 # Find the model
@@ -1508,6 +1521,7 @@ def importWorkbook(request):
                             ).lower()
                             == "true"
                         )
+            wb.close()
             yield "</tbody></table></div>"
             yield "<div><strong>%s</strong><br><br></div>" % _("Done")
     except GeneratorExit:
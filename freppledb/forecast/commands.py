@@ -24,7 +24,6 @@
 import os
 from datetime import datetime, timedelta
 from psycopg2.extras import execute_batch
-import tempfile
 import logging
 import sys
 from time import time, sleep
@@ -34,12 +33,26 @@ from django.db import connections, transaction, DEFAULT_DB_ALIAS
 from django.db.models import Case, When, Value, IntegerField, Q
 from django.utils.translation import gettext_lazy as _
 
-from .models import Forecast
+from .models import Forecast, ForecastPlan
 from freppledb.boot import getAttributes
-from freppledb.common.commands import PlanTaskRegistry, PlanTask, clean_value
+from freppledb.common.commands import (
+    PlanTaskRegistry,
+    PlanTask,
+    clean_value,
+    CopyFromGenerator,
+)
 from freppledb.common.models import Parameter, BucketDetail
 from freppledb.common.report import getCurrentDate
-from freppledb.input.commands.load import LoadTask
+from freppledb.input.commands.load import (
+    LoadTask,
+    loadCalendarBuckets,
+    loadCustomers,
+    loadDemand,
+    loadItems,
+    loadLocations,
+    loadOperationPlans,
+    loadOperations,
+)
 from freppledb.input.models import Item, Customer, Location
 
 
@@ -199,7 +212,8 @@ class PopulateForecastTable(PlanTask):
                     delete from forecast f
                     using (select distinct item_id, location_id from forecast
                     except select distinct item_id, location_id from demand
-                    except select distinct item_id, location_id from forecastplan where value ?| array['ordersadjustment','forecastoverride']) t
+                    except select distinct item_id, location_id from forecastplan
+                    where ordersadjustment is not null or forecastoverride is not null) t
                     where t.item_id = f.item_id
                     and t.location_id = f.location_id
                     """
@@ -219,7 +233,8 @@ class PopulateForecastTable(PlanTask):
                                     where forecastplan.item_id = forecast.item_id
                                     and forecastplan.location_id =forecast.location_id
                                     and forecastplan.customer_id =forecast.customer_id
-                                    and forecastplan.value ?| array['ordersadjustment','forecastoverride'])
+                                    and (forecastplan.ordersadjustment is not null
+                                         or forecastplan.forecastoverride is not null))
                     """,
                     (parentCustomer,),
                 )
@@ -512,8 +527,10 @@ class AggregateDemand(PlanTask):
             cursor.execute(
                 """
                 delete from forecastplan
-                where value = '{}'::jsonb or value is null
+                where (value = '{}'::jsonb or value is null)
+                and coalesce(%s) is null
                 """
+                % ", ".join(ForecastPlan.measure_columns)
             )
             transaction.commit(using=database)
             logger.info(
@@ -729,7 +746,7 @@ class AggregateDemand(PlanTask):
             inner join forecast on forecast.item_id = forecastplan.item_id
                                 and forecast.location_id = forecastplan.location_id
                                 and forecast.customer_id = forecastplan.customer_id
-            where forecastplan.value ? 'ordersopen'
+            where forecastplan.ordersopen is not null
             and coalesce(forecast.method, 'automatic') != 'aggregate'
             except
             select item_id, location_id, customer_id, startdate, 'ordersopen' from demand_agg
@@ -740,7 +757,7 @@ class AggregateDemand(PlanTask):
             inner join forecast on forecast.item_id = forecastplan.item_id
                                 and forecast.location_id = forecastplan.location_id
                                 and forecast.customer_id = forecastplan.customer_id
-            where forecastplan.value ? 'orderstotal'
+            where forecastplan.orderstotal is not null
             and coalesce(forecast.method, 'automatic') != 'aggregate'
             except
             select item_id, location_id, customer_id, startdate, 'orderstotal' from demand_agg
@@ -752,7 +769,9 @@ class AggregateDemand(PlanTask):
 
         cursor.execute(
             """
-           update forecastplan set value = (value - leaf_nomore_orders.measure) - (leaf_nomore_orders.measure||'value')
+           update forecastplan set value = value - (leaf_nomore_orders.measure||'value'),
+           ordersopen = case when leaf_nomore_orders.measure = 'ordersopen' then null else ordersopen end,
+           orderstotal = case when leaf_nomore_orders.measure = 'orderstotal' then null else orderstotal end
            from leaf_nomore_orders
            where forecastplan.item_id = leaf_nomore_orders.item_id
            and forecastplan.location_id = leaf_nomore_orders.location_id
@@ -770,19 +789,24 @@ class AggregateDemand(PlanTask):
         starttime = time()
         cursor.execute(
             """
-            insert into forecastplan (item_id, location_id, customer_id, startdate, enddate, value)
-            select item_id, location_id, customer_id, startdate, enddate, jsonb_strip_nulls(
-                                          jsonb_build_object('orderstotal', demand_agg.orderstotal,
-                                          'orderstotalvalue', demand_agg.orderstotalvalue,
-                                          'ordersopen', case when demand_agg.ordersopen = 0 then null else ordersopen end,
-                                          'ordersopenvalue', case when demand_agg.ordersopenvalue = 0 then null else ordersopenvalue end)
-                                          ) as value
+            insert into forecastplan (item_id, location_id, customer_id, startdate, enddate,
+              orderstotal, ordersopen, value)
+            select item_id, location_id, customer_id, startdate, enddate,
+              demand_agg.orderstotal,
+              case when demand_agg.ordersopen = 0 then null else ordersopen end,
+              jsonb_strip_nulls(
+                jsonb_build_object('orderstotalvalue', demand_agg.orderstotalvalue,
+                'ordersopenvalue', case when demand_agg.ordersopenvalue = 0 then null else ordersopenvalue end)
+                ) as value
             from demand_agg
             on conflict (item_id, location_id, customer_id, startdate)
-            do update set value =  forecastplan.value || excluded.value
+            do update set
+              orderstotal = excluded.orderstotal,
+              ordersopen = coalesce(excluded.ordersopen, forecastplan.ordersopen),
+              value = forecastplan.value || excluded.value
             where
-              (excluded.value->>'orderstotal')::numeric is distinct from (forecastplan.value->>'orderstotal')::numeric
-              or (excluded.value->>'ordersopen')::numeric is distinct from (forecastplan.value->>'ordersopen')::numeric
+              excluded.orderstotal is distinct from forecastplan.orderstotal
+              or excluded.ordersopen is distinct from forecastplan.ordersopen
               or (excluded.value->>'orderstotalvalue')::numeric is distinct from (forecastplan.value->>'orderstotalvalue')::numeric
               or (excluded.value->>'ordersopenvalue')::numeric is distinct from (forecastplan.value->>'ordersopenvalue')::numeric
             """
@@ -798,7 +822,9 @@ class AggregateDemand(PlanTask):
             """
             delete from forecastplan
             where (value = '{}' or value is null)
+            and coalesce(%s) is null
             """
+            % ", ".join(ForecastPlan.measure_columns)
         )
         transaction.commit(using=database)
         logger.info(
@@ -888,6 +914,15 @@ class LoadMeasures(PlanTask):
 class LoadForecast(LoadTask):
     description = "Load forecast"
     sequence = 107.5
+    dependencies = (
+        loadLocations,
+        loadCalendarBuckets,
+        loadCustomers,
+        loadOperations,
+        loadItems,
+        loadDemand,
+    )
+    fetchVolume = 10
 
     calendar = None
 
@@ -903,9 +938,7 @@ class LoadForecast(LoadTask):
             return 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = " and %s " % cls.filter
         else:
@@ -917,25 +950,6 @@ class LoadForecast(LoadTask):
         else:
             attrsql = ""
 
-        createForecastSolver(database)
-
-        horizon_history = int(
-            Parameter.getValue("forecast.Horizon_history", database, 10000)
-        )
-        horizon_future = int(
-            Parameter.getValue("forecast.Horizon_future", database, 365)
-        )
-        with connections[database].cursor() as cursor:
-            cursor.execute(
-                "select greatest(0,extract(day from %s - min(startdate))) from forecastplan",
-                (frepple.settings.current.date(),),
-            )
-            oldest = cursor.fetchone()[0]
-            if oldest is not None and oldest < horizon_history:
-                horizon_history = oldest
-
-        cnt = 0
-        starttime = time()
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
                 cursor.execute(
@@ -956,43 +970,74 @@ class LoadForecast(LoadTask):
                         filter_where,
                     )
                 )
-                for i in cursor:
-                    try:
-                        cnt += 1
-                        fcst = frepple.demand_forecast(
-                            name=i[0],
-                            customer=frepple.customer(name=i[1]),
-                            item=frepple.item(name=i[2]),
-                            location=frepple.location(name=i[3]),
-                            priority=i[4],
-                            category=i[8],
-                            subcategory=i[9],
-                            horizon_history=horizon_history,
-                            horizon_future=horizon_future,
-                            deviation=i[13] or None,
-                        )
-                        if i[12]:
-                            fcst.operation = frepple.operation(name=i[12])
-                        if i[5] is not None:
-                            fcst.minshipment = i[5]
-                        if not i[6]:
-                            fcst.discrete = False  # null value -> False
-                        if i[7] is not None:
-                            fcst.maxlateness = i[7].total_seconds()
-                        if i[10]:
-                            fcst.methods = i[10]
-                        fcst.planned = i[11]
-                        if i[14]:
-                            fcst.batch = i[14]
-                        idx = 15
-                        for a in attrs:
-                            setattr(fcst, a, i[idx])
-                            idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, database=DEFAULT_DB_ALIAS, **kwargs):
+        import frepple
+
+        attrs = [f[0] for f in getAttributes(Forecast)]
+
+        createForecastSolver(database)
+
+        horizon_history = int(
+            Parameter.getValue("forecast.Horizon_history", database, 10000)
+        )
+        horizon_future = int(
+            Parameter.getValue("forecast.Horizon_future", database, 365)
+        )
+        with connections[database].cursor() as cursor:
+            cursor.execute(
+                "select greatest(0,extract(day from %s - min(startdate))) from forecastplan",
+                (frepple.settings.current.date(),),
+            )
+            oldest = cursor.fetchone()[0]
+            if oldest is not None and oldest < horizon_history:
+                horizon_history = oldest
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            try:
+                cnt += 1
+                fcst = frepple.demand_forecast(
+                    name=i[0],
+                    customer=frepple.customer(name=i[1]),
+                    item=frepple.item(name=i[2]),
+                    location=frepple.location(name=i[3]),
+                    priority=i[4],
+                    category=i[8],
+                    subcategory=i[9],
+                    horizon_history=horizon_history,
+                    horizon_future=horizon_future,
+                    deviation=i[13] or None,
+                )
+                if i[12]:
+                    fcst.operation = frepple.operation(name=i[12])
+                if i[5] is not None:
+                    fcst.minshipment = i[5]
+                if not i[6]:
+                    fcst.discrete = False  # null value -> False
+                if i[7] is not None:
+                    fcst.maxlateness = i[7].total_seconds()
+                if i[10]:
+                    fcst.methods = i[10]
+                fcst.planned = i[11]
+                if i[14]:
+                    fcst.batch = i[14]
+                idx = 15
+                for a in attrs:
+                    setattr(fcst, a, i[idx])
+                    idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
         logger.info("Loaded %d forecasts in %.2f seconds" % (cnt, time() - starttime))
 
 
+# Operationplans can be linked to forecast buckets
+loadOperationPlans.dependencies += (LoadForecast,)
+
+
 @PlanTaskRegistry.register
 class ExportStaticForecast(PlanTask):
     description = ("Export static data", "Export forecast")
@@ -1318,6 +1363,105 @@ class CalculateForecast(PlanTask):
         slvr.solve(run_fcst="fcst" in os.environ, run_netting=netting)
 
 
+@PlanTaskRegistry.register
+class BacktestForecast(PlanTask):
+    """
+    Measures the forecast accuracy over a list of past periods.
+
+    The periods are passed by the forecast_simulation command in the
+    fcst_backtest environment variable, as a semicolon separated list of
+    bucket start dates.
+    For each period the current date is moved to the start of the period, the
+    statistical forecast is recomputed in memory and compared with the orders
+    in that period. The forecast changes are rolled back afterwards, so only
+    the error totals are saved in the forecast_backtest table.
+    """
+
+    description = "Backtest forecast"
+    sequence = 170.5
+
+    @classmethod
+    def getWeight(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        if "fcst_backtest" in os.environ and Parameter.getValue(
+            "forecast.calendar", database, None
+        ):
+            return 1
+        else:
+            return -1
+
+    @classmethod
+    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        import frepple
+
+        periods = [
+            datetime.strptime(i, "%Y-%m-%d")
+            for i in os.environ["fcst_backtest"].split(";")
+            if i
+        ]
+        slvr = createForecastSolver(database)
+        if not slvr:
+            raise Exception("Can't compute a statistical forecast")
+        forecasts = [
+            i
+            for i in frepple.demands()
+            if isinstance(i, frepple.demand_forecast) and i.methods != "manual"
+        ]
+
+        # Errors per forecast and method:
+        # [periods, orders, error, absolute error, smape]
+        results = {}
+        currentdate = frepple.settings.current
+        try:
+            for period in periods:
+                starttime = time()
+                frepple.settings.current = period
+                for fcst in forecasts:
+                    try:
+                        slvr.solve(demand=fcst)
+                        forecast = fcst.get(period, "forecastbaseline")
+                        orders = fcst.get(period, "orderstotal") + fcst.get(
+                            period, "ordersadjustment"
+                        )
+                        method = fcst.method
+                    except Exception:
+                        # No bucket for this period
+                        continue
+                    finally:
+                        slvr.rollback()
+                    if abs(forecast + orders) < 0.0001:
+                        continue
+                    r = results.setdefault((fcst.name, method), [0, 0, 0, 0, 0])
+                    r[0] += 1
+                    r[1] += orders
+                    r[2] += forecast - orders
+                    r[3] += abs(forecast - orders)
+                    r[4] += abs(forecast - orders) / abs(forecast + orders) * 100
+                logger.info(
+                    "Backtested period %s in %.2f seconds"
+                    % (period.date(), time() - starttime)
+                )
+        finally:
+            frepple.settings.current = currentdate
+
+        # Add the totals to the results of other processes
+        with connections[database].cursor() as cursor:
+            execute_batch(
+                cursor,
+                """
+                insert into forecast_backtest
+                  (forecast, method, periods, orders, error, abserror, smape)
+                values (%s, %s, %s, %s, %s, %s, %s)
+                on conflict (forecast, method) do update set
+                  periods = forecast_backtest.periods + excluded.periods,
+                  orders = forecast_backtest.orders + excluded.orders,
+                  error = forecast_backtest.error + excluded.error,
+                  abserror = forecast_backtest.abserror + excluded.abserror,
+                  smape = forecast_backtest.smape + excluded.smape
+                """,
+                [(k[0], k[1], *v) for k, v in results.items()],
+            )
+
+
 @PlanTaskRegistry.register
 class ExportForecastMetrics(PlanTask):
     description = "Export forecast metrics"
@@ -1339,11 +1483,15 @@ class ExportForecastMetrics(PlanTask):
     def run(cls, database=DEFAULT_DB_ALIAS, cluster=-1, **kwargs):
         import frepple
 
-        with connections[database].cursor() as cursor:
-            if cluster == -1:
-                cursor.execute(
-                    "update forecast set out_smape=null, out_method=null, out_deviation=null"
-                )
+        if cluster == -2:
+            return
+
+        with transaction.atomic(using=database):
+            with connections[database].cursor() as cursor:
+                if cluster == -1:
+                    cursor.execute(
+                        "update forecast set out_smape=null, out_method=null, out_deviation=null"
+                    )
                 cursor.execute(
                     """
                     create temporary table forecast_tmp
@@ -1353,30 +1501,33 @@ class ExportForecastMetrics(PlanTask):
                     out_method character varying(20),
                     out_deviation numeric(20,8)
                     )
-                    on commit preserve rows
+                    on commit drop
                     """
                 )
 
-                with tempfile.TemporaryFile(mode="w+t", encoding="utf-8") as tmp:
+                def getData():
                     for i in frepple.demands():
-                        if isinstance(i, frepple.demand_forecast):
-                            print(
-                                "%s\v%s\v%s\v%s"
-                                % (
-                                    clean_value(i.name),
-                                    i.smape_error * 100,
-                                    i.method,
-                                    i.deviation,
-                                ),
-                                file=tmp,
+                        if isinstance(i, frepple.demand_forecast) and (
+                            cluster == -1 or i.item.cluster in cluster
+                        ):
+                            yield "%s\v%s\v%s\v%s\n" % (
+                                clean_value(i.name),
+                                i.smape_error * 100,
+                                i.method,
+                                i.deviation,
                             )
-                    tmp.seek(0)
-                    cursor.copy_from(file=tmp, table="forecast_tmp", sep="\v")
-                    tmp.close()
+
+                cursor.copy_from(
+                    CopyFromGenerator(getData()),
+                    "forecast_tmp",
+                    size=CopyFromGenerator.chunksize,
+                    sep="\v",
+                )
 
                 cursor.execute(
                     "create unique index forecast_tmp_idx on forecast_tmp (name)"
                 )
+                cursor.execute("analyze forecast_tmp")
                 cursor.execute(
                     """
                     update forecast
@@ -1387,25 +1538,10 @@ class ExportForecastMetrics(PlanTask):
                     where tmp.name = forecast.name
                     """
                 )
-                cursor.execute("drop table forecast_tmp")
+
+        if cluster == -1:
+            with connections[database].cursor() as cursor:
                 cursor.execute("vacuum analyze forecast")
-            elif cluster != -2:
-                # Incremental export for a single cluster
-                for i in frepple.demands():
-                    if (
-                        isinstance(i, frepple.demand_forecast)
-                        and i.item.cluster in cluster
-                    ):
-                        cursor.execute(
-                            """
-                            update forecast set
-                                out_smape = %s,
-                                out_method = %s,
-                                out_deviation = %s
-                            where name = %s
-                            """,
-                            (i.smape_error * 100, i.method, i.deviation, i.name),
-                        )
 
 
 @PlanTaskRegistry.register
@@ -1445,8 +1581,9 @@ class ExportForecast(PlanTask):
 
 @PlanTaskRegistry.register
 class ExportOutlierCount(PlanTask):
+    # Runs after the plan is published, since it reads the exported problems
     description = "Export outlier count"
-    sequence = (401, "export2", 4)
+    sequence = 401.6
     export = True
 
     @classmethod
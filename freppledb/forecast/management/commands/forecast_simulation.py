@@ -24,11 +24,13 @@
 from datetime import datetime
 from dateutil.parser import parse
 import os
+from subprocess import Popen
+import sys
 
 from django.conf import settings
 from django.core import management
 from django.core.management.base import BaseCommand, CommandError
-from django.db import DEFAULT_DB_ALIAS
+from django.db import connections, DEFAULT_DB_ALIAS
 
 from freppledb import VERSION
 from freppledb.common.models import User, Parameter, BucketDetail
@@ -50,6 +52,14 @@ class Command(BaseCommand):
       No other calculation processes and user interface actions should be run
       during the simulation, as they would incorrectly use the manipulated
       current_date value.
+
+      The backtest mode is a lot faster. It loads the model only once, and
+      moves the current date in the planning engine instead. Every period
+      only the statistical forecast is recomputed in memory. The errors
+      per forecast and method are saved in the forecast_backtest table, and
+      the forecast data and current_date parameter are left untouched.
+      The periods can be split over multiple processes, each loading its
+      own copy of the model.
       """
 
     requires_system_checks = []
@@ -65,6 +75,18 @@ class Command(BaseCommand):
             default=12,
             help="Number of periods in the past to step back",
         )
+        parser.add_argument(
+            "--mode",
+            default="replan",
+            choices=["replan", "backtest"],
+            help="Run a complete forecast calculation for every period, or backtest all periods in memory",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of processes to split the periods over in backtest mode",
+        )
         parser.add_argument(
             "--database",
             default=DEFAULT_DB_ALIAS,
@@ -124,7 +146,12 @@ class Command(BaseCommand):
             history = int(options["history"])
             if history < 0:
                 raise ValueError("Invalid history: %s" % options["history"])
-            task.arguments = "--history=%d" % history
+            processes = int(options["processes"])
+            if processes < 1:
+                raise ValueError("Invalid processes: %s" % options["processes"])
+            task.arguments = "--history=%d --mode=%s" % (history, options["mode"])
+            if options["mode"] == "backtest":
+                task.arguments += " --processes=%d" % processes
 
             # Log task
             task.processid = os.getpid()
@@ -154,33 +181,37 @@ class Command(BaseCommand):
             bckt_list = bckt_list[-history:]
             if not bckt_list:
                 raise Exception("No calendar buckets found")
-            idx = 0
-            for bckt in bckt_list:
-                # Start message
-                task.status = "%.0f%%" % (100.0 * idx / history)
-                task.message = "Simulating period %s" % bckt.startdate.date()
-                task.save(using=database)
-                idx += 1
+            if options["mode"] == "backtest":
+                self.backtest(database, task, bckt_list, processes)
+            else:
+                idx = 0
+                for bckt in bckt_list:
+                    # Start message
+                    task.status = "%.0f%%" % (100.0 * idx / history)
+                    task.message = "Simulating period %s" % bckt.startdate.date()
+                    task.save(using=database)
+                    idx += 1
 
-                # Update currentdate parameter
-                param.value = bckt.startdate.date().strftime("%Y-%m-%d %H:%M:%S")
-                param.save(using=database)
+                    # Update currentdate parameter
+                    param.value = bckt.startdate.date().strftime("%Y-%m-%d %H:%M:%S")
+                    param.save(using=database)
 
-                # Run simulation
-                management.call_command(
-                    "runplan", database=database, env="fcst,nowebservice"
-                )
+                    # Run simulation
+                    management.call_command(
+                        "runplan", database=database, env="fcst,nowebservice"
+                    )
+
+                    # Uncomment the next line to stop the simulation here and check the
+                    # intermediate results in the database
+                    # input("finished %s" % bckt.startdate.date())
 
-                # Uncomment the next line to stop the simulation here and check the
-                # intermediate results in the database
-                # input("finished %s" % bckt.startdate.date())
+                task.message = "Simulated from %s till %s" % (
+                    bckt_list[0].startdate.date(),
+                    bckt_list[-1].startdate.date(),
+                )
 
             # Task update
             task.status = "Done"
-            task.message = "Simulated from %s till %s" % (
-                bckt_list[0].startdate.date(),
-                bckt_list[-1].startdate.date(),
-            )
             task.finished = datetime.now()
 
         except Exception as e:
@@ -202,3 +233,51 @@ class Command(BaseCommand):
             if task:
                 task.processid = None
                 task.save(using=database)
+
+    def backtest(self, database, task, bckt_list, processes):
+        with connections[database].cursor() as cursor:
+            cursor.execute("truncate table forecast_backtest")
+
+        # Distribute the periods evenly over the processes
+        processes = min(processes, len(bckt_list))
+        envs = [
+            "fcst_backtest=%s,nowebservice"
+            % ";".join(
+                b.startdate.strftime("%Y-%m-%d") for b in bckt_list[i::processes]
+            )
+            for i in range(processes)
+        ]
+        task.message = "Backtesting from %s till %s" % (
+            bckt_list[0].startdate.date(),
+            bckt_list[-1].startdate.date(),
+        )
+        task.save(using=database)
+        if processes == 1:
+            try:
+                management.call_command("runplan", database=database, env=envs[0])
+            finally:
+                # Runplan leaves the variable behind in this process
+                os.environ.pop("fcst_backtest", None)
+        else:
+            if os.path.isfile(os.path.join(settings.FREPPLE_APP, "frepplectl.py")):
+                # Development layout
+                cmd = [
+                    sys.executable,
+                    os.path.join(settings.FREPPLE_APP, "frepplectl.py"),
+                ]
+            else:
+                # Linux standard installation
+                cmd = ["frepplectl"]
+            workers = [
+                Popen(cmd + ["runplan", "--database=%s" % database, "--env=%s" % env])
+                for env in envs
+            ]
+            failed = sum(1 for w in workers if w.wait())
+            if failed:
+                raise Exception(
+                    "%d out of %d backtest processes failed" % (failed, processes)
+                )
+        task.message = "Backtested from %s till %s" % (
+            bckt_list[0].startdate.date(),
+            bckt_list[-1].startdate.date(),
+        )
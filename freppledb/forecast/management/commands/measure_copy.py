@@ -76,7 +76,7 @@ class Command(BaseCommand):
         parser.add_argument("destination", help="destination measure")
 
     def handle(self, **options):
-        from freppledb.forecast.models import Measure
+        from freppledb.forecast.models import ForecastPlan, Measure
 
         # Make sure the debug flag is not set!
         # When it is set, the django database wrapper collects a list of all sql
@@ -190,35 +190,69 @@ class Command(BaseCommand):
 
             cursor = connections[database].cursor()
 
+            # Standard measures are stored in a column of the forecastplan
+            # table, other measures in the value field.
+            if source in ForecastPlan.measure_columns:
+                source_exists = "%s is not null" % source
+                source_value = source
+                source_params = ()
+            else:
+                source_exists = "value ? %s"
+                source_value = "(value->>%%s)%s" % (
+                    "::numeric"
+                    if sourceMeasure.formatter in ("currency", "number")
+                    or destination in ForecastPlan.measure_columns
+                    else "",
+                )
+                source_params = (source,)
+
             # We need to make some cleansing first
             if destinationExists:
+                if destination in ForecastPlan.measure_columns:
+                    clear = "%s = null" % destination
+                    clear_params = ()
+                    destination_exists = "%s is not null" % destination
+                    destination_params = ()
+                else:
+                    clear = "value = value - %s"
+                    clear_params = (destination,)
+                    destination_exists = "value ? %s"
+                    destination_params = (destination,)
                 sql = """
-                      update forecastplan set value = value - %%s
-                      where value ? %%s and not value ? %%s
+                      update forecastplan set %s
+                      where %s and not %s
                       %s
                       %s
                 """ % (
+                    clear,
+                    destination_exists,
+                    source_exists,
                     ("and enddate >= '%s'" % (startdate,)) if startdate else "",
                     ("and startdate <= '%s'" % (enddate,)) if enddate else "",
                 )
-                cursor.execute(sql, (destination, destination, source))
+                cursor.execute(sql, clear_params + destination_params + source_params)
 
             # Make the copy
             # We want to capture the days specified in start and end dates
             # So we compare the startdate with forecastplan enddates and vice versa
+            if destination in ForecastPlan.measure_columns:
+                copy = "%s = %s" % (destination, source_value)
+                copy_params = source_params
+            else:
+                copy = "value = value || jsonb_build_object(%%s, %s)" % source_value
+                copy_params = (destination,) + source_params
             sql = """
-                update forecastplan set value = value || jsonb_build_object(%%s, (value->>%%s)%s)
-                where value ? %%s
+                update forecastplan set %s
+                where %s
                 %s
                 %s
                 """ % (
-                "::numeric"
-                if sourceMeasure.formatter in ("currency", "number")
-                else "",
+                copy,
+                source_exists,
                 ("and enddate >= '%s'" % (startdate,)) if startdate else "",
                 ("and startdate <= '%s'" % (enddate,)) if enddate else "",
             )
-            cursor.execute(sql, (destination, source, source))
+            cursor.execute(sql, copy_params + source_params)
             # Logging message
             task.processid = None
             task.status = "Done"
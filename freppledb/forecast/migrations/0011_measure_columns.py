@@ -0,0 +1,106 @@
+#
+# Copyright (C) 2023 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.db import migrations
+
+# Standard measures that are stored in a numeric column rather than in the
+# value field. This list must match ForecastPlan.measure_columns.
+measures = (
+    "orderstotal",
+    "ordersopen",
+    "ordersadjustment",
+    "forecastbaseline",
+    "forecastoverride",
+    "forecastnet",
+    "forecastconsumed",
+    "ordersplanned",
+    "forecastplanned",
+)
+
+
+class Migration(migrations.Migration):
+    dependencies = [("forecast", "0010_forecast_backtest")]
+
+    operations = [
+        # Adding a nullable column without default doesn't rewrite the table
+        migrations.RunSQL(
+            "alter table forecastplan %s"
+            % ", ".join("add column %s numeric" % m for m in measures),
+            "alter table forecastplan %s"
+            % ", ".join("drop column %s" % m for m in measures),
+        ),
+        # Move the measures out of the value field
+        migrations.RunSQL(
+            """
+            update forecastplan set %s,
+            value = value - array[%s]
+            where value ?| array[%s]
+            """
+            % (
+                ", ".join("%s = (value->>'%s')::numeric" % (m, m) for m in measures),
+                ", ".join("'%s'" % m for m in measures),
+                ", ".join("'%s'" % m for m in measures),
+            ),
+            """
+            update forecastplan
+            set value = value || jsonb_strip_nulls(jsonb_build_object(%s))
+            where %s
+            """
+            % (
+                ", ".join("'%s', %s" % (m, m) for m in measures),
+                " or ".join("%s is not null" % m for m in measures),
+            ),
+        ),
+        # Writers that still put a standard measure in the value field get it
+        # moved to its column
+        migrations.RunSQL(
+            """
+            create or replace function forecastplan_measures() returns trigger
+            language plpgsql as $$
+            begin
+              %s
+              new.value = new.value - array[%s];
+              return new;
+            end;
+            $$;
+
+            create trigger forecastplan_measures
+            before insert or update on forecastplan
+            for each row when (new.value ?| array[%s])
+            execute function forecastplan_measures();
+            """
+            % (
+                "\n              ".join(
+                    "new.%s = coalesce((new.value->>'%s')::numeric, new.%s);"
+                    % (m, m, m)
+                    for m in measures
+                ),
+                ", ".join("'%s'" % m for m in measures),
+                ", ".join("'%s'" % m for m in measures),
+            ),
+            """
+            drop trigger if exists forecastplan_measures on forecastplan;
+            drop function if exists forecastplan_measures
+            """,
+        ),
+    ]
@@ -25,8 +25,6 @@ from datetime import date, datetime
 from itertools import chain
 import json
 from logging import INFO, ERROR, WARNING, DEBUG
-from openpyxl.worksheet.cell_range import CellRange
-from openpyxl.worksheet.worksheet import Worksheet
 import os
 import random
 import requests
@@ -42,6 +40,7 @@ from django.utils.encoding import force_str
 from django.utils.translation import pgettext, gettext_lazy as _
 
 from freppledb.common.auth import getWebserviceAuthorization
+from freppledb.common.dataload import getAutoFilterBounds
 from freppledb.common.localization import parseLocalizedDateTime
 from freppledb.common.models import AuditModel, BucketDetail, Parameter
 from freppledb.input.models import Customer, Item, Location, Operation
@@ -307,11 +306,48 @@ class ForecastPlan(models.Model):
     # Model managers
     objects = models.Manager()  # The default model manager
 
+    # Standard measures stored in a numeric column of the forecastplan table.
+    # All other measures are stored in the value field. A database trigger moves
+    # standard measures written in the value field to their column.
+    # This list must match the columns created in the migrations.
+    measure_columns = (
+        "orderstotal",
+        "ordersopen",
+        "ordersadjustment",
+        "forecastbaseline",
+        "forecastoverride",
+        "forecastnet",
+        "forecastconsumed",
+        "ordersplanned",
+        "forecastplanned",
+    )
+
+    @classmethod
+    def measureSQL(cls, measure, table="forecastplan"):
+        """
+        Returns a SQL expression to read a measure from the forecastplan table.
+        """
+        if measure in cls.measure_columns:
+            return "%s.%s" % (table, measure)
+        else:
+            return "(%s.value->>'%s')::numeric" % (table, measure.replace("'", "''"))
+
+    @classmethod
+    def valueSQL(cls, table="forecastplan"):
+        """
+        Returns a SQL expression with a JSON object holding all measures
+        of a forecastplan record.
+        """
+        return "%s.value || jsonb_strip_nulls(jsonb_build_object(%s))" % (
+            table,
+            ", ".join("'%s', %s.%s" % (m, table, m) for m in cls.measure_columns),
+        )
+
     @classmethod
     def export_objects(cls, query, request):
         return query.extra(
             select={
-                m.name: "(value->>'%s')::numeric" % m.name
+                m.name: cls.measureSQL(m.name)
                 for m in chain(
                     Measure.standard_measures(), Measure.objects.using(request.database)
                 )
@@ -458,10 +494,7 @@ class ForecastPlan(models.Model):
             raise StopIteration
 
         # Detect excel autofilter data tables
-        if isinstance(data, Worksheet) and data.auto_filter.ref:
-            bounds = CellRange(data.auto_filter.ref).bounds
-        else:
-            bounds = None
+        bounds = getAutoFilterBounds(data)
         svcdata = []
 
         # keep a list of all forecast combinations visited
@@ -886,6 +919,42 @@ class ForecastPlan(models.Model):
             cursor.execute("REFRESH MATERIALIZED VIEW forecastreport_view")
 
 
+class ForecastBacktest(models.Model):
+    """
+    Forecast accuracy measured by the forecast_simulation command.
+
+    Every record accumulates the errors of a forecast over the simulated
+    periods in which the given method was selected. The fields store totals
+    rather than averages, so the results of parallel simulation processes
+    can simply be added up.
+    """
+
+    forecast = models.CharField(_("forecast"), max_length=300, db_index=True)
+    method = models.CharField(_("method"), max_length=20)
+    periods = models.IntegerField(_("periods"), default=0)
+    orders = models.DecimalField(
+        _("orders"), max_digits=20, decimal_places=8, default=0
+    )
+    error = models.DecimalField(_("error"), max_digits=20, decimal_places=8, default=0)
+    abserror = models.DecimalField(
+        _("absolute error"), max_digits=20, decimal_places=8, default=0
+    )
+    smape = models.DecimalField(
+        _("SMAPE error"), max_digits=20, decimal_places=8, default=0
+    )
+
+    class Meta:
+        db_table = "forecast_backtest"
+        verbose_name = "forecast backtest"
+        verbose_name_plural = "forecast backtests"
+        default_permissions = []
+        constraints = [
+            models.UniqueConstraint(
+                fields=["forecast", "method"], name="forecast_backtest_uidx"
+            )
+        ]
+
+
 class Measure(AuditModel):
     obfuscate = False
 
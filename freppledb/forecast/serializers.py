@@ -150,7 +150,7 @@ class ForecastPlanAPI(frePPleListCreateAPIView):
         forecastplan.customer_id,
         forecastplan.startdate,
         forecastplan.enddate,
-        forecastplan.value
+        %s as value
         FROM forecastplan
         inner join forecast on forecast.item_id = forecastplan.item_id
         and forecast.location_id = forecastplan.location_id
@@ -159,7 +159,10 @@ class ForecastPlanAPI(frePPleListCreateAPIView):
         where
         forecastplan.enddate > to_date('%s','YYYY-MM-DD HH24:MI:SS')
         """
-            % (parameter_currentdate.strftime("%Y-%m-%d %H:%M:%S"),)
+            % (
+                ForecastPlan.valueSQL(),
+                parameter_currentdate.strftime("%Y-%m-%d %H:%M:%S"),
+            )
         )
 
     serializer_class = ForecastPlanSerializer
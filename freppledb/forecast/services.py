@@ -65,6 +65,29 @@ class ForecastService(AsyncHttpConsumer):
             item=f.item.name, location=f.location.name, customer=f.customer.name
         ).update(method=f.methods)
 
+    @staticmethod
+    def getClusters(data):
+        """
+        Returns the planning clusters impacted by a message, or None when it
+        can impact the complete model.
+        Only updates of a single item and location at the lowest level of
+        the hierarchies stay within a single cluster.
+        """
+        if isinstance(data, list) or not data.get("item") or not data.get("location"):
+            return None
+        try:
+            item = frepple.item(name=data["item"], action="C")
+            location = frepple.location(name=data["location"], action="C")
+            if any(True for i in item.members) or any(True for i in location.members):
+                return None
+            return [
+                frepple.buffer(
+                    name="%s @ %s" % (item.name, location.name), action="C"
+                ).cluster
+            ]
+        except Exception:
+            return None
+
     @database_sync_to_async
     def replan(self, item, location):
         from freppledb.forecast.commands import ExportForecastMetrics
@@ -127,7 +150,11 @@ class ForecastService(AsyncHttpConsumer):
             raise Exception("Invalid comment type")
 
     async def handle(self, body):
-        async with lock:
+        try:
+            clusters = self.getClusters(json.loads(body.decode("utf-8")))
+        except Exception:
+            clusters = None
+        async with lock.clusters(clusters):
             errors = []
             try:
                 if self.scope["method"] != "POST":
@@ -452,13 +479,16 @@ class FlushService(AsyncHttpConsumer):
                     headers=self.scope["response_headers"],
                 )
                 return
+            # The cache calls below are synchronous, so requests on other
+            # clusters can't interleave with them. Locking no cluster only
+            # waits for the services that lock the complete model.
             if self.scope["path"] == "/flush/manual/":
-                async with lock:
+                async with lock.clusters(()):
                     frepple.cache.write_immediately = False
                     if settings.CACHE_MAXIMUM > 300:
                         frepple.cache.maximum = settings.CACHE_MAXIMUM
             elif self.scope["path"] == "/flush/auto/":
-                async with lock:
+                async with lock.clusters(()):
                     frepple.cache.flush()
                     frepple.cache.write_immediately = True
                     if frepple.cache.maximum > 300:
@@ -23,9 +23,12 @@
 
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+import logging
 import os
 from rest_framework.test import APIClient, APITransactionTestCase, APIRequestFactory
+from time import perf_counter
 import unittest
+from unittest import mock
 
 from django.conf import settings
 from django.core import management
@@ -38,7 +41,9 @@ from freppledb.common.tests import checkResponse
 from freppledb.input.models import Item, Location, Customer
 
 if "freppledb.forecast" in settings.INSTALLED_APPS:
-    from freppledb.forecast.models import Forecast, ForecastPlan
+    from freppledb.forecast.models import Forecast, ForecastPlan, Measure
+
+logger = logging.getLogger(__name__)
 
 
 @unittest.skipUnless(
@@ -566,6 +571,96 @@ class ReportTest(TransactionTestCase):
         )
         checkResponse(self, response)
 
+    def testMeasureColumns(self):
+        # All stored standard measures have a column
+        self.assertEqual(
+            set(ForecastPlan.measure_columns),
+            {m.name for m in Measure.standard_measures() if not m.computed},
+        )
+
+        # The planning engine writes the standard measures in their column
+        management.call_command("runplan", env="fcst")
+        with connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                "select count(*) from forecastplan where value ?| %s",
+                (list(ForecastPlan.measure_columns),),
+            )
+            self.assertEqual(cursor.fetchone()[0], 0)
+            cursor.execute(
+                "select count(*) from forecastplan where forecastnet is not null"
+            )
+            self.assertGreater(cursor.fetchone()[0], 0)
+
+    @unittest.skipUnless(
+        "FREPPLE_BENCHMARK" in os.environ, "Benchmarks run on request only"
+    )
+    def testMeasureColumnsBenchmark(self):
+        # Compares the forecast editor trees reading the standard measures from
+        # their column and from the value field, on a forecastplan table with
+        # a long history
+        management.call_command("runplan", env="fcst")
+        trees = (
+            "/forecast/itemtree/",
+            "/forecast/locationtree/",
+            "/forecast/customertree/",
+        )
+        results = {}
+        with transaction.atomic(), connections[DEFAULT_DB_ALIAS].cursor() as cursor:
+            cursor.execute(
+                """
+                insert into forecastplan
+                  (item_id, location_id, customer_id, startdate, enddate,
+                  orderstotal, forecastbaseline, value)
+                select item_id, location_id, customer_id, d, d + interval '1 day',
+                  1, 1, '{}'::jsonb
+                from forecast
+                cross join generate_series(
+                  '2000-01-01'::timestamp, '2019-12-31'::timestamp, interval '1 day'
+                  ) d
+                on conflict do nothing
+                """
+            )
+            cursor.execute("analyze forecastplan")
+            for layout in ("columns", "json"):
+                if layout == "json":
+                    # Move the standard measures back into the value field
+                    cursor.execute(
+                        "alter table forecastplan disable trigger forecastplan_measures"
+                    )
+                    cursor.execute(
+                        "update forecastplan set value = %s, %s"
+                        % (
+                            ForecastPlan.valueSQL(),
+                            ", ".join(
+                                "%s = null" % m for m in ForecastPlan.measure_columns
+                            ),
+                        )
+                    )
+                    cursor.execute("analyze forecastplan")
+                with mock.patch.object(
+                    ForecastPlan,
+                    "measure_columns",
+                    ForecastPlan.measure_columns if layout == "columns" else (),
+                ):
+                    for url in trees:
+                        for measure in ("orderstotal", "forecastbaseline"):
+                            start = perf_counter()
+                            response = self.client.get(
+                                url, {"units": "unit", "measure": measure}
+                            )
+                            checkResponse(self, response)
+                            logger.info(
+                                "Forecast editor %s %s from %s: %.3fs"
+                                % (url, measure, layout, perf_counter() - start)
+                            )
+                            # The storage layout doesn't change the result
+                            self.assertEqual(
+                                results.setdefault((url, measure), response.content),
+                                response.content,
+                            )
+            # Undo the test data
+            transaction.set_rollback(True)
+
 
 @unittest.skipUnless(
     "freppledb.forecast" in settings.INSTALLED_APPS, "App not activated"
@@ -603,7 +698,7 @@ class ForecastSimulation(TransactionTestCase):
             select
               startdate,
               greatest(coalesce((value->>'forecasttotal')::numeric,0),0) fcst,
-              greatest(coalesce((value->>'orderstotal')::numeric,0) + coalesce((value->>'ordersadjustment')::numeric,0),0) orders
+              greatest(coalesce(orderstotal,0) + coalesce(ordersadjustment,0),0) orders
             from forecastplan
             inner join forecast
               on forecastplan.item_id = forecast.item_id
@@ -630,3 +725,19 @@ class ForecastSimulation(TransactionTestCase):
         self.assertAlmostEqual(
             first=errorSum, second=Decimal(405.74), delta=Decimal(5.0)
         )
+
+    def test_forecast_backtest(self):
+        management.call_command("createbuckets")
+        management.call_command("runplan", env="fcst")
+        management.call_command("forecast_simulation", mode="backtest", processes=2)
+        cursor = connections[DEFAULT_DB_ALIAS].cursor()
+        cursor.execute(
+            "select count(*), sum(periods), sum(smape) / sum(periods) from forecast_backtest"
+        )
+        records, periods, smape = cursor.fetchone()
+        self.assertGreater(records, 0)
+        self.assertGreater(periods, 0)
+        self.assertTrue(0 <= smape <= 200)
+        # The current date is left untouched
+        cursor.execute("select value from common_parameter where name = 'currentdate'")
+        self.assertEqual(cursor.fetchone()[0], self.now.strftime("%Y-%m-%d %H:%M:%S"))
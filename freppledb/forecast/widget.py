@@ -274,10 +274,10 @@ class ForecastWidget(Widget):
               round(sum(greatest((value->>'ordersopenvalue')::numeric,0))) as ordersopenvalue,
               round(sum(greatest((value->>'forecasttotal')::numeric,0))) as fcst,
               round(sum(greatest(0,
-                (value->>'orderstotal')::numeric +
-                coalesce((value->>'ordersadjustment')::numeric,0)
+                orderstotal +
+                coalesce(ordersadjustment,0)
                 ))) as orderstotal,
-              round(sum(greatest((value->>'ordersopen')::numeric,0))) as ordersopen
+              round(sum(greatest(ordersopen,0))) as ordersopen
             from common_bucketdetail
             left outer join forecastplan
               on item_id = (select name from item where item.lvl = 0 limit 1)
@@ -440,7 +440,7 @@ class ForecastAccuracyWidget(Widget):
               select
                 startdate,
                 greatest((value->>'forecasttotal')::numeric,0) fcst,
-                greatest((value->>'orderstotal')::numeric + coalesce((value->>'ordersadjustment')::numeric,0),0) orders
+                greatest(orderstotal + coalesce(ordersadjustment,0),0) orders
               from forecastplan
               inner join forecast
                 on forecastplan.item_id = forecast.item_id
@@ -23,8 +23,9 @@
 import os
 import logging
 import uuid
+from itertools import chain
 from time import time
-from datetime import datetime, date, timedelta
+from datetime import datetime, timedelta
 from dateutil.parser import parse
 
 from django.conf import settings
@@ -68,6 +69,13 @@ class LoadTask(PlanTask):
     - low weight by default, ie fast execution assumed
     - filter attribute to load only a subset of the data
     - subclass is used by the odoo connector to recognize data loading tasks
+
+    Tasks that implement the fetch and apply methods rather than the run
+    method have their database queries executed in parallel when the
+    LOAD_THREADS setting (or the loadthreads environment variable) is
+    bigger than 1. The dependencies attribute lists the tasks that need to
+    be applied before. Tasks with a big fetchVolume are applied as soon as
+    their dependencies are, and they need to declare all of them.
     """
 
     @staticmethod
@@ -401,9 +409,7 @@ class loadLocations(LoadTask):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -411,9 +417,6 @@ class loadLocations(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
-
                 attrs = [f[0] for f in getAttributes(Location)]
                 if attrs:
                     attrsql = ", %s" % ", ".join(attrs)
@@ -428,30 +431,36 @@ class loadLocations(LoadTask):
                     """
                     % (attrsql, filter_where)
                 )
+                yield from cursor
 
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        x = frepple.location(
-                            name=i[0],
-                            description=i[1],
-                            category=i[4],
-                            subcategory=i[5],
-                            source=i[6],
-                        )
-                        if i[2]:
-                            x.owner = frepple.location(name=i[2])
-                        if i[3]:
-                            x.available = frepple.calendar(name=i[3])
-                        idx = 7
-                        for a in attrs:
-                            setattr(x, a, i[idx])
-                            idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d locations in %.2f seconds" % (cnt, time() - starttime)
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        attrs = [f[0] for f in getAttributes(Location)]
+        for i in rows:
+            cnt += 1
+            try:
+                x = frepple.location(
+                    name=i[0],
+                    description=i[1],
+                    category=i[4],
+                    subcategory=i[5],
+                    source=i[6],
                 )
+                if i[2]:
+                    x.owner = frepple.location(name=i[2])
+                if i[3]:
+                    x.available = frepple.calendar(name=i[3])
+                idx = 7
+                for a in attrs:
+                    setattr(x, a, i[idx])
+                    idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d locations in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
@@ -464,9 +473,7 @@ class loadCalendars(LoadTask):
         return 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -474,8 +481,6 @@ class loadCalendars(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 if kwargs.get("skipLoad", False):
                     cursor.execute(
                         """
@@ -499,32 +504,35 @@ class loadCalendars(LoadTask):
                         """
                         % filter_where
                     )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        frepple.calendar(
-                            name=i[0], default=i[1], source=i[2], hidden=i[3]
-                        )
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d calendars in %.2f seconds" % (cnt, time() - starttime)
-                )
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                frepple.calendar(name=i[0], default=i[1], source=i[2], hidden=i[3])
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d calendars in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
 class loadCalendarBuckets(LoadTask):
     description = "Importing calendar buckets"
     sequence = 93
+    dependencies = (loadCalendars,)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -532,8 +540,6 @@ class loadCalendarBuckets(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 if kwargs.get("skipLoad", False):
                     cursor.execute(
                         """
@@ -563,53 +569,56 @@ class loadCalendarBuckets(LoadTask):
                         """
                         % filter_where
                     )
-                prevcal = None
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        days = 0
-                        if i[5]:
-                            days += 1
-                        if i[6]:
-                            days += 2
-                        if i[7]:
-                            days += 4
-                        if i[8]:
-                            days += 8
-                        if i[9]:
-                            days += 16
-                        if i[10]:
-                            days += 32
-                        if i[11]:
-                            days += 64
-                        if i[0] != prevcal:
-                            cal = frepple.calendar(name=i[0])
-                            prevcal = i[0]
-                        b = frepple.bucket(
-                            calendar=cal,
-                            start=i[1],
-                            end=i[2] if i[2] else datetime(2030, 12, 31),
-                            priority=i[3],
-                            source=i[14],
-                            value=i[4],
-                            days=days,
-                        )
-                        if i[12]:
-                            b.starttime = (
-                                i[12].hour * 3600 + i[12].minute * 60 + i[12].second
-                            )
-                        if i[13]:
-                            b.endtime = (
-                                i[13].hour * 3600 + i[13].minute * 60 + i[13].second + 1
-                            )
-                        if i[15]:
-                            b.name = i[15]
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d calendar buckets in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        prevcal = None
+        for i in rows:
+            cnt += 1
+            try:
+                days = 0
+                if i[5]:
+                    days += 1
+                if i[6]:
+                    days += 2
+                if i[7]:
+                    days += 4
+                if i[8]:
+                    days += 8
+                if i[9]:
+                    days += 16
+                if i[10]:
+                    days += 32
+                if i[11]:
+                    days += 64
+                if i[0] != prevcal:
+                    cal = frepple.calendar(name=i[0])
+                    prevcal = i[0]
+                b = frepple.bucket(
+                    calendar=cal,
+                    start=i[1],
+                    end=i[2] if i[2] else datetime(2030, 12, 31),
+                    priority=i[3],
+                    source=i[14],
+                    value=i[4],
+                    days=days,
                 )
+                if i[12]:
+                    b.starttime = i[12].hour * 3600 + i[12].minute * 60 + i[12].second
+                if i[13]:
+                    b.endtime = i[13].hour * 3600 + i[13].minute * 60 + i[13].second + 1
+                if i[15]:
+                    b.name = i[15]
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d calendar buckets in %.2f seconds" % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
@@ -622,9 +631,7 @@ class loadCustomers(LoadTask):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -632,8 +639,6 @@ class loadCustomers(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 SELECT
@@ -642,38 +647,43 @@ class loadCustomers(LoadTask):
                 """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        x = frepple.customer(
-                            name=i[0],
-                            description=i[1],
-                            category=i[3],
-                            subcategory=i[4],
-                            source=i[5],
-                        )
-                        if i[2]:
-                            x.owner = frepple.customer(name=i[2])
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d customers in %.2f seconds" % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                x = frepple.customer(
+                    name=i[0],
+                    description=i[1],
+                    category=i[3],
+                    subcategory=i[4],
+                    source=i[5],
                 )
+                if i[2]:
+                    x.owner = frepple.customer(name=i[2])
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d customers in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
 class loadSuppliers(LoadTask):
     description = "Importing suppliers"
     sequence = 95
+    dependencies = (loadLocations, loadCalendars)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -681,8 +691,6 @@ class loadSuppliers(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 SELECT
@@ -691,33 +699,44 @@ class loadSuppliers(LoadTask):
                 """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        x = frepple.supplier(
-                            name=i[0],
-                            description=i[1],
-                            category=i[3],
-                            subcategory=i[4],
-                            source=i[5],
-                        )
-                        if i[2]:
-                            x.owner = frepple.supplier(name=i[2])
-                        if i[6]:
-                            frepple.location(name=i[0]).available = frepple.calendar(
-                                name=i[6]
-                            )
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d suppliers in %.2f seconds" % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                x = frepple.supplier(
+                    name=i[0],
+                    description=i[1],
+                    category=i[3],
+                    subcategory=i[4],
+                    source=i[5],
                 )
+                if i[2]:
+                    x.owner = frepple.supplier(name=i[2])
+                if i[6]:
+                    frepple.location(name=i[0]).available = frepple.calendar(name=i[6])
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d suppliers in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
-class loadOperations(LoadTask):
-    description = "Importing operations"
-    sequence = 96
+class prepareOperations(LoadTask):
+    """
+    Populates the item field of the operations before they are loaded.
+
+    This runs on the main connection before the load tasks start fetching
+    data in parallel, since their fetch methods only read.
+    """
+
+    description = "Preparing operations"
+    sequence = 90.75
 
     @classmethod
     def getWeight(cls, **kwargs):
@@ -725,23 +744,7 @@ class loadOperations(LoadTask):
 
     @classmethod
     def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
-        if cls.filter:
-            filter_where = "where %s " % cls.filter
-        else:
-            filter_where = ""
-
-        attrs = [f[0] for f in getAttributes(Operation)]
-        if attrs:
-            attrsql = ", %s" % ", ".join(attrs)
-        else:
-            attrsql = ""
-
         with connections[database].cursor() as cursor:
-            cnt = 0
-            starttime = time()
-
             # Preprocessing step
             # Make sure any routing has the produced item of its last step populated in the operation table
             # Old style
@@ -839,6 +842,30 @@ class loadOperations(LoadTask):
                 """
             )
 
+
+@PlanTaskRegistry.register
+class loadOperations(LoadTask):
+    description = "Importing operations"
+    sequence = 96
+    dependencies = (loadLocations, loadCalendars)
+
+    @classmethod
+    def getWeight(cls, **kwargs):
+        return -1 if kwargs.get("skipLoad", False) else 1
+
+    @classmethod
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        if cls.filter:
+            filter_where = "where %s " % cls.filter
+        else:
+            filter_where = ""
+
+        attrs = [f[0] for f in getAttributes(Operation)]
+        if attrs:
+            attrsql = ", %s" % ", ".join(attrs)
+        else:
+            attrsql = ""
+
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
                 cursor.execute(
@@ -854,122 +881,126 @@ class loadOperations(LoadTask):
                     """
                     % (attrsql, filter_where)
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        if not i[6] or i[6] == "fixed_time":
-                            x = frepple.operation_fixed_time(
-                                name=i[0],
-                                description=i[12],
-                                category=i[13],
-                                subcategory=i[14],
-                                source=i[15],
-                            )
-                            if i[7]:
-                                # Convert to second to support microseconds
-                                x.duration = i[7].total_seconds()
-                        elif i[6] == "time_per":
-                            x = frepple.operation_time_per(
-                                name=i[0],
-                                description=i[12],
-                                category=i[13],
-                                subcategory=i[14],
-                                source=i[15],
-                            )
-                            if i[7]:
-                                # Convert to second to support microseconds
-                                x.duration = i[7].total_seconds()
-                            if i[8]:
-                                # Convert to second to support microseconds
-                                x.duration_per = i[8].total_seconds()
-                        elif i[6] == "alternate":
-                            x = frepple.operation_alternate(
-                                name=i[0],
-                                description=i[12],
-                                category=i[13],
-                                subcategory=i[14],
-                                source=i[15],
-                            )
-                        elif i[6] == "split":
-                            x = frepple.operation_split(
-                                name=i[0],
-                                description=i[12],
-                                category=i[13],
-                                subcategory=i[14],
-                                source=i[15],
-                            )
-                        elif i[6] == "routing":
-                            x = frepple.operation_routing(
-                                name=i[0],
-                                description=i[12],
-                                category=i[13],
-                                subcategory=i[14],
-                                source=i[15],
-                                # Uncomment the next line if you want to treat post-operation times
-                                # between routing steps as a hard constraint.
-                                # By default they are a soft constraint only, meaning that we can
-                                # compress them to deliver sales orders faster.
-                                # hard_posttime=True,
-                            )
-                        else:
-                            raise ValueError(
-                                "Operation type '%s' not recognized" % i[6]
-                            )
-                        if i[1]:
-                            x.fence = i[1]
-                        if i[2]:
-                            x.posttime = i[2]
-                        if i[3] is not None:
-                            x.size_minimum = i[3]
-                        if i[4]:
-                            x.size_multiple = i[4]
-                        if i[5]:
-                            x.size_maximum = i[5]
-                        if i[9]:
-                            x.location = frepple.location(name=i[9])
-                        if i[10]:
-                            x.cost = i[10]
-                        if i[11]:
-                            x.search = i[11]
-                        if i[16]:
-                            if i[21] == "make to order":
-                                x.item = frepple.item_mto(name=i[16])
-                            else:
-                                x.item = frepple.item_mts(name=i[16])
-                        if i[17] is not None:
-                            x.priority = i[17]
-                        if i[18] and i[18] > datetime(1971, 1, 3):
-                            x.effective_start = i[18]
-                        if i[19] and i[19] < datetime(2030, 12, 29):
-                            x.effective_end = i[19]
-                        if i[20]:
-                            x.available = frepple.calendar(name=i[20])
-                        if i[13] == "subcontractor":
-                            x.nolocationcalendar = True
-                        idx = 22
-                        for a in attrs:
-                            setattr(x, a, i[idx])
-                            idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d operations in %.2f seconds" % (cnt, time() - starttime)
-                )
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        attrs = [f[0] for f in getAttributes(Operation)]
+        for i in rows:
+            cnt += 1
+            try:
+                if not i[6] or i[6] == "fixed_time":
+                    x = frepple.operation_fixed_time(
+                        name=i[0],
+                        description=i[12],
+                        category=i[13],
+                        subcategory=i[14],
+                        source=i[15],
+                    )
+                    if i[7]:
+                        # Convert to second to support microseconds
+                        x.duration = i[7].total_seconds()
+                elif i[6] == "time_per":
+                    x = frepple.operation_time_per(
+                        name=i[0],
+                        description=i[12],
+                        category=i[13],
+                        subcategory=i[14],
+                        source=i[15],
+                    )
+                    if i[7]:
+                        # Convert to second to support microseconds
+                        x.duration = i[7].total_seconds()
+                    if i[8]:
+                        # Convert to second to support microseconds
+                        x.duration_per = i[8].total_seconds()
+                elif i[6] == "alternate":
+                    x = frepple.operation_alternate(
+                        name=i[0],
+                        description=i[12],
+                        category=i[13],
+                        subcategory=i[14],
+                        source=i[15],
+                    )
+                elif i[6] == "split":
+                    x = frepple.operation_split(
+                        name=i[0],
+                        description=i[12],
+                        category=i[13],
+                        subcategory=i[14],
+                        source=i[15],
+                    )
+                elif i[6] == "routing":
+                    x = frepple.operation_routing(
+                        name=i[0],
+                        description=i[12],
+                        category=i[13],
+                        subcategory=i[14],
+                        source=i[15],
+                        # Uncomment the next line if you want to treat post-operation times
+                        # between routing steps as a hard constraint.
+                        # By default they are a soft constraint only, meaning that we can
+                        # compress them to deliver sales orders faster.
+                        # hard_posttime=True,
+                    )
+                else:
+                    raise ValueError("Operation type '%s' not recognized" % i[6])
+                if i[1]:
+                    x.fence = i[1]
+                if i[2]:
+                    x.posttime = i[2]
+                if i[3] is not None:
+                    x.size_minimum = i[3]
+                if i[4]:
+                    x.size_multiple = i[4]
+                if i[5]:
+                    x.size_maximum = i[5]
+                if i[9]:
+                    x.location = frepple.location(name=i[9])
+                if i[10]:
+                    x.cost = i[10]
+                if i[11]:
+                    x.search = i[11]
+                if i[16]:
+                    if i[21] == "make to order":
+                        x.item = frepple.item_mto(name=i[16])
+                    else:
+                        x.item = frepple.item_mts(name=i[16])
+                if i[17] is not None:
+                    x.priority = i[17]
+                if i[18] and i[18] > datetime(1971, 1, 3):
+                    x.effective_start = i[18]
+                if i[19] and i[19] < datetime(2030, 12, 29):
+                    x.effective_end = i[19]
+                if i[20]:
+                    x.available = frepple.calendar(name=i[20])
+                if i[13] == "subcontractor":
+                    x.nolocationcalendar = True
+                idx = 22
+                for a in attrs:
+                    setattr(x, a, i[idx])
+                    idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d operations in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
 class loadSuboperations(LoadTask):
     description = "Importing suboperations"
     sequence = 97
+    dependencies = (loadOperations,)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_and = "and %s " % cls.filter
         else:
@@ -977,8 +1008,6 @@ class loadSuboperations(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 select
@@ -1002,43 +1031,49 @@ class loadSuboperations(LoadTask):
                 """
                     % (filter_and, filter_and)
                 )
-                curopername = None
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        if i[0] != curopername:
-                            curopername = i[0]
-                            curoper = frepple.operation(name=curopername)
-                        sub = frepple.suboperation(
-                            owner=curoper,
-                            operation=frepple.operation(name=i[1]),
-                            priority=i[2],
-                        )
-                        if i[3] and i[3] > datetime(1971, 1, 3):
-                            sub.effective_start = i[3]
-                        if i[4] and i[4] < datetime(2030, 12, 29):
-                            sub.effective_end = i[4]
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d suboperations in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        curopername = None
+        for i in rows:
+            cnt += 1
+            try:
+                if i[0] != curopername:
+                    curopername = i[0]
+                    curoper = frepple.operation(name=curopername)
+                sub = frepple.suboperation(
+                    owner=curoper,
+                    operation=frepple.operation(name=i[1]),
+                    priority=i[2],
                 )
+                if i[3] and i[3] > datetime(1971, 1, 3):
+                    sub.effective_start = i[3]
+                if i[4] and i[4] < datetime(2030, 12, 29):
+                    sub.effective_end = i[4]
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d suboperations in %.2f seconds" % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
 class loadOperationDependencies(LoadTask):
     description = "Importing operation dependencies"
     sequence = 97.5
+    dependencies = (loadOperations,)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1046,8 +1081,6 @@ class loadOperationDependencies(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                     select
@@ -1058,25 +1091,33 @@ class loadOperationDependencies(LoadTask):
                     """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        op1 = frepple.operation(name=i[0], action="C")
-                        op2 = frepple.operation(name=i[1], action="C")
-                        if op1 and op2:
-                            frepple.operationdependency(
-                                operation=op1,
-                                blockedby=op2,
-                                quantity=i[2] if i[2] is not None else 1,
-                                safety_leadtime=i[3] or 0,
-                                hard_safety_leadtime=i[4] or 0,
-                            )
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d operation dependencies in %.2f seconds"
-                    % (cnt, time() - starttime)
-                )
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                op1 = frepple.operation(name=i[0], action="C")
+                op2 = frepple.operation(name=i[1], action="C")
+                if op1 and op2:
+                    frepple.operationdependency(
+                        operation=op1,
+                        blockedby=op2,
+                        quantity=i[2] if i[2] is not None else 1,
+                        safety_leadtime=i[3] or 0,
+                        hard_safety_leadtime=i[4] or 0,
+                    )
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d operation dependencies in %.2f seconds"
+            % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
@@ -1089,9 +1130,7 @@ class loadItems(LoadTask):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1099,8 +1138,6 @@ class loadItems(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 attrs = [f[0] for f in getAttributes(Item)]
                 if attrs:
                     attrsql = ", %s" % ", ".join(attrs)
@@ -1116,56 +1153,62 @@ class loadItems(LoadTask):
                 """
                     % (attrsql, filter_where)
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        if i[7] == "make to order":
-                            x = frepple.item_mto(
-                                name=i[0],
-                                description=i[1],
-                                category=i[4],
-                                subcategory=i[5],
-                                source=i[6],
-                            )
-                        else:
-                            x = frepple.item_mts(
-                                name=i[0],
-                                description=i[1],
-                                category=i[4],
-                                subcategory=i[5],
-                                source=i[6],
-                            )
-                        if i[2]:
-                            if i[8] == "make to order":
-                                x.owner = frepple.item_mto(name=i[2])
-                            else:
-                                x.owner = frepple.item_mts(name=i[2])
-                        if i[3]:
-                            x.cost = i[3]
-                        idx = 9
-                        for a in attrs:
-                            setattr(x, a, i[idx])
-                            idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d items in %.2f seconds" % (cnt, time() - starttime)
-                )
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        attrs = [f[0] for f in getAttributes(Item)]
+        for i in rows:
+            cnt += 1
+            try:
+                if i[7] == "make to order":
+                    x = frepple.item_mto(
+                        name=i[0],
+                        description=i[1],
+                        category=i[4],
+                        subcategory=i[5],
+                        source=i[6],
+                    )
+                else:
+                    x = frepple.item_mts(
+                        name=i[0],
+                        description=i[1],
+                        category=i[4],
+                        subcategory=i[5],
+                        source=i[6],
+                    )
+                if i[2]:
+                    if i[8] == "make to order":
+                        x.owner = frepple.item_mto(name=i[2])
+                    else:
+                        x.owner = frepple.item_mts(name=i[2])
+                if i[3]:
+                    x.cost = i[3]
+                idx = 9
+                for a in attrs:
+                    setattr(x, a, i[idx])
+                    idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d items in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
 class loadItemSuppliers(LoadTask):
     description = "Importing item suppliers"
     sequence = 99
+    dependencies = (loadLocations, loadSuppliers, loadItems)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1173,8 +1216,6 @@ class loadItemSuppliers(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                     SELECT
@@ -1187,67 +1228,73 @@ class loadItemSuppliers(LoadTask):
                     """
                     % filter_where
                 )
-                cursuppliername = None
-                curitemname = None
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        if i[0] != cursuppliername:
-                            cursuppliername = i[0]
-                            cursupplier = frepple.supplier(name=cursuppliername)
-                        if i[1] != curitemname:
-                            curitemname = i[1]
-                            curitem = frepple.item(name=curitemname)
-                        curitemsupplier = frepple.itemsupplier(
-                            supplier=cursupplier,
-                            item=curitem,
-                            source=i[9],
-                            leadtime=i[11] if i[11] else 0,
-                            fence=i[14] if i[14] else 0,
-                            resource_qty=i[13],
-                            batchwindow=i[15] if i[15] is not None else 7 * 86400,
-                            extra_safety_leadtime=i[16] if i[16] else 0,
-                            hard_safety_leadtime=i[17] if i[17] else 0,
-                        )
-                        if i[2]:
-                            curitemsupplier.location = frepple.location(name=i[2])
-                        if i[3] is not None:
-                            curitemsupplier.size_minimum = i[3]
-                        if i[4] is not None:
-                            curitemsupplier.size_multiple = i[4]
-                        if i[5]:
-                            curitemsupplier.size_maximum = i[5]
-                        if i[6]:
-                            curitemsupplier.cost = i[6]
-                        if i[7] is not None:
-                            curitemsupplier.priority = i[7]
-                        if i[8] and i[8] > datetime(1971, 1, 3):
-                            curitemsupplier.effective_start = i[8]
-                        if i[9] and i[9] < datetime(2030, 12, 29):
-                            curitemsupplier.effective_end = i[9]
-                        if i[12]:
-                            curitemsupplier.resource = frepple.resource(name=i[12])
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d item suppliers in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        cursuppliername = None
+        curitemname = None
+        for i in rows:
+            cnt += 1
+            try:
+                if i[0] != cursuppliername:
+                    cursuppliername = i[0]
+                    cursupplier = frepple.supplier(name=cursuppliername)
+                if i[1] != curitemname:
+                    curitemname = i[1]
+                    curitem = frepple.item(name=curitemname)
+                curitemsupplier = frepple.itemsupplier(
+                    supplier=cursupplier,
+                    item=curitem,
+                    source=i[9],
+                    leadtime=i[11] if i[11] else 0,
+                    fence=i[14] if i[14] else 0,
+                    resource_qty=i[13],
+                    batchwindow=i[15] if i[15] is not None else 7 * 86400,
+                    extra_safety_leadtime=i[16] if i[16] else 0,
+                    hard_safety_leadtime=i[17] if i[17] else 0,
                 )
+                if i[2]:
+                    curitemsupplier.location = frepple.location(name=i[2])
+                if i[3] is not None:
+                    curitemsupplier.size_minimum = i[3]
+                if i[4] is not None:
+                    curitemsupplier.size_multiple = i[4]
+                if i[5]:
+                    curitemsupplier.size_maximum = i[5]
+                if i[6]:
+                    curitemsupplier.cost = i[6]
+                if i[7] is not None:
+                    curitemsupplier.priority = i[7]
+                if i[8] and i[8] > datetime(1971, 1, 3):
+                    curitemsupplier.effective_start = i[8]
+                if i[9] and i[9] < datetime(2030, 12, 29):
+                    curitemsupplier.effective_end = i[9]
+                if i[12]:
+                    curitemsupplier.resource = frepple.resource(name=i[12])
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d item suppliers in %.2f seconds" % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
 class loadItemDistributions(LoadTask):
     description = "Importing item distributions"
     sequence = 100
+    dependencies = (loadLocations, loadItems)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1255,8 +1302,6 @@ class loadItemDistributions(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 SELECT
@@ -1268,77 +1313,79 @@ class loadItemDistributions(LoadTask):
                 """
                     % filter_where
                 )
-                curoriginname = None
-                curitemname = None
-                for i in cursor:
-                    if not i[0] or not i[2]:
-                        logger.error(
-                            "Origin and location must be defined, skipping one record"
-                        )
-                        continue
-                    if i[0] == i[2]:
-                        logger.error(
-                            "Origin and location must be different, skipping one record"
-                        )
-                        continue
-                    cnt += 1
-                    try:
-                        if i[0] != curoriginname:
-                            curoriginname = i[0]
-                            curorigin = frepple.location(name=curoriginname)
-                        if i[1] != curitemname:
-                            curitemname = i[1]
-                            curitem = frepple.item(name=curitemname)
-                        curitemdistribution = frepple.itemdistribution(
-                            origin=curorigin,
-                            item=curitem,
-                            source=i[10],
-                            leadtime=i[11] if i[11] else 0,
-                            fence=i[14] if i[14] else 0,
-                            resource_qty=i[13],
-                            batchwindow=i[15] if i[15] is not None else 7 * 86400,
-                        )
-                        if i[2]:
-                            curitemdistribution.destination = frepple.location(
-                                name=i[2]
-                            )
-                        if i[3] is not None:
-                            curitemdistribution.size_minimum = i[3]
-                        if i[4] is not None:
-                            curitemdistribution.size_multiple = i[4]
-                        if i[5]:
-                            curitemdistribution.size_maximum = i[5]
-                        if i[6]:
-                            curitemdistribution.cost = i[6]
-                        if i[7] is not None:
-                            curitemdistribution.priority = i[7]
-                        if i[8] and i[8] > datetime(1971, 1, 3):
-                            curitemdistribution.effective_start = i[8]
-                        if i[9] and i[9] < datetime(2030, 12, 29):
-                            curitemdistribution.effective_end = i[9]
-                        if i[12]:
-                            curitemdistribution.resource = frepple.resource(name=i[12])
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d item distributions in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        curoriginname = None
+        curitemname = None
+        for i in rows:
+            if not i[0] or not i[2]:
+                logger.error("Origin and location must be defined, skipping one record")
+                continue
+            if i[0] == i[2]:
+                logger.error(
+                    "Origin and location must be different, skipping one record"
+                )
+                continue
+            cnt += 1
+            try:
+                if i[0] != curoriginname:
+                    curoriginname = i[0]
+                    curorigin = frepple.location(name=curoriginname)
+                if i[1] != curitemname:
+                    curitemname = i[1]
+                    curitem = frepple.item(name=curitemname)
+                curitemdistribution = frepple.itemdistribution(
+                    origin=curorigin,
+                    item=curitem,
+                    source=i[10],
+                    leadtime=i[11] if i[11] else 0,
+                    fence=i[14] if i[14] else 0,
+                    resource_qty=i[13],
+                    batchwindow=i[15] if i[15] is not None else 7 * 86400,
                 )
+                if i[2]:
+                    curitemdistribution.destination = frepple.location(name=i[2])
+                if i[3] is not None:
+                    curitemdistribution.size_minimum = i[3]
+                if i[4] is not None:
+                    curitemdistribution.size_multiple = i[4]
+                if i[5]:
+                    curitemdistribution.size_maximum = i[5]
+                if i[6]:
+                    curitemdistribution.cost = i[6]
+                if i[7] is not None:
+                    curitemdistribution.priority = i[7]
+                if i[8] and i[8] > datetime(1971, 1, 3):
+                    curitemdistribution.effective_start = i[8]
+                if i[9] and i[9] < datetime(2030, 12, 29):
+                    curitemdistribution.effective_end = i[9]
+                if i[12]:
+                    curitemdistribution.resource = frepple.resource(name=i[12])
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d item distributions in %.2f seconds" % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
 class loadBuffers(LoadTask):
     description = "Importing buffers"
     sequence = 101
+    dependencies = (loadLocations, loadCalendars, loadItems)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1346,8 +1393,6 @@ class loadBuffers(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 select
@@ -1385,142 +1430,78 @@ class loadBuffers(LoadTask):
                 """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    if i[7] == "infinite":
-                        b = frepple.buffer_infinite(
-                            name=i[0],
-                            description=i[1],
-                            location=frepple.location(name=i[2]),
-                            item=frepple.item(name=i[3]),
-                            batch=i[12] if i[12] else None,
-                            onhand=max(i[4] or 0, 0),
-                            category=i[9],
-                            subcategory=i[10],
-                            source=i[11],
-                        )
-                    elif not i[7] or i[7] == "default":
-                        b = frepple.buffer(
-                            name=i[0],
-                            description=i[1],
-                            location=frepple.location(name=i[2]),
-                            item=frepple.item(name=i[3]),
-                            batch=i[12] if i[12] else None,
-                            onhand=max(i[4] or 0, 0),
-                            category=i[9],
-                            subcategory=i[10],
-                            source=i[11],
-                        )
-                        if i[8]:
-                            b.mininterval = i[8]
-                    else:
-                        raise ValueError("Buffer type '%s' not recognized" % i[7])
-                    if i[10] == "tool":
-                        b.tool = True
-                    if i[5]:
-                        b.minimum = i[5]
-                    if i[6]:
-                        b.minimum_calendar = frepple.calendar(name=i[6])
-                    if i[13]:
-                        b.maximum = i[13]
-                    if i[14]:
-                        b.maximum_calendar = frepple.calendar(name=i[14])
+                yield from cursor
 
-                logger.info(
-                    "Loaded %d buffers in %.2f seconds" % (cnt, time() - starttime)
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            if i[7] == "infinite":
+                b = frepple.buffer_infinite(
+                    name=i[0],
+                    description=i[1],
+                    location=frepple.location(name=i[2]),
+                    item=frepple.item(name=i[3]),
+                    batch=i[12] if i[12] else None,
+                    onhand=max(i[4] or 0, 0),
+                    category=i[9],
+                    subcategory=i[10],
+                    source=i[11],
                 )
+            elif not i[7] or i[7] == "default":
+                b = frepple.buffer(
+                    name=i[0],
+                    description=i[1],
+                    location=frepple.location(name=i[2]),
+                    item=frepple.item(name=i[3]),
+                    batch=i[12] if i[12] else None,
+                    onhand=max(i[4] or 0, 0),
+                    category=i[9],
+                    subcategory=i[10],
+                    source=i[11],
+                )
+                if i[8]:
+                    b.mininterval = i[8]
+            else:
+                raise ValueError("Buffer type '%s' not recognized" % i[7])
+            if i[10] == "tool":
+                b.tool = True
+            if i[5]:
+                b.minimum = i[5]
+            if i[6]:
+                b.minimum_calendar = frepple.calendar(name=i[6])
+            if i[13]:
+                b.maximum = i[13]
+            if i[14]:
+                b.maximum_calendar = frepple.calendar(name=i[14])
+
+        logger.info("Loaded %d buffers in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
-class LinkCalendarsToBuffers(LoadTask):
-    description = "Associate calendars to the buffers"
-    sequence = 105.5
+class loadSetupMatrices(LoadTask):
+    description = "Importing setup matrix rules"
+    sequence = 102
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
-    @staticmethod
-    def run(database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
-        def findOrCreateBuffer(name):
-            try:
-                # Found existing buffer
-                return frepple.buffer(name=name, action="C")
-            except Exception:
-                try:
-                    # Create new buffer
-                    p = name.rsplit(" @ ", 2)
-                    if len(p) == 2:
-                        return frepple.buffer(
-                            name=name,
-                            item=frepple.item(name=p[0], action="C"),
-                            location=frepple.location(name=p[1], action="C"),
-                        )
-                    elif len(p) == 3:
-                        return frepple.buffer(
-                            name=name,
-                            item=frepple.item(name=p[0], action="C"),
-                            location=frepple.location(name=p[1], action="C"),
-                            batch=p[2],
-                        )
-                except Exception:
-                    return None
-
-        for cal in frepple.calendars():
-            # Try linking safety stock calendar to a buffer
-            if cal.name.startswith("SS for "):
-                b = findOrCreateBuffer(cal.name[7:])
-                if b:
-                    b.minimum_calendar = cal
-
-            # Try linking safety stock calendar with a replenishment quantity calendar
-            if cal.name.startswith("ROQ for "):
-                try:
-                    b = findOrCreateBuffer(cal.name[8:])
-                    if not b:
-                        continue
-                    if isinstance(
-                        b.producing,
-                        (
-                            frepple.operation_routing,
-                            frepple.operation_alternate,
-                        ),
-                    ):
-                        for o in b.producing.suboperations:
-                            o.operation.size_minimum_calendar = cal
-                            if isinstance(o.operation, frepple.operation_routing):
-                                for o2 in o.operation.suboperations:
-                                    o2.operation.size_minimum_calendar = cal
-                    elif b.producing:
-                        b.producing.size_minimum_calendar = cal
-                except Exception:
-                    pass
-
-
-@PlanTaskRegistry.register
-class loadSetupMatrices(LoadTask):
-    description = "Importing setup matrix rules"
-    sequence = 102
-
-    @classmethod
-    def getWeight(cls, **kwargs):
-        return -1 if kwargs.get("skipLoad", False) else 1
-
-    @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
-        if cls.filter:
-            filter_where = "where %s " % cls.filter
-        else:
-            filter_where = ""
+    @classmethod
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        # Setup matrices are returned as (name, source) tuples, and rules
+        # as (matrix, rule fields) tuples. All matrices come first.
+        if cls.filter:
+            filter_where = "where %s " % cls.filter
+        else:
+            filter_where = ""
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 SELECT name, source
@@ -1530,20 +1511,10 @@ class loadSetupMatrices(LoadTask):
                     % filter_where
                 )
                 for i in cursor:
-                    cnt += 1
-                    try:
-                        frepple.setupmatrix(name=i[0], source=i[1])
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d setup matrices in %.2f seconds"
-                    % (cnt, time() - starttime)
-                )
+                    yield (None, i)
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 SELECT
@@ -1555,41 +1526,69 @@ class loadSetupMatrices(LoadTask):
                     % filter_where
                 )
                 for i in cursor:
-                    cnt += 1
-                    try:
-                        r = frepple.setupmatrixrule(
-                            setupmatrix=frepple.setupmatrix(name=i[0]),
-                            priority=i[1],
-                            fromsetup=i[2],
-                            tosetup=i[3],
-                            duration=i[4] if i[4] else 0,
-                            cost=i[5],
-                            source=i[6],
-                        )
-                        if i[7]:
-                            r.resource = frepple.resource(name=i[7])
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
+                    yield (i[0], i)
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        rulecnt = 0
+        starttime = time()
+        rulestarttime = None
+        for matrix, i in rows:
+            if not matrix:
+                cnt += 1
+                try:
+                    frepple.setupmatrix(name=i[0], source=i[1])
+                except Exception as e:
+                    logger.error("**** %s ****" % e)
+                continue
+            if rulestarttime is None:
                 logger.info(
-                    "Loaded %d setup matrix rules in %.2f seconds"
+                    "Loaded %d setup matrices in %.2f seconds"
                     % (cnt, time() - starttime)
                 )
+                rulestarttime = time()
+            rulecnt += 1
+            try:
+                r = frepple.setupmatrixrule(
+                    setupmatrix=frepple.setupmatrix(name=i[0]),
+                    priority=i[1],
+                    fromsetup=i[2],
+                    tosetup=i[3],
+                    duration=i[4] if i[4] else 0,
+                    cost=i[5],
+                    source=i[6],
+                )
+                if i[7]:
+                    r.resource = frepple.resource(name=i[7])
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        if rulestarttime is None:
+            logger.info(
+                "Loaded %d setup matrices in %.2f seconds" % (cnt, time() - starttime)
+            )
+            rulestarttime = time()
+        logger.info(
+            "Loaded %d setup matrix rules in %.2f seconds"
+            % (rulecnt, time() - rulestarttime)
+        )
 
 
 @PlanTaskRegistry.register
 class loadResources(LoadTask):
     description = "Importing resources"
     sequence = 94.5
+    dependencies = (loadLocations, loadCalendarBuckets)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         # NOTE: setup matrices aren't assigned here, but in the loadOperationPlans method
-        import frepple
-
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1603,8 +1602,6 @@ class loadResources(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 Resource.rebuildHierarchy(database=database)
                 cursor.execute(
                     """
@@ -1618,94 +1615,100 @@ class loadResources(LoadTask):
                 """
                     % (attrsql, filter_where)
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        if i[5] == "infinite":
-                            x = frepple.resource_infinite(
-                                name=i[0],
-                                description=i[1],
-                                category=i[10],
-                                subcategory=i[11],
-                                source=i[13],
-                                constrained=i[17],
-                            )
-                            convert2cal = None
-                        elif not i[5] or i[5] == "default":
-                            x = frepple.resource_default(
-                                name=i[0],
-                                description=i[1],
-                                category=i[10],
-                                subcategory=i[11],
-                                source=i[13],
-                                constrained=i[17],
-                            )
-                            convert2cal = None
-                        elif i[5].startswith("buckets"):
-                            x = frepple.resource_buckets(
-                                name=i[0],
-                                description=i[1],
-                                category=i[10],
-                                subcategory=i[11],
-                                source=i[13],
-                                constrained=i[17],
-                            )
-                            convert2cal = i[5][8:]
-                        else:
-                            raise ValueError("Resource type '%s' not recognized" % i[5])
-                        if i[11] == "tool":
-                            x.tool = True
-                        elif i[11] == "tool per piece":
-                            x.toolperpiece = True
-                        if i[7] is not None:
-                            x.maxearly = i[7]
-                        if i[2] is not None:
-                            x.maximum = i[2]
-                        if i[3]:
-                            x.maximum_calendar = frepple.calendar(name=i[3])
-                        if i[4]:
-                            x.location = frepple.location(name=i[4])
-                        if i[6]:
-                            x.cost = i[6]
-                        if i[8]:
-                            x.setup = i[8]
-                        if i[12]:
-                            x.owner = frepple.resource(name=i[12])
-                        if i[14]:
-                            x.available = frepple.calendar(name=i[14])
-                        if i[15] is not None:
-                            x.efficiency = i[15]
-                        if i[16]:
-                            x.efficiency_calendar = frepple.calendar(name=i[16])
-                        if convert2cal:
-                            x.computeAvailability(
-                                frepple.calendar(name=convert2cal, action="C"),
-                                False,  # Debug flag
-                            )
-                        idx = 18
-                        for a in attrs:
-                            setattr(x, a, i[idx])
-                            idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d resources in %.2f seconds" % (cnt, time() - starttime)
-                )
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        attrs = [f[0] for f in getAttributes(Resource)]
+        for i in rows:
+            cnt += 1
+            try:
+                if i[5] == "infinite":
+                    x = frepple.resource_infinite(
+                        name=i[0],
+                        description=i[1],
+                        category=i[10],
+                        subcategory=i[11],
+                        source=i[13],
+                        constrained=i[17],
+                    )
+                    convert2cal = None
+                elif not i[5] or i[5] == "default":
+                    x = frepple.resource_default(
+                        name=i[0],
+                        description=i[1],
+                        category=i[10],
+                        subcategory=i[11],
+                        source=i[13],
+                        constrained=i[17],
+                    )
+                    convert2cal = None
+                elif i[5].startswith("buckets"):
+                    x = frepple.resource_buckets(
+                        name=i[0],
+                        description=i[1],
+                        category=i[10],
+                        subcategory=i[11],
+                        source=i[13],
+                        constrained=i[17],
+                    )
+                    convert2cal = i[5][8:]
+                else:
+                    raise ValueError("Resource type '%s' not recognized" % i[5])
+                if i[11] == "tool":
+                    x.tool = True
+                elif i[11] == "tool per piece":
+                    x.toolperpiece = True
+                if i[7] is not None:
+                    x.maxearly = i[7]
+                if i[2] is not None:
+                    x.maximum = i[2]
+                if i[3]:
+                    x.maximum_calendar = frepple.calendar(name=i[3])
+                if i[4]:
+                    x.location = frepple.location(name=i[4])
+                if i[6]:
+                    x.cost = i[6]
+                if i[8]:
+                    x.setup = i[8]
+                if i[12]:
+                    x.owner = frepple.resource(name=i[12])
+                if i[14]:
+                    x.available = frepple.calendar(name=i[14])
+                if i[15] is not None:
+                    x.efficiency = i[15]
+                if i[16]:
+                    x.efficiency_calendar = frepple.calendar(name=i[16])
+                if convert2cal:
+                    x.computeAvailability(
+                        frepple.calendar(name=convert2cal, action="C"),
+                        False,  # Debug flag
+                    )
+                idx = 18
+                for a in attrs:
+                    setattr(x, a, i[idx])
+                    idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d resources in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
 class loadResourceSkills(LoadTask):
     description = "Importing resources skills"
     sequence = 104
+    dependencies = (loadResources,)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1713,8 +1716,6 @@ class loadResourceSkills(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                 SELECT
@@ -1724,40 +1725,46 @@ class loadResourceSkills(LoadTask):
                 """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        cur = frepple.resourceskill(
-                            resource=frepple.resource(name=i[0]),
-                            skill=frepple.skill(name=i[1]),
-                            priority=i[4] if i[4] is not None else 1,
-                            source=i[5],
-                        )
-                        if i[2] and i[2] > datetime(1971, 1, 3):
-                            cur.effective_start = i[2]
-                        if i[3] and i[3] < datetime(2030, 12, 29):
-                            cur.effective_end = i[3]
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d resource skills in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                cur = frepple.resourceskill(
+                    resource=frepple.resource(name=i[0]),
+                    skill=frepple.skill(name=i[1]),
+                    priority=i[4] if i[4] is not None else 1,
+                    source=i[5],
                 )
+                if i[2] and i[2] > datetime(1971, 1, 3):
+                    cur.effective_start = i[2]
+                if i[3] and i[3] < datetime(2030, 12, 29):
+                    cur.effective_end = i[3]
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d resource skills in %.2f seconds" % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
 class loadOperationMaterials(LoadTask):
     description = "Importing operation materials"
     sequence = 105
+    dependencies = (loadOperations, loadItems, loadBuffers)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1765,8 +1772,6 @@ class loadOperationMaterials(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 # Note: The sorting of the flows is not really necessary, but helps to make
                 # the planning progress consistent across runs and database engines.
                 cursor.execute(
@@ -1779,81 +1784,168 @@ class loadOperationMaterials(LoadTask):
                 """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        curflow = frepple.flow(
-                            operation=frepple.operation(name=i[0]),
-                            item=frepple.item(name=i[1]),
-                            quantity=i[2],
-                            quantity_fixed=i[11],
-                            type="flow_%s" % i[3],
-                            source=i[9],
-                        )
-                        if i[4] and i[4] > datetime(1971, 1, 3):
-                            curflow.effective_start = i[4]
-                        if i[5] and i[5] < datetime(2030, 12, 29):
-                            curflow.effective_end = i[5]
-                        if i[6] and i[6] != "":
-                            curflow.name = i[6]
-                        if i[7] is not None:
-                            curflow.priority = i[7]
-                        if i[8]:
-                            curflow.search = i[8]
-                        if i[3] == "transfer_batch":
-                            if i[10]:
-                                curflow.transferbatch = i[10]
-                        else:
-                            if i[12]:
-                                curflow.offset = i[12]
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d operation materials in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                curflow = frepple.flow(
+                    operation=frepple.operation(name=i[0]),
+                    item=frepple.item(name=i[1]),
+                    quantity=i[2],
+                    quantity_fixed=i[11],
+                    type="flow_%s" % i[3],
+                    source=i[9],
                 )
+                if i[4] and i[4] > datetime(1971, 1, 3):
+                    curflow.effective_start = i[4]
+                if i[5] and i[5] < datetime(2030, 12, 29):
+                    curflow.effective_end = i[5]
+                if i[6] and i[6] != "":
+                    curflow.name = i[6]
+                if i[7] is not None:
+                    curflow.priority = i[7]
+                if i[8]:
+                    curflow.search = i[8]
+                if i[3] == "transfer_batch":
+                    if i[10]:
+                        curflow.transferbatch = i[10]
+                else:
+                    if i[12]:
+                        curflow.offset = i[12]
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d operation materials in %.2f seconds" % (cnt, time() - starttime)
+        )
 
-                # Check for operations where:
-                #  - operation.item is still blank
-                #  - they have a single operationmaterial item with quantity > 0
-                # If found we update
-                starttime = time()
-                cnt = 0
-                logger.info("Auto-update operation items...")
-                for oper in frepple.operations():
-                    if oper.hidden or oper.item or oper.owner:
-                        continue
+        # Check for operations where:
+        #  - operation.item is still blank
+        #  - they have a single operationmaterial item with quantity > 0
+        # If found we update
+        starttime = time()
+        cnt = 0
+        logger.info("Auto-update operation items...")
+        for oper in frepple.operations():
+            if oper.hidden or oper.item or oper.owner:
+                continue
+            item = None
+            for fl in oper.flows:
+                if fl.quantity < 0 or fl.hidden:
+                    continue
+                if item and item != fl.item:
                     item = None
-                    for fl in oper.flows:
-                        if fl.quantity < 0 or fl.hidden:
-                            continue
-                        if item and item != fl.item:
-                            item = None
-                            break
-                        else:
-                            item = fl.item
-                    if item:
-                        cnt += 1
-                        oper.item = item
-                logger.info(
-                    "Auto-update of %s operation items in %.2f seconds"
-                    % (cnt, time() - starttime)
-                )
+                    break
+                else:
+                    item = fl.item
+            if item:
+                cnt += 1
+                oper.item = item
+        logger.info(
+            "Auto-update of %s operation items in %.2f seconds"
+            % (cnt, time() - starttime)
+        )
+
+
+@PlanTaskRegistry.register
+class LinkCalendarsToBuffers(LoadTask):
+    description = "Associate calendars to the buffers"
+    sequence = 105.5
+    dependencies = (
+        loadCalendarBuckets,
+        loadLocations,
+        loadItems,
+        loadSuboperations,
+        loadBuffers,
+        loadOperationMaterials,
+    )
+
+    @classmethod
+    def getWeight(cls, **kwargs):
+        return -1 if kwargs.get("skipLoad", False) else 1
+
+    @classmethod
+    def fetch(cls, **kwargs):
+        # All data is already in the planning engine
+        return iter(())
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        def findOrCreateBuffer(name):
+            try:
+                # Found existing buffer
+                return frepple.buffer(name=name, action="C")
+            except Exception:
+                try:
+                    # Create new buffer
+                    p = name.rsplit(" @ ", 2)
+                    if len(p) == 2:
+                        return frepple.buffer(
+                            name=name,
+                            item=frepple.item(name=p[0], action="C"),
+                            location=frepple.location(name=p[1], action="C"),
+                        )
+                    elif len(p) == 3:
+                        return frepple.buffer(
+                            name=name,
+                            item=frepple.item(name=p[0], action="C"),
+                            location=frepple.location(name=p[1], action="C"),
+                            batch=p[2],
+                        )
+                except Exception:
+                    return None
+
+        for cal in frepple.calendars():
+            # Try linking safety stock calendar to a buffer
+            if cal.name.startswith("SS for "):
+                b = findOrCreateBuffer(cal.name[7:])
+                if b:
+                    b.minimum_calendar = cal
+
+            # Try linking safety stock calendar with a replenishment quantity calendar
+            if cal.name.startswith("ROQ for "):
+                try:
+                    b = findOrCreateBuffer(cal.name[8:])
+                    if not b:
+                        continue
+                    if isinstance(
+                        b.producing,
+                        (
+                            frepple.operation_routing,
+                            frepple.operation_alternate,
+                        ),
+                    ):
+                        for o in b.producing.suboperations:
+                            o.operation.size_minimum_calendar = cal
+                            if isinstance(o.operation, frepple.operation_routing):
+                                for o2 in o.operation.suboperations:
+                                    o2.operation.size_minimum_calendar = cal
+                    elif b.producing:
+                        b.producing.size_minimum_calendar = cal
+                except Exception:
+                    pass
 
 
 @PlanTaskRegistry.register
 class loadOperationResources(LoadTask):
     description = "Importing operation resources"
     sequence = 106
+    dependencies = (loadOperations, loadResources, loadResourceSkills)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         if cls.filter:
             filter_where = "where %s " % cls.filter
         else:
@@ -1861,8 +1953,6 @@ class loadOperationResources(LoadTask):
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 # Note: The sorting of the loads is not really necessary, but helps to make
                 # the planning progress consistent across runs and database engines.
                 cursor.execute(
@@ -1875,52 +1965,71 @@ class loadOperationResources(LoadTask):
                 """
                     % filter_where
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        curload = frepple.load(
-                            operation=frepple.operation(name=i[0]),
-                            resource=frepple.resource(name=i[1]),
-                            quantity=i[2],
-                            source=i[10],
-                        )
-                        if i[3] and i[3] > datetime(1971, 1, 3):
-                            curload.effective_start = i[3]
-                        if i[4] and i[4] < datetime(2030, 12, 29):
-                            curload.effective_end = i[4]
-                        if i[5]:
-                            curload.name = i[5]
-                        if i[6] is not None:
-                            curload.priority = i[6]
-                        if i[7]:
-                            curload.setup = i[7]
-                        if i[8]:
-                            curload.search = i[8]
-                        if i[9]:
-                            curload.skill = frepple.skill(name=i[9])
-                        if i[11]:
-                            curload.quantity_fixed = i[11]
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d resource loads in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                curload = frepple.load(
+                    operation=frepple.operation(name=i[0]),
+                    resource=frepple.resource(name=i[1]),
+                    quantity=i[2],
+                    source=i[10],
                 )
+                if i[3] and i[3] > datetime(1971, 1, 3):
+                    curload.effective_start = i[3]
+                if i[4] and i[4] < datetime(2030, 12, 29):
+                    curload.effective_end = i[4]
+                if i[5]:
+                    curload.name = i[5]
+                if i[6] is not None:
+                    curload.priority = i[6]
+                if i[7]:
+                    curload.setup = i[7]
+                if i[8]:
+                    curload.search = i[8]
+                if i[9]:
+                    curload.skill = frepple.skill(name=i[9])
+                if i[11]:
+                    curload.quantity_fixed = i[11]
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d resource loads in %.2f seconds" % (cnt, time() - starttime)
+        )
 
 
 @PlanTaskRegistry.register
 class loadDemand(LoadTask):
     description = "Importing demands"
     sequence = 107
+    dependencies = (
+        loadLocations,
+        loadCalendarBuckets,
+        loadCustomers,
+        loadOperations,
+        loadItems,
+    )
+    fetchVolume = 10
+
+    # Closed demands are loaded from the start of the current forecast bucket,
+    # which is only known in the planning engine. The fetch method reads the
+    # closed demands due in this period before the current date, and the apply
+    # method filters them.
+    closedHorizon = timedelta(days=366)
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def getRows(cls, database, where, *params):
         if cls.filter:
             # Note: extra escaping of % is needed to avoid colliding with query argument
             filter_and = "and %s " % cls.filter.replace("%", "%%")
@@ -1933,6 +2042,38 @@ class loadDemand(LoadTask):
         else:
             attrsql = ""
 
+        with transaction.atomic(using=database):
+            with connections[database].chunked_cursor() as cursor:
+                cursor.execute(
+                    """
+                    SELECT
+                    name, due, quantity, priority, item_id,
+                    operation_id, customer_id, owner, minshipment, maxlateness,
+                    category, subcategory, source, location_id, status,
+                    batch, description, policy %s
+                    FROM demand
+                    WHERE %s %s
+                    """
+                    % (attrsql, where, filter_and),
+                    params,
+                )
+                yield from cursor
+
+    @classmethod
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        import frepple
+
+        # The current date is set before the load tasks start
+        yield from cls.getRows(
+            database,
+            "(status IS NULL OR status in ('open', 'quote', 'inquiry') or (status = 'closed' and due >= %s))",
+            frepple.settings.current - cls.closedHorizon,
+        )
+
+    @classmethod
+    def apply(cls, rows, database=DEFAULT_DB_ALIAS, **kwargs):
+        import frepple
+
         # Find the start date of the current forecasting bucket
         calendar = Parameter.getValue("forecast.calendar", database, None)
         threshold = frepple.settings.current
@@ -1953,138 +2094,124 @@ class loadDemand(LoadTask):
                     break
                 fcst_start_date = i[0]
         if not fcst_start_date:
-            fcst_start_date = date(2030, 1, 1)
+            fcst_start_date = datetime(2030, 1, 1)
+
+        # Read the closed demands before the period of the fetch method
+        horizon = frepple.settings.current - cls.closedHorizon
+        if fcst_start_date < horizon:
+            rows = chain(
+                rows,
+                cls.getRows(
+                    database,
+                    "status = 'closed' and due >= %s and due < %s",
+                    fcst_start_date,
+                    horizon,
+                ),
+            )
 
-        with transaction.atomic(using=database):
-            with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
-                cursor.execute(
-                    """
-                    SELECT
-                    name, due, quantity, priority, item_id,
-                    operation_id, customer_id, owner, minshipment, maxlateness,
-                    category, subcategory, source, location_id, status,
-                    batch, description, policy %s
-                    FROM demand
-                    WHERE (status IS NULL OR status in ('open', 'quote', 'inquiry') or (status = 'closed' and due >= %%s)) %s
-                    """
-                    % (attrsql, filter_and),
-                    (fcst_start_date,),
-                )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        x = frepple.demand(
-                            name=i[0],
-                            due=i[1],
-                            quantity=i[2],
-                            priority=i[3],
-                            status=i[14],
-                            item=frepple.item(name=i[4]),
-                            category=i[10],
-                            subcategory=i[11],
-                            source=i[12],
-                            batch=i[15],
-                            description=i[16],
-                        )
-                        if i[5]:
-                            x.operation = frepple.operation(name=i[5])
-                        if i[6]:
-                            x.customer = frepple.customer(name=i[6])
-                        if i[7]:
-                            x.owner = frepple.demand_group(name=i[7])
-                            if i[17]:
-                                x.owner.policy = i[17]
-                        if i[8] is not None:
-                            x.minshipment = i[8]
-                        if i[9] is not None:
-                            x.maxlateness = i[9]
-                        if i[13]:
-                            x.location = frepple.location(name=i[13])
-                        idx = 18
-                        for a in attrs:
-                            setattr(x, a, i[idx])
-                            idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d demands in %.2f seconds" % (cnt, time() - starttime)
+        cnt = 0
+        starttime = time()
+        attrs = [f[0] for f in getAttributes(Demand)]
+        for i in rows:
+            if i[14] == "closed" and i[1] < fcst_start_date:
+                continue
+            cnt += 1
+            try:
+                x = frepple.demand(
+                    name=i[0],
+                    due=i[1],
+                    quantity=i[2],
+                    priority=i[3],
+                    status=i[14],
+                    item=frepple.item(name=i[4]),
+                    category=i[10],
+                    subcategory=i[11],
+                    source=i[12],
+                    batch=i[15],
+                    description=i[16],
                 )
+                if i[5]:
+                    x.operation = frepple.operation(name=i[5])
+                if i[6]:
+                    x.customer = frepple.customer(name=i[6])
+                if i[7]:
+                    x.owner = frepple.demand_group(name=i[7])
+                    if i[17]:
+                        x.owner.policy = i[17]
+                if i[8] is not None:
+                    x.minshipment = i[8]
+                if i[9] is not None:
+                    x.maxlateness = i[9]
+                if i[13]:
+                    x.location = frepple.location(name=i[13])
+                idx = 18
+                for a in attrs:
+                    setattr(x, a, i[idx])
+                    idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info("Loaded %d demands in %.2f seconds" % (cnt, time() - starttime))
 
 
 @PlanTaskRegistry.register
 class loadOperationPlans(LoadTask):
     description = "Importing operationplans"
     sequence = 108
+    dependencies = (
+        loadLocations,
+        loadSuppliers,
+        loadOperations,
+        loadSuboperations,
+        loadOperationDependencies,
+        loadItems,
+        loadItemSuppliers,
+        loadItemDistributions,
+        loadBuffers,
+        loadSetupMatrices,
+        loadResources,
+        loadResourceSkills,
+        loadOperationMaterials,
+        LinkCalendarsToBuffers,
+        loadOperationResources,
+        loadDemand,
+    )
+    fetchVolume = 100
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
+        # The rows of the successive queries are separated with None
         if cls.filter:
             filter_and = "and %s " % cls.filter
         else:
             filter_and = ""
+        with_fcst = "freppledb.forecast" in settings.INSTALLED_APPS
+        if "supply" in os.environ:
+            confirmed_filter = """ and (
+              operationplan.status in ('confirmed', 'approved', 'completed')
+              or exists (
+                select 1 from operationplan as child_opplans
+                where child_opplans.owner_id = operationplan.reference
+                and child_opplans.status in ('approved', 'confirmed', 'completed')
+                )
+              )
+              """
+            parent_filter = " where status in ('confirmed', 'approved', 'completed') "
+        else:
+            confirmed_filter = " and operationplan.status <> 'closed'"
+            parent_filter = " where status <> 'closed' "
 
-        # Disable the automatic creation of inventory consumption & production until we have
-        # read also operationplanmaterial. When operationplanmaterial data is available we
-        # don't create extra ones but take that data as input.
-        frepple.settings.suppressFlowplanCreation = True
+        attrs = ["operationplan.%s" % f[0] for f in getAttributes(OperationPlan)]
+        if attrs:
+            attrsql = ", %s" % ", ".join(attrs)
+        else:
+            attrsql = ""
 
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                with_fcst = "freppledb.forecast" in settings.INSTALLED_APPS
-                consume_material = (
-                    Parameter.getValue("WIP.consume_material", database, "true").lower()
-                    == "true"
-                )
-                consume_capacity = (
-                    Parameter.getValue("WIP.consume_capacity", database, "true").lower()
-                    == "true"
-                )
-                consume_material_completed = (
-                    Parameter.getValue(
-                        "COMPLETED.consume_material", database, "true"
-                    ).lower()
-                    == "true"
-                )
-                if "supply" in os.environ:
-                    confirmed_filter = """ and (
-                      operationplan.status in ('confirmed', 'approved', 'completed')
-                      or exists (
-                        select 1 from operationplan as child_opplans
-                        where child_opplans.owner_id = operationplan.reference
-                        and child_opplans.status in ('approved', 'confirmed', 'completed')
-                        )
-                      )
-                      """
-                    parent_filter = (
-                        " where status in ('confirmed', 'approved', 'completed') "
-                    )
-                    create_flag = True
-                else:
-                    confirmed_filter = " and operationplan.status <> 'closed'"
-                    parent_filter = " where status <> 'closed' "
-                    create_flag = False
-                cnt_mo = 0
-                cnt_po = 0
-                cnt_do = 0
-                cnt_dlvr = 0
-
-                attrs = [
-                    "operationplan.%s" % f[0] for f in getAttributes(OperationPlan)
-                ]
-                if attrs:
-                    attrsql = ", %s" % ", ".join(attrs)
-                else:
-                    attrsql = ""
-
-                starttime = time()
                 if with_fcst:
                     cursor.execute(
                         """
@@ -2160,131 +2287,8 @@ class loadOperationPlans(LoadTask):
                         """
                         % (attrsql, filter_and, confirmed_filter)
                     )
-                for i in cursor:
-                    try:
-                        if i[17]:
-                            dmd = frepple.demand(name=i[17])
-                        elif with_fcst and i[18] and i[19]:
-                            dmd = frepple.demand_forecastbucket(
-                                forecast=frepple.demand_forecast(name=i[18]),
-                                start=i[19],
-                            )
-                        else:
-                            dmd = None
-                        if i[7] == "MO":
-                            cnt_mo += 1
-                            opplan = frepple.operationplan(
-                                operation=frepple.operation(name=i[0]),
-                                reference=i[1],
-                                quantity=i[2],
-                                source=i[6],
-                                start=i[3],
-                                end=i[4],
-                                statusNoPropagation=i[5],
-                                create=create_flag,
-                                batch=i[13],
-                                quantity_completed=i[14],
-                                resources=i[15],
-                            )
-                            if opplan:
-                                if i[5] == "confirmed":
-                                    if not consume_material:
-                                        opplan.consume_material = False
-                                    if not consume_capacity:
-                                        opplan.consume_capacity = False
-                                elif i[5] == "completed":
-                                    if not consume_material_completed:
-                                        opplan.consume_material = False
-                                if i[16] is not None:
-                                    opplan.setupoverride = i[16]
-                        elif i[7] == "PO":
-                            cnt_po += 1
-                            opplan = frepple.operationplan(
-                                location=frepple.location(name=i[12]),
-                                ordertype=i[7],
-                                reference=i[1],
-                                item=frepple.item(name=i[11]) if i[11] else None,
-                                supplier=(
-                                    frepple.supplier(name=i[10]) if i[10] else None
-                                ),
-                                quantity=i[2],
-                                start=i[3],
-                                end=i[4],
-                                statusNoPropagation=i[5],
-                                source=i[6],
-                                create=create_flag,
-                                batch=i[13],
-                            )
-                            if opplan and i[5] == "confirmed":
-                                if not consume_capacity:
-                                    opplan.consume_capacity = False
-                        elif i[7] == "DO":
-                            cnt_do += 1
-                            opplan = frepple.operationplan(
-                                location=frepple.location(name=i[9]) if i[9] else None,
-                                reference=i[1],
-                                ordertype=i[7],
-                                item=frepple.item(name=i[11]) if i[11] else None,
-                                origin=frepple.location(name=i[8]) if i[8] else None,
-                                quantity=i[2],
-                                start=i[3],
-                                end=i[4],
-                                statusNoPropagation=i[5],
-                                source=i[6],
-                                create=create_flag,
-                                batch=i[13],
-                            )
-                            if opplan:
-                                if i[5] == "confirmed":
-                                    if not consume_capacity:
-                                        opplan.consume_capacity = False
-                                elif i[5] == "completed":
-                                    if not consume_material_completed:
-                                        opplan.consume_material = False
-                        elif i[7] == "DLVR":
-                            cnt_dlvr += 1
-                            opplan = frepple.operationplan(
-                                location=(
-                                    frepple.location(name=i[12]) if i[12] else None
-                                ),
-                                reference=i[1],
-                                ordertype=i[7],
-                                item=frepple.item(name=i[11]) if i[11] else None,
-                                origin=frepple.location(name=i[8]) if i[8] else None,
-                                demand=dmd,
-                                quantity=i[2],
-                                start=i[3],
-                                end=i[4],
-                                statusNoPropagation=i[5],
-                                source=i[6],
-                                create=create_flag,
-                                batch=i[13],
-                            )
-                            if opplan:
-                                if i[5] == "confirmed":
-                                    if not consume_capacity:
-                                        opplan.consume_capacity = False
-                                elif i[5] == "completed":
-                                    if not consume_material_completed:
-                                        opplan.consume_material = False
-                            opplan = None
-                        else:
-                            logger.warning(
-                                "Warning: unhandled operationplan type '%s'" % i[7]
-                            )
-                            continue
-
-                        if opplan:
-                            idx = 20 if with_fcst else 18
-                            for a in getAttributes(OperationPlan):
-                                setattr(opplan, a[0], i[idx])
-                                idx += 1
-
-                        if dmd and opplan:
-                            opplan.demand = dmd
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-        with transaction.atomic(using=database):
+                yield from cursor
+            yield None
             with connections[database].chunked_cursor() as cursor:
                 if with_fcst:
                     cursor.execute(
@@ -2372,89 +2376,34 @@ class loadOperationPlans(LoadTask):
                         """
                         % (attrsql, parent_filter, filter_and)
                     )
-                for i in cursor:
-                    try:
-                        cnt_mo += 1
-                        opplan = frepple.operationplan(
-                            operation=frepple.operation(name=i[0]),
-                            reference=i[1],
-                            quantity=i[2],
-                            source=i[7],
-                            start=i[3],
-                            end=i[4],
-                            statusNoPropagation=i[5],
-                            batch=i[8],
-                            resources=i[9],
-                        )
-                        if opplan:
-                            if i[5] == "confirmed":
-                                if not consume_material:
-                                    opplan.consume_material = False
-                                if not consume_capacity:
-                                    opplan.consume_capacity = False
-                            elif i[5] == "completed":
-                                if not consume_material_completed:
-                                    opplan.consume_material = False
-                            if i[6]:
-                                try:
-                                    opplan.owner = frepple.operationplan(reference=i[6])
-                                except Exception:
-                                    logger.error(
-                                        "Reference %s: Can't set owner field to %s"
-                                        % (i[1], i[6])
-                                    )
-                            if i[10]:
-                                opplan.demand = frepple.demand(name=i[10])
-                            elif with_fcst and i[11] and i[12]:
-                                opplan.demand = frepple.forecastbucket(
-                                    forecast=frepple.demand_forecast(name=i[11]),
-                                    start=i[12],
-                                )
-                            idx = 13 if with_fcst else 11
-                            for a in getAttributes(OperationPlan):
-                                setattr(opplan, a[0], i[idx])
-                                idx += 1
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d manufacturing orders, %d purchase orders, %d distribution orders and %s deliveries in %.2f seconds"
-                    % (cnt_mo, cnt_po, cnt_do, cnt_dlvr, time() - starttime)
-                )
-
-        with connections[database].cursor() as cursor:
-            # Assure the operationplan ids will be unique.
-            # We call this method only at the end, as calling it earlier gives a slower
-            # performance to load operationplans
-            # By limiting the number of digits in the query we enforce reusing numbers at some point.
-            if "supply" in os.environ:
-                # Allow reusing references of proposed operationplans
-                cursor.execute(
-                    """
-                    select coalesce(max(reference::bigint), 0) as max_reference
-                    from operationplan
-                    where status <> 'proposed'
-                    and reference ~ '^[0-9]*$'
-                    and char_length(reference) <= 9
-                    """
-                )
-            else:
-                # Don't reuse any references
-                cursor.execute(
-                    """
-                    select coalesce(max(reference::bigint), 0) as max_reference
-                    from operationplan
-                    where reference ~ '^[0-9]*$'
-                    and char_length(reference) <= 9
-                    """
-                )
-            d = cursor.fetchone()
-            frepple.settings.id = d[0] + 1
-
-        # We only assign resource setup matrices here.
-        # If we do it before the operationplans are read in, then a) the setup
-        # calculations take extra calculations and b) the results depend on the
-        # order we read in the operationplans.
-        with transaction.atomic(using=database):
+                yield from cursor
+            yield None
+            with connections[database].cursor() as cursor:
+                # Highest numeric reference.
+                # By limiting the number of digits in the query we enforce reusing numbers at some point.
+                if "supply" in os.environ:
+                    # Allow reusing references of proposed operationplans
+                    cursor.execute(
+                        """
+                        select coalesce(max(reference::bigint), 0) as max_reference
+                        from operationplan
+                        where status <> 'proposed'
+                        and reference ~ '^[0-9]*$'
+                        and char_length(reference) <= 9
+                        """
+                    )
+                else:
+                    # Don't reuse any references
+                    cursor.execute(
+                        """
+                        select coalesce(max(reference::bigint), 0) as max_reference
+                        from operationplan
+                        where reference ~ '^[0-9]*$'
+                        and char_length(reference) <= 9
+                        """
+                    )
+                yield cursor.fetchone()
+            yield None
             with connections[database].chunked_cursor() as cursor:
                 cursor.execute(
                     """
@@ -2465,29 +2414,240 @@ class loadOperationPlans(LoadTask):
                     """
                     % filter_and
                 )
-                for i in cursor:
-                    frepple.resource(name=i[0]).setupmatrix = frepple.setupmatrix(
-                        name=i[1]
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, database=DEFAULT_DB_ALIAS, **kwargs):
+        import frepple
+
+        rows = iter(rows)
+
+        # Disable the automatic creation of inventory consumption & production until we have
+        # read also operationplanmaterial. When operationplanmaterial data is available we
+        # don't create extra ones but take that data as input.
+        frepple.settings.suppressFlowplanCreation = True
+
+        with_fcst = "freppledb.forecast" in settings.INSTALLED_APPS
+        consume_material = (
+            Parameter.getValue("WIP.consume_material", database, "true").lower()
+            == "true"
+        )
+        consume_capacity = (
+            Parameter.getValue("WIP.consume_capacity", database, "true").lower()
+            == "true"
+        )
+        consume_material_completed = (
+            Parameter.getValue("COMPLETED.consume_material", database, "true").lower()
+            == "true"
+        )
+        create_flag = "supply" in os.environ
+        cnt_mo = 0
+        cnt_po = 0
+        cnt_do = 0
+        cnt_dlvr = 0
+        starttime = time()
+        for i in rows:
+            if i is None:
+                break
+            try:
+                if i[17]:
+                    dmd = frepple.demand(name=i[17])
+                elif with_fcst and i[18] and i[19]:
+                    dmd = frepple.demand_forecastbucket(
+                        forecast=frepple.demand_forecast(name=i[18]),
+                        start=i[19],
+                    )
+                else:
+                    dmd = None
+                if i[7] == "MO":
+                    cnt_mo += 1
+                    opplan = frepple.operationplan(
+                        operation=frepple.operation(name=i[0]),
+                        reference=i[1],
+                        quantity=i[2],
+                        source=i[6],
+                        start=i[3],
+                        end=i[4],
+                        statusNoPropagation=i[5],
+                        create=create_flag,
+                        batch=i[13],
+                        quantity_completed=i[14],
+                        resources=i[15],
+                    )
+                    if opplan:
+                        if i[5] == "confirmed":
+                            if not consume_material:
+                                opplan.consume_material = False
+                            if not consume_capacity:
+                                opplan.consume_capacity = False
+                        elif i[5] == "completed":
+                            if not consume_material_completed:
+                                opplan.consume_material = False
+                        if i[16] is not None:
+                            opplan.setupoverride = i[16]
+                elif i[7] == "PO":
+                    cnt_po += 1
+                    opplan = frepple.operationplan(
+                        location=frepple.location(name=i[12]),
+                        ordertype=i[7],
+                        reference=i[1],
+                        item=frepple.item(name=i[11]) if i[11] else None,
+                        supplier=(frepple.supplier(name=i[10]) if i[10] else None),
+                        quantity=i[2],
+                        start=i[3],
+                        end=i[4],
+                        statusNoPropagation=i[5],
+                        source=i[6],
+                        create=create_flag,
+                        batch=i[13],
                     )
+                    if opplan and i[5] == "confirmed":
+                        if not consume_capacity:
+                            opplan.consume_capacity = False
+                elif i[7] == "DO":
+                    cnt_do += 1
+                    opplan = frepple.operationplan(
+                        location=frepple.location(name=i[9]) if i[9] else None,
+                        reference=i[1],
+                        ordertype=i[7],
+                        item=frepple.item(name=i[11]) if i[11] else None,
+                        origin=frepple.location(name=i[8]) if i[8] else None,
+                        quantity=i[2],
+                        start=i[3],
+                        end=i[4],
+                        statusNoPropagation=i[5],
+                        source=i[6],
+                        create=create_flag,
+                        batch=i[13],
+                    )
+                    if opplan:
+                        if i[5] == "confirmed":
+                            if not consume_capacity:
+                                opplan.consume_capacity = False
+                        elif i[5] == "completed":
+                            if not consume_material_completed:
+                                opplan.consume_material = False
+                elif i[7] == "DLVR":
+                    cnt_dlvr += 1
+                    opplan = frepple.operationplan(
+                        location=(frepple.location(name=i[12]) if i[12] else None),
+                        reference=i[1],
+                        ordertype=i[7],
+                        item=frepple.item(name=i[11]) if i[11] else None,
+                        origin=frepple.location(name=i[8]) if i[8] else None,
+                        demand=dmd,
+                        quantity=i[2],
+                        start=i[3],
+                        end=i[4],
+                        statusNoPropagation=i[5],
+                        source=i[6],
+                        create=create_flag,
+                        batch=i[13],
+                    )
+                    if opplan:
+                        if i[5] == "confirmed":
+                            if not consume_capacity:
+                                opplan.consume_capacity = False
+                        elif i[5] == "completed":
+                            if not consume_material_completed:
+                                opplan.consume_material = False
+                    opplan = None
+                else:
+                    logger.warning("Warning: unhandled operationplan type '%s'" % i[7])
+                    continue
+
+                if opplan:
+                    idx = 20 if with_fcst else 18
+                    for a in getAttributes(OperationPlan):
+                        setattr(opplan, a[0], i[idx])
+                        idx += 1
+
+                if dmd and opplan:
+                    opplan.demand = dmd
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        for i in rows:
+            if i is None:
+                break
+            try:
+                cnt_mo += 1
+                opplan = frepple.operationplan(
+                    operation=frepple.operation(name=i[0]),
+                    reference=i[1],
+                    quantity=i[2],
+                    source=i[7],
+                    start=i[3],
+                    end=i[4],
+                    statusNoPropagation=i[5],
+                    batch=i[8],
+                    resources=i[9],
+                )
+                if opplan:
+                    if i[5] == "confirmed":
+                        if not consume_material:
+                            opplan.consume_material = False
+                        if not consume_capacity:
+                            opplan.consume_capacity = False
+                    elif i[5] == "completed":
+                        if not consume_material_completed:
+                            opplan.consume_material = False
+                    if i[6]:
+                        try:
+                            opplan.owner = frepple.operationplan(reference=i[6])
+                        except Exception:
+                            logger.error(
+                                "Reference %s: Can't set owner field to %s"
+                                % (i[1], i[6])
+                            )
+                    if i[10]:
+                        opplan.demand = frepple.demand(name=i[10])
+                    elif with_fcst and i[11] and i[12]:
+                        opplan.demand = frepple.forecastbucket(
+                            forecast=frepple.demand_forecast(name=i[11]),
+                            start=i[12],
+                        )
+                    idx = 13 if with_fcst else 11
+                    for a in getAttributes(OperationPlan):
+                        setattr(opplan, a[0], i[idx])
+                        idx += 1
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d manufacturing orders, %d purchase orders, %d distribution orders and %s deliveries in %.2f seconds"
+            % (cnt_mo, cnt_po, cnt_do, cnt_dlvr, time() - starttime)
+        )
+
+        # Assure the operationplan ids will be unique.
+        # We call this method only at the end, as calling it earlier gives a slower
+        # performance to load operationplans
+        for i in rows:
+            if i is None:
+                break
+            frepple.settings.id = i[0] + 1
+
+        # We only assign resource setup matrices here.
+        # If we do it before the operationplans are read in, then a) the setup
+        # calculations take extra calculations and b) the results depend on the
+        # order we read in the operationplans.
+        for i in rows:
+            frepple.resource(name=i[0]).setupmatrix = frepple.setupmatrix(name=i[1])
 
 
 @PlanTaskRegistry.register
 class loadOperationPlanMaterials(LoadTask):
     description = "Importing operationplanmaterials"
     sequence = 109
+    dependencies = (loadOperationPlans,)
+    fetchVolume = 100
 
     @classmethod
     def getWeight(cls, **kwargs):
         return -1 if kwargs.get("skipLoad", False) else 1
 
     @classmethod
-    def run(cls, database=DEFAULT_DB_ALIAS, **kwargs):
-        import frepple
-
+    def fetch(cls, database=DEFAULT_DB_ALIAS, **kwargs):
         with transaction.atomic(using=database):
             with connections[database].chunked_cursor() as cursor:
-                cnt = 0
-                starttime = time()
                 cursor.execute(
                     """
                     select
@@ -2510,25 +2670,33 @@ class loadOperationPlanMaterials(LoadTask):
                         ),
                     )
                 )
-                for i in cursor:
-                    cnt += 1
-                    try:
-                        frepple.flowplan(
-                            operationplan=frepple.operationplan(id=i[0]),
-                            item=frepple.item(name=i[1]),
-                            status=i[2],
-                            quantity=i[3],
-                        )
-                    except Exception as e:
-                        logger.error("**** %s ****" % e)
-                logger.info(
-                    "Loaded %d operationplanmaterials in %.2f seconds"
-                    % (cnt, time() - starttime)
+                yield from cursor
+
+    @classmethod
+    def apply(cls, rows, **kwargs):
+        import frepple
+
+        cnt = 0
+        starttime = time()
+        for i in rows:
+            cnt += 1
+            try:
+                frepple.flowplan(
+                    operationplan=frepple.operationplan(id=i[0]),
+                    item=frepple.item(name=i[1]),
+                    status=i[2],
+                    quantity=i[3],
                 )
+            except Exception as e:
+                logger.error("**** %s ****" % e)
+        logger.info(
+            "Loaded %d operationplanmaterials in %.2f seconds"
+            % (cnt, time() - starttime)
+        )
 
-                # All predefined inventory detail records are now loaded.
-                # We now create any missing ones.
-                frepple.settings.suppressFlowplanCreation = False
+        # All predefined inventory detail records are now loaded.
+        # We now create any missing ones.
+        frepple.settings.suppressFlowplanCreation = False
 
 
 @PlanTaskRegistry.register
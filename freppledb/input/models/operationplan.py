@@ -28,7 +28,7 @@ from dateutil.parser import parse
 import json
 from logging import INFO, ERROR, WARNING, DEBUG, getLogger
 import math
-from openpyxl.worksheet.cell_range import CellRange
+from openpyxl.worksheet._read_only import ReadOnlyWorksheet
 from openpyxl.worksheet.worksheet import Worksheet
 from typing import List
 
@@ -46,7 +46,7 @@ from django.utils import translation
 from django.utils.encoding import force_str
 from django.utils.text import get_text_list
 
-from freppledb.common.dataload import BulkForeignKeyFormField
+from freppledb.common.dataload import BulkForeignKeyFormField, getAutoFilterBounds
 from freppledb.common.fields import AliasDateTimeField, AliasField
 from freppledb.common.models import AuditModel, MultiDBManager, Parameter, Comment
 
@@ -847,13 +847,7 @@ class ManufacturingOrder(OperationPlan):
         )
 
         # Detect excel autofilter data tables
-        if isinstance(data, Worksheet) and data.auto_filter.ref:
-            try:
-                bounds = CellRange(data.auto_filter.ref).bounds
-            except Exception:
-                bounds = None
-        else:
-            bounds = None
+        bounds = getAutoFilterBounds(data)
 
         for row in data:
             rownumber += 1
@@ -974,7 +968,10 @@ class ManufacturingOrder(OperationPlan):
                     )
                 # Abort when there are errors
                 if errors:
-                    if isinstance(data, Worksheet) and len(data.parent.sheetnames) > 1:
+                    if (
+                        isinstance(data, (Worksheet, ReadOnlyWorksheet))
+                        and len(data.parent.sheetnames) > 1
+                    ):
                         # Skip this sheet an continue with the next one
                         return
                     else:
@@ -51,12 +51,14 @@ from .models import (
 )
 
 
-@NotificationFactory.register(CalendarBucket, [CalendarBucket])
+@NotificationFactory.register(CalendarBucket, [CalendarBucket], keys=())
 def CalendarBucketNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(Calendar, [Calendar, CalendarBucket])
+@NotificationFactory.register(
+    Calendar, [Calendar, CalendarBucket], keys=("calendar_id",)
+)
 def CalendarNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return flw.object_pk == msg.object_pk
@@ -68,7 +70,9 @@ def CalendarNotification(flw, msg):
 
 
 @NotificationFactory.register(
-    Location, [Location, Demand, PurchaseOrder, ManufacturingOrder, DistributionOrder]
+    Location,
+    [Location, Demand, PurchaseOrder, ManufacturingOrder, DistributionOrder],
+    keys=("location_id", "origin_id", "destination_id"),
 )
 def LocationNotification(flw, msg):
     if flw.content_type == msg.content_type:
@@ -95,7 +99,7 @@ def LocationNotification(flw, msg):
             return msg.model_name() in args if args else True
 
 
-@NotificationFactory.register(Customer, [Customer, Demand])
+@NotificationFactory.register(Customer, [Customer, Demand], keys=("customer_id",))
 def CustomerNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return flw.object_pk == msg.object_pk
@@ -106,7 +110,9 @@ def CustomerNotification(flw, msg):
         return msg.model_name() in args if args else True
 
 
-@NotificationFactory.register(Supplier, [Supplier, PurchaseOrder])
+@NotificationFactory.register(
+    Supplier, [Supplier, PurchaseOrder], keys=("supplier_id",)
+)
 def SupplierNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return flw.object_pk == msg.object_pk
@@ -129,6 +135,7 @@ def SupplierNotification(flw, msg):
         ItemDistribution,
         Operation,
     ],
+    keys=("item_id",),
 )
 def ItemNotification(flw, msg):
     if flw.content_type == msg.content_type:
@@ -142,17 +149,19 @@ def ItemNotification(flw, msg):
         return msg.model_name() in args if args else True
 
 
-@NotificationFactory.register(ItemSupplier, [ItemSupplier])
+@NotificationFactory.register(ItemSupplier, [ItemSupplier], keys=())
 def ItemSupplierNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(ItemDistribution, [ItemDistribution])
+@NotificationFactory.register(ItemDistribution, [ItemDistribution], keys=())
 def ItemDistributionNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(Operation, [Operation, ManufacturingOrder])
+@NotificationFactory.register(
+    Operation, [Operation, ManufacturingOrder], keys=("owner_id", "operation_id")
+)
 def OperationNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return (
@@ -166,22 +175,24 @@ def OperationNotification(flw, msg):
         return msg.model_name() in args if args else True
 
 
-@NotificationFactory.register(SubOperation, [SubOperation])
+@NotificationFactory.register(SubOperation, [SubOperation], keys=())
 def SubOperationNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(Buffer, [Buffer])
+@NotificationFactory.register(Buffer, [Buffer], keys=())
 def BufferNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(SetupRule, [SetupRule])
+@NotificationFactory.register(SetupRule, [SetupRule], keys=())
 def SetupRuleNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(SetupMatrix, [SetupMatrix, SetupRule])
+@NotificationFactory.register(
+    SetupMatrix, [SetupMatrix, SetupRule], keys=("setupmatrix_id",)
+)
 def SetupMatrixNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return flw.object_pk == msg.object_pk
@@ -192,7 +203,9 @@ def SetupMatrixNotification(flw, msg):
         return msg.model_name() in args if args else True
 
 
-@NotificationFactory.register(Skill, [Skill, ResourceSkill, OperationResource])
+@NotificationFactory.register(
+    Skill, [Skill, ResourceSkill, OperationResource], keys=("skill_id",)
+)
 def SkillNotification(flw, msg):
     if flw.content_type == msg.content_type:
         return flw.object_pk == msg.object_pk
@@ -203,13 +216,16 @@ def SkillNotification(flw, msg):
         return msg.model_name() in args if args else True
 
 
-@NotificationFactory.register(ResourceSkill, [ResourceSkill])
+@NotificationFactory.register(ResourceSkill, [ResourceSkill], keys=())
 def ResourceSkillNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
 @NotificationFactory.register(
-    Resource, [Resource, ResourceSkill, OperationResource, ManufacturingOrder]
+    Resource,
+    [Resource, ResourceSkill, OperationResource, ManufacturingOrder],
+    keys=("resource_id", "resources__resource_id"),
+    prefetch={ManufacturingOrder: ("resources",)},
 )
 def ResourceNotification(flw, msg):
     if flw.content_type == msg.content_type:
@@ -230,46 +246,46 @@ def ResourceNotification(flw, msg):
         return False
 
 
-@NotificationFactory.register(OperationMaterial, [OperationMaterial])
+@NotificationFactory.register(OperationMaterial, [OperationMaterial], keys=())
 def OperationMaterialNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(OperationResource, [OperationResource])
+@NotificationFactory.register(OperationResource, [OperationResource], keys=())
 def OperationResourceNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(ManufacturingOrder, [ManufacturingOrder])
+@NotificationFactory.register(ManufacturingOrder, [ManufacturingOrder], keys=())
 def ManufacturingOrderNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(DistributionOrder, [DistributionOrder])
+@NotificationFactory.register(DistributionOrder, [DistributionOrder], keys=())
 def DistributionOrderNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(PurchaseOrder, [PurchaseOrder])
+@NotificationFactory.register(PurchaseOrder, [PurchaseOrder], keys=())
 def PurchaseOrderNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(DeliveryOrder, [DeliveryOrder])
+@NotificationFactory.register(DeliveryOrder, [DeliveryOrder], keys=())
 def DeliveryOrderNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(Demand, [Demand])
+@NotificationFactory.register(Demand, [Demand], keys=())
 def DemandNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(OperationPlanResource, [OperationPlanResource])
+@NotificationFactory.register(OperationPlanResource, [OperationPlanResource], keys=())
 def OperationPlanResourceNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
 
 
-@NotificationFactory.register(OperationPlanMaterial, [OperationPlanMaterial])
+@NotificationFactory.register(OperationPlanMaterial, [OperationPlanMaterial], keys=())
 def OperationPlanMaterialNotification(flw, msg):
     return flw.content_type == msg.content_type and flw.object_pk == msg.object_pk
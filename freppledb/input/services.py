@@ -26,40 +26,12 @@ import frepple
 from collections import OrderedDict
 import json
 
-from channels.db import database_sync_to_async
 from channels.generic.http import AsyncHttpConsumer
 
 from freppledb.boot import getAttributes
-from freppledb.common.commands import PlanTaskRegistry
 from freppledb.common.localization import parseLocalizedDateTime, parseLocalizedDate
 from freppledb.input.models import OperationPlan
-from freppledb.webservice.utils import lock
-
-
-@database_sync_to_async
-def savePlan(
-    deleted_opplans,
-    related_opplans,
-    related_resources,
-    related_buffers,
-    related_demands,
-    database,
-    cluster,
-):
-    try:
-        PlanTaskRegistry.run(
-            export=1,
-            cluster=cluster,
-            database=database,
-            deleted_opplans=deleted_opplans,
-            opplans=related_opplans,
-            resources=related_resources,
-            buffers=related_buffers,
-            demands=related_demands,
-        )
-    except Exception as e:
-        print("Error saving plan:", e)
-        raise e
+from freppledb.webservice.utils import lock, PlanWriter
 
 
 def collectRelated(
@@ -125,6 +97,61 @@ def collectRelated(
 opplanAttributes = [a for a in getAttributes(OperationPlan)]
 
 
+def getClusters(data):
+    """
+    Returns the planning clusters impacted by a list of updates, or None
+    when they can impact the complete model.
+    """
+    clusters = set()
+    try:
+        for rec in data:
+            for d in rec.get("delete", []):
+                clusters.add(frepple.operationplan(reference=d, action="C").cluster)
+            ref = rec.get(
+                "operationplan__reference",
+                rec.get("operationplan__id", rec.get("reference", rec.get("id", None))),
+            )
+            if ref:
+                opplan = frepple.operationplan(reference=ref, action="C")
+                clusters.add(opplan.cluster)
+                if opplan.ordertype in ("PO", "DO"):
+                    current = {
+                        "location": opplan.location,
+                        "destination": opplan.location,
+                        "origin": getattr(opplan, "origin", None),
+                        "supplier": getattr(opplan, "supplier", None),
+                    }
+                    for k, v in current.items():
+                        if k in rec and (not v or rec[k] != v.name):
+                            # Moving an order to another location or supplier
+                            # can put it in any buffer
+                            return None
+            elif rec.get("type", "MO") != "MO" or "operation" not in rec:
+                # A new purchase or distribution order
+                return None
+
+            # The update can move the operationplan to other clusters
+            if "operation" in rec:
+                clusters.add(
+                    frepple.operation(name=rec["operation"], action="C").cluster
+                )
+            if "item" in rec:
+                clusters.add(frepple.item(name=rec["item"], action="C").cluster)
+            if rec.get("demand", None):
+                clusters.add(frepple.demand(name=rec["demand"], action="C").cluster)
+            rsrcs = rec.get("resources", rec.get("resource", None))
+            if rsrcs:
+                for r in [rsrcs] if isinstance(rsrcs, str) else rsrcs:
+                    clusters.add(
+                        frepple.resource(
+                            name=r if isinstance(r, str) else r[0], action="C"
+                        ).cluster
+                    )
+    except Exception:
+        return None
+    return clusters
+
+
 class OperationplanService(AsyncHttpConsumer):
     async def handle(self, body):
         errors = []
@@ -145,7 +172,8 @@ class OperationplanService(AsyncHttpConsumer):
             related_buffers = set()
             related_demands = set()
 
-            async with lock:
+            clusters = getClusters(data)
+            async with lock.clusters(clusters):
                 # Update the plan in memory
                 for rec in data:
                     try:
@@ -364,27 +392,23 @@ class OperationplanService(AsyncHttpConsumer):
                     except Exception as e:
                         errors.append(str(e))
 
-                # Save all changes
-                if (
-                    deleted_opplans
-                    or related_opplans
-                    or related_resources
-                    or related_buffers
-                    or related_demands
-                ):
-                    try:
-                        await savePlan(
-                            deleted_opplans,
-                            related_opplans,
-                            related_resources,
-                            related_buffers,
-                            related_demands,
-                            self.scope["database"],
-                            -2,
-                        )
-                    except Exception as e:
-                        print("exception " % e)
-                        errors.append("Error saving plan")
+            # Save all changes, outside of the lock
+            if (
+                deleted_opplans
+                or related_opplans
+                or related_resources
+                or related_buffers
+                or related_demands
+            ):
+                PlanWriter.save(
+                    self.scope["database"],
+                    clusters,
+                    deleted_opplans=deleted_opplans,
+                    opplans=related_opplans,
+                    resources=related_resources,
+                    buffers=related_buffers,
+                    demands=related_demands,
+                )
 
             self.scope["response_headers"].append((b"Content-Type", b"text/html"))
             if errors:
@@ -21,13 +21,16 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-from datetime import date
+from datetime import date, datetime
 from itertools import chain
+import json
+import logging
 import os
 import random
 from rest_framework.test import APIClient, APITestCase, APIRequestFactory
 import tempfile
 from time import sleep
+import tracemalloc
 from unittest import skipUnless
 
 from django.conf import settings
@@ -38,8 +41,14 @@ from django.http.response import StreamingHttpResponse
 from django.test import TestCase, TransactionTestCase
 from django.utils import translation
 from django.utils.formats import date_format
+from openpyxl import Workbook
 
-from freppledb.common.dataload import parseCSVdata
+from freppledb.common.dataload import (
+    getAutoFilterBounds,
+    loadWorkbook,
+    parseCSVdata,
+    parseExcelWorksheet,
+)
 from freppledb.common.models import (
     User,
     Bucket,
@@ -157,6 +166,107 @@ class DataLoadTest(TestCase):
             ],  # Test result is different in Enterprise Edition
         )
 
+    def test_csv_bulk_upload(self):
+        user = User.objects.get(username="admin")
+        errors = list(
+            parseCSVdata(
+                Customer,
+                [
+                    ["name", "owner", "category"],
+                    ["Customer near factory 1", "All customers", "cat1"],
+                    ["Customer near factory 3", "Region 1", ""],
+                    ["Region 1", "All customers", ""],
+                    ["Customer near factory 4", "unknown customer", ""],
+                    ["Customer near factory 2", "All customers", ""],
+                ],
+                user=user,
+            )
+        )
+        self.assertEqual(
+            [(e[1], e[2]) for e in errors if e[0] == logging.ERROR],
+            [(5, "owner")],
+        )
+        self.assertIn("changed 1 and added 2 records, 1 errors", str(errors[-1][4]))
+        self.assertEqual(
+            [
+                (i.name, i.owner_id, i.category or "")
+                for i in Customer.objects.order_by("name")
+            ],
+            [
+                ("All customers", None, ""),
+                ("Customer near factory 1", "All customers", "cat1"),
+                ("Customer near factory 2", "All customers", ""),
+                ("Customer near factory 3", "Region 1", ""),
+                ("Region 1", "All customers", ""),
+            ],
+        )
+        self.assertIsNone(Customer.objects.get(name="Region 1").lft)
+        self.assertEqual(
+            Comment.objects.filter(
+                object_pk="Customer near factory 1", type="change"
+            ).count(),
+            1,
+        )
+
+    def checkHierarchy(self, model):
+        # Verify the nested set fields against the owner field
+        nodes = {i.name: i for i in model.objects.all()}
+        numbers = []
+        for i in nodes.values():
+            self.assertIsNotNone(i.lft, i.name)
+            numbers += [i.lft, i.rght]
+            if i.owner_id:
+                parent = nodes[i.owner_id]
+                self.assertEqual(i.lvl, parent.lvl + 1, i.name)
+                self.assertTrue(parent.lft < i.lft < i.rght < parent.rght, i.name)
+            else:
+                self.assertEqual(i.lvl, 0, i.name)
+            childcount = sum(1 for j in nodes.values() if j.owner_id == i.name)
+            if not childcount:
+                self.assertEqual(i.rght, i.lft + 1, i.name)
+        self.assertEqual(sorted(numbers), list(range(1, 2 * len(nodes) + 1)))
+
+    def test_hierarchy(self):
+        Location.rebuildHierarchy()
+        self.checkHierarchy(Location)
+
+        # Incremental insert, move and delete
+        Location.objects.create(name="Region A", owner_id="All locations")
+        Location.objects.create(name="Region B")
+        for i in range(5):
+            Location.objects.create(name="Location A%s" % i, owner_id="Region A")
+        self.checkHierarchy(Location)
+        loc = Location.objects.get(name="Region A")
+        loc.owner_id = "Region B"
+        loc.save()
+        self.checkHierarchy(Location)
+        loc.owner_id = "All locations"
+        loc.save()
+        self.checkHierarchy(Location)
+        Location.objects.get(name="Location A3").delete()
+        self.checkHierarchy(Location)
+        Location.objects.get(name="Region A").delete()
+        self.checkHierarchy(Location)
+        self.assertFalse(Location.objects.filter(lft__isnull=True).exists())
+
+        # A loop in the hierarchy isn't allowed to move
+        loc = Location.objects.get(name="Region B")
+        loc.owner_id = "Location A1"
+        loc.save()
+        Location.objects.filter(name="Location A1").update(owner="Region B", lft=None)
+        Location.rebuildHierarchy()
+        self.assertFalse(Location.objects.filter(lft__isnull=True).exists())
+
+        # Full rebuild of a deep hierarchy
+        Location.objects.filter(name="Location A1").update(owner=None)
+        parent = None
+        for i in range(2000):
+            parent = Location.objects.create(name="Level %s" % i, owner=parent)
+        Location.objects.all().update(lft=None)
+        Location.rebuildHierarchy()
+        self.checkHierarchy(Location)
+        self.assertEqual(Location.objects.get(name="Level 1999").lvl, 1999)
+
     def test_forms(self):
         item = Item.objects.all()[0].name
         loc1 = Location.objects.all()[0].name
@@ -429,6 +539,61 @@ class ExcelTest(TransactionTestCase):
         self.run_workbook("zh-tw")
 
 
+class ExcelStreamingTest(TestCase):
+    def setUp(self):
+        os.environ["FREPPLE_TEST"] = "YES"
+        super().setUp()
+
+    def tearDown(self):
+        del os.environ["FREPPLE_TEST"]
+        super().tearDown()
+
+    def test_large_workbook(self):
+        # Generate a workbook with a title above an auto-filter data table
+        rows = 20000
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("customer")
+        ws.append(["Customers"])
+        ws.append([])
+        ws.append(["name", "description", "category"])
+        for i in range(rows):
+            ws.append(["customer %s" % i, "description", i % 10])
+        ws.auto_filter.ref = "A3:C%s" % (rows + 3)
+        data = tempfile.NamedTemporaryFile(suffix=".xlsx")
+        try:
+            wb.save(data.name)
+
+            # Read the workbook row by row, and check the memory that took
+            tracemalloc.start()
+            try:
+                wb = loadWorkbook(data.name)
+                ws = wb["customer"]
+                self.assertEqual(getAutoFilterBounds(ws), (1, 3, 3, rows + 3))
+                cnt = 0
+                for row in ws:
+                    if row and row[0].value:
+                        cnt += 1
+                wb.close()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertEqual(cnt, rows + 2)
+            self.assertLess(peak, 20 * 1024 * 1024)
+
+            # Import the data rows
+            wb = loadWorkbook(data.name)
+            errors = [
+                i
+                for i in parseExcelWorksheet(Customer, wb["customer"])
+                if i[0] == logging.ERROR
+            ]
+            wb.close()
+            self.assertEqual(errors, [])
+            self.assertEqual(Customer.objects.count(), rows)
+        finally:
+            data.close()
+
+
 class freppleREST(APITestCase):
     fixtures = ["demo"]
 
@@ -703,6 +868,51 @@ class freppleREST(APITestCase):
         self.assertEqual(response.status_code, 204)
         self.assertEqual(Customer.objects.filter(category="TEST DELETE").count(), 0)
 
+    def test_api_pagination(self):
+        # Unpaginated lists are streamed
+        response = self.client.get("/api/input/item/?fields=name,cost")
+        self.assertIsInstance(response, StreamingHttpResponse)
+        items = json.loads(b"".join(response.streaming_content))
+        self.assertEqual(len(items), Item.objects.count())
+        self.assertEqual(set(items[0].keys()), {"name", "cost"})
+
+        # Keyset pagination
+        names = []
+        url = "/api/input/item/?page_size=3&fields=name"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page["results"]), 3)
+            names += [i["name"] for i in page["results"]]
+            url = page["next"]
+        self.assertEqual(
+            names, list(Item.objects.order_by("name").values_list("name", flat=True))
+        )
+
+        # Records with the same modification date, as created by a bulk upload
+        Item.objects.update(lastmodified=datetime(2026, 1, 1, 12, 0, 0, 123456))
+        names = []
+        url = "/api/input/item/?page_size=3&fields=name&ordering=lastmodified"
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            names += [i["name"] for i in page["results"]]
+            if page["next"]:
+                last = page
+            url = page["next"]
+        self.assertEqual(
+            names, list(Item.objects.order_by("name").values_list("name", flat=True))
+        )
+
+        # The previous page of the last page
+        response = self.client.get(last["next"].replace("http://testserver", ""))
+        response = self.client.get(
+            response.json()["previous"].replace("http://testserver", "")
+        )
+        self.assertEqual(response.json()["results"], last["results"])
+
     def test_api_customer(self):
         response = self.client.get("/api/input/customer/")
         checkResponse(self, response)
@@ -881,6 +1091,80 @@ class NotificationTest(TransactionTestCase):
         NotificationFactory.start()
         self.assertEqual(Notification.objects.count(), 4)
 
+    def test_follower_index(self):
+        user = User.objects.get(username="admin")
+        itemtype = ContentType.objects.get(model="item")
+        followers = [
+            Follower.objects.create(user=user, content_type=itemtype, object_pk=i)
+            for i in ("all", "item 1", "item 2")
+        ]
+        index = NotificationFactory.indexFollowers(followers)
+        NotificationFactory._buildRegistry()
+        item = Item.objects.create(name="item 1")
+        msg = Comment(content_object=item, object_repr=str(item), type="add")
+
+        # Only the followers of all items and of this item are evaluated
+        self.assertEqual(
+            [
+                flw.object_pk
+                for flw, funcs in NotificationFactory.candidates(
+                    msg, NotificationFactory._reg[Item], index
+                )
+            ],
+            ["all", "item 1"],
+        )
+
+    def test_follower_related_keys(self):
+        user = User.objects.get(username="admin")
+        restype = ContentType.objects.get(model="resource")
+        followers = [
+            Follower.objects.create(
+                user=user,
+                content_type=restype,
+                object_pk=i,
+                args={"sub": ["input.manufacturingorder"]},
+            )
+            for i in ("resource 1", "resource 2")
+        ]
+        index = NotificationFactory.indexFollowers(followers)
+        NotificationFactory._buildRegistry()
+        loc = Location.objects.create(name="location 1")
+        item = Item.objects.create(name="item 1")
+        oper = Operation.objects.create(
+            name="operation 1", type="fixed_time", item=item, location=loc
+        )
+        res = Resource.objects.create(name="resource 1", location=loc)
+        mo = ManufacturingOrder.objects.create(
+            reference="MO 1",
+            operation=oper,
+            quantity=1,
+            status="confirmed",
+            startdate=date(2026, 1, 1),
+            enddate=date(2026, 1, 2),
+        )
+        OperationPlanResource.objects.create(
+            operationplan=mo,
+            resource=res,
+            quantity=1,
+            startdate=mo.startdate,
+            enddate=mo.enddate,
+        )
+        msg = Comment.objects.create(content_object=mo, object_repr=str(mo), type="add")
+        msg = Comment.objects.prefetch_related("content_object").get(pk=msg.pk)
+        NotificationFactory.prefetch([msg])
+
+        # Only the follower of the resource of the order is evaluated, and the
+        # prefetched resources are used without extra queries
+        with self.assertNumQueries(0):
+            candidates = NotificationFactory.candidates(
+                msg, NotificationFactory._reg[ManufacturingOrder], index
+            )
+            self.assertEqual(
+                [flw.object_pk for flw, funcs in candidates], ["resource 1"]
+            )
+            flw, funcs = candidates[0]
+            self.assertTrue(all(c(flw, msg) for c in funcs))
+
     def test_performance(self):
         # Admin user follows all items
         user = User.objects.get(username="admin")
@@ -200,68 +200,35 @@ class OperationPlanMixin(GridReport):
                 Q(reference=parentreference) | Q(owner__reference=parentreference)
             )
 
-        if "freppledb.forecast" in settings.INSTALLED_APPS:
-            return query.annotate(
-                demands=RawSQL(
-                    """
-          select json_agg(json_build_array(value, key, tp))
+        return query.annotate(
+            demands=RawSQL(
+                """
+          select json_agg(json_build_array(quantity, demand, tp))
           from (
             select
-              key, value,
-              case when demand.name is not null then 'D' when forecast.name is not null then 'F' end as tp
-            from jsonb_each_text(operationplan.plan->'pegging')
-            left outer join demand on key = demand.name
-            left outer join forecast on substring(key from 0 for length(key)
-                                                                 - position(' - ' in reverse(key))
-                                                                 -1) = forecast.name
-            where demand.name is not null or forecast.name is not null
-            order by value desc, key desc
+              quantity::float8 as quantity, demand,
+              case when forecast is not null then 'F' else 'D' end as tp
+            from operationplan_pegging
+            where operationplan_pegging.operationplan = operationplan.reference
+            order by quantity desc, demand desc
             limit 10
           ) peg""",
-                    [],
-                ),
-                end_items=RawSQL(
-                    """
-          select json_agg(json_build_array(key, val))
-          from (
-            select coalesce(demand.item_id, forecast.item_id) as key, sum(value::numeric) as val
-            from jsonb_each_text(operationplan.plan->'pegging')
-            left outer join demand on key = demand.name
-            left outer join forecast on substring(key from 0 for position(' - ' in key)) = forecast.name
-            group by coalesce(demand.item_id, forecast.item_id)
-            order by 2 desc
-            limit 10
-            ) peg_items""",
-                    [],
-                ),
-            )
-        else:
-            return query.annotate(
-                demands=RawSQL(
-                    """
-          select json_agg(json_build_array(value, key))
-          from (
-            select key, value
-            from jsonb_each_text(operationplan.plan->'pegging')
-            order by value desc, key desc
-            limit 10
-            ) peg""",
-                    [],
-                ),
-                end_items=RawSQL(
-                    """
+                [],
+            ),
+            end_items=RawSQL(
+                """
           select json_agg(json_build_array(key, val))
           from (
-            select demand.item_id as key, sum(value::numeric) as val
-            from jsonb_each_text(operationplan.plan->'pegging')
-            inner join demand on key = demand.name
-            group by demand.item_id
+            select end_item as key, sum(quantity)::float8 as val
+            from operationplan_pegging
+            where operationplan_pegging.operationplan = operationplan.reference
+            group by end_item
             order by 2 desc
             limit 10
             ) peg_items""",
-                    [],
-                ),
-            )
+                [],
+            ),
+        )
 
     @classmethod
     def _generate_kanban_data(cls, request, *args, **kwargs):
@@ -47,6 +47,7 @@ from freppledb.input.commands import (
     loadOperationPlans,
     loadOperationPlanMaterials,
 )
+from freppledb.odoo.utils import XMLStream
 
 logger = logging.getLogger(__name__)
 
@@ -214,26 +215,18 @@ class OdooReadData(PlanTask):
                 )
                 request.add_header("Accept-Encoding", "gzip")
 
-                # Download and parse XML data
+                # Download and parse XML data, streaming it in chunks
                 with urlopen(request) as response:
-                    if response.info().get("Content-Encoding") == "gzip":
-                        frepple.readXMLdata(
-                            gzip.decompress(response.read())
-                            .decode(encoding="utf-8", errors="ignore")
-                            .translate({ord(i): None for i in "\f\v\b"}),
-                            False,
-                            False,
-                            loglevel,
-                        )
-                    else:
-                        frepple.readXMLdata(
-                            response.read()
-                            .decode(encoding="utf-8", errors="ignore")
-                            .translate({ord(i): None for i in "\f\v\b"}),
-                            False,
-                            False,
-                            loglevel,
-                        )
+                    frepple.readXMLdata(
+                        XMLStream(
+                            response,
+                            compressed=response.info().get("Content-Encoding")
+                            == "gzip",
+                        ),
+                        False,
+                        False,
+                        loglevel,
+                    )
 
             except HTTPError as e:
                 print("Error connecting to odoo at %s" % url)
@@ -263,13 +256,8 @@ class OdooReadData(PlanTask):
 
         else:
             # Parse XML data file
-            with open(debugFile, encoding="utf-8") as f:
-                frepple.readXMLdata(
-                    f.read().translate({ord(i): None for i in "\f\v\b"}),
-                    False,
-                    False,
-                    loglevel,
-                )
+            with open(debugFile, "rb") as f:
+                frepple.readXMLdata(XMLStream(f), False, False, loglevel)
 
         # All predefined inventory detail records are now loaded.
         # We now create any missing ones.
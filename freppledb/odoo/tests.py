@@ -21,21 +21,88 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+import gzip
+import hashlib
+import io
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import os
+from threading import Thread
+import tracemalloc
 from unittest import skipUnless
+from urllib.request import urlopen, Request
 import xmlrpc.client
 
 from django.conf import settings
 from django.core import management
 from django.db.models import F
-from django.test import TransactionTestCase
+from django.test import SimpleTestCase, TransactionTestCase
 from django.contrib.auth.models import Group
 
 from freppledb.common.models import User
 from freppledb.input.models import Item, PurchaseOrder, ManufacturingOrder
 from .management.commands.odoo_container import Command as odoo_container_command
-from .utils import getOdooVersion
+from .utils import getOdooVersion, XMLStream
+
+
+class XMLStreamTest(SimpleTestCase):
+    def test_streaming(self):
+        # Generate a large XML document with some invalid characters in it
+        data = b"".join(
+            [b"<plan><items>"]
+            + [
+                ('<item name="item\f%s \xe9" description="\v\b"/>' % i).encode("utf-8")
+                for i in range(200000)
+            ]
+            + [b"</items></plan>"]
+        )
+        expected = hashlib.md5(data.translate(None, b"\f\v\b")).hexdigest()
+        compressed = gzip.compress(data)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(compressed)))
+                self.end_headers()
+                self.wfile.write(compressed)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("localhost", 0), Handler)
+        Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            request = Request("http://localhost:%s/" % server.server_port)
+            request.add_header("Accept-Encoding", "gzip")
+            with urlopen(request) as response:
+                tracemalloc.start()
+                stream = XMLStream(
+                    response,
+                    compressed=response.info().get("Content-Encoding") == "gzip",
+                )
+                md5 = hashlib.md5()
+                while True:
+                    chunk = stream.read(8192)
+                    if not chunk:
+                        break
+                    self.assertLessEqual(len(chunk), 8192)
+                    md5.update(chunk)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            self.assertEqual(md5.hexdigest(), expected)
+            # Memory use is bounded by the chunk size, not the document size
+            self.assertLess(peak, len(data) / 10)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_gzip_members(self):
+        # A gzip stream can consist of multiple concatenated members
+        data = b"<plan><items>" + b'<item name="a"/>' * 10000 + b"</items></plan>"
+        compressed = gzip.compress(data[:1000]) + gzip.compress(data[1000:])
+        stream = XMLStream(io.BytesIO(compressed), compressed=True)
+        self.assertEqual(stream.read(), data)
 
 
 @skipUnless("freppledb.odoo" in settings.INSTALLED_APPS, "App not activated")
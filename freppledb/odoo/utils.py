@@ -21,6 +21,9 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+import codecs
+import gzip
+import io
 import os
 
 
@@ -38,3 +41,46 @@ def getOdooVersion(
                     return l.split(":", 1)[-1]
     except Exception:
         raise Exception("Can't determine odoo version")
+
+
+class XMLStream(io.RawIOBase):
+    """
+    A readable stream that decompresses and cleans XML data in chunks.
+
+    The form feed, vertical tab and backspace characters aren't allowed in XML
+    documents and are removed. Invalid UTF-8 sequences are ignored.
+    The complete document is never kept in memory, which allows feeding large
+    documents to frepple.readXMLdata.
+    """
+
+    chunksize = 65536
+
+    def __init__(self, source, compressed=False):
+        # GzipFile also reads the members a server appends after the first one
+        self.source = gzip.GzipFile(fileobj=source) if compressed else source
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.buffer = b""
+        self.offset = 0
+        self.eof = False
+
+    def readable(self):
+        return True
+
+    def _nextChunk(self):
+        data = self.source.read(self.chunksize)
+        if not data:
+            self.eof = True
+        self.buffer = self.decoder.decode(
+            data.translate(None, b"\f\v\b"), final=self.eof
+        ).encode("utf-8")
+        self.offset = 0
+
+    def readinto(self, b):
+        while self.offset >= len(self.buffer):
+            if self.eof:
+                return 0
+            self._nextChunk()
+        cnt = min(len(b), len(self.buffer) - self.offset)
+        b[:cnt] = self.buffer[self.offset : self.offset + cnt]
+        self.offset += cnt
+        return cnt
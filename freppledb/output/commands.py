@@ -25,6 +25,7 @@ from datetime import timedelta, datetime, date
 import json
 import logging
 import os
+import tempfile
 from psycopg2.extras import execute_batch
 
 from django.conf import settings
@@ -34,6 +35,8 @@ from freppledb.common.commands import (
     PlanTaskRegistry,
     PlanTask,
     clean_value,
+    copyRows,
+    textRows,
     CopyFromGenerator,
 )
 from freppledb.input.models import OperationPlan
@@ -41,6 +44,18 @@ from freppledb.boot import getAttributes
 
 logger = logging.getLogger(__name__)
 
+# PostgreSQL column type for each attribute type
+attributeTypes = {
+    "boolean": "boolean",
+    "duration": "interval",
+    "integer": "integer",
+    "number": "numeric",
+    "string": "varchar",
+    "time": "time",
+    "date": "date",
+    "datetime": "timestamptz",
+}
+
 
 @PlanTaskRegistry.register
 class TruncatePlan(PlanTask):
@@ -72,14 +87,45 @@ class TruncatePlan(PlanTask):
         cursor = connections[database].cursor()
         if cluster == -1:
             # Complete export for the complete model
+            PublishPlan.active = PublishPlan.getWeight(database=database) > 0
+            PublishPlan.tables = (
+                PublishPlan.createShadowTables(database) if PublishPlan.active else ()
+            )
+            PublishPlan.pending = []
             if "fcst" in os.environ:
-                cursor.execute(
-                    "truncate table out_problem, out_resourceplan, out_constraint"
-                )
+                tables = [
+                    t
+                    for t in ("out_problem", "out_resourceplan", "out_constraint")
+                    if t not in PublishPlan.tables
+                ]
+                if tables:
+                    cursor.execute("truncate table %s" % ", ".join(tables))
             else:
                 # TODO not very clean to make this difference here
-                cursor.execute("delete from out_problem where name != 'outlier'")
-                cursor.execute("truncate table out_resourceplan, out_constraint")
+                if "out_problem" not in PublishPlan.tables:
+                    cursor.execute("delete from out_problem where name != 'outlier'")
+                tables = [
+                    t
+                    for t in ("out_resourceplan", "out_constraint")
+                    if t not in PublishPlan.tables
+                ]
+                if tables:
+                    cursor.execute("truncate table %s" % ", ".join(tables))
+            tables = [
+                t
+                for t in (
+                    "operationplanmaterial",
+                    "operationplanresource",
+                    "operationplan_pegging",
+                )
+                if t not in PublishPlan.tables
+            ]
+            if PublishPlan.active:
+                # Proposed operationplans are updated in place, and the
+                # obsolete ones are deleted when the plan is published.
+                if tables:
+                    cursor.execute("truncate table %s" % ", ".join(tables))
+                return
             cursor.execute(
                 """
                 update operationplan
@@ -95,7 +141,7 @@ class TruncatePlan(PlanTask):
             )
             cursor.execute(
                 """
-                truncate operationplanmaterial, operationplanresource
+                truncate operationplanmaterial, operationplanresource, operationplan_pegging
                 """
             )
             cursor.execute(
@@ -107,12 +153,19 @@ class TruncatePlan(PlanTask):
         elif cluster == -2:
             # Minimal incremental export
             if deleted_opplans:
+                cursor.execute(
+                    """
+                    delete from operationplan_pegging
+                    where operationplan = any(%s)
+                    """,
+                    (list(deleted_opplans),),
+                )
                 cursor.execute(
                     """
                     delete from operationplan
-                    where reference in any(%s)
+                    where reference = any(%s)
                     """,
-                    (deleted_opplans),
+                    (list(deleted_opplans),),
                 )
             if resources:
                 resnames = [r.name for r in resources]
@@ -231,6 +284,11 @@ class TruncatePlan(PlanTask):
                 delete from operationplanresource
                 using opplans
                 where opplans.reference = operationplan_id
+                ),
+                opplanpeg as (
+                delete from operationplan_pegging
+                using opplans
+                where opplans.reference = operationplan_pegging.operationplan
                 )
                 delete from operationplan
                 using opplans
@@ -314,6 +372,338 @@ class TruncatePlan(PlanTask):
             cursor.execute("drop table cluster_keys")
 
 
+@PlanTaskRegistry.register
+class PublishPlan(PlanTask):
+    """
+    With the EXPORT_SHADOW_TABLES setting, a complete export writes the plan
+    output tables into unlogged copies of the live tables, named <table>_new.
+    The live tables keep the previous plan until this task builds the
+    indexes and constraints of the copies and swaps them in with a short
+    transaction.
+
+    Proposed operationplans are updated in place by the export, and the ones
+    that are no longer part of the plan are deleted at the swap.
+    Tasks that read the exported plan are postponed till after the swap.
+    """
+
+    description = "Publishing plan"
+    sequence = 401.5
+    export = True
+
+    # Tables that can be exported in a shadow table
+    shadowTables = (
+        "operationplanmaterial",
+        "operationplanresource",
+        "out_resourceplan",
+        "out_constraint",
+        "out_problem",
+        "operationplan_pegging",
+    )
+
+    # Fields for internal use, reset at the start of each complete export
+    active = False
+    tables = ()
+    pending = []
+    timestamp = None
+
+    @classmethod
+    def getWeight(cls, **kwargs):
+        # The "shadowtables" flag of runplan --env overrides the setting
+        if "shadowtables" in os.environ:
+            enabled = os.environ["shadowtables"] not in ("0", "false")
+        else:
+            enabled = getattr(settings, "EXPORT_SHADOW_TABLES", False)
+        if "supply" in os.environ and enabled:
+            return 1
+        else:
+            return -1
+
+    @classmethod
+    def table(cls, name, cluster=-1):
+        """
+        Returns the table an export task needs to write into.
+        """
+        return "%s_new" % name if cluster == -1 and name in cls.tables else name
+
+    @classmethod
+    def defer(cls, task, cluster=-1, **kwargs):
+        """
+        Tasks that read the exported plan call this method first.
+        When the plan is exported in shadow tables, it returns True and the
+        task is run again after the swap.
+        """
+        if cluster != -1 or not cls.active or kwargs.get("published", False):
+            return False
+        cls.pending.append((task, kwargs))
+        return True
+
+    @classmethod
+    def createShadowTables(cls, database=DEFAULT_DB_ALIAS):
+        """
+        Creates empty shadow tables, and returns the list of tables they replace.
+
+        Tables referenced by foreign keys or views of other tables are
+        exported in the live table.
+        """
+        tables = []
+        with connections[database].cursor() as cursor:
+            for t in cls.shadowTables:
+                # Leftovers from a previous export
+                cursor.execute("drop table if exists %s_new, %s_old" % (t, t))
+                cursor.execute(
+                    """
+                    select exists (
+                      select 1 from pg_constraint
+                      where confrelid = %s::regclass and conrelid != confrelid
+                      union all
+                      select 1 from pg_depend
+                      inner join pg_rewrite on pg_rewrite.oid = pg_depend.objid
+                      where pg_depend.refobjid = %s::regclass
+                      and pg_rewrite.ev_class != %s::regclass
+                      )
+                    """,
+                    (t, t, t),
+                )
+                if cursor.fetchone()[0]:
+                    continue
+                cursor.execute(
+                    """
+                    create unlogged table %s_new
+                    (like %s including defaults including identity including generated including constraints)
+                    """
+                    % (t, t)
+                )
+
+                # Identity columns continue from the live table
+                cursor.execute(
+                    """
+                    select attname from pg_attribute
+                    where attrelid = %s::regclass and attidentity != '' and not attisdropped
+                    """,
+                    (t,),
+                )
+                for (col,) in cursor.fetchall():
+                    cursor.execute("select coalesce(max(%s), 0) + 1 from %s" % (col, t))
+                    cursor.execute(
+                        "alter table %s_new alter column %s restart with %s"
+                        % (t, col, cursor.fetchone()[0])
+                    )
+
+                # Read access for the same users
+                cursor.execute(
+                    """
+                    select grantee, string_agg(privilege_type, ', ')
+                    from information_schema.role_table_grants
+                    where table_schema = 'public' and table_name = %s
+                    and grantee != current_user
+                    group by grantee
+                    """,
+                    (t,),
+                )
+                for grantee, privileges in cursor.fetchall():
+                    cursor.execute(
+                        "grant %s on %s_new to %s"
+                        % (privileges, t, connections[database].ops.quote_name(grantee))
+                    )
+                tables.append(t)
+
+            if "out_problem" in tables and "fcst" not in os.environ:
+                # Outliers are only computed when the forecast is generated
+                cursor.execute(
+                    """
+                    select string_agg(quote_ident(column_name), ', ')
+                    from information_schema.columns
+                    where table_schema = 'public' and table_name = 'out_problem'
+                    and is_identity = 'NO' and is_generated = 'NEVER'
+                    """
+                )
+                columns = cursor.fetchone()[0]
+                cursor.execute(
+                    """
+                    insert into out_problem_new (%s)
+                    select %s from out_problem where name = 'outlier'
+                    """
+                    % (columns, columns)
+                )
+        return tables
+
+    @classmethod
+    def prepareShadowTable(cls, cursor, t):
+        """
+        Converts a shadow table to a regular table with the indexes and
+        constraints of the live table, under temporary names.
+        Returns the renames to perform at the swap.
+        """
+        cursor.execute("alter table %s_new set logged" % t)
+        renames = []
+        cursor.execute(
+            """
+            select pg_index.indexrelid, pg_class.relname, pg_index.indisunique,
+              pg_get_indexdef(pg_index.indexrelid), pg_constraint.contype
+            from pg_index
+            inner join pg_class on pg_class.oid = pg_index.indexrelid
+            left outer join pg_constraint
+              on pg_constraint.conindid = pg_index.indexrelid
+              and pg_constraint.conrelid = pg_index.indrelid
+            where pg_index.indrelid = %s::regclass
+            """,
+            (t,),
+        )
+        for oid, name, unique, definition, contype in cursor.fetchall():
+            tmpname = "shadow_%s" % oid
+            cursor.execute(
+                "create %sindex %s on %s_new using %s"
+                % (
+                    "unique " if unique else "",
+                    tmpname,
+                    t,
+                    definition.split(" USING ", 1)[1],
+                )
+            )
+            if contype == "p":
+                cursor.execute(
+                    "alter table %s_new add constraint %s primary key using index %s"
+                    % (t, tmpname, tmpname)
+                )
+            elif contype == "u":
+                cursor.execute(
+                    "alter table %s_new add constraint %s unique using index %s"
+                    % (t, tmpname, tmpname)
+                )
+            renames.append(("constraint" if contype else "index", name, oid))
+        cursor.execute(
+            """
+            select oid, conname, pg_get_constraintdef(oid)
+            from pg_constraint
+            where conrelid = %s::regclass and contype = 'f'
+            """,
+            (t,),
+        )
+        for oid, name, definition in cursor.fetchall():
+            cursor.execute(
+                "alter table %s_new add constraint shadow_%s %s" % (t, oid, definition)
+            )
+            renames.append(("foreign key", name, oid))
+        cursor.execute("analyze %s_new" % t)
+        return renames
+
+    @classmethod
+    def swap(cls, cursor, t, renames):
+        """
+        Replaces the live table with the shadow table. The live table is kept
+        as <table>_old, without foreign keys.
+        """
+        cursor.execute(
+            """
+            select pg_get_triggerdef(oid) from pg_trigger
+            where tgrelid = %s::regclass and not tgisinternal
+            """,
+            (t,),
+        )
+        triggers = [i[0] for i in cursor.fetchall()]
+        cursor.execute(
+            """
+            select pg_get_serial_sequence(%s, attname), attname
+            from pg_attribute
+            where attrelid = %s::regclass and attnum > 0 and not attisdropped
+            and attidentity = ''
+            """,
+            (t, t),
+        )
+        sequences = [i for i in cursor.fetchall() if i[0]]
+        cursor.execute("alter table %s rename to %s_old" % (t, t))
+        for kind, name, oid in renames:
+            if kind == "index":
+                cursor.execute('alter index "%s" rename to old_%s' % (name, oid))
+            elif kind == "constraint":
+                cursor.execute(
+                    'alter table %s_old rename constraint "%s" to old_%s'
+                    % (t, name, oid)
+                )
+            else:
+                cursor.execute('alter table %s_old drop constraint "%s"' % (t, name))
+        cursor.execute("alter table %s_new rename to %s" % (t, t))
+        for kind, name, oid in renames:
+            if kind == "index":
+                cursor.execute('alter index shadow_%s rename to "%s"' % (oid, name))
+            else:
+                cursor.execute(
+                    'alter table %s rename constraint shadow_%s to "%s"'
+                    % (t, oid, name)
+                )
+        for seq, col in sequences:
+            cursor.execute("alter sequence %s owned by %s.%s" % (seq, t, col))
+        for trg in triggers:
+            cursor.execute(trg)
+
+    @classmethod
+    def run(cls, cluster=-1, database=DEFAULT_DB_ALIAS, **kwargs):
+        if cluster != -1 or not cls.active:
+            return
+        with connections[database].cursor() as cursor:
+            # Build the indexes and constraints before locking anything
+            renames = {t: cls.prepareShadowTable(cursor, t) for t in cls.tables}
+
+            with transaction.atomic(using=database):
+                if cls.tables:
+                    cursor.execute(
+                        "lock table %s in access exclusive mode" % ", ".join(cls.tables)
+                    )
+                for t in cls.tables:
+                    cls.swap(cursor, t, renames[t])
+
+                # A swap replaces all records, just like a truncate
+                cursor.execute(
+                    """
+                    insert into common_tombstone (tablename)
+                    select unnest(%s::text[])
+                    where to_regclass('common_tombstone') is not null
+                    """,
+                    (list(cls.tables),),
+                )
+
+                # Delete the proposed operationplans the export didn't update
+                if cls.timestamp:
+                    cursor.execute(
+                        """
+                        update operationplan
+                          set owner_id = null
+                          where owner_id in (
+                            select reference from operationplan
+                            where (status = 'proposed' or status is null or type = 'STCK')
+                            and lastmodified < %s
+                            )
+                        """,
+                        (cls.timestamp,),
+                    )
+                    cursor.execute(
+                        """
+                        delete from operationplan
+                        where (status = 'proposed' or status is null or type = 'STCK')
+                        and lastmodified < %s
+                        """,
+                        (cls.timestamp,),
+                    )
+                ExportOperationPlans.updateDemands(cursor)
+
+            # Queries that started before the swap may still read the previous
+            # plan. We don't wait for them: what can't be dropped now will be
+            # dropped at the next export.
+            for t in cls.tables:
+                try:
+                    with transaction.atomic(using=database):
+                        cursor.execute("set local lock_timeout = '1s'")
+                        cursor.execute("drop table if exists %s_old" % t)
+                except Exception:
+                    pass
+
+        # Run the tasks that read the plan
+        cls.active = False
+        for task, kw in cls.pending:
+            task.run(cluster=-1, published=True, **kw)
+        cls.pending = []
+
+
 @PlanTaskRegistry.register
 class ShowPlanStats(PlanTask):
     description = "Show plan statistics"
@@ -395,7 +785,7 @@ class ExportProblems(PlanTask):
         with connections[database].cursor() as cursor:
             cursor.copy_from(
                 CopyFromGenerator(cls.getData(cluster)),
-                "out_problem",
+                PublishPlan.table("out_problem", cluster),
                 columns=(
                     "entity",
                     "name",
@@ -405,7 +795,7 @@ class ExportProblems(PlanTask):
                     "enddate",
                     "weight",
                 ),
-                size=1024,
+                size=CopyFromGenerator.chunksize,
                 sep="\v",
             )
 
@@ -466,7 +856,7 @@ class ExportConstraints(PlanTask):
         with connections[database].cursor() as cursor:
             cursor.copy_from(
                 CopyFromGenerator(cls.getData(cluster=cluster)),
-                "out_constraint",
+                PublishPlan.table("out_constraint", cluster),
                 columns=(
                     "demand",
                     "forecast",
@@ -479,7 +869,7 @@ class ExportConstraints(PlanTask):
                     "enddate",
                     "weight",
                 ),
-                size=1024,
+                size=CopyFromGenerator.chunksize,
                 sep="\v",
             )
 
@@ -490,6 +880,37 @@ class ExportOperationPlans(PlanTask):
     sequence = (401, "export1", 1)
     export = True
 
+    # Format of the COPY command: "text" or "binary"
+    copyformat = getattr(settings, "EXPORT_COPY_FORMAT", "text")
+
+    # Exported fields and their type in the temporary table
+    fields = (
+        ("name", "varchar"),
+        ("type", "varchar"),
+        ("status", "varchar"),
+        ("quantity", "numeric"),
+        ("startdate", "timestamptz"),
+        ("enddate", "timestamptz"),
+        ("criticality", "numeric"),
+        ("delay", "numeric"),
+        ("plan", "jsonb"),
+        ("source", "varchar"),
+        ("lastmodified", "timestamptz"),
+        ("operation_id", "varchar"),
+        ("owner_id", "varchar"),
+        ("item_id", "varchar"),
+        ("destination_id", "varchar"),
+        ("origin_id", "varchar"),
+        ("location_id", "varchar"),
+        ("supplier_id", "varchar"),
+        ("demand_id", "varchar"),
+        ("due", "timestamptz"),
+        ("color", "numeric"),
+        ("reference", "varchar"),
+        ("batch", "varchar"),
+        ("quantity_completed", "numeric"),
+    )
+
     @classmethod
     def getWeight(cls, **kwargs):
         if "supply" in os.environ or kwargs.get("exportstatic", False):
@@ -497,11 +918,33 @@ class ExportOperationPlans(PlanTask):
         else:
             return -1
 
-    @staticmethod
-    def getPegging(opplan, buffer=None):
+    # Temporary file collecting the normalized pegging during the export
+    pegging = None
+
+    @classmethod
+    def getPegging(cls, opplan, buffer=None):
         import frepple
 
         unavail = opplan.unavailable
+        pegged = [(j.demand, round(j.quantity, 8)) for j in opplan.pegging_demand]
+        if cls.pegging:
+            fcstbucket = getattr(frepple, "demand_forecastbucket", None)
+            for dmd, qty in pegged:
+                fcst = (
+                    dmd.owner.name
+                    if fcstbucket and isinstance(dmd, fcstbucket)
+                    else None
+                )
+                cls.pegging.write(
+                    "%s\v%s\v%s\v%s\v%s\n"
+                    % (
+                        clean_value(opplan.reference),
+                        clean_value(dmd.name),
+                        clean_value(fcst),
+                        clean_value(dmd.item.name if dmd.item else None),
+                        qty,
+                    )
+                )
 
         upstream_opplans = None
         if (
@@ -531,9 +974,7 @@ class ExportOperationPlans(PlanTask):
                 ]
 
         pln = {
-            "pegging": {
-                j.demand.name: round(j.quantity, 8) for j in opplan.pegging_demand
-            },
+            "pegging": {dmd.name: qty for dmd, qty in pegged},
             "downstream_opplans": [
                 (j.operationplan.reference, j.quantity, j.offset)
                 for j in opplan.pegging_downstream_first_level
@@ -570,29 +1011,20 @@ class ExportOperationPlans(PlanTask):
                 pln["location"] = buffer.location.name
         if opplan.rule:
             pln["setuprule"] = [opplan.rule.setupmatrix.name, opplan.rule.priority]
-        # We need to double any backslash to assure that the string remains
-        # valid when passing it through postgresql (which eats them away)
-        return json.dumps(pln).replace("\\", "\\\\")
+        return json.dumps(pln)
 
     @classmethod
-    def getData(
+    def getRows(
         cls, with_fcst, timestamp, cluster=-1, opplans=None, accepted_status=[]
     ):
         import frepple
 
-        linetemplate = "%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s"
-        if with_fcst:
-            linetemplate += "\v%s"
-        for unused in cls.attrs:
-            linetemplate += "\v%s"
-        linetemplate += "\n"
-
         if cluster == -2:
             for j in opplans:
                 if j.status in accepted_status:
                     data = cls.getDataOpplan(j.operation, j, with_fcst, timestamp)
                     if data:
-                        yield linetemplate % tuple(data)
+                        yield data
         else:
             for i in frepple.operations():
                 if cluster != -1 and i.cluster not in cluster:
@@ -602,7 +1034,11 @@ class ExportOperationPlans(PlanTask):
                     if j.status in accepted_status:
                         data = cls.getDataOpplan(i, j, with_fcst, timestamp)
                         if data:
-                            yield linetemplate % tuple(data)
+                            yield data
+
+    @classmethod
+    def getData(cls, *args, **kwargs):
+        return textRows(cls.getRows(*args, **kwargs))
 
     @classmethod
     def getDataOpplan(cls, i, j, with_fcst, timestamp):
@@ -641,236 +1077,242 @@ class ExportOperationPlans(PlanTask):
         if isinstance(i, frepple.operation_inventory) or (
             j.demand or (j.owner and j.owner.demand)
         ):
-            color = "\\N"
+            color = None
         else:
             color = j.getColor()[0]
             if color == 999999:
-                color = "\\N"
+                color = None
 
         data = None
         if isinstance(i, frepple.operation_inventory):
             # Export inventory
             data = [
-                clean_value(i.name),
+                i.name,
                 "STCK",
                 status,
                 round(j.quantity, 8),
-                str(j.start),
-                str(j.end),
+                j.start,
+                j.end,
                 round(j.criticality, 8),
                 delay,
                 cls.getPegging(j),
-                clean_value(j.source),
+                j.source,
                 timestamp,
-                "\\N",
+                None,
                 (
-                    clean_value(j.owner.reference)
+                    j.owner.reference
                     if j.owner and not j.owner.operation.hidden
-                    else "\\N"
+                    else None
                 ),
-                clean_value(j.operation.buffer.item.name),
-                clean_value(j.operation.buffer.location.name),
-                "\\N",
-                clean_value(j.operation.buffer.location.name),
-                "\\N",
-                clean_value(j.demand.name) if demand else "\\N",
+                j.operation.buffer.item.name,
+                j.operation.buffer.location.name,
+                None,
+                j.operation.buffer.location.name,
+                None,
+                j.demand.name if demand else None,
                 (
                     j.demand.due
                     if j.demand
-                    else j.owner.demand.due if j.owner and j.owner.demand else "\\N"
+                    else j.owner.demand.due
+                    if j.owner and j.owner.demand
+                    else None
                 ),
-                "\\N",  # color is empty for stock
-                clean_value(j.reference),
-                clean_value(j.batch),
-                "\\N",
+                None,  # color is empty for stock
+                j.reference,
+                j.batch,
+                None,
             ]
         elif isinstance(i, frepple.operation_itemdistribution):
             # Export DO
             data = [
-                clean_value(i.name),
+                i.name,
                 "DO",
                 status,
                 round(j.quantity, 8),
-                str(j.start),
-                str(j.end),
+                j.start,
+                j.end,
                 round(j.criticality, 8),
                 delay,
                 cls.getPegging(j),
-                clean_value(j.source),
+                j.source,
                 timestamp,
-                "\\N",
+                None,
                 (
-                    clean_value(j.owner.reference)
+                    j.owner.reference
                     if j.owner and not j.owner.operation.hidden
-                    else "\\N"
+                    else None
                 ),
                 (
-                    clean_value(j.operation.destination.item.name)
+                    j.operation.destination.item.name
                     if j.operation.destination
                     else j.operation.origin.item.name
                 ),
                 (
-                    clean_value(j.operation.destination.location.name)
+                    j.operation.destination.location.name
                     if j.operation.destination
-                    else "\\N"
-                ),
-                (
-                    clean_value(j.operation.origin.location.name)
-                    if j.operation.origin
-                    else "\\N"
+                    else None
                 ),
-                "\\N",
-                "\\N",
-                clean_value(j.demand.name) if demand else "\\N",
+                (j.operation.origin.location.name if j.operation.origin else None),
+                None,
+                None,
+                j.demand.name if demand else None,
                 (
                     j.demand.due
                     if j.demand
-                    else j.owner.demand.due if j.owner and j.owner.demand else "\\N"
+                    else j.owner.demand.due
+                    if j.owner and j.owner.demand
+                    else None
                 ),
                 color,  # color
-                clean_value(j.reference),
-                clean_value(j.batch),
-                "\\N",
+                j.reference,
+                j.batch,
+                None,
             ]
         elif isinstance(i, frepple.operation_itemsupplier):
             # Export PO
             data = [
-                clean_value(i.name),
+                i.name,
                 "PO",
                 status,
                 round(j.quantity, 8),
-                str(j.start),
-                str(j.end),
+                j.start,
+                j.end,
                 round(j.criticality, 8),
                 delay,
                 cls.getPegging(j),
-                clean_value(j.source),
+                j.source,
                 timestamp,
-                "\\N",
+                None,
                 (
-                    clean_value(j.owner.reference)
+                    j.owner.reference
                     if j.owner and not j.owner.operation.hidden
-                    else "\\N"
+                    else None
                 ),
-                clean_value(j.operation.buffer.item.name),
-                "\\N",
-                "\\N",
-                clean_value(j.operation.buffer.location.name),
-                clean_value(j.operation.itemsupplier.supplier.name),
-                clean_value(j.demand.name) if demand else "\\N",
+                j.operation.buffer.item.name,
+                None,
+                None,
+                j.operation.buffer.location.name,
+                j.operation.itemsupplier.supplier.name,
+                j.demand.name if demand else None,
                 (
                     j.demand.due
                     if j.demand
-                    else j.owner.demand.due if j.owner and j.owner.demand else "\\N"
+                    else j.owner.demand.due
+                    if j.owner and j.owner.demand
+                    else None
                 ),
                 color,  # color
-                clean_value(j.reference),
-                clean_value(j.batch),
-                "\\N",
+                j.reference,
+                j.batch,
+                None,
             ]
         elif not i.hidden:
             # Export MO
             data = [
-                clean_value(i.name),
+                i.name,
                 "MO",
                 status,
                 round(j.quantity, 8),
-                str(j.start),
-                str(j.end),
+                j.start,
+                j.end,
                 round(j.criticality, 8),
                 delay,
                 cls.getPegging(j),
-                clean_value(j.source),
+                j.source,
                 timestamp,
-                clean_value(i.name),
+                i.name,
                 (
-                    clean_value(j.owner.reference)
+                    j.owner.reference
                     if j.owner and not j.owner.operation.hidden
-                    else "\\N"
+                    else None
                 ),
                 (
-                    clean_value(i.item.name)
+                    i.item.name
                     if i.item
                     else (
-                        clean_value(i.owner.item.name)
+                        i.owner.item.name
                         if i.owner and i.owner.item
                         else (
-                            clean_value(j.demand.item.name)
+                            j.demand.item.name
                             if j.demand and j.demand.item
                             else (
-                                clean_value(j.owner.demand.item.name)
+                                j.owner.demand.item.name
                                 if j.owner and j.owner.demand and j.owner.demand.item
-                                else "\\N"
+                                else None
                             )
                         )
                     )
                 ),
-                "\\N",
-                "\\N",
-                clean_value(i.location.name) if i.location else "\\N",
-                "\\N",
-                clean_value(j.demand.name) if demand and j.demand else "\\N",
+                None,
+                None,
+                i.location.name if i.location else None,
+                None,
+                j.demand.name if demand and j.demand else None,
                 (
                     j.demand.due
                     if j.demand
-                    else j.owner.demand.due if j.owner and j.owner.demand else "\\N"
+                    else j.owner.demand.due
+                    if j.owner and j.owner.demand
+                    else None
                 ),
                 color,  # color
-                clean_value(j.reference),
-                clean_value(j.batch),
-                round(j.quantity_completed, 8) if j.quantity_completed else "\\N",
+                j.reference,
+                j.batch,
+                round(j.quantity_completed, 8) if j.quantity_completed else None,
             ]
         elif j.demand or (j.owner and j.owner.demand):
             # Export shipments (with automatically created delivery operations)
             data = [
-                clean_value(i.name),
+                i.name,
                 "DLVR",
                 status,
                 round(j.quantity, 8),
-                str(j.start),
-                str(j.end),
+                j.start,
+                j.end,
                 round(j.criticality, 8),
                 delay,
                 cls.getPegging(j),
-                clean_value(j.source),
+                j.source,
                 timestamp,
-                "\\N",
+                None,
                 (
-                    clean_value(j.owner.reference)
+                    j.owner.reference
                     if j.owner and not j.owner.operation.hidden
-                    else "\\N"
+                    else None
                 ),
-                clean_value(
+                (
                     j.owner.demand.item.name
                     if j.owner and j.owner.demand
                     else j.demand.item.name
                 ),
-                "\\N",
-                "\\N",
-                clean_value(
+                None,
+                None,
+                (
                     j.owner.demand.location.name
                     if j.owner and j.owner.demand
                     else j.demand.location.name
                 ),
-                "\\N",
-                clean_value(j.demand.name) if demand else "\\N",
+                None,
+                j.demand.name if demand else None,
                 (
                     j.demand.due
                     if j.demand
-                    else j.owner.demand.due if j.owner and j.owner.demand else "\\N"
+                    else j.owner.demand.due
+                    if j.owner and j.owner.demand
+                    else None
                 ),
-                "\\N",  # color is empty for deliver operation
-                clean_value(j.reference),
-                clean_value(j.batch),
-                "\\N",
+                None,  # color is empty for deliver operation
+                j.reference,
+                j.batch,
+                None,
             ]
         if data:
             if with_fcst:
-                data.append(clean_value(forecast.owner.name) if forecast else "\\N")
+                data.append(forecast.owner.name if forecast else None)
             for attr in cls.attrs:
                 v = getattr(j, attr[0], None)
                 if v is None:
-                    data.append("\\N")
+                    data.append(None)
                 elif attr[2] == "boolean":
                     data.append(True if v else False)
                 elif attr[2] == "duration":
@@ -880,7 +1322,7 @@ class ExportOperationPlans(PlanTask):
                 elif attr[2] == "number":
                     data.append(round(v, 6))
                 elif attr[2] == "string":
-                    data.append(clean_value(v))
+                    data.append(v)
                 elif attr[2] == "time":
                     data.append(v)
                 elif attr[2] == "date":
@@ -891,6 +1333,41 @@ class ExportOperationPlans(PlanTask):
                     raise Exception("Unknown attribute type %s" % attr[2])
         return data
 
+    @staticmethod
+    def updateDemands(cursor):
+        cursor.execute(
+            """
+            with cte as (
+            select demand_id, sum(quantity) plannedquantity, max(enddate) deliverydate, max(enddate)-due as delay
+            from operationplan
+            where demand_id is not null and owner_id is null
+            group by demand_id, due
+            )
+            update demand
+            set delay = cte.delay,
+            plannedquantity = cte.plannedquantity,
+            deliverydate = cte.deliverydate
+            from cte
+            where cte.demand_id = demand.name
+            and (demand.plannedquantity is distinct from cte.plannedquantity
+            or demand.deliverydate is distinct from cte.deliverydate)
+            """
+        )
+        cursor.execute(
+            """
+            update demand set
+            delay = null,
+            plannedquantity = case when demand.status in ('open','quote') then 0 else null end,
+            deliverydate = null
+            where (delay is not null
+                or plannedquantity is distinct from (case when demand.status in ('open','quote') then 0 else null end)
+                or deliverydate is not null)
+            and not exists(
+            select 1 from operationplan where owner_id is null and operationplan.demand_id = demand.name
+            )
+            """
+        )
+
     @classmethod
     def run(cls, cluster=-1, opplans=None, database=DEFAULT_DB_ALIAS, **kwargs):
         if cluster == -2 and not opplans:
@@ -951,29 +1428,47 @@ class ExportOperationPlans(PlanTask):
         sql += ")"
         cursor.execute(sql)
 
-        cursor.copy_from(
-            CopyFromGenerator(
-                cls.getData(
-                    with_fcst,
-                    cls.parent.timestamp,
-                    cluster=cluster,
-                    opplans=opplans,
-                    accepted_status=(
-                        ["confirmed", "approved", "completed", "closed"]
-                        if cluster != -2
-                        else [
-                            "proposed",
-                            "confirmed",
-                            "approved",
-                            "completed",
-                            "closed",
-                        ]
-                    ),
-                )
+        binary = cls.copyformat == "binary"
+        columns = [f[0] for f in cls.fields]
+        types = [f[1] for f in cls.fields]
+        if with_fcst:
+            columns.append("forecast")
+            types.append("varchar")
+        columns += [a[0] for a in cls.attrs]
+        types += [attributeTypes[a[2]] for a in cls.attrs]
+
+        # With shadow tables the proposed operationplans are also merged, so
+        # the previous plan remains available till it is published.
+        shadow = cluster == -1 and PublishPlan.active
+        if shadow:
+            PublishPlan.timestamp = cls.parent.timestamp
+
+        # The normalized pegging is collected while exporting the operationplans
+        cls.pegging = tempfile.SpooledTemporaryFile(
+            max_size=100 * 1024 * 1024, mode="w+", encoding="utf-8"
+        )
+        copyRows(
+            cursor,
+            cls.getRows(
+                with_fcst,
+                cls.parent.timestamp,
+                cluster=cluster,
+                opplans=opplans,
+                accepted_status=(
+                    ["confirmed", "approved", "completed", "closed"]
+                    if cluster != -2 and not shadow
+                    else [
+                        "proposed",
+                        "confirmed",
+                        "approved",
+                        "completed",
+                        "closed",
+                    ]
+                ),
             ),
-            table="tmp_operationplan",
-            size=1024,
-            sep="\v",
+            "tmp_operationplan",
+            types=types,
+            binary=binary,
         )
 
         if with_fcst:
@@ -1028,90 +1523,50 @@ class ExportOperationPlans(PlanTask):
             )
 
         # Directly injecting proposed records in operationplan table
-        if cluster != -2:
-            cursor.copy_from(
-                CopyFromGenerator(
-                    cls.getData(
-                        with_fcst,
-                        cls.parent.timestamp,
-                        cluster=cluster,
-                        opplans=opplans,
-                        accepted_status=["proposed"],
-                    )
+        # The delay is stored as an interval in that table.
+        if cluster != -2 and not shadow:
+            copyRows(
+                cursor,
+                cls.getRows(
+                    with_fcst,
+                    cls.parent.timestamp,
+                    cluster=cluster,
+                    opplans=opplans,
+                    accepted_status=["proposed"],
                 ),
-                table="operationplan",
-                size=1024,
-                sep="\v",
-                columns=[
-                    "name",
-                    "type",
-                    "status",
-                    "quantity",
-                    "startdate",
-                    "enddate",
-                    "criticality",
-                    "delay",
-                    "plan",
-                    "source",
-                    "lastmodified",
-                    "operation_id",
-                    "owner_id",
-                    "item_id",
-                    "destination_id",
-                    "origin_id",
-                    "location_id",
-                    "supplier_id",
-                    "demand_id",
-                    "due",
-                    "color",
-                    "reference",
-                    "batch",
-                    "quantity_completed",
-                ]
-                + (
-                    [
-                        "forecast",
-                    ]
-                    if with_fcst
-                    else []
-                )
-                + [a[0] for a in cls.attrs],
+                "operationplan",
+                columns=columns,
+                types=[
+                    "interval" if c == "delay" else t for c, t in zip(columns, types)
+                ],
+                binary=binary,
             )
 
-        # update demand table specific fields
-        if cluster != -2:
-            cursor.execute(
-                """
-                with cte as (
-                select demand_id, sum(quantity) plannedquantity, max(enddate) deliverydate, max(enddate)-due as delay
-                from operationplan
-                where demand_id is not null and owner_id is null
-                group by demand_id, due
-                )
-                update demand
-                set delay = cte.delay,
-                plannedquantity = cte.plannedquantity,
-                deliverydate = cte.deliverydate
-                from cte
-                where cte.demand_id = demand.name
-                and (demand.plannedquantity is distinct from cte.plannedquantity
-                or demand.deliverydate is distinct from cte.deliverydate)
-                """
-            )
+        # Store the normalized pegging
+        if cluster != -1:
             cursor.execute(
                 """
-                update demand set
-                delay = null,
-                plannedquantity = case when demand.status in ('open','quote') then 0 else null end,
-                deliverydate = null
-                where (delay is not null
-                    or plannedquantity is distinct from (case when demand.status in ('open','quote') then 0 else null end)
-                    or deliverydate is not null)
-                and not exists(
-                select 1 from operationplan where owner_id is null and operationplan.demand_id = demand.name
-                )
+                delete from operationplan_pegging
+                using tmp_operationplan
+                where operationplan_pegging.operationplan = tmp_operationplan.reference
                 """
             )
+        cls.pegging.seek(0)
+        cursor.copy_from(
+            cls.pegging,
+            PublishPlan.table("operationplan_pegging", cluster),
+            columns=("operationplan", "demand", "forecast", "end_item", "quantity"),
+            size=CopyFromGenerator.chunksize,
+            sep="\v",
+        )
+        cls.pegging.close()
+        cls.pegging = None
+
+        # update demand table specific fields
+        if cluster != -2:
+            # With shadow tables this is done when the plan is published
+            if not shadow:
+                cls.updateDemands(cursor)
         else:
             # interactive planning
             demands_to_update = [j.demand.name for j in opplans if j.demand]
@@ -1171,6 +1626,23 @@ class ExportOperationPlanMaterials(PlanTask):
     sequence = (401, "export1", 2)
     export = True
 
+    # Format of the COPY command: "text" or "binary"
+    copyformat = getattr(settings, "EXPORT_COPY_FORMAT", "text")
+
+    # Exported fields and their type
+    fields = (
+        ("operationplan_id", "varchar"),
+        ("item_id", "varchar"),
+        ("location_id", "varchar"),
+        ("quantity", "numeric"),
+        ("flowdate", "timestamptz"),
+        ("onhand", "numeric"),
+        ("minimum", "numeric"),
+        ("periodofcover", "numeric"),
+        ("status", "varchar"),
+        ("lastmodified", "timestamptz"),
+    )
+
     @classmethod
     def getWeight(cls, **kwargs):
         if "supply" in os.environ or kwargs.get("exportstatic", False):
@@ -1179,7 +1651,7 @@ class ExportOperationPlanMaterials(PlanTask):
             return -1
 
     @staticmethod
-    def getData(timestamp, cluster=-1, buffers=None):
+    def getRows(timestamp, cluster=-1, buffers=None):
         import frepple
 
         for i in buffers if cluster == -2 else frepple.buffers():
@@ -1199,12 +1671,12 @@ class ExportOperationPlanMaterials(PlanTask):
                         )
                     )
                 else:
-                    yield "%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\v%s\n" % (
-                        clean_value(j.operationplan.reference),
-                        clean_value(j.buffer.item.name),
-                        clean_value(j.buffer.location.name),
+                    yield (
+                        j.operationplan.reference,
+                        j.buffer.item.name,
+                        j.buffer.location.name,
                         round(j.quantity, 8),
-                        str(j.date),
+                        j.date,
                         round(j.onhand, 8),
                         round(j.minimum, 8),
                         round(j.period_of_cover, 8),
@@ -1212,6 +1684,10 @@ class ExportOperationPlanMaterials(PlanTask):
                         timestamp,
                     )
 
+    @classmethod
+    def getData(cls, *args, **kwargs):
+        return textRows(cls.getRows(*args, **kwargs))
+
     @classmethod
     def run(
         cls,
@@ -1225,29 +1701,17 @@ class ExportOperationPlanMaterials(PlanTask):
             return
 
         cursor = connections[database].cursor()
-        cursor.copy_from(
-            CopyFromGenerator(
-                cls.getData(
-                    timestamp=timestamp or cls.parent.timestamp,
-                    cluster=cluster,
-                    buffers=buffers,
-                )
-            ),
-            "operationplanmaterial",
-            columns=(
-                "operationplan_id",
-                "item_id",
-                "location_id",
-                "quantity",
-                "flowdate",
-                "onhand",
-                "minimum",
-                "periodofcover",
-                "status",
-                "lastmodified",
+        copyRows(
+            cursor,
+            cls.getRows(
+                timestamp=timestamp or cls.parent.timestamp,
+                cluster=cluster,
+                buffers=buffers,
             ),
-            size=1024,
-            sep="\v",
+            PublishPlan.table("operationplanmaterial", cluster),
+            columns=[f[0] for f in cls.fields],
+            types=[f[1] for f in cls.fields],
+            binary=cls.copyformat == "binary",
         )
 
 
@@ -1278,7 +1742,9 @@ class ComputePeriodOfCover(PlanTask):
     def run(cls, cluster=-1, database=DEFAULT_DB_ALIAS, **kwargs):
         import frepple
 
-        if cluster == -2:
+        if cluster == -2 or PublishPlan.defer(
+            cls, cluster=cluster, database=database, **kwargs
+        ):
             return
 
         currentdate = frepple.settings.current
@@ -1294,6 +1760,7 @@ class ComputePeriodOfCover(PlanTask):
             cursor.copy_from(
                 CopyFromGenerator(cls.getItemsFromCluster(cluster)),
                 "cluster_item_tmp",
+                size=CopyFromGenerator.chunksize,
                 sep="\v",
             )
 
@@ -1389,6 +1856,19 @@ class ExportOperationPlanResources(PlanTask):
     sequence = (401, "export1", 3)
     export = True
 
+    # Format of the COPY command: "text" or "binary"
+    copyformat = getattr(settings, "EXPORT_COPY_FORMAT", "text")
+
+    # Exported fields and their type
+    fields = (
+        ("operationplan_id", "varchar"),
+        ("resource_id", "varchar"),
+        ("quantity", "numeric"),
+        ("setup", "varchar"),
+        ("status", "varchar"),
+        ("lastmodified", "timestamptz"),
+    )
+
     @classmethod
     def getWeight(cls, **kwargs):
         if "supply" in os.environ or kwargs.get("exportstatic", False):
@@ -1397,7 +1877,7 @@ class ExportOperationPlanResources(PlanTask):
             return -1
 
     @staticmethod
-    def getData(timestamp, resources=None, cluster=-1, **kwargs):
+    def getRows(timestamp, resources=None, cluster=-1, **kwargs):
         import frepple
 
         for i in resources or frepple.resources():
@@ -1417,15 +1897,19 @@ class ExportOperationPlanResources(PlanTask):
                         )
                     )
                 else:
-                    yield "%s\v%s\v%s\v%s\v%s\v%s\n" % (
-                        clean_value(j.operationplan.reference),
-                        clean_value(j.resource.name),
+                    yield (
+                        j.operationplan.reference,
+                        j.resource.name,
                         round(-j.quantity, 8),
-                        clean_value(j.setup),
+                        j.setup,
                         j.status,
                         timestamp,
                     )
 
+    @classmethod
+    def getData(cls, *args, **kwargs):
+        return textRows(cls.getRows(*args, **kwargs))
+
     @classmethod
     def run(
         cls,
@@ -1438,26 +1922,18 @@ class ExportOperationPlanResources(PlanTask):
         if cluster == -2 and not resources:
             return
         with connections[database].cursor() as cursor:
-            cursor.copy_from(
-                CopyFromGenerator(
-                    cls.getData(
-                        timestamp=timestamp or cls.parent.timestamp,
-                        cluster=cluster,
-                        resources=resources,
-                        **kwargs,
-                    )
-                ),
-                "operationplanresource",
-                columns=(
-                    "operationplan_id",
-                    "resource_id",
-                    "quantity",
-                    "setup",
-                    "status",
-                    "lastmodified",
+            copyRows(
+                cursor,
+                cls.getRows(
+                    timestamp=timestamp or cls.parent.timestamp,
+                    cluster=cluster,
+                    resources=resources,
+                    **kwargs,
                 ),
-                size=1024,
-                sep="\v",
+                PublishPlan.table("operationplanresource", cluster),
+                columns=[f[0] for f in cls.fields],
+                types=[f[1] for f in cls.fields],
+                binary=cls.copyformat == "binary",
             )
 
 
@@ -1467,6 +1943,20 @@ class ExportResourcePlans(PlanTask):
     sequence = (401, "export2", 1)
     export = True
 
+    # Format of the COPY command: "text" or "binary"
+    copyformat = getattr(settings, "EXPORT_COPY_FORMAT", "text")
+
+    # Exported fields and their type
+    fields = (
+        ("resource", "varchar"),
+        ("startdate", "timestamptz"),
+        ("available", "numeric"),
+        ("unavailable", "numeric"),
+        ("setup", "numeric"),
+        ("load", "numeric"),
+        ("free", "numeric"),
+    )
+
     @classmethod
     def getWeight(cls, **kwargs):
         if "supply" in os.environ:
@@ -1528,9 +2018,9 @@ class ExportResourcePlans(PlanTask):
                 if cluster not in (-1, -2) and cluster != i.cluster:
                     continue
                 for j in i.plan(buckets):
-                    yield "%s\v%s\v%s\v%s\v%s\v%s\v%s\n" % (
-                        clean_value(i.name),
-                        str(j["start"]),
+                    yield (
+                        i.name,
+                        j["start"],
                         round(j["available"], 8),
                         round(j["unavailable"], 8),
                         round(j["setup"], 8),
@@ -1538,20 +2028,13 @@ class ExportResourcePlans(PlanTask):
                         round(j["free"], 8),
                     )
 
-        cursor.copy_from(
-            CopyFromGenerator(getData(resources=resources)),
-            "out_resourceplan",
-            columns=(
-                "resource",
-                "startdate",
-                "available",
-                "unavailable",
-                "setup",
-                "load",
-                "free",
-            ),
-            size=1024,
-            sep="\v",
+        copyRows(
+            cursor,
+            getData(resources=resources),
+            PublishPlan.table("out_resourceplan", cluster),
+            columns=[f[0] for f in cls.fields],
+            types=[f[1] for f in cls.fields],
+            binary=cls.copyformat == "binary",
         )
 
 
@@ -1589,18 +2072,295 @@ class ExportPegging(PlanTask):
                         "quantity": j.quantity,
                     }
                 )
-            yield (json.dumps({"pegging": peg}), i.name)
+            yield (i.name, json.dumps({"pegging": peg}))
 
     @classmethod
     def run(cls, cluster=-1, demands=None, database=DEFAULT_DB_ALIAS, **kwargs):
         with transaction.atomic(using=database, savepoint=False):
             with connections[database].cursor() as cursor:
-                execute_batch(
+                # Stream the pegging into a temporary table, and update all
+                # demands with a single statement
+                cursor.execute(
+                    """
+                    create temporary table tmp_demandplan (
+                      name character varying(300),
+                      plan jsonb
+                    )
+                    """
+                )
+                copyRows(
                     cursor,
-                    "update demand set plan=%s where name=%s",
                     cls.getDemandPlan(cluster=cluster, demands=demands),
-                    page_size=200,
+                    "tmp_demandplan",
+                    types=["varchar", "jsonb"],
+                    binary=ExportOperationPlans.copyformat == "binary",
+                )
+                cursor.execute(
+                    """
+                    update demand
+                    set plan = tmp_demandplan.plan
+                    from tmp_demandplan
+                    where demand.name = tmp_demandplan.name
+                    and demand.plan is distinct from tmp_demandplan.plan
+                    """
                 )
+                cursor.execute("drop table tmp_demandplan")
+
+
+class ExportBucketSummary(PlanTask):
+    """
+    Base class for tasks that aggregate the plan per bucket of all reporting
+    calendars. The pivot reports read these tables instead of aggregating
+    the detailed plan on every page view.
+
+    Only a complete export refreshes a summary. Any later change to the
+    source tables marks the summary as invalid, and the reports then fall
+    back to the detailed plan until the next complete export.
+    """
+
+    # Summary table and source tables. Subclasses set these and define a
+    # getQuery classmethod returning the statement that fills the table.
+    # The base class has no table and is never run.
+    table = None
+    sources = ()
+
+    @classmethod
+    def getWeight(cls, **kwargs):
+        if cls.table and "supply" in os.environ:
+            return 1
+        else:
+            return -1
+
+    @classmethod
+    def run(cls, cluster=-1, database=DEFAULT_DB_ALIAS, **kwargs):
+        if cluster != -1 or PublishPlan.defer(cls, database=database, **kwargs):
+            return
+        with transaction.atomic(using=database):
+            with connections[database].cursor() as cursor:
+                # Block changes to the source tables while building the summary
+                cursor.execute("lock table %s in share mode" % ", ".join(cls.sources))
+                cursor.execute("truncate table %s" % cls.table)
+                cursor.execute(cls.getQuery())
+                cursor.execute(
+                    """
+                    insert into out_summarystatus (name, valid, lastmodified)
+                    values (%s, true, now())
+                    on conflict (name)
+                    do update set valid = true, lastmodified = excluded.lastmodified
+                    """,
+                    (cls.table,),
+                )
+
+
+@PlanTaskRegistry.register
+class ExportResourceSummary(ExportBucketSummary):
+    description = ("Export plan", "Summarizing resource plans per bucket")
+    sequence = (401, "export2", 5)
+    export = True
+
+    table = "out_resourcesummary"
+    sources = ("out_resourceplan", "common_bucketdetail")
+
+    @classmethod
+    def getQuery(cls):
+        # The resource plan is exported in the buckets of the most detailed
+        # calendar. We first map each of its dates to the bucket of each
+        # reporting calendar.
+        return """
+            with dates as (
+              select distinct startdate from out_resourceplan
+              ),
+            buckets as (
+              select dates.startdate, d.bucket_id, d.startdate as bucketstart, d.enddate
+              from dates
+              inner join common_bucketdetail d
+                on dates.startdate >= d.startdate
+                and dates.startdate < d.enddate
+              )
+            insert into out_resourcesummary
+              (resource, bucket, startdate, enddate, available, unavailable, setup, load)
+            select
+              out_resourceplan.resource, buckets.bucket_id,
+              buckets.bucketstart, buckets.enddate,
+              sum(out_resourceplan.available), sum(out_resourceplan.unavailable),
+              sum(out_resourceplan.setup), sum(out_resourceplan.load)
+            from out_resourceplan
+            inner join buckets
+              on buckets.startdate = out_resourceplan.startdate
+            group by out_resourceplan.resource, buckets.bucket_id,
+              buckets.bucketstart, buckets.enddate
+            """
+
+
+@PlanTaskRegistry.register
+class ExportOperationSummary(ExportBucketSummary):
+    description = ("Export plan", "Summarizing operationplans per bucket")
+    sequence = (401, "export1", 6)
+    export = True
+
+    table = "out_operationsummary"
+    sources = ("operationplan", "common_bucketdetail")
+
+    @classmethod
+    def getQuery(cls):
+        from freppledb.output.views.operation import OverviewReport
+
+        # For each calendar the first overlapping bucket is found with an
+        # index lookup, which limits the range of buckets to compare with.
+        return """
+            insert into out_operationsummary
+              (operation, bucket, startdate, enddate, proposed_start, total_start,
+              proposed_end, total_end, proposed_production, total_production)
+            select
+              operationplan.operation_id, d.bucket_id, d.startdate, d.enddate,
+              %s
+            from operationplan
+            cross join common_bucket
+            left outer join lateral (
+              select startdate
+              from common_bucketdetail
+              where common_bucketdetail.bucket_id = common_bucket.name
+                and common_bucketdetail.startdate <= operationplan.startdate
+              order by common_bucketdetail.startdate desc
+              limit 1
+              ) firstbucket on true
+            inner join common_bucketdetail d
+              on d.bucket_id = common_bucket.name
+              and d.startdate >= coalesce(firstbucket.startdate, operationplan.startdate)
+              and d.startdate <= operationplan.enddate
+              and (operationplan.startdate, operationplan.enddate)
+                overlaps (d.startdate, d.enddate)
+            where operationplan.operation_id is not null
+            group by operationplan.operation_id, d.bucket_id, d.startdate, d.enddate
+            """ % (
+            OverviewReport.bucketsums,
+        )
+
+
+@PlanTaskRegistry.register
+class ExportBufferSummary(ExportBucketSummary):
+    description = ("Export plan", "Summarizing inventory flows per bucket")
+    sequence = (401, "export1", 7)
+    export = True
+
+    table = "out_buffersummary"
+    sources = ("operationplanmaterial", "operationplan", "common_bucketdetail")
+
+    @classmethod
+    def getQuery(cls):
+        from freppledb.output.views.buffer import OverviewReport
+
+        # A flow belongs to the bucket of its date, and to all buckets ending
+        # while its operationplan is in progress. The report only reads
+        # summaries of buckets starting after the current date, where its
+        # expressions don't depend on the report arguments.
+        return """
+            insert into out_buffersummary
+              (item, location, batch, bucket, startdate, enddate, %s)
+            select
+              opm.item_id, opm.location_id, operationplan.batch,
+              d.bucket_id, d.startdate, d.enddate,
+              %s
+            from (
+              select opm.id, common_bucket.name as bucket_id, d.startdate
+              from operationplanmaterial opm
+              cross join common_bucket
+              inner join lateral (
+                select startdate, enddate
+                from common_bucketdetail
+                where common_bucketdetail.bucket_id = common_bucket.name
+                  and common_bucketdetail.startdate <= opm.flowdate
+                order by common_bucketdetail.startdate desc
+                limit 1
+                ) d on d.enddate > opm.flowdate
+              union
+              select opm.id, d.bucket_id, d.startdate
+              from operationplanmaterial opm
+              inner join operationplan
+                on operationplan.reference = opm.operationplan_id
+              cross join common_bucket
+              left outer join lateral (
+                select startdate
+                from common_bucketdetail
+                where common_bucketdetail.bucket_id = common_bucket.name
+                  and common_bucketdetail.startdate <= operationplan.startdate
+                order by common_bucketdetail.startdate desc
+                limit 1
+                ) firstbucket on true
+              inner join common_bucketdetail d
+                on d.bucket_id = common_bucket.name
+                and d.startdate >= coalesce(firstbucket.startdate, operationplan.startdate)
+                and d.startdate < operationplan.enddate
+                and d.enddate > operationplan.startdate
+                and d.enddate <= operationplan.enddate
+              where opm.quantity > 0
+              ) flows
+            inner join operationplanmaterial opm
+              on opm.id = flows.id
+            inner join operationplan
+              on operationplan.reference = opm.operationplan_id
+            inner join common_bucketdetail d
+              on d.bucket_id = flows.bucket_id
+              and d.startdate = flows.startdate
+            cross join (
+              select '-infinity'::timestamp report_startdate,
+                '-infinity'::timestamp report_currentdate
+              ) arguments
+            group by opm.item_id, opm.location_id, operationplan.batch,
+              d.bucket_id, d.startdate, d.enddate
+            """ % (
+            ", ".join(
+                name.lower() for name, function, expression in OverviewReport.bucketsums
+            ),
+            ",\n".join(
+                "%s(%s)" % (function, expression)
+                for name, function, expression in OverviewReport.bucketsums
+            ),
+        )
+
+
+@PlanTaskRegistry.register
+class ExportDemandSummary(ExportBucketSummary):
+    description = ("Export plan", "Summarizing demand per bucket")
+    sequence = (401, "export1", 8)
+    export = True
+
+    table = "out_demandsummary"
+    sources = ("demand", "operationplan", "common_bucketdetail")
+
+    @classmethod
+    def getQuery(cls):
+        return """
+            insert into out_demandsummary
+              (item, bucket, startdate, enddate, orders, planned_orders, planned_forecast)
+            select
+              t.item_id, common_bucket.name, d.startdate, d.enddate,
+              sum(t.orders), sum(t.planned_orders), sum(t.planned_forecast)
+            from (
+              select item_id, due as date, quantity as orders,
+                null::numeric as planned_orders, null::numeric as planned_forecast
+              from demand
+              where status in ('open','quote') and due is not null
+              union all
+              select item_id, enddate,
+                null,
+                case when demand_id is not null then quantity end,
+                case when forecast is not null then quantity end
+              from operationplan
+              where (demand_id is not null or forecast is not null)
+              and enddate is not null
+              ) t
+            cross join common_bucket
+            inner join lateral (
+              select startdate, enddate
+              from common_bucketdetail
+              where common_bucketdetail.bucket_id = common_bucket.name
+                and common_bucketdetail.startdate <= t.date
+              order by common_bucketdetail.startdate desc
+              limit 1
+              ) d on d.enddate > t.date
+            group by t.item_id, common_bucket.name, d.startdate, d.enddate
+            """
 
 
 @PlanTaskRegistry.register
@@ -0,0 +1,223 @@
+#
+# Copyright (C) 2026 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.conf import settings
+from django.db import migrations, models, connections
+
+
+def grant_read_access(apps, schema_editor):
+    db = schema_editor.connection.alias
+    role = settings.DATABASES[db].get("SQL_ROLE", "report_role")
+    if role:
+        with connections[db].cursor() as cursor:
+            cursor.execute("select count(*) from pg_roles where rolname = %s", (role,))
+            if not cursor.fetchone()[0]:
+                cursor.execute(
+                    "create role %s with nologin noinherit role current_user" % (role,)
+                )
+            for table in ["out_resourcesummary", "out_operationsummary"]:
+                cursor.execute("grant select on table %s to %s" % (table, role))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("output", "0011_exports"),
+        ("input", "0074_buffer_maximum"),
+        ("common", "0035_user_scenario_themes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ResourceBucketSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("resource", models.CharField(max_length=300, verbose_name="resource")),
+                ("bucket", models.CharField(max_length=300, verbose_name="bucket")),
+                ("startdate", models.DateTimeField(verbose_name="startdate")),
+                ("enddate", models.DateTimeField(verbose_name="enddate")),
+                (
+                    "available",
+                    models.DecimalField(
+                        decimal_places=8,
+                        max_digits=20,
+                        null=True,
+                        verbose_name="available",
+                    ),
+                ),
+                (
+                    "unavailable",
+                    models.DecimalField(
+                        decimal_places=8,
+                        max_digits=20,
+                        null=True,
+                        verbose_name="unavailable",
+                    ),
+                ),
+                (
+                    "setup",
+                    models.DecimalField(
+                        decimal_places=8, max_digits=20, null=True, verbose_name="setup"
+                    ),
+                ),
+                (
+                    "load",
+                    models.DecimalField(
+                        decimal_places=8, max_digits=20, null=True, verbose_name="load"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "resource bucket summary",
+                "verbose_name_plural": "resource bucket summaries",
+                "db_table": "out_resourcesummary",
+                "ordering": ["resource", "bucket", "startdate"],
+                "unique_together": {("bucket", "resource", "startdate")},
+                "default_permissions": [],
+            },
+        ),
+        migrations.CreateModel(
+            name="OperationBucketSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "operation",
+                    models.CharField(max_length=300, verbose_name="operation"),
+                ),
+                ("bucket", models.CharField(max_length=300, verbose_name="bucket")),
+                ("startdate", models.DateTimeField(verbose_name="startdate")),
+                ("enddate", models.DateTimeField(verbose_name="enddate")),
+                (
+                    "proposed_start",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "total_start",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "proposed_end",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "total_end",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "proposed_production",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "total_production",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+            ],
+            options={
+                "verbose_name": "operation bucket summary",
+                "verbose_name_plural": "operation bucket summaries",
+                "db_table": "out_operationsummary",
+                "ordering": ["operation", "bucket", "startdate"],
+                "unique_together": {("bucket", "operation", "startdate")},
+                "default_permissions": [],
+            },
+        ),
+        migrations.CreateModel(
+            name="SummaryStatus",
+            fields=[
+                (
+                    "name",
+                    models.CharField(
+                        max_length=300,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="name",
+                    ),
+                ),
+                ("valid", models.BooleanField(default=False, verbose_name="valid")),
+                (
+                    "lastmodified",
+                    models.DateTimeField(null=True, verbose_name="last modified"),
+                ),
+            ],
+            options={
+                "verbose_name": "summary status",
+                "verbose_name_plural": "summary statuses",
+                "db_table": "out_summarystatus",
+                "default_permissions": [],
+            },
+        ),
+        migrations.RunPython(
+            code=grant_read_access,
+        ),
+        # Any change to a source table invalidates the summaries built from it
+        migrations.RunSQL(
+            sql="""
+            create or replace function out_summarystatus_invalidate()
+            returns trigger as $$
+            begin
+              update out_summarystatus set valid = false
+              where valid and name = any(TG_ARGV);
+              return null;
+            end;
+            $$ language plpgsql;
+
+            create trigger out_resourcesummary_invalidate
+            after insert or update or delete or truncate on out_resourceplan
+            for each statement
+            execute procedure out_summarystatus_invalidate('out_resourcesummary');
+
+            create trigger out_operationsummary_invalidate
+            after insert or update or delete or truncate on operationplan
+            for each statement
+            execute procedure out_summarystatus_invalidate('out_operationsummary');
+
+            create trigger out_bucketsummary_invalidate
+            after insert or update or delete or truncate on common_bucketdetail
+            for each statement
+            execute procedure out_summarystatus_invalidate(
+              'out_resourcesummary', 'out_operationsummary'
+              );
+            """,
+            reverse_sql="""
+            drop trigger out_resourcesummary_invalidate on out_resourceplan;
+            drop trigger out_operationsummary_invalidate on operationplan;
+            drop trigger out_bucketsummary_invalidate on common_bucketdetail;
+            drop function out_summarystatus_invalidate();
+            """,
+        ),
+    ]
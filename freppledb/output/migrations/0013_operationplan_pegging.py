@@ -0,0 +1,141 @@
+#
+# Copyright (C) 2026 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.conf import settings
+from django.db import migrations, models, connections
+
+
+def grant_read_access(apps, schema_editor):
+    db = schema_editor.connection.alias
+    role = settings.DATABASES[db].get("SQL_ROLE", "report_role")
+    if role:
+        with connections[db].cursor() as cursor:
+            cursor.execute("select count(*) from pg_roles where rolname = %s", (role,))
+            if not cursor.fetchone()[0]:
+                cursor.execute(
+                    "create role %s with nologin noinherit role current_user" % (role,)
+                )
+            cursor.execute("grant select on table operationplan_pegging to %s" % role)
+
+
+def populate(apps, schema_editor):
+    # Normalize the pegging of the current plan
+    with connections[schema_editor.connection.alias].cursor() as cursor:
+        cursor.execute("select to_regclass('forecast') is not null")
+        if cursor.fetchone()[0]:
+            cursor.execute(
+                """
+                insert into operationplan_pegging
+                  (operationplan, demand, forecast, end_item, quantity)
+                select
+                  operationplan.reference, peg.key, forecast.name,
+                  coalesce(demand.item_id, forecast.item_id), peg.value::numeric
+                from operationplan
+                cross join lateral jsonb_each_text(operationplan.plan->'pegging') peg
+                left outer join demand on peg.key = demand.name
+                left outer join forecast
+                  on demand.name is null
+                  and substring(peg.key from 0 for length(peg.key)
+                    - position(' - ' in reverse(peg.key)) - 1) = forecast.name
+                where jsonb_typeof(operationplan.plan->'pegging') = 'object'
+                and (demand.name is not null or forecast.name is not null)
+                """
+            )
+        else:
+            cursor.execute(
+                """
+                insert into operationplan_pegging
+                  (operationplan, demand, end_item, quantity)
+                select
+                  operationplan.reference, peg.key, demand.item_id, peg.value::numeric
+                from operationplan
+                cross join lateral jsonb_each_text(operationplan.plan->'pegging') peg
+                inner join demand on peg.key = demand.name
+                where jsonb_typeof(operationplan.plan->'pegging') = 'object'
+                """
+            )
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("output", "0012_bucket_summaries"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OperationPlanPegging",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "operationplan",
+                    models.CharField(
+                        db_index=True, max_length=300, verbose_name="reference"
+                    ),
+                ),
+                (
+                    "demand",
+                    models.CharField(
+                        db_index=True, max_length=300, verbose_name="demand"
+                    ),
+                ),
+                (
+                    "forecast",
+                    models.CharField(
+                        max_length=300, null=True, verbose_name="forecast"
+                    ),
+                ),
+                (
+                    "end_item",
+                    models.CharField(
+                        max_length=300, null=True, verbose_name="end item"
+                    ),
+                ),
+                (
+                    "quantity",
+                    models.DecimalField(
+                        decimal_places=8, max_digits=20, verbose_name="quantity"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "operationplan pegging",
+                "verbose_name_plural": "operationplan peggings",
+                "db_table": "operationplan_pegging",
+                "default_permissions": [],
+            },
+        ),
+        migrations.RunPython(
+            code=grant_read_access,
+        ),
+        migrations.RunPython(
+            code=populate,
+        ),
+    ]
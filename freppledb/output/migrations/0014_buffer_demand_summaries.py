@@ -0,0 +1,322 @@
+#
+# Copyright (C) 2026 by frePPLe bv
+#
+# Permission is hereby granted, free of charge, to any person obtaining
+# a copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish,
+# distribute, sublicense, and/or sell copies of the Software, and to
+# permit persons to whom the Software is furnished to do so, subject to
+# the following conditions:
+#
+# The above copyright notice and this permission notice shall be
+# included in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+# EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+# MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND
+# NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR COPYRIGHT HOLDERS BE
+# LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION
+# OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION
+# WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+#
+
+from django.conf import settings
+from django.db import migrations, models, connections
+
+
+def grant_read_access(apps, schema_editor):
+    db = schema_editor.connection.alias
+    role = settings.DATABASES[db].get("SQL_ROLE", "report_role")
+    if role:
+        with connections[db].cursor() as cursor:
+            cursor.execute("select count(*) from pg_roles where rolname = %s", (role,))
+            if not cursor.fetchone()[0]:
+                cursor.execute(
+                    "create role %s with nologin noinherit role current_user" % (role,)
+                )
+            for table in ["out_buffersummary", "out_demandsummary"]:
+                cursor.execute("grant select on table %s to %s" % (table, role))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("output", "0013_operationplan_pegging"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BufferBucketSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("item", models.CharField(max_length=300, verbose_name="item")),
+                ("location", models.CharField(max_length=300, verbose_name="location")),
+                (
+                    "batch",
+                    models.CharField(max_length=300, null=True, verbose_name="batch"),
+                ),
+                ("bucket", models.CharField(max_length=300, verbose_name="bucket")),
+                ("startdate", models.DateTimeField(verbose_name="startdate")),
+                ("enddate", models.DateTimeField(verbose_name="enddate")),
+                (
+                    "work_in_progress_mo",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "work_in_progress_mo_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "work_in_progress_mo_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "on_order_po",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "on_order_po_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "on_order_po_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "proposed_ordering",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "in_transit_do",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "in_transit_do_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "in_transit_do_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "total_in_progress",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "total_in_progress_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "total_in_progress_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumed_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumed_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumedmo",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumedmo_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumedmo_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumeddo",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumedfcst",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumeddo_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumeddo_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "consumedso",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "produced",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "produced_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "produced_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "producedmo",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "producedmo_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "producedmo_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "produceddo",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "produceddo_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "produceddo_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "producedpo",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "producedpo_confirmed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "producedpo_proposed",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "max_delay",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+            ],
+            options={
+                "verbose_name": "buffer bucket summary",
+                "verbose_name_plural": "buffer bucket summaries",
+                "db_table": "out_buffersummary",
+                "ordering": ["item", "location", "batch", "bucket", "startdate"],
+                "indexes": [
+                    models.Index(
+                        fields=["item", "location", "bucket", "startdate"],
+                        name="out_buffersummary_idx",
+                    )
+                ],
+                "default_permissions": [],
+            },
+        ),
+        migrations.CreateModel(
+            name="DemandBucketSummary",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("item", models.CharField(max_length=300, verbose_name="item")),
+                ("bucket", models.CharField(max_length=300, verbose_name="bucket")),
+                ("startdate", models.DateTimeField(verbose_name="startdate")),
+                ("enddate", models.DateTimeField(verbose_name="enddate")),
+                (
+                    "orders",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "planned_orders",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+                (
+                    "planned_forecast",
+                    models.DecimalField(decimal_places=8, max_digits=20, null=True),
+                ),
+            ],
+            options={
+                "verbose_name": "demand bucket summary",
+                "verbose_name_plural": "demand bucket summaries",
+                "db_table": "out_demandsummary",
+                "ordering": ["item", "bucket", "startdate"],
+                "unique_together": {("bucket", "item", "startdate")},
+                "default_permissions": [],
+            },
+        ),
+        migrations.RunPython(
+            code=grant_read_access,
+        ),
+        # Any change to a source table invalidates the summaries built from it
+        migrations.RunSQL(
+            sql="""
+            create trigger out_buffersummary_invalidate
+            after insert or update or delete or truncate on operationplanmaterial
+            for each statement
+            execute procedure out_summarystatus_invalidate('out_buffersummary');
+
+            drop trigger out_operationsummary_invalidate on operationplan;
+            create trigger out_operationsummary_invalidate
+            after insert or update or delete or truncate on operationplan
+            for each statement
+            execute procedure out_summarystatus_invalidate(
+              'out_operationsummary', 'out_buffersummary', 'out_demandsummary'
+              );
+
+            create trigger out_demandsummary_invalidate
+            after insert or update or delete or truncate on demand
+            for each statement
+            execute procedure out_summarystatus_invalidate('out_demandsummary');
+
+            drop trigger out_bucketsummary_invalidate on common_bucketdetail;
+            create trigger out_bucketsummary_invalidate
+            after insert or update or delete or truncate on common_bucketdetail
+            for each statement
+            execute procedure out_summarystatus_invalidate(
+              'out_resourcesummary', 'out_operationsummary',
+              'out_buffersummary', 'out_demandsummary'
+              );
+            """,
+            reverse_sql="""
+            drop trigger out_buffersummary_invalidate on operationplanmaterial;
+            drop trigger out_demandsummary_invalidate on demand;
+
+            drop trigger out_operationsummary_invalidate on operationplan;
+            create trigger out_operationsummary_invalidate
+            after insert or update or delete or truncate on operationplan
+            for each statement
+            execute procedure out_summarystatus_invalidate('out_operationsummary');
+
+            drop trigger out_bucketsummary_invalidate on common_bucketdetail;
+            create trigger out_bucketsummary_invalidate
+            after insert or update or delete or truncate on common_bucketdetail
+            for each statement
+            execute procedure out_summarystatus_invalidate(
+              'out_resourcesummary', 'out_operationsummary'
+              );
+            """,
+        ),
+    ]
@@ -92,3 +92,227 @@ class ResourceSummary(models.Model):
         )
         verbose_name_plural = "resource summaries"
         default_permissions = []
+
+
+class ResourceBucketSummary(models.Model):
+    """
+    Resource plan aggregated per bucket of each reporting calendar.
+    """
+
+    resource = models.CharField(_("resource"), max_length=300)
+    bucket = models.CharField(_("bucket"), max_length=300)
+    startdate = models.DateTimeField(_("startdate"))
+    enddate = models.DateTimeField(_("enddate"))
+    available = models.DecimalField(
+        _("available"), max_digits=20, decimal_places=8, null=True
+    )
+    unavailable = models.DecimalField(
+        _("unavailable"), max_digits=20, decimal_places=8, null=True
+    )
+    setup = models.DecimalField(_("setup"), max_digits=20, decimal_places=8, null=True)
+    load = models.DecimalField(_("load"), max_digits=20, decimal_places=8, null=True)
+
+    class Meta:
+        db_table = "out_resourcesummary"
+        ordering = ["resource", "bucket", "startdate"]
+        unique_together = (("bucket", "resource", "startdate"),)
+        verbose_name = "resource bucket summary"
+        verbose_name_plural = "resource bucket summaries"
+        default_permissions = []
+
+
+class OperationBucketSummary(models.Model):
+    """
+    Operationplans aggregated per bucket of each reporting calendar.
+    """
+
+    operation = models.CharField(_("operation"), max_length=300)
+    bucket = models.CharField(_("bucket"), max_length=300)
+    startdate = models.DateTimeField(_("startdate"))
+    enddate = models.DateTimeField(_("enddate"))
+    proposed_start = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    total_start = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    proposed_end = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    total_end = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    proposed_production = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    total_production = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+
+    class Meta:
+        db_table = "out_operationsummary"
+        ordering = ["operation", "bucket", "startdate"]
+        unique_together = (("bucket", "operation", "startdate"),)
+        verbose_name = "operation bucket summary"
+        verbose_name_plural = "operation bucket summaries"
+        default_permissions = []
+
+
+class BufferBucketSummary(models.Model):
+    """
+    Flows of a buffer and batch aggregated per bucket of each reporting calendar.
+    """
+
+    item = models.CharField(_("item"), max_length=300)
+    location = models.CharField(_("location"), max_length=300)
+    batch = models.CharField(_("batch"), max_length=300, null=True)
+    bucket = models.CharField(_("bucket"), max_length=300)
+    startdate = models.DateTimeField(_("startdate"))
+    enddate = models.DateTimeField(_("enddate"))
+    work_in_progress_mo = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    work_in_progress_mo_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    work_in_progress_mo_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    on_order_po = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    on_order_po_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    on_order_po_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    proposed_ordering = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    in_transit_do = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    in_transit_do_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    in_transit_do_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    total_in_progress = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    total_in_progress_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    total_in_progress_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    consumed = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    consumed_confirmed = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    consumed_proposed = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    consumedmo = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    consumedmo_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    consumedmo_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    consumeddo = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    consumedfcst = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    consumeddo_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    consumeddo_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    consumedso = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    produced = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    produced_confirmed = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    produced_proposed = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    producedmo = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    producedmo_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    producedmo_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    produceddo = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    produceddo_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    produceddo_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    producedpo = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    producedpo_confirmed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    producedpo_proposed = models.DecimalField(
+        max_digits=20, decimal_places=8, null=True
+    )
+    max_delay = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+
+    class Meta:
+        db_table = "out_buffersummary"
+        ordering = ["item", "location", "batch", "bucket", "startdate"]
+        indexes = [
+            models.Index(
+                fields=["item", "location", "bucket", "startdate"],
+                name="out_buffersummary_idx",
+            )
+        ]
+        verbose_name = "buffer bucket summary"
+        verbose_name_plural = "buffer bucket summaries"
+        default_permissions = []
+
+
+class DemandBucketSummary(models.Model):
+    """
+    Demand and planned deliveries of an item aggregated per bucket of each
+    reporting calendar.
+    """
+
+    item = models.CharField(_("item"), max_length=300)
+    bucket = models.CharField(_("bucket"), max_length=300)
+    startdate = models.DateTimeField(_("startdate"))
+    enddate = models.DateTimeField(_("enddate"))
+    orders = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    planned_orders = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+    planned_forecast = models.DecimalField(max_digits=20, decimal_places=8, null=True)
+
+    class Meta:
+        db_table = "out_demandsummary"
+        ordering = ["item", "bucket", "startdate"]
+        unique_together = (("bucket", "item", "startdate"),)
+        verbose_name = "demand bucket summary"
+        verbose_name_plural = "demand bucket summaries"
+        default_permissions = []
+
+
+class SummaryStatus(models.Model):
+    """
+    Keeps track of the summary tables that are in sync with the plan.
+    A database trigger resets the valid flag when a source table of the
+    summary changes.
+    """
+
+    name = models.CharField(_("name"), max_length=300, primary_key=True)
+    valid = models.BooleanField(_("valid"), default=False)
+    lastmodified = models.DateTimeField(_("last modified"), null=True)
+
+    @staticmethod
+    def isValid(name, database):
+        return (
+            SummaryStatus.objects.using(database).filter(name=name, valid=True).exists()
+        )
+
+    class Meta:
+        db_table = "out_summarystatus"
+        verbose_name = "summary status"
+        verbose_name_plural = "summary statuses"
+        default_permissions = []
+
+
+class OperationPlanPegging(models.Model):
+    """
+    Demands an operationplan is pegged to, and the quantity pegged to each.
+
+    This is a normalized copy of the pegging stored in the plan field of
+    the operationplan, exported with the plan. The operationplan lists
+    aggregate from this table rather than from the JSON field.
+    """
+
+    operationplan = models.CharField(_("reference"), max_length=300, db_index=True)
+    demand = models.CharField(_("demand"), max_length=300, db_index=True)
+    forecast = models.CharField(_("forecast"), max_length=300, null=True)
+    end_item = models.CharField(_("end item"), max_length=300, null=True)
+    quantity = models.DecimalField(_("quantity"), max_digits=20, decimal_places=8)
+
+    class Meta:
+        db_table = "operationplan_pegging"
+        verbose_name = "operationplan pegging"
+        verbose_name_plural = "operationplan peggings"
+        default_permissions = []
@@ -21,9 +21,18 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
-from django.test import TestCase
+import json
+import os
 
+from django.core import management
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from freppledb.common.models import Parameter, User
 from freppledb.common.tests import checkResponse
+from freppledb.input.models import OperationPlan
+from freppledb.output.commands import PublishPlan
+from freppledb.output.models import OperationPlanPegging, SummaryStatus
 
 
 class OutputTest(TestCase):
@@ -209,3 +218,215 @@ class OutputTest(TestCase):
                 "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
             )
         )
+
+
+class BucketSummaryTest(TransactionTestCase):
+    fixtures = ["demo"]
+
+    def setUp(self):
+        os.environ["FREPPLE_TEST"] = "YES"
+        param = Parameter.objects.all().get_or_create(pk="plan.webservice")[0]
+        param.value = "false"
+        param.save()
+        if not User.objects.filter(username="admin").count():
+            User.objects.create_superuser("admin", "your@company.com", "admin")
+        self.client.login(username="admin", password="admin")
+        super().setUp()
+
+    def tearDown(self):
+        del os.environ["FREPPLE_TEST"]
+        super().tearDown()
+
+    def getData(self, url):
+        # Numbers are rounded, since the summaries can store them with a
+        # different scale
+        def parse(value):
+            if isinstance(value, list):
+                return [parse(v) for v in value]
+            try:
+                return round(float(value), 4)
+            except (TypeError, ValueError):
+                return value
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content).decode("utf-8")
+        return [
+            {k: parse(v) for k, v in row.items()} for row in json.loads(content)["rows"]
+        ]
+
+    def test_summary(self):
+        management.call_command(
+            "runplan", plantype=1, constraint="capa,mfg_lt,po_lt", env="supply"
+        )
+        self.assertTrue(SummaryStatus.isValid("out_resourcesummary", "default"))
+        self.assertTrue(SummaryStatus.isValid("out_operationsummary", "default"))
+        self.assertTrue(SummaryStatus.isValid("out_buffersummary", "default"))
+        self.assertTrue(SummaryStatus.isValid("out_demandsummary", "default"))
+
+        # The reports show the same numbers with and without summaries
+        urls = [
+            "/resource/?format=json&rows=1000&buckets=week",
+            "/resource/?format=json&rows=1000&buckets=month",
+            "/operation/?format=json&rows=1000&buckets=week",
+            "/buffer/?format=json&rows=1000&buckets=week",
+            "/buffer/?format=json&rows=1000&buckets=month",
+            "/demand/?format=json&rows=1000&buckets=month",
+        ]
+        with_summary = [self.getData(u) for u in urls]
+        SummaryStatus.objects.all().update(valid=False)
+        without_summary = [self.getData(u) for u in urls]
+        self.assertEqual(with_summary, without_summary)
+
+        # Editing the plan invalidates the summary
+        SummaryStatus.objects.all().update(valid=True)
+        op = OperationPlan.objects.filter(type="MO").first()
+        op.quantity += 1
+        op.save()
+        self.assertFalse(SummaryStatus.isValid("out_operationsummary", "default"))
+        self.assertFalse(SummaryStatus.isValid("out_buffersummary", "default"))
+        self.assertFalse(SummaryStatus.isValid("out_demandsummary", "default"))
+        self.assertTrue(SummaryStatus.isValid("out_resourcesummary", "default"))
+
+
+class PeggingExportTest(TransactionTestCase):
+    fixtures = ["demo"]
+
+    def setUp(self):
+        os.environ["FREPPLE_TEST"] = "YES"
+        param = Parameter.objects.all().get_or_create(pk="plan.webservice")[0]
+        param.value = "false"
+        param.save()
+        if not User.objects.filter(username="admin").count():
+            User.objects.create_superuser("admin", "your@company.com", "admin")
+        self.client.login(username="admin", password="admin")
+        super().setUp()
+
+    def tearDown(self):
+        del os.environ["FREPPLE_TEST"]
+        super().tearDown()
+
+    def test_pegging(self):
+        management.call_command(
+            "runplan", plantype=1, constraint="capa,mfg_lt,po_lt", env="supply"
+        )
+
+        # The normalized pegging matches the pegging of the operationplans
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                select operationplan.reference, peg.key, peg.value::numeric
+                from operationplan
+                cross join lateral jsonb_each_text(operationplan.plan->'pegging') peg
+                except
+                select operationplan, demand, quantity
+                from operationplan_pegging
+                """
+            )
+            self.assertEqual(cursor.fetchall(), [])
+        self.assertGreater(OperationPlanPegging.objects.count(), 0)
+
+        # The purchase order list shows the pegged demands
+        response = self.client.get("/data/input/purchaseorder/?format=json&rows=1000")
+        self.assertEqual(response.status_code, 200)
+        content = b"".join(response.streaming_content).decode("utf-8")
+        self.assertTrue(any(row.get("demands") for row in json.loads(content)["rows"]))
+
+
+class ShadowTableTest(TransactionTestCase):
+    fixtures = ["demo"]
+
+    def setUp(self):
+        os.environ["FREPPLE_TEST"] = "YES"
+        param = Parameter.objects.all().get_or_create(pk="plan.webservice")[0]
+        param.value = "false"
+        param.save()
+        super().setUp()
+
+    def tearDown(self):
+        del os.environ["FREPPLE_TEST"]
+        os.environ.pop("shadowtables", None)
+        super().tearDown()
+
+    def getTables(self):
+        # Indexes, constraints and triggers of the plan output tables
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                select
+                  pg_class.relname, pg_class.oid, pg_class.relpersistence,
+                  array(
+                    select indexdef from pg_indexes
+                    where tablename = pg_class.relname
+                    order by indexname
+                    ),
+                  array(
+                    select conname || ' ' || pg_get_constraintdef(oid)
+                    from pg_constraint
+                    where conrelid = pg_class.oid
+                    order by conname
+                    ),
+                  array(
+                    select tgname from pg_trigger
+                    where tgrelid = pg_class.oid and not tgisinternal
+                    order by tgname
+                    )
+                from pg_class
+                where relname = any(%s) and relkind = 'r'
+                """,
+                (list(PublishPlan.shadowTables),),
+            )
+            return {i[0]: i[1:] for i in cursor.fetchall()}
+
+    def getPlan(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                select
+                  (select count(*) from operationplan),
+                  (select count(*) from operationplanmaterial),
+                  (select round(sum(quantity), 4) from operationplanmaterial),
+                  (select count(*) from operationplanresource),
+                  (select round(sum(quantity), 4) from operationplanresource),
+                  (select round(sum(load), 4) from out_resourceplan),
+                  (select count(*) from out_problem),
+                  (select count(*) from out_constraint),
+                  (select count(*) from operationplan_pegging)
+                """
+            )
+            return cursor.fetchone()
+
+    def test_shadow_tables(self):
+        management.call_command(
+            "runplan", plantype=1, constraint="capa,mfg_lt,po_lt", env="supply"
+        )
+        plan = self.getPlan()
+        tables = self.getTables()
+        self.assertGreater(plan[1], 0)
+
+        # Export the same plan again through shadow tables
+        management.call_command(
+            "runplan",
+            plantype=1,
+            constraint="capa,mfg_lt,po_lt",
+            env="supply,shadowtables",
+        )
+        self.assertEqual(self.getPlan(), plan)
+        current = self.getTables()
+        self.assertEqual(current.keys(), tables.keys())
+        for name, before in tables.items():
+            # The swapped tables are logged and keep their indexes,
+            # constraints and triggers
+            self.assertEqual(current[name][1:], before[1:])
+        self.assertTrue(any(current[t][0] != tables[t][0] for t in tables))
+
+        # The previous tables are dropped
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "select relname from pg_class where relname = any(%s)",
+                (
+                    ["%s_old" % t for t in PublishPlan.shadowTables]
+                    + ["%s_new" % t for t in PublishPlan.shadowTables],
+                ),
+            )
+            self.assertEqual(cursor.fetchall(), [])
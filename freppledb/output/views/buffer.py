@@ -33,6 +33,7 @@ from django.utils.translation import gettext_lazy as _
 
 from freppledb.boot import getAttributeFields
 from freppledb.input.models import Buffer, Item, Location, OperationPlanMaterial
+from freppledb.output.models import SummaryStatus
 from freppledb.common.report import (
     GridPivot,
     GridFieldText,
@@ -596,6 +597,195 @@ class OverviewReport(GridPivot):
         else:
             return {"withforecast": "freppledb.forecast" in settings.INSTALLED_APPS}
 
+    # Flows of a buffer in a bucket "d": name, aggregate function and expression
+    bucketsums = (
+        (
+            "work_in_progress_mo",
+            "sum",
+            "case when (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'MO' then opm.quantity else 0 end",
+        ),
+        (
+            "work_in_progress_mo_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'MO' then opm.quantity else 0 end",
+        ),
+        (
+            "work_in_progress_mo_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.status = 'proposed' and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'MO' then opm.quantity else 0 end",
+        ),
+        (
+            "on_order_po",
+            "sum",
+            "case when (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'PO' then opm.quantity else 0 end",
+        ),
+        (
+            "on_order_po_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'PO' then opm.quantity else 0 end",
+        ),
+        (
+            "on_order_po_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.status = 'proposed' and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'PO' then opm.quantity else 0 end",
+        ),
+        (
+            "proposed_ordering",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.type = 'PO' and (operationplan.startdate >= greatest(d.startdate,arguments.report_startdate) and operationplan.startdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "in_transit_do",
+            "sum",
+            "case when (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'DO' then opm.quantity else 0 end",
+        ),
+        (
+            "in_transit_do_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'DO' then opm.quantity else 0 end",
+        ),
+        (
+            "in_transit_do_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'DO' then opm.quantity else 0 end",
+        ),
+        (
+            "total_in_progress",
+            "sum",
+            "case when (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "total_in_progress_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "total_in_progress_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and (operationplan.startdate < d.enddate and operationplan.enddate >= d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "consumed",
+            "sum",
+            "case when (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumed_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumed_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedMO",
+            "sum",
+            "case when operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedMO_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedMO_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedDO",
+            "sum",
+            "case when operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedFcst",
+            "sum",
+            "case when operationplan.type = 'DLVR' and operationplan.demand_id is null and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedDO_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedDO_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "consumedSO",
+            "sum",
+            "case when operationplan.demand_id is not null and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end",
+        ),
+        (
+            "produced",
+            "sum",
+            "case when (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "produced_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "produced_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedMO",
+            "sum",
+            "case when operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedMO_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedMO_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedDO",
+            "sum",
+            "case when operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedDO_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedDO_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedPO",
+            "sum",
+            "case when operationplan.type = 'PO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedPO_confirmed",
+            "sum",
+            "case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'PO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "producedPO_proposed",
+            "sum",
+            "case when operationplan.status = 'proposed' and operationplan.type = 'PO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end",
+        ),
+        (
+            "max_delay",
+            "max",
+            "extract(epoch from case when opm.flowdate >= greatest(d.startdate,arguments.report_currentdate) and opm.flowdate < d.enddate then operationplan.delay else interval '0 second' end) / 86400",
+        ),
+    )
+
     @classmethod
     def query(reportclass, request, basequery, sortsql="1 asc"):
         basesql, baseparams = basequery.query.get_compiler(basequery.db).as_sql(
@@ -610,7 +800,7 @@ class OverviewReport(GridPivot):
 
         backlog_fcst = """
             union all
-          select opm.item_id, opm.location_id, '' as batch, 0::numeric qty_orders, coalesce(sum((forecastplan.value->>'forecastnet')::numeric),0) qty_forecast
+          select opm.item_id, opm.location_id, '' as batch, 0::numeric qty_orders, coalesce(sum(forecastplan.forecastnet),0) qty_forecast
           from forecastplan
           left outer join common_parameter cp on cp.name = 'forecast.DueWithinBucket'
           inner join (%s) opm on forecastplan.item_id = opm.item_id
@@ -729,6 +919,26 @@ class OverviewReport(GridPivot):
                             max(float(row[4] or 0), 0),
                         )
         # Execute the actual query
+        if SummaryStatus.isValid("out_buffersummary", request.database):
+            # Flows of the buckets after the current date and inside the
+            # horizon are precomputed during the plan export
+            summary_sql = """
+            when d.startdate >= greatest(arguments.report_startdate, arguments.report_currentdate)
+            then (
+             select json_build_object(%s)
+             from out_buffersummary s
+             where s.item = item.name
+               and s.location = location.name
+               and (item.type is distinct from 'make to order' or s.batch is not distinct from opplanmat.opplan_batch)
+               and s.bucket = arguments.report_bucket
+               and s.startdate = d.startdate
+             )
+            """ % ",".join(
+                "'%s', %s(s.%s)" % (name, function, name.lower())
+                for name, function, expression in reportclass.bucketsums
+            )
+        else:
+            summary_sql = ""
         reasons_forecast = """
                 union all
                 select distinct out_constraint.name, out_constraint.owner
@@ -739,7 +949,7 @@ class OverviewReport(GridPivot):
                 and operationplan.due < d.enddate
                 """
         net_forecast = """
-        (select sum((forecastplan.value->>'forecastnet')::numeric)
+        (select sum(forecastplan.forecastnet)
             from forecastplan
             left outer join common_parameter cp on cp.name = 'forecast.DueWithinBucket'
             where forecastplan.item_id = item.name and forecastplan.location_id = location.name
@@ -915,46 +1125,9 @@ class OverviewReport(GridPivot):
             limit 1)
             end as safetystock,
             case when d.history then json_build_object()
+            %s
             else (
-             select json_build_object(
-               'work_in_progress_mo', sum(case when (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'MO' then opm.quantity else 0 end),
-               'work_in_progress_mo_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'MO' then opm.quantity else 0 end),
-               'work_in_progress_mo_proposed', sum(case when operationplan.status = 'proposed' and operationplan.status = 'proposed' and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'MO' then opm.quantity else 0 end),
-               'on_order_po', sum(case when (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'PO' then opm.quantity else 0 end),
-               'on_order_po_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'PO' then opm.quantity else 0 end),
-               'on_order_po_proposed', sum(case when operationplan.status = 'proposed' and operationplan.status = 'proposed' and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'PO' then opm.quantity else 0 end),
-               'proposed_ordering', sum(case when operationplan.status = 'proposed' and operationplan.type = 'PO' and (operationplan.startdate >= greatest(d.startdate,arguments.report_startdate) and operationplan.startdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'in_transit_do', sum(case when (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'DO' then opm.quantity else 0 end),
-               'in_transit_do_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'DO' then opm.quantity else 0 end),
-               'in_transit_do_proposed', sum(case when operationplan.status = 'proposed' and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 and operationplan.type = 'DO' then opm.quantity else 0 end),
-               'total_in_progress', sum(case when (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'total_in_progress_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'total_in_progress_proposed', sum(case when operationplan.status = 'proposed' and (startdate < d.enddate and enddate >= d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'consumed', sum(case when (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumed_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumed_proposed', sum(case when operationplan.status = 'proposed' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedMO', sum(case when operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedMO_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedMO_proposed', sum(case when operationplan.status = 'proposed' and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedDO', sum(case when operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedFcst', sum(case when operationplan.type = 'DLVR' and operationplan.demand_id is null and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedDO_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedDO_proposed', sum(case when operationplan.status = 'proposed' and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'consumedSO', sum(case when operationplan.demand_id is not null and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity < 0 then -opm.quantity else 0 end),
-               'produced', sum(case when (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'produced_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'produced_proposed', sum(case when operationplan.status = 'proposed' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedMO', sum(case when operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedMO_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedMO_proposed', sum(case when operationplan.status = 'proposed' and operationplan.type = 'MO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedDO', sum(case when operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedDO_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedDO_proposed', sum(case when operationplan.status = 'proposed' and operationplan.type = 'DO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedPO', sum(case when operationplan.type = 'PO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedPO_confirmed', sum(case when operationplan.status in ('approved','confirmed','completed') and operationplan.type = 'PO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'producedPO_proposed', sum(case when operationplan.status = 'proposed' and operationplan.type = 'PO' and (opm.flowdate >= greatest(d.startdate,arguments.report_startdate) and opm.flowdate < d.enddate) and opm.quantity > 0 then opm.quantity else 0 end),
-               'max_delay', max(extract(epoch from case when opm.flowdate >= greatest(d.startdate,arguments.report_currentdate) and opm.flowdate < d.enddate then operationplan.delay else interval '0 second' end) / 86400)
-               )
+             select json_build_object(%s)
              from operationplanmaterial opm
              inner join operationplan
              on operationplan.reference = opm.operationplan_id
@@ -1067,12 +1240,18 @@ class OverviewReport(GridPivot):
            d.enddate,
            d.history,
            arguments.report_startdate,
-           arguments.report_currentdate
+           arguments.report_currentdate,
+           arguments.report_bucket
            order by %s, d.startdate
         """ % (
             reportclass.attr_sql,
             net_forecast if "freppledb.forecast" in settings.INSTALLED_APPS else "0",
             reasons_forecast if "freppledb.forecast" in settings.INSTALLED_APPS else "",
+            summary_sql,
+            ",".join(
+                "'%s', %s(%s)" % (name, function, expression)
+                for name, function, expression in reportclass.bucketsums
+            ),
             basesql,
             sortsql,
         )
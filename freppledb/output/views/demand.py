@@ -42,6 +42,7 @@ from freppledb.common.report import (
     getCurrentDate,
 )
 from freppledb.common.report import GridFieldCurrency, GridFieldLastModified
+from freppledb.output.models import SummaryStatus
 
 
 class OverviewReportWithoutForecast(GridPivot):
@@ -174,7 +175,14 @@ class OverviewReportWithoutForecast(GridPivot):
           d.bucket,
           d.startdate,
           d.enddate,
-          sum(coalesce((
+          sum(coalesce(case when d.summarized then (
+            select sum(s.orders)
+            from out_demandsummary s
+            inner join item child on child.lft between parent.lft and parent.rght
+            where s.item = child.name
+            and s.bucket = d.bucket_id
+            and s.startdate = d.startdate
+            ) else (
             select sum(quantity)
             from demand
             inner join item child on child.lft between parent.lft and parent.rght
@@ -182,8 +190,15 @@ class OverviewReportWithoutForecast(GridPivot):
             and status in ('open','quote')
             and due >= greatest(%%s,d.startdate)
             and due < d.enddate
-            ),0)) orders,
-          sum(coalesce((
+            ) end,0)) orders,
+          sum(coalesce(case when d.summarized then (
+            select sum(s.planned_orders)
+            from out_demandsummary s
+            inner join item child on child.lft between parent.lft and parent.rght
+            where s.item = child.name
+            and s.bucket = d.bucket_id
+            and s.startdate = d.startdate
+            ) else (
             select sum(operationplan.quantity)
             from operationplan
             inner join item child on child.lft between parent.lft and parent.rght
@@ -191,7 +206,7 @@ class OverviewReportWithoutForecast(GridPivot):
             and operationplan.demand_id is not null
             and operationplan.enddate >= greatest(%%s,d.startdate)
             and operationplan.enddate < d.enddate
-            ),0)) planned,
+            ) end,0)) planned,
           (select json_agg(json_build_array(f1,f2)) from
             (select distinct out_constraint.name as f1, out_constraint.owner as f2
             from out_constraint
@@ -208,7 +223,8 @@ class OverviewReportWithoutForecast(GridPivot):
           ) reasons
           from (%s) parent
           cross join (
-                       select name as bucket, startdate, enddate
+                       select name as bucket, bucket_id, startdate, enddate,
+                         (%%s and startdate >= %%s) as summarized
                        from common_bucketdetail
                        where bucket_id = %%s and enddate > %%s and startdate < %%s
                        ) d
@@ -217,7 +233,7 @@ class OverviewReportWithoutForecast(GridPivot):
             parent.owner_id, parent.cost, parent.volume, parent.weight, parent.uom, parent.periodofcover,
             parent.source, parent.lastmodified, parent.lft, parent.rght,
             %s
-            d.bucket, d.startdate, d.enddate
+            d.bucket, d.bucket_id, d.startdate, d.enddate, d.summarized
           order by %s, d.startdate
         """ % (
             reportclass.attr_sql,
@@ -234,6 +250,9 @@ class OverviewReportWithoutForecast(GridPivot):
                     (request.report_startdate,) * 3  # orders + planned + constraints
                     + baseparams  # orders planned
                     + (
+                        # Full buckets are read from the summary when it's valid
+                        SummaryStatus.isValid("out_demandsummary", request.database),
+                        request.report_startdate,
                         request.report_bucket,
                         request.report_startdate,
                         request.report_enddate,
@@ -376,7 +395,7 @@ class OverviewReportWithForecast(GridPivot):
           inner join demand on demand.item_id = child.name and demand.status in ('open','quote') and due < %%s
           group by item.name
           union all
-          select item.name, 0::numeric qty_orders, coalesce(sum((forecastplan.value->>'forecastnet')::numeric),0) qty_forecast
+          select item.name, 0::numeric qty_orders, coalesce(sum(forecastplan.forecastnet),0) qty_forecast
           from forecastplan
           left outer join common_parameter cp on cp.name = 'forecast.DueWithinBucket'
           inner join (%s) item on forecastplan.item_id = item.name
@@ -433,7 +452,14 @@ class OverviewReportWithForecast(GridPivot):
           d.bucket,
           d.startdate,
           d.enddate,
-          sum(coalesce((
+          sum(coalesce(case when d.summarized then (
+            select sum(s.orders)
+            from out_demandsummary s
+            inner join item child on child.lft between parent.lft and parent.rght
+            where s.item = child.name
+            and s.bucket = d.bucket_id
+            and s.startdate = d.startdate
+            ) else (
             select sum(quantity)
             from demand
             inner join item child on child.lft between parent.lft and parent.rght
@@ -441,23 +467,39 @@ class OverviewReportWithForecast(GridPivot):
             and status in ('open','quote')
             and due >= greatest(%%s,d.startdate)
             and due < d.enddate
-            ),0)) orders,
-          (select coalesce(sum(operationplan.quantity),0)
+            ) end,0)) orders,
+          case when d.summarized then (
+            select coalesce(sum(s.planned_orders),0)
+            from out_demandsummary s
+            inner join item child on child.lft between parent.lft and parent.rght
+            where s.item = child.name
+            and s.bucket = d.bucket_id
+            and s.startdate = d.startdate
+            ) else (
+            select coalesce(sum(operationplan.quantity),0)
             from operationplan
             inner join item child on child.lft between parent.lft and parent.rght
             where operationplan.demand_id is not null
             and operationplan.item_id = child.name
             and operationplan.enddate >= greatest(%%s,d.startdate)
             and operationplan.enddate < d.enddate
-            ) planned_orders,
-          (select coalesce(sum(operationplan.quantity),0)
+            ) end planned_orders,
+          case when d.summarized then (
+            select coalesce(sum(s.planned_forecast),0)
+            from out_demandsummary s
+            inner join item child on child.lft between parent.lft and parent.rght
+            where s.item = child.name
+            and s.bucket = d.bucket_id
+            and s.startdate = d.startdate
+            ) else (
+            select coalesce(sum(operationplan.quantity),0)
             from operationplan
             inner join item child on child.lft between parent.lft and parent.rght
             where operationplan.forecast is not null
             and operationplan.item_id = child.name
             and operationplan.enddate >= greatest(%%s,d.startdate)
             and operationplan.enddate < d.enddate
-            ) planned_forecast,
+            ) end planned_forecast,
           (select json_agg(json_build_array(f1,f2)) from
             (select distinct out_constraint.name as f1, out_constraint.owner as f2
             from out_constraint
@@ -473,7 +515,7 @@ class OverviewReportWithForecast(GridPivot):
             ) cte_reasons
             ) reasons,
           coalesce((
-            select sum((forecastplan.value->>'forecastnet')::numeric)
+            select sum(forecastplan.forecastnet)
             from forecastplan
             left outer join common_parameter cp on cp.name = 'forecast.DueWithinBucket'
             where forecastplan.item_id = parent.name
@@ -489,7 +531,8 @@ class OverviewReportWithForecast(GridPivot):
             ),0) forecast
           from (%s) parent
           cross join (
-                       select name as bucket, startdate, enddate
+                       select name as bucket, bucket_id, startdate, enddate,
+                         (%%s and startdate >= %%s) as summarized
                        from common_bucketdetail
                        where bucket_id = %%s and enddate > %%s and startdate < %%s
                        ) d
@@ -497,7 +540,7 @@ class OverviewReportWithForecast(GridPivot):
             parent.name, parent.description, parent.category, parent.subcategory,
             parent.owner_id, parent.cost, parent.source, parent.lastmodified, parent.lft, parent.rght,
             %s
-            d.bucket, d.startdate, d.enddate
+            d.bucket, d.bucket_id, d.startdate, d.enddate, d.summarized
           order by %s, d.startdate
         """ % (
             reportclass.attr_sql,
@@ -521,6 +564,9 @@ class OverviewReportWithForecast(GridPivot):
                     )
                     + baseparams
                     + (
+                        # Full buckets are read from the summary when it's valid
+                        SummaryStatus.isValid("out_demandsummary", request.database),
+                        request.report_startdate,
                         request.report_bucket,
                         request.report_startdate,
                         request.report_enddate,  # buckets
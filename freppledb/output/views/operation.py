@@ -43,6 +43,7 @@ from freppledb.common.report import (
     GridFieldDateTime,
     GridFieldLastModified,
 )
+from freppledb.output.models import SummaryStatus
 
 
 class OverviewReport(GridPivot):
@@ -321,32 +322,8 @@ class OverviewReport(GridPivot):
         else:
             return {}
 
-    @classmethod
-    def query(reportclass, request, basequery, sortsql="1 asc"):
-        basesql, baseparams = basequery.query.get_compiler(basequery.db).as_sql(
-            with_col_aliases=False
-        )
-        # Build the query
-        query = """
-      select
-        operation.name, location.name, operation.item_id, operation.description,
-        operation.category, operation.subcategory, operation.type, operation.duration,
-        operation.duration_per, operation.fence, operation.posttime, operation.sizeminimum,
-        operation.sizemultiple, operation.sizemaximum, operation.priority, operation.effective_start,
-        operation.effective_end, operation.cost, operation.search, operation.source, operation.lastmodified,
-        location.description, location.category, location.subcategory, location.available_id,
-        location.lastmodified, item.description, item.category, item.subcategory, item.cost,
-        item.volume, item.weight, item.uom, item.periodofcover, item.owner_id, item.source, item.lastmodified,
-        %s
-        res.bucket, res.startdate, res.enddate,
-        res.proposed_start, res.total_start, res.proposed_end, res.total_end, res.proposed_production, res.total_production
-      from operation
-      left outer join item
-      on operation.item_id = item.name
-      left outer join location
-      on operation.location_id = location.name
-      inner join (
-        select oper.name as operation_id, d.bucket, d.startdate, d.enddate,
+    # Totals of the operationplans overlapping with a bucket "d"
+    bucketsums = """
          coalesce(sum(
            case when operationplan.status = 'proposed'
              and d.startdate <= operationplan.startdate and d.enddate > operationplan.startdate
@@ -416,6 +393,46 @@ class OverviewReport(GridPivot):
            * operationplan.quantity
            end
            ), 0) total_production
+    """
+
+    @classmethod
+    def query(reportclass, request, basequery, sortsql="1 asc"):
+        basesql, baseparams = basequery.query.get_compiler(basequery.db).as_sql(
+            with_col_aliases=False
+        )
+        # Build the query
+        if SummaryStatus.isValid("out_operationsummary", request.database):
+            # Bucket totals precomputed during the plan export
+            bucketsql = """
+        select oper.name as operation_id, d.bucket, d.startdate, d.enddate,
+          coalesce(s.proposed_start, 0) proposed_start,
+          coalesce(s.total_start, 0) total_start,
+          coalesce(s.proposed_end, 0) proposed_end,
+          coalesce(s.total_end, 0) total_end,
+          coalesce(s.proposed_production, 0) proposed_production,
+          coalesce(s.total_production, 0) total_production
+        from (%s) oper
+        -- Multiply with buckets
+        cross join (
+          select name as bucket, startdate, enddate
+          from common_bucketdetail
+          where bucket_id = '%s' and enddate > '%s' and startdate < '%s'
+          ) d
+        left outer join out_operationsummary s
+          on s.operation = oper.name
+          and s.bucket = '%s'
+          and s.startdate = d.startdate
+        """ % (
+                basesql,
+                request.report_bucket,
+                request.report_startdate,
+                request.report_enddate,
+                request.report_bucket,
+            )
+        else:
+            bucketsql = """
+        select oper.name as operation_id, d.bucket, d.startdate, d.enddate,
+        %s
         from (%s) oper
         -- Multiply with buckets
         cross join (
@@ -428,15 +445,37 @@ class OverviewReport(GridPivot):
           on operationplan.operation_id = oper.name
           and (operationplan.startdate, operationplan.enddate) overlaps (d.startdate, d.enddate)
         group by oper.name, d.bucket, d.startdate, d.enddate
-      ) res
+        """ % (
+                reportclass.bucketsums,
+                basesql,
+                request.report_bucket,
+                request.report_startdate,
+                request.report_enddate,
+            )
+        query = """
+      select
+        operation.name, location.name, operation.item_id, operation.description,
+        operation.category, operation.subcategory, operation.type, operation.duration,
+        operation.duration_per, operation.fence, operation.posttime, operation.sizeminimum,
+        operation.sizemultiple, operation.sizemaximum, operation.priority, operation.effective_start,
+        operation.effective_end, operation.cost, operation.search, operation.source, operation.lastmodified,
+        location.description, location.category, location.subcategory, location.available_id,
+        location.lastmodified, item.description, item.category, item.subcategory, item.cost,
+        item.volume, item.weight, item.uom, item.periodofcover, item.owner_id, item.source, item.lastmodified,
+        %s
+        res.bucket, res.startdate, res.enddate,
+        res.proposed_start, res.total_start, res.proposed_end, res.total_end, res.proposed_production, res.total_production
+      from operation
+      left outer join item
+      on operation.item_id = item.name
+      left outer join location
+      on operation.location_id = location.name
+      inner join (%s) res
       on res.operation_id = operation.name
       order by %s, res.startdate
       """ % (
             reportclass.attr_sql,
-            basesql,
-            request.report_bucket,
-            request.report_startdate,
-            request.report_enddate,
+            bucketsql,
             sortsql,
         )
 
@@ -32,6 +32,7 @@ from freppledb.input.models import Resource, Location
 from freppledb.common.models import Parameter
 from freppledb.common.report import GridPivot, GridFieldCurrency, GridFieldDuration
 from freppledb.common.report import GridFieldNumber, GridFieldText, GridFieldBool
+from freppledb.output.models import SummaryStatus
 
 
 class OverviewReport(GridPivot):
@@ -285,6 +286,30 @@ class OverviewReport(GridPivot):
         # Assure the item hierarchy is up to date
         Resource.rebuildHierarchy(database=basequery.db)
 
+        # Buckets completely within the reporting horizon are read from the
+        # summary table. The detailed resource plan is only used for the
+        # buckets that are cut by the horizon boundaries.
+        if SummaryStatus.isValid("out_resourcesummary", request.database):
+            summarysql = """
+      left join out_resourcesummary s
+      on res.name = s.resource
+      and s.bucket = '%s'
+      and s.startdate = d.startdate
+      and d.startdate >= '%s'
+      and d.enddate <= '%s'
+      """ % (
+                request.report_bucket,
+                request.report_startdate,
+                request.report_enddate,
+            )
+            rawsql = "and (d.startdate < '%s' or d.enddate > '%s')" % (
+                request.report_startdate,
+                request.report_enddate,
+            )
+        else:
+            summarysql = "left join out_resourcesummary s on false"
+            rawsql = ""
+
         # Execute the query
         query = """
       select res.name, res.description, res.category, res.subcategory,
@@ -295,10 +320,14 @@ class OverviewReport(GridPivot):
         res.owner_id,
         %s
         d.bucket as col1, d.startdate as col2,
-        coalesce(sum(out_resourceplan.available),0) / (case when res.type = 'buckets' then 1 else %f end) as available,
-        coalesce(sum(out_resourceplan.unavailable),0) / (case when res.type = 'buckets' then 1 else %f end) as unavailable,
-        coalesce(sum(out_resourceplan.load),0) / (case when res.type = 'buckets' then 1 else %f end) as loading,
-        coalesce(sum(out_resourceplan.setup),0) / (case when res.type = 'buckets' then 1 else %f end) as setup
+        (coalesce(sum(out_resourceplan.available),0) + coalesce(sum(s.available),0))
+          / (case when res.type = 'buckets' then 1 else %f end) as available,
+        (coalesce(sum(out_resourceplan.unavailable),0) + coalesce(sum(s.unavailable),0))
+          / (case when res.type = 'buckets' then 1 else %f end) as unavailable,
+        (coalesce(sum(out_resourceplan.load),0) + coalesce(sum(s.load),0))
+          / (case when res.type = 'buckets' then 1 else %f end) as loading,
+        (coalesce(sum(out_resourceplan.setup),0) + coalesce(sum(s.setup),0))
+          / (case when res.type = 'buckets' then 1 else %f end) as setup
       from (%s) res
       left outer join location
         on res.location_id = location.name
@@ -309,12 +338,14 @@ class OverviewReport(GridPivot):
                    where bucket_id = '%s' and enddate > '%s' and startdate < '%s'
                    ) d
       -- Utilization info
+      %s
       left join out_resourceplan
       on res.name = out_resourceplan.resource
       and d.startdate <= out_resourceplan.startdate
       and d.enddate > out_resourceplan.startdate
       and out_resourceplan.startdate >= '%s'
       and out_resourceplan.startdate < '%s'
+      %s
       -- Grouping and sorting
       group by res.name, res.description, res.category, res.subcategory,
         res.type, res.maximum, res.maximum_calendar_id, res.available_id, res.cost, res.maxearly,
@@ -333,8 +364,10 @@ class OverviewReport(GridPivot):
             request.report_bucket,
             request.report_startdate,
             request.report_enddate,
+            summarysql,
             request.report_startdate,
             request.report_enddate,
+            rawsql,
             reportclass.attr_sql,
             sortsql,
         )
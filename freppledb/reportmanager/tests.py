@@ -30,7 +30,9 @@ from django.test import TransactionTestCase
 
 from freppledb.common.models import User
 from freppledb.common.tests import checkResponse
+from freppledb.input.models import Item
 from .models import SQLReport, SQLColumn
+from .views import ReportResultCache
 
 
 @skipUnless("freppledb.reportmanager" in settings.INSTALLED_APPS, "App not activated")
@@ -139,3 +141,114 @@ class ReportManagerTest(TransactionTestCase):
         checkResponse(self, response)
         self.assertEqual(SQLReport.objects.all().count(), 0)
         self.assertEqual(SQLColumn.objects.all().count(), 0)
+
+    def test_paging(self):
+        response = self.client.post(
+            "/reportmanager/",
+            {
+                "sql": "select name, cost from item",
+                "save": "true",
+                "name": "paged report",
+                "public": "false",
+            },
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+        checkResponse(self, response)
+        report = SQLReport.objects.all()[0]
+        ReportResultCache.clear()
+
+        # All pages and the count are served from a single cached result
+        names = []
+        for page in range(1, 4):
+            response = self.client.get(
+                "/reportmanager/%s/?format=json&rows=3&page=%s&sidx=name&sord=asc"
+                % (report.id, page)
+            )
+            self.assertContains(response, '"records":7,')
+            names.extend(
+                r["name"] for r in json.loads(response.content.decode("utf-8"))["rows"]
+            )
+            self.assertEqual(len(ReportResultCache.entries), 1)
+        self.assertEqual(
+            names, list(Item.objects.order_by("name").values_list("name", flat=True))
+        )
+
+        # Saving the report invalidates its cached result
+        response = self.client.post(
+            "/reportmanager/%s/" % report.id,
+            {
+                "id": report.id,
+                "save": "true",
+                "sql": "select name, cost from item where name like '%e%'",
+                "name": report.name,
+                "public": report.public,
+            },
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+        answer = json.loads(response.content.decode("utf-8"))
+        self.assertEqual(answer["status"], "ok")
+        response = self.client.get("/reportmanager/%s/?format=json" % report.id)
+        self.assertNotContains(response, '"records":7,')
+
+    def test_download(self):
+        for sql in (
+            "select name, cost from item",
+            "select name, cost, lastmodified from item",
+        ):
+            response = self.client.post(
+                "/reportmanager/",
+                {
+                    "sql": sql,
+                    "save": "true",
+                    "name": sql,
+                    "public": "false",
+                },
+                HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+            )
+            checkResponse(self, response)
+        expected = [
+            '"%s","%s"' % (i.name, i.cost if i.cost is not None else "")
+            for i in Item.objects.order_by("name")
+        ]
+
+        # Text and number columns are exported by the database
+        report = SQLReport.objects.get(name="select name, cost from item")
+        response = self.client.get(
+            "/reportmanager/%s/?format=csv&sidx=name&sord=asc" % report.id
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[1:], expected)
+
+        # Other columns are formatted in python
+        report = SQLReport.objects.get(name="select name, cost, lastmodified from item")
+        response = self.client.get(
+            "/reportmanager/%s/?format=csv&sidx=name&sord=asc" % report.id
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual([l.rsplit(",", 1)[0] for l in lines[1:]], expected)
+        response = self.client.get("/reportmanager/%s/?format=spreadsheet" % report.id)
+        checkResponse(self, response)
+
+        # Booleans and arrays are exported like in the python formatting
+        sql = "select name, cost, cost is null as nocost, array['a','b'] as list from item"
+        response = self.client.post(
+            "/reportmanager/",
+            {"sql": sql, "save": "true", "name": sql, "public": "false"},
+            HTTP_X_REQUESTED_WITH="XMLHttpRequest",
+        )
+        checkResponse(self, response)
+        report = SQLReport.objects.get(name=sql)
+        response = self.client.get(
+            "/reportmanager/%s/?format=csv&sidx=name&sord=asc" % report.id
+        )
+        self.assertEqual(response.status_code, 200)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(
+            lines[1:],
+            [
+                '%s,"%s","a|b"' % (e, i.cost is None)
+                for e, i in zip(expected, Item.objects.order_by("name"))
+            ],
+        )
@@ -21,10 +21,16 @@
 # WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
 #
 
+from collections import OrderedDict
 from datetime import timedelta, date
+from hashlib import sha1
+import io
 import json
 import logging
 import sqlparse
+import tempfile
+from threading import Lock
+from time import time
 
 from django.conf import settings
 from django.contrib.auth.decorators import permission_required
@@ -48,7 +54,7 @@ from django.utils.translation import gettext_lazy as _
 from freppledb.common.localization import parseLocalizedDate, parseLocalizedDateTime
 from freppledb.common.models import User, Parameter
 from freppledb.common.report import (
-    create_connection,
+    RoleConnectionPool,
     GridReport,
     GridFieldText,
     GridFieldLastModified,
@@ -66,6 +72,47 @@ from .admin import SQLReportForm
 
 logger = logging.getLogger(__name__)
 
+# Column formats that the database formats the same way as the CSV export in
+# python. Columns of type "character" can hold any other database type, such as
+# booleans, dates and arrays, which are formatted differently.
+copyFormats = ("text", "number", "integer", "currency")
+
+
+class ReportResultCache:
+    """
+    An in-memory cache with the filtered and sorted result of custom reports.
+    The count and all pages of a report are served from a single execution
+    of its query.
+    """
+
+    lock = Lock()
+    entries = OrderedDict()
+    size = 20
+
+    @classmethod
+    def get(cls, key):
+        ttl = getattr(settings, "REPORT_CACHE_TTL", 300)
+        with cls.lock:
+            entry = cls.entries.get(key, None)
+            if entry:
+                if entry[0] > time() - ttl:
+                    cls.entries.move_to_end(key)
+                    return entry[1]
+                del cls.entries[key]
+
+    @classmethod
+    def put(cls, key, rows):
+        with cls.lock:
+            cls.entries[key] = (time(), rows)
+            cls.entries.move_to_end(key)
+            while len(cls.entries) > cls.size:
+                cls.entries.popitem(last=False)
+
+    @classmethod
+    def clear(cls):
+        with cls.lock:
+            cls.entries.clear()
+
 
 @permission_required("reportmanager.add_sqlreport", raise_exception=True)
 def getSchema(request):
@@ -165,6 +212,9 @@ class ReportManager(GridReport):
     help_url = "user-interface/report-manager.html"
     default_sort = ""
 
+    # Number of records fetched at a time when downloading a report
+    itersize = 2000
+
     @staticmethod
     def _filter_ne(reportrow, field, data):
         if isinstance(
@@ -443,87 +493,184 @@ class ReportManager(GridReport):
         return q_filters
 
     @classmethod
-    def data_query(cls, request, *args, page=None, **kwargs):
-        # Main query that will return all data records.
-        # It implements filtering, paging and sorting.
-        conn = None
+    def _getReport(cls, request, *args, **kwargs):
         if not hasattr(request, "report"):
             request.report = (
                 SQLReport.objects.all().using(request.database).get(pk=args[0])
             )
         if request.report and request.report.sql:
-            try:
-                conn = create_connection(request.database)
+            if not hasattr(request, "filter"):
+                request.filter = cls.getFilter(request, *args, **kwargs)
+            return request.report
+
+    @classmethod
+    def _getQuery(cls, request, page=None, limit=None):
+        return (
+            "select * from (%s) t_subquery %s order by %s %s %s"
+            % (
+                request.report.sql.replace("%", "%%"),
+                "where %s" % request.filter[0] if request.filter[0] else "",
+                cls._apply_sort_index(request),
+                (
+                    ("offset %s" % ((page - 1) * request.pagesize))
+                    if page and page > 1
+                    else ""
+                ),
+                (
+                    "limit %s" % request.pagesize
+                    if page
+                    else "limit %s" % limit
+                    if limit
+                    else ""
+                ),
+            ),
+            request.filter[1],
+        )
+
+    @classmethod
+    def _getCachedResult(cls, request):
+        """
+        Returns all filtered and sorted records of the report.
+        None is returned when the result is too big to be cached.
+        """
+        if hasattr(request, "report_result"):
+            return request.report_result
+        request.report_result = None
+        maxrows = getattr(settings, "REPORT_CACHE_ROWS", 10000)
+        if not maxrows or not getattr(settings, "REPORT_CACHE_TTL", 300):
+            return None
+
+        # The version of the data in the scenario changes after every task
+        # and after every change to the tables.
+        with connections[request.database].cursor() as cursor:
+            cursor.execute(
+                """
+                select
+                  (select coalesce(max(id), 0) from execute_log where finished is not null),
+                  (select coalesce(sum(n_tup_ins + n_tup_upd + n_tup_del), 0)
+                   from pg_stat_user_tables)
+                """
+            )
+            version = tuple(cursor.fetchone())
+        key = (
+            request.database,
+            request.report.id,
+            sha1(request.report.sql.encode("utf-8")).hexdigest(),
+            request.report.lastmodified,
+            request.filter[0],
+            tuple(str(i) for i in request.filter[1]),
+            cls._apply_sort_index(request),
+            version,
+        )
+        rows = ReportResultCache.get(key)
+        if rows is None:
+            with RoleConnectionPool.connection(request.database) as conn:
                 with conn.cursor() as cursor:
-                    sqlrole = settings.DATABASES[request.database].get(
-                        "SQL_ROLE", "report_role"
-                    )
-                    if sqlrole:
-                        cursor.execute("set role %s" % (sqlrole,))
-                    if not hasattr(request, "filter"):
-                        request.filter = cls.getFilter(request, *args, **kwargs)
+                    cursor.execute(*cls._getQuery(request, limit=maxrows + 1))
+                    rows = cursor.fetchall()
+            if len(rows) > maxrows:
+                # Remember the report is too big, to avoid trying again
+                rows = False
+            ReportResultCache.put(key, rows)
+        if rows is not False:
+            request.report_result = rows
+        return request.report_result
+
+    @classmethod
+    def data_query(cls, request, *args, page=None, **kwargs):
+        # Main query that will return all data records.
+        # It implements filtering, paging and sorting.
+        if not cls._getReport(request, *args, **kwargs):
+            return
+        names = [f.name for f in request.rows]
+        if not page:
+            # Downloads are streamed from a server-side cursor, to keep
+            # the memory usage flat regardless of the size of the report.
+            with RoleConnectionPool.connection(request.database) as conn:
+                conn.set_autocommit(False)
+                with conn.chunked_cursor() as cursor:
+                    cursor.cursor.itersize = cls.itersize
                     cursor.execute(
-                        "select * from (%s) t_subquery %s order by %s %s %s"
-                        % (
-                            request.report.sql.replace("%", "%%"),
-                            "where %s" % request.filter[0] if request.filter[0] else "",
-                            cls._apply_sort_index(request),
-                            ("offset %s" % ((page - 1) * request.pagesize + 1))
-                            if page and page > 1
-                            else "",
-                            "limit %s" % request.pagesize
-                            if page
-                            else "limit %s" % kwargs["report_download_limit"]
-                            if "report_download_limit" in kwargs
-                            else "",
-                        ),
-                        request.filter[1],
+                        *cls._getQuery(
+                            request, limit=kwargs.get("report_download_limit", None)
+                        )
                     )
-                    for rec in cursor.fetchall():
-                        result = {}
-                        idx = 0
-                        for f in request.rows:
-                            result[f.name] = rec[idx]
-                            idx += 1
-                        yield result
-            finally:
-                if conn:
-                    conn.close()
+                    for rec in cursor:
+                        yield dict(zip(names, rec))
+                conn.rollback()
+                conn.set_autocommit(True)
+            return
+        rows = cls._getCachedResult(request)
+        if rows is not None:
+            first = (page - 1) * request.pagesize
+            rows = rows[first : first + request.pagesize]
+        else:
+            with RoleConnectionPool.connection(request.database) as conn:
+                with conn.cursor() as cursor:
+                    cursor.execute(*cls._getQuery(request, page=page))
+                    rows = cursor.fetchall()
+        for rec in rows:
+            yield dict(zip(names, rec))
 
     @classmethod
-    def count_query(cls, request, *args, **kwargs):
-        # Query that returns the number of records in the report.
-        # It implements filtering, but no paging or sorting.
-        conn = None
-        if not hasattr(request, "report"):
-            request.report = (
-                SQLReport.objects.all().using(request.database).get(pk=args[0])
+    def copy_query(cls, request, *args, fields=None, **kwargs):
+        if not cls._getReport(request, *args, **kwargs) or not fields:
+            return None
+        formats = {
+            c.name: c.format
+            for c in SQLColumn.objects.using(request.database).filter(
+                report=request.report
             )
-        if request.report and request.report.sql:
-            try:
-                conn = create_connection(request.database)
+        }
+        if any(formats.get(f.name) not in copyFormats for f in fields):
+            return None
+        query, params = cls._getQuery(
+            request, limit=kwargs.get("report_download_limit", None)
+        )
+        query = "select %s from (%s) t_copy" % (
+            ", ".join(
+                "coalesce(t_copy.\"%s\"::text, '')"
+                % f.name.replace('"', '""').replace("%", "%%")
+                for f in fields
+            ),
+            query,
+        )
+        return cls._copyData(request, query, params)
+
+    @staticmethod
+    def _copyData(request, query, params):
+        with tempfile.TemporaryFile() as datafile:
+            with RoleConnectionPool.connection(request.database) as conn:
                 with conn.cursor() as cursor:
-                    sqlrole = settings.DATABASES[request.database].get(
-                        "SQL_ROLE", "report_role"
-                    )
-                    if sqlrole:
-                        cursor.execute("set role %s" % (sqlrole,))
-                    if not hasattr(request, "filter"):
-                        request.filter = cls.getFilter(request, *args, **kwargs)
-                    cursor.execute(
-                        "select count(*) from (%s) t_subquery %s"
-                        % (
-                            request.report.sql.replace("%", "%%"),
-                            "where %s" % request.filter[0] if request.filter[0] else "",
-                        ),
-                        request.filter[1],
+                    cursor.copy_expert(
+                        "copy (%s) to stdout with (format csv, force_quote *)"
+                        % cursor.mogrify(query, params).decode("utf-8"),
+                        datafile,
                     )
-                    return cursor.fetchone()[0]
-            finally:
-                if conn:
-                    conn.close()
-        else:
+            datafile.seek(0)
+            with io.TextIOWrapper(datafile, encoding="utf-8", newline="") as text:
+                yield from text
+
+    @classmethod
+    def count_query(cls, request, *args, **kwargs):
+        # Query that returns the number of records in the report.
+        # It implements filtering, but no paging or sorting.
+        if not cls._getReport(request, *args, **kwargs):
             return 0
+        rows = cls._getCachedResult(request)
+        if rows is not None:
+            return len(rows)
+        with RoleConnectionPool.connection(request.database) as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "select count(*) from (%s) t_subquery %s"
+                    % (
+                        request.report.sql.replace("%", "%%"),
+                        "where %s" % request.filter[0] if request.filter[0] else "",
+                    ),
+                    request.filter[1],
+                )
+                return cursor.fetchone()[0]
 
     @classmethod
     def rows(cls, request, *args, **kwargs):
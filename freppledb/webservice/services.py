@@ -23,6 +23,7 @@
 
 from channels.generic.http import AsyncHttpConsumer
 from .commands import WebService
+from .utils import PlanWriter
 
 
 class StopService(AsyncHttpConsumer):
@@ -45,7 +46,12 @@ class StopService(AsyncHttpConsumer):
                 headers=self.scope["response_headers"],
             )
         else:
-            # TODO wait for lock?
+            # Save pending changes before shutting down
+            try:
+                await PlanWriter.flush()
+            except Exception:
+                # Already logged
+                pass
             await self.send_response(
                 404,
                 (self.msgtemplate % "Shutting down").encode("utf-8"),
@@ -62,3 +68,25 @@ class PingService(AsyncHttpConsumer):
             b"OK",
             headers=self.scope["response_headers"],
         )
+
+
+class FlushPlanService(AsyncHttpConsumer):
+    """
+    Replies when all pending changes to the plan are saved in the database.
+    """
+
+    async def handle(self, body):
+        self.scope["response_headers"].append((b"Content-Type", b"text/plain"))
+        if self.scope["method"] != "POST":
+            return await self.send_response(
+                401,
+                b"Only POST requests allowed",
+                headers=self.scope["response_headers"],
+            )
+        try:
+            await PlanWriter.flush()
+            await self.send_response(200, b"OK", headers=self.scope["response_headers"])
+        except Exception:
+            await self.send_response(
+                500, b"Error saving plan", headers=self.scope["response_headers"]
+            )
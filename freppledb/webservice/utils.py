@@ -22,10 +22,13 @@
 #
 
 import asyncio
+import logging
 import os
 import portend
 import sys
 
+from channels.db import database_sync_to_async
+
 from django.conf import settings
 from django.db import DEFAULT_DB_ALIAS
 
@@ -33,12 +36,212 @@ from freppledb.common.auth import getWebserviceAuthorization
 from freppledb.common.commands import PlanTaskRegistry
 from freppledb.common.models import Parameter
 
-# Only a single service can be making updates at the same time
+logger = logging.getLogger(__name__)
+
+
+class ClusterLock:
+    """
+    Lock on the planning clusters of the model.
+
+    A service only locks the clusters it updates, so that updates in
+    unrelated clusters can proceed concurrently:
+      async with lock.clusters([3, 5]):
+          ...
+    Locking None or the lock itself locks the complete model, which is
+    needed when we don't know upfront which clusters will be touched:
+      async with lock:
+          ...
+    Requests waiting for the complete model get priority over new requests
+    for individual clusters.
+    """
+
+    def __init__(self):
+        self.condition = asyncio.Condition()
+        self.locked = set()
+        self.locked_all = False
+        self.waiting_all = 0
+
+    def _free(self, clusters):
+        if self.locked_all:
+            return False
+        elif clusters is None:
+            return not self.locked
+        else:
+            return not self.waiting_all and self.locked.isdisjoint(clusters)
+
+    async def acquire(self, clusters=None):
+        async with self.condition:
+            if clusters is None:
+                self.waiting_all += 1
+                try:
+                    await self.condition.wait_for(lambda: self._free(None))
+                finally:
+                    self.waiting_all -= 1
+                self.locked_all = True
+            else:
+                await self.condition.wait_for(lambda: self._free(clusters))
+                self.locked.update(clusters)
+
+    async def release(self, clusters=None):
+        async with self.condition:
+            if clusters is None:
+                self.locked_all = False
+            else:
+                self.locked.difference_update(clusters)
+            self.condition.notify_all()
+
+    def clusters(self, clusters):
+        return ClusterLockContext(
+            self, None if clusters is None else frozenset(clusters)
+        )
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+
+class ClusterLockContext:
+    def __init__(self, lock, clusters):
+        self.lock = lock
+        self.clusters = clusters
+
+    async def __aenter__(self):
+        await self.lock.acquire(self.clusters)
+
+    async def __aexit__(self, *exc):
+        await self.lock.release(self.clusters)
+
+
 try:
-    lock = asyncio.Lock()
+    lock = ClusterLock()
 except Exception:
     lock = None
 
+
+@database_sync_to_async
+def savePlan(
+    deleted_opplans,
+    related_opplans,
+    related_resources,
+    related_buffers,
+    related_demands,
+    database,
+    cluster,
+):
+    PlanTaskRegistry.run(
+        export=1,
+        cluster=cluster,
+        database=database,
+        deleted_opplans=deleted_opplans,
+        opplans=related_opplans,
+        resources=related_resources,
+        buffers=related_buffers,
+        demands=related_demands,
+    )
+
+
+class PlanWriter:
+    """
+    Saves interactive changes to the plan in the database.
+
+    The services queue their changes here and reply without waiting for the
+    database. The changes of all requests received within a short delay are
+    merged and saved with a single export, while locking the clusters they
+    belong to. Dragging dozens of operationplans thus results in a single
+    write of each related operationplan, resource, buffer and demand.
+
+    The flush method is a barrier: it saves all pending changes right away
+    and returns when they are in the database. It raises an exception when
+    any of them couldn't be saved.
+    """
+
+    # Maximum delay in seconds before a change is saved
+    delay = getattr(settings, "WEBSERVICE_SAVE_DELAY", 0.5)
+
+    # Pending changes per database
+    pending = {}
+    timer = None
+    writing = None
+
+    @classmethod
+    def save(
+        cls,
+        database,
+        clusters,
+        deleted_opplans=None,
+        opplans=None,
+        resources=None,
+        buffers=None,
+        demands=None,
+    ):
+        p = cls.pending.get(database)
+        if not p:
+            p = cls.pending[database] = {
+                "clusters": set(),
+                "deleted_opplans": set(),
+                "opplans": {},
+                "resources": {},
+                "buffers": {},
+                "demands": {},
+            }
+        if clusters is None or p["clusters"] is None:
+            p["clusters"] = None
+        else:
+            p["clusters"].update(clusters)
+        for o in opplans or ():
+            p["opplans"][o.reference] = o
+        for o in deleted_opplans or ():
+            # Forget about earlier changes of deleted operationplans
+            p["deleted_opplans"].add(o)
+            p["opplans"].pop(o, None)
+        for r in resources or ():
+            p["resources"][r.name] = r
+        for b in buffers or ():
+            p["buffers"][b.name] = b
+        for d in demands or ():
+            p["demands"][d.name] = d
+        if not cls.timer:
+            cls.timer = asyncio.get_running_loop().create_task(cls.flushLater())
+
+    @classmethod
+    async def flushLater(cls):
+        await asyncio.sleep(cls.delay)
+        cls.timer = None
+        try:
+            await cls.flush()
+        except Exception:
+            # Already logged
+            pass
+
+    @classmethod
+    async def flush(cls):
+        if not cls.writing:
+            cls.writing = asyncio.Lock()
+        error = None
+        async with cls.writing:
+            while cls.pending:
+                database, p = cls.pending.popitem()
+                try:
+                    async with lock.clusters(p["clusters"]):
+                        await savePlan(
+                            p["deleted_opplans"],
+                            set(p["opplans"].values()),
+                            set(p["resources"].values()),
+                            set(p["buffers"].values()),
+                            set(p["demands"].values()),
+                            database,
+                            -2,
+                        )
+                except Exception as e:
+                    logger.error("Error saving plan: %s" % e)
+                    if not error:
+                        error = e
+        if error:
+            raise error
+
+
 # Solvers reusable for all services
 mrp_solver = None
 clean_solver = None
@@ -43,6 +43,7 @@
 #include <xercesc/sax2/DefaultHandler.hpp>
 #include <xercesc/sax2/SAX2XMLReader.hpp>
 #include <xercesc/sax2/XMLReaderFactory.hpp>
+#include <xercesc/util/BinInputStream.hpp>
 #include <xercesc/util/PlatformUtils.hpp>
 #include <xercesc/util/TransService.hpp>
 #include <xercesc/util/XMLException.hpp>
@@ -257,6 +258,27 @@ class XMLInputString : public XMLInput {
   const string data;
 };
 
+/* This class reads XML data from a Python file-like object.
+ *
+ * The data is read in chunks by calling the read() method of the object,
+ * which must return bytes. This allows parsing large documents without
+ * keeping a complete copy of the data in memory.
+ */
+class XMLInputStream : public XMLInput {
+ public:
+  /* Constructor. The argument is an object with a read() method. */
+  XMLInputStream(PyObject* s) : stream(s){};
+
+  /* Parse the data from the stream. */
+  void parse(Object*, bool = false);
+
+ private:
+  /* Python object from which we read the data. The class relies on the code
+   * calling the command to keep a reference to the object.
+   */
+  PyObject* stream;
+};
+
 /* This class reads XML data from a file system.
  *
  * The filename argument can be the name of a file or a directory.
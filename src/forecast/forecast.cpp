@@ -1032,26 +1032,30 @@ ForecastData::ForecastData(const ForecastBase* f) {
       // Mode 2: Connected to a database
       mode = 2;
       // We use a single, dedicated database connection for this
+      string tbl = "forecastplan";
+      if (f->getForecastPartition() != -1) {
+        tbl += "_";
+        tbl += to_string(f->getForecastPartition());
+      }
+      // The standard measures are stored in a numeric column, all other
+      // measures in the value field. We merge them in a single JSON object.
       std::string str =
           "select extract(epoch from startdate), extract(epoch from "
           "enddate), "
-          "value from forecastplan "
-          "where item_id = $1::text and location_id = $2::text "
+          "value || jsonb_strip_nulls(jsonb_build_object("
+          "'orderstotal', orderstotal, 'ordersopen', ordersopen, "
+          "'ordersadjustment', ordersadjustment, "
+          "'forecastbaseline', forecastbaseline, "
+          "'forecastoverride', forecastoverride, 'forecastnet', forecastnet, "
+          "'forecastconsumed', forecastconsumed, "
+          "'ordersplanned', ordersplanned, "
+          "'forecastplanned', forecastplanned)) "
+          "from " +
+          tbl +
+          " where item_id = $1::text and location_id = $2::text "
           "and customer_id = $3::text "
           "and enddate >= $4::timestamp and startdate <= $5::timestamp "
           "order by startdate";
-
-      if (f->getForecastPartition() != -1) {
-        const string s = "forecastplan";
-        string t = "forecastplan_";
-        t.append(to_string(f->getForecastPartition()));
-
-        string::size_type n = 0;
-        while ((n = str.find(s, n)) != string::npos) {
-          str.replace(n, s.size(), t);
-          n += t.size();
-        }
-      }
       try {
         stmt =
             DatabasePreparedStatement<5>(db, "Read forecastplan values", str);
@@ -1257,21 +1261,58 @@ void ForecastData::flush() {
               "($37, $38, $39),"
               "($40, $41, $42),"
               "($43, $44, $45)"
-              ")"
+              "), "
+              "rec as (select st::timestamp st, nd::timestamp nd, "
+              "val::jsonb val from cte where st is not null) "
               "insert into forecastplan";
           auto partition = ForecastBase::getForecastPartitionStatic();
           if (partition != -1) {
             str += "_";
             str += to_string(partition);
           }
+          // The standard measures are stored in a numeric column, all other
+          // measures in the value field.
           str +=
               "  as fcstplan "
-              "(item_id,location_id,customer_id,startdate,enddate,value)"
-              "  select $46,$47,$48,st::timestamp,nd::timestamp,val::jsonb"
-              "  from cte where st is not null "
+              "(item_id,location_id,customer_id,startdate,enddate,value,"
+              "orderstotal,ordersopen,ordersadjustment,forecastbaseline,"
+              "forecastoverride,forecastnet,forecastconsumed,ordersplanned,"
+              "forecastplanned)"
+              "  select $46,$47,$48,st,nd,"
+              "val - '{orderstotal,ordersopen,ordersadjustment,"
+              "forecastbaseline,forecastoverride,forecastnet,forecastconsumed,"
+              "ordersplanned,forecastplanned}'::text[],"
+              "(val->>'orderstotal')::numeric,"
+              "(val->>'ordersopen')::numeric,"
+              "(val->>'ordersadjustment')::numeric,"
+              "(val->>'forecastbaseline')::numeric,"
+              "(val->>'forecastoverride')::numeric,"
+              "(val->>'forecastnet')::numeric,"
+              "(val->>'forecastconsumed')::numeric,"
+              "(val->>'ordersplanned')::numeric,"
+              "(val->>'forecastplanned')::numeric"
+              "  from rec "
               "on conflict(item_id, location_id, customer_id, startdate) "
-              "do update set value = excluded.value "
-              "where fcstplan.value is distinct from excluded.value";
+              "do update set value = excluded.value, "
+              "orderstotal = excluded.orderstotal, "
+              "ordersopen = excluded.ordersopen, "
+              "ordersadjustment = excluded.ordersadjustment, "
+              "forecastbaseline = excluded.forecastbaseline, "
+              "forecastoverride = excluded.forecastoverride, "
+              "forecastnet = excluded.forecastnet, "
+              "forecastconsumed = excluded.forecastconsumed, "
+              "ordersplanned = excluded.ordersplanned, "
+              "forecastplanned = excluded.forecastplanned "
+              "where (fcstplan.value, fcstplan.orderstotal, "
+              "fcstplan.ordersopen, fcstplan.ordersadjustment, fcstplan.forecastbaseline, "
+              "fcstplan.forecastoverride, fcstplan.forecastnet, "
+              "fcstplan.forecastconsumed, fcstplan.ordersplanned, "
+              "fcstplan.forecastplanned) is distinct from "
+              "(excluded.value, excluded.orderstotal, excluded.ordersopen, "
+              "excluded.ordersadjustment, excluded.forecastbaseline, "
+              "excluded.forecastoverride, excluded.forecastnet, "
+              "excluded.forecastconsumed, excluded.ordersplanned, "
+              "excluded.forecastplanned)";
           stmt = DatabasePreparedStatement<48>(db, "forecastplan_write", str);
           stmt_begin = DatabasePreparedStatement<0>(db, "begin_trx", "begin");
           stmt_end = DatabasePreparedStatement<0>(db, "commit_trx", "commit");
@@ -749,6 +749,60 @@ void XMLInput::parse(xercesc::InputSource& in, Object* pRoot, bool validate) {
   parser = nullptr;
 }
 
+/* Xerces input stream calling the read() method of a Python object. */
+class PythonBinInputStream : public xercesc::BinInputStream {
+ public:
+  PythonBinInputStream(PyObject* s) : stream(s) {}
+
+  XMLFilePos curPos() const { return pos; }
+
+  const XMLCh* getContentType() const { return nullptr; }
+
+  XMLSize_t readBytes(XMLByte* const toFill, const XMLSize_t maxToRead) {
+    // The parser runs without the Python interpreter lock
+    auto pythonstate = PyGILState_Ensure();
+    PyObject* result = PyObject_CallMethod(
+        stream, "read", "n", static_cast<Py_ssize_t>(maxToRead));
+    char* data;
+    Py_ssize_t cnt;
+    if (!result || PyBytes_AsStringAndSize(result, &data, &cnt) ||
+        cnt > static_cast<Py_ssize_t>(maxToRead)) {
+      if (PyErr_Occurred()) PyErr_PrintEx(0);
+      Py_XDECREF(result);
+      PyGILState_Release(pythonstate);
+      throw RuntimeException("Error reading XML data stream");
+    }
+    memcpy(toFill, data, cnt);
+    Py_DECREF(result);
+    PyGILState_Release(pythonstate);
+    pos += cnt;
+    return cnt;
+  }
+
+ private:
+  PyObject* stream;
+  XMLFilePos pos = 0;
+};
+
+/* Xerces input source reading from a Python object. */
+class PythonInputSource : public xercesc::InputSource {
+ public:
+  PythonInputSource(PyObject* s) : stream(s) {}
+
+  xercesc::BinInputStream* makeStream() const {
+    return new PythonBinInputStream(stream);
+  }
+
+ private:
+  PyObject* stream;
+};
+
+void XMLInputStream::parse(Object* pRoot, bool validate) {
+  if (!stream) throw DataException("Missing input stream");
+  PythonInputSource in(stream);
+  XMLInput::parse(in, pRoot, validate);
+}
+
 void XMLSerializer::escape(const string& x) {
   for (const char* p = x.c_str(); *p; ++p) {
     switch (*p) {